@@ -0,0 +1,69 @@
+# Client analytics: lifetime revenue, outstanding balance, payment speed and effective hourly rate
+# per client, valued in one currency. Kept free of Streamlit so the analytics page and the tests
+# use it without loading the UI.
+import numpy as np
+import pandas as pd
+
+from database import round_half_up
+from fx import CurrencyConverter
+
+
+# Per-client revenue, payment speed and effective rate, for deciding which clients are worth keeping
+class ClientAnalytics:
+    SCOPES = ("clients", "projects", "invoices", "payments", "time")
+    COLUMNS = {
+        'revenue': "Lifetime Revenue",
+        'outstanding': "Outstanding",
+        'billed': "Billed",
+        'avg_days_to_pay': "Avg Days to Pay",
+        'projects': "Projects",
+        'hours': "Hours",
+        'effective_rate': "Effective Hourly Rate"
+    }
+
+    # Reports are reused until one of the scopes above or the exchange rates change
+    _cache = {}
+
+    def __init__(self, db, converter=None):
+        self.db = db
+        self.converter = converter or CurrencyConverter(db)
+
+    def report(self, user_id, base_currency):
+        versions = self.db.get_data_versions(user_id, "client_analytics")
+        stamp = (tuple(versions.get(scope, 0) for scope in self.SCOPES), self.db.get_meta("fx_version", "0"))
+        key = (self.db.db_name, user_id, base_currency)
+        cached = self._cache.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        frame = pd.DataFrame(self.db.get_client_stats(user_id), columns=[
+            'client_id', 'name', 'company', 'currency', 'projects', 'seconds',
+            'billed_cents', 'paid_cents', 'outstanding_cents', 'paid_invoices', 'days_to_pay_total'
+        ])
+        # One rate lookup per row, valued at today's rates
+        frame['unit'] = 1.0
+        frame['day'] = None
+        rate = self.converter.convert(frame, base_currency, amount_column='unit')
+        frame['billed'] = frame['billed_cents'] * rate
+        frame['revenue'] = frame['paid_cents'] * rate
+        frame['outstanding'] = frame['outstanding_cents'] * rate
+
+        clients = frame.groupby(['client_id', 'name', 'company'], as_index=False, dropna=False).agg(
+            projects=('projects', 'max'), seconds=('seconds', 'max'),
+            billed=('billed', 'sum'), revenue=('revenue', 'sum'), outstanding=('outstanding', 'sum'),
+            paid_invoices=('paid_invoices', 'sum'), days_to_pay_total=('days_to_pay_total', 'sum')
+        )
+        for column in ['billed', 'revenue', 'outstanding']:
+            clients[column] = round_half_up(clients[column].to_numpy())
+        clients['hours'] = clients['seconds'].to_numpy() / 3600
+        with np.errstate(divide='ignore', invalid='ignore'):
+            clients['avg_days_to_pay'] = np.where(clients['paid_invoices'] > 0, clients['days_to_pay_total'] / clients['paid_invoices'], np.nan)
+            clients['effective_rate'] = np.where(clients['hours'] > 0, clients['revenue'] / clients['hours'], np.nan)
+        clients = clients.sort_values('revenue', ascending=False).reset_index(drop=True)
+
+        result = {
+            "clients": clients,
+            "missing_currencies": sorted(frame.loc[rate.isna() & (frame['billed_cents'] != 0), 'currency'].unique())
+        }
+        self._cache[key] = (stamp, result)
+        return result
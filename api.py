@@ -0,0 +1,305 @@
+# REST/JSON API next to the Streamlit UI: clients, projects, tasks, invoices and payments of the
+# token's user, read from and written to the same database (and tenant shards) through the
+# Database class. Needs FastAPI and uvicorn (pip install fastapi uvicorn):
+#
+#   uvicorn api:app --port 8000 --workers 2
+#
+# Requests send "Authorization: Bearer <token>" with a token created under Settings > API Tokens.
+#
+#   GET    /v1/{resource}?limit=100&after=<next>&parent_id=   one page, oldest first; "next" is the
+#                                                             cursor of the following page or null
+#   GET    /v1/{resource}/{id}
+#   POST   /v1/{resource}                                     201 with the new record
+#   PATCH  /v1/{resource}/{id}                                fields to change; If-Match: <ETag>
+#   DELETE /v1/{resource}/{id}                                204 (records go to the trash, as in the UI)
+#   GET    /v1/{resource}/changes?since=<next>[&full=1]       change feed, see list_changes (sync.py)
+#
+# Every GET carries an ETag: the record's version for single records, the user's data versions for
+# collections, so a client sending it back as If-None-Match gets an empty 304 while nothing changed.
+# Handlers are plain functions, which FastAPI runs on its thread pool, so a slow query never blocks
+# the event loop; each request borrows a cached connection (storage.SqliteBackend) and returns it.
+# Money is in integer cents, as stored.
+import hashlib
+import json
+from typing import Literal, Optional
+
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Query, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ValidationError
+
+from database import Database, Tenants
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+CHANGES_PAGE_SIZE = 500
+MAX_CHANGES_PAGE_SIZE = 5000
+# Columns left out of responses
+HIDDEN_COLUMNS = ("rowid", "deleted_at")
+# The data_versions scopes whose changes can alter each collection's response, its own first
+SCOPES = {
+    "clients": ["clients"],
+    "projects": ["projects", "clients"],
+    "tasks": ["tasks", "projects", "clients", "invoices"],
+    "invoices": ["invoices", "invoice_edits", "payments", "payment_edits", "projects", "clients"],
+    "payments": ["payments", "payment_edits", "invoices", "projects", "clients"],
+}
+# Parent column and resource of each record the user creates under another one
+PARENTS = {
+    "projects": ("client_id", "clients"),
+    "tasks": ("project_id", "projects"),
+    "invoices": ("project_id", "projects"),
+    "payments": ("invoice_id", "invoices"),
+}
+Resource = Literal["clients", "projects", "tasks", "invoices", "payments"]
+
+
+class ClientIn(BaseModel):
+    name: str
+    email: str = ""
+    phone: str = ""
+    company: str = ""
+    address: str = ""
+    notes: str = ""
+    currency: str = "USD"
+
+
+class ProjectIn(BaseModel):
+    client_id: str
+    name: str
+    description: str = ""
+    start_date: str
+    end_date: Optional[str] = None
+    status: Literal["Not Started", "In Progress", "On Hold", "Completed", "Cancelled"] = "Not Started"
+    budget_cents: int = 0
+    currency: str = "USD"
+
+
+class TaskIn(BaseModel):
+    project_id: str
+    name: str
+    description: str = ""
+    due_date: Optional[str] = None
+    status: Literal["Not Started", "In Progress", "Completed"] = "Not Started"
+
+
+class InvoiceIn(BaseModel):
+    project_id: str
+    amount_cents: int
+    issue_date: str
+    due_date: str
+    status: Literal["Unpaid", "Partially Paid", "Paid", "Overdue"] = "Unpaid"
+    notes: str = ""
+    currency: str = "USD"
+
+
+class PaymentIn(BaseModel):
+    invoice_id: str
+    amount_cents: int
+    payment_date: str
+    payment_method: Literal["Credit Card", "Bank Transfer", "Cash", "Check", "PayPal", "Other"] = "Bank Transfer"
+    notes: str = ""
+
+
+MODELS = {"clients": ClientIn, "projects": ProjectIn, "tasks": TaskIn, "invoices": InvoiceIn, "payments": PaymentIn}
+CREATE = {
+    "clients": lambda db, user_id, r: db.add_client(user_id, r.name, r.email, r.phone, r.company, r.address, r.notes, r.currency),
+    "projects": lambda db, user_id, r: db.add_project(user_id, r.client_id, r.name, r.description, r.start_date, r.end_date, r.status, r.budget_cents, r.currency),
+    "tasks": lambda db, user_id, r: db.add_task(r.project_id, r.name, r.description, r.due_date, r.status),
+    "invoices": lambda db, user_id, r: db.add_invoice(r.project_id, r.amount_cents, r.issue_date, r.due_date, r.status, r.notes, r.currency),
+    "payments": lambda db, user_id, r: db.add_payment(r.invoice_id, r.amount_cents, r.payment_date, r.payment_method, r.notes),
+}
+# Each returns {"current": ...} when the record changed after version was read; tasks have no version
+UPDATE = {
+    "clients": lambda db, id, r, version: db.update_client(id, r.name, r.email, r.phone, r.company, r.address, r.notes, r.currency, expected_version=version),
+    "projects": lambda db, id, r, version: db.update_project(id, r.client_id, r.name, r.description, r.start_date, r.end_date, r.status, r.budget_cents, r.currency, expected_version=version),
+    "tasks": lambda db, id, r, version: db.update_task(id, r.name, r.description, r.due_date, r.status),
+    "invoices": lambda db, id, r, version: db.update_invoice(id, r.amount_cents, r.issue_date, r.due_date, r.status, r.notes, expected_version=version),
+    "payments": lambda db, id, r, version: db.update_payment(id, r.amount_cents, r.payment_date, r.payment_method, r.notes, expected_version=version),
+}
+DELETE = {
+    "clients": Database.delete_client,
+    "projects": Database.delete_project,
+    "tasks": Database.delete_task,
+    "invoices": Database.delete_invoice,
+    "payments": Database.delete_payment,
+}
+
+app = FastAPI(title="FreelanceFlow API", version="1")
+# Pages of records compress well; tiny responses aren't worth the CPU
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+
+class Session:
+    def __init__(self, user_id, db):
+        self.user_id = user_id
+        self.db = db
+
+
+def authenticate(authorization: Optional[str] = Header(None)):
+    # The token's user and the database holding their records, for the length of one request
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(401, "Missing bearer token", headers={"WWW-Authenticate": "Bearer"})
+    catalog = Database()
+    db = None
+    try:
+        user_id = catalog.get_api_token_user(authorization.removeprefix("Bearer ").strip())
+        if not user_id:
+            raise HTTPException(401, "Invalid token", headers={"WWW-Authenticate": "Bearer"})
+        db = Tenants(catalog).database(user_id)
+        db.actor = user_id
+        yield Session(user_id, db)
+    finally:
+        if db is not None and db is not catalog:
+            db.close()
+        catalog.close()
+
+
+def public(record):
+    return {column: value for column, value in record.items() if column not in HIDDEN_COLUMNS}
+
+
+def record_etag(record):
+    # Tasks have no version column, so theirs is a digest of the record
+    if "version" in record:
+        return f'"{record["version"]}"'
+    return '"' + hashlib.sha256(json.dumps(public(record), sort_keys=True).encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(header, etag):
+    return header is not None and (header.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in header.split(",")])
+
+
+def json_response(payload, etag=None, status_code=200):
+    # Rows are plain strings and numbers, so json.dumps skips FastAPI's slower generic encoder
+    headers = {"ETag": etag} if etag else None
+    return Response(json.dumps(payload, separators=(",", ":")), status_code=status_code, media_type="application/json", headers=headers)
+
+
+def get_record(session, resource, record_id):
+    records = session.db.get_records(resource, session.user_id, ids=[record_id])
+    if not records:
+        raise HTTPException(404, f"No such {resource[:-1]}")
+    return records[0]
+
+
+def check_parent(session, resource, record):
+    # Records may only be created under (or moved to) the user's own live parents
+    if resource in PARENTS:
+        column, parent = PARENTS[resource]
+        if not session.db.get_records(parent, session.user_id, ids=[getattr(record, column)]):
+            raise HTTPException(422, f"No such {parent[:-1]}: {getattr(record, column)}")
+
+
+def validate(resource, values):
+    try:
+        return MODELS[resource](**values)
+    except ValidationError as e:
+        raise HTTPException(422, json.loads(e.json(include_url=False)))
+
+
+def validate_changes(resource, current, values):
+    # Only the fields sent are checked: the others keep their stored values, which older rows
+    # may hold in forms the model no longer accepts (a NULL phone or notes, say)
+    model = MODELS[resource]
+    record = model.model_construct(**{field: current[field] for field in model.model_fields if field in current})
+    errors = []
+    for field, value in values.items():
+        if field in model.model_fields:
+            try:
+                model.__pydantic_validator__.validate_assignment(record, field, value)
+            except ValidationError as e:
+                errors += json.loads(e.json(include_url=False))
+    if errors:
+        raise HTTPException(422, errors)
+    return record
+
+
+@app.get("/v1/{resource}")
+def list_records(resource: Resource, limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: int = Query(0, ge=0),
+                 parent_id: Optional[str] = None, if_none_match: Optional[str] = Header(None), session: Session = Depends(authenticate)):
+    if parent_id is not None and resource not in PARENTS:
+        raise HTTPException(422, f"{resource} have no parent")
+    # Any write that could change this page bumps one of these versions; the nightly overdue
+    # sweep only touches statuses, so its date stands in for it
+    versions = session.db.get_data_versions(session.user_id)
+    seed = [resource, [versions.get(scope, 0) for scope in SCOPES[resource]], limit, after, parent_id]
+    if resource == "invoices":
+        seed.append(session.db.get_meta("last_overdue_sweep"))
+    etag = '"' + hashlib.sha256(json.dumps(seed).encode()).hexdigest()[:32] + '"'
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    # Keyset paging on rowid: every page is an index range scan, however deep
+    records = session.db.get_records(resource, session.user_id, parent_id=parent_id, after_rowid=after, limit=limit + 1)
+    next_cursor = records[limit - 1]["rowid"] if len(records) > limit else None
+    return json_response({"data": [public(record) for record in records[:limit]], "next": next_cursor}, etag)
+
+
+# Declared before /v1/{resource}/{record_id}, which would otherwise take "changes" for an id
+@app.get("/v1/{resource}/changes")
+def list_changes(resource: Resource, since: int = Query(0, ge=0), full: bool = Query(False), limit: int = Query(CHANGES_PAGE_SIZE, ge=1, le=MAX_CHANGES_PAGE_SIZE),
+                 session: Session = Depends(authenticate)):
+    # Every record created, changed, trashed, restored or deleted after the since cursor, in
+    # change order, as whole records with "deleted" set for trashed ones. Deleted ones are
+    # tombstones: id, change_seq, deleted_at and "tombstone": true. Pass "next" back as since
+    # until "more" is false. 410 means deletions since the cursor are no longer known: drop the
+    # copy and start again at 0 with full=1, kept on every page until the first one without
+    # "more" (cursors of a full read can be older than the kept tombstones).
+    page = session.db.get_changes(resource, session.user_id, since, limit, full)
+    if page is None:
+        raise HTTPException(410, "Deletions after this cursor are no longer kept; sync again from since=0 with full=1")
+    changes, next_cursor = page
+    data = [{**{column: value for column, value in change.items() if column != "rowid"},
+             "deleted": change.get("tombstone", False) or change.get("deleted_at") is not None} for change in changes]
+    return json_response({"data": data, "next": next_cursor, "more": len(changes) == limit})
+
+
+@app.get("/v1/{resource}/{record_id}")
+def read_record(resource: Resource, record_id: str, if_none_match: Optional[str] = Header(None), session: Session = Depends(authenticate)):
+    record = get_record(session, resource, record_id)
+    etag = record_etag(record)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return json_response(public(record), etag)
+
+
+@app.post("/v1/{resource}", status_code=201)
+def create_record(resource: Resource, values: dict = Body(...), session: Session = Depends(authenticate)):
+    record = validate(resource, values)
+    check_parent(session, resource, record)
+    record_id = CREATE[resource](session.db, session.user_id, record)
+    created = get_record(session, resource, record_id)
+    return json_response(public(created), record_etag(created), status_code=201)
+
+
+@app.patch("/v1/{resource}/{record_id}")
+def update_record(resource: Resource, record_id: str, values: dict = Body(...), if_match: Optional[str] = Header(None),
+                  session: Session = Depends(authenticate)):
+    current = get_record(session, resource, record_id)
+    if if_match is not None and not etag_matches(if_match, record_etag(current)):
+        raise HTTPException(412, "The record changed since it was read")
+    # Unchanged fields keep their current values; parents other than a project's client are fixed
+    if resource in PARENTS and resource != "projects":
+        values.pop(PARENTS[resource][0], None)
+    record = validate_changes(resource, current, values)
+    if resource == "projects" and record.client_id != current["client_id"]:
+        check_parent(session, resource, record)
+    # The version read above guards the write, so a concurrent change is never overwritten
+    conflict = UPDATE[resource](session.db, record_id, record, current.get("version"))
+    if conflict:
+        raise HTTPException(412 if if_match is not None else 409, "The record changed since it was read")
+    updated = get_record(session, resource, record_id)
+    return json_response(public(updated), record_etag(updated))
+
+
+@app.delete("/v1/{resource}/{record_id}", status_code=204)
+def delete_record(resource: Resource, record_id: str, if_match: Optional[str] = Header(None), session: Session = Depends(authenticate)):
+    current = get_record(session, resource, record_id)
+    if if_match is not None and not etag_matches(if_match, record_etag(current)):
+        raise HTTPException(412, "The record changed since it was read")
+    DELETE[resource](session.db, record_id)
+    return Response(status_code=204)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", port=8000)
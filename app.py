@@ -1,14 +1,25 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import datetime
-import hashlib
-import uuid
 import os
 from PIL import Image
 import io
 import base64
+import json
+import calendar
+import rendering
+from database import Database, Tenants, edited_line_amounts, round_half_up, to_cents
+from reminders import ReminderEngine
+from billing import InvoiceBuilder, RecurringInvoiceScheduler
+from deadlines import DeadlineCalendar
+from analytics import ClientAnalytics
+from forecast import CashFlowForecast
+from fx import CurrencyConverter
+import jobs
+import maintenance
+import webhooks
 
 # Set page configuration
 st.set_page_config(
@@ -49,6 +60,33 @@ st.markdown("""
     .sidebar .sidebar-content {
         background-color: #f8f9fa;
     }
+    .calendar {
+        width: 100%;
+        border-collapse: collapse;
+        table-layout: fixed;
+    }
+    .calendar th, .calendar td {
+        border: 1px solid #e3e6f0;
+        padding: 0.3rem;
+        vertical-align: top;
+        font-size: 0.8rem;
+    }
+    .calendar td {
+        height: 6rem;
+    }
+    .calendar .other-month {
+        color: #b7b9cc;
+    }
+    .calendar .event {
+        display: block;
+        margin-top: 0.15rem;
+        padding: 0 0.25rem;
+        border-radius: 0.25rem;
+        color: white;
+        overflow: hidden;
+        white-space: nowrap;
+        text-overflow: ellipsis;
+    }
     .stButton>button {
         width: 100%;
         background-color: #4F8BF9;
@@ -57,476 +95,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Database class using OOP principles
-class Database:
-    def __init__(self, db_name="freelance_flow.db"):
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
-    
-    def create_tables(self):
-        # Users table
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            username TEXT UNIQUE,
-            password TEXT,
-            email TEXT UNIQUE,
-            full_name TEXT,
-            subscription_type TEXT DEFAULT 'free',
-            subscription_end_date TEXT,
-            created_at TEXT
-        )
-        ''')
-        
-        # Clients table
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clients (
-            id TEXT PRIMARY KEY,
-            user_id TEXT,
-            name TEXT,
-            email TEXT,
-            phone TEXT,
-            company TEXT,
-            address TEXT,
-            notes TEXT,
-            created_at TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-        ''')
-        
-        # Projects table
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS projects (
-            id TEXT PRIMARY KEY,
-            user_id TEXT,
-            client_id TEXT,
-            name TEXT,
-            description TEXT,
-            start_date TEXT,
-            end_date TEXT,
-            status TEXT,
-            budget REAL,
-            created_at TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (client_id) REFERENCES clients (id)
-        )
-        ''')
-        
-        # Tasks table
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id TEXT PRIMARY KEY,
-            project_id TEXT,
-            name TEXT,
-            description TEXT,
-            due_date TEXT,
-            status TEXT,
-            created_at TEXT,
-            FOREIGN KEY (project_id) REFERENCES projects (id)
-        )
-        ''')
-        
-        # Invoices table
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS invoices (
-            id TEXT PRIMARY KEY,
-            project_id TEXT,
-            amount REAL,
-            issue_date TEXT,
-            due_date TEXT,
-            status TEXT,
-            notes TEXT,
-            created_at TEXT,
-            FOREIGN KEY (project_id) REFERENCES projects (id)
-        )
-        ''')
-        
-        # Payments table
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payments (
-            id TEXT PRIMARY KEY,
-            invoice_id TEXT,
-            amount REAL,
-            payment_date TEXT,
-            payment_method TEXT,
-            notes TEXT,
-            created_at TEXT,
-            FOREIGN KEY (invoice_id) REFERENCES invoices (id)
-        )
-        ''')
-        
-        self.conn.commit()
-    
-    def close(self):
-        self.conn.close()
-    
-    # User methods
-    def add_user(self, username, password, email, full_name):
-        user_id = str(uuid.uuid4())
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        try:
-            self.cursor.execute(
-                "INSERT INTO users (id, username, password, email, full_name, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                (user_id, username, hashed_password, email, full_name, created_at)
-            )
-            self.conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
-    
-    def verify_user(self, username, password):
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        self.cursor.execute(
-            "SELECT id, username, email, full_name, subscription_type FROM users WHERE username = ? AND password = ?",
-            (username, hashed_password)
-        )
-        user = self.cursor.fetchone()
-        if user:
-            return {
-                "id": user[0],
-                "username": user[1],
-                "email": user[2],
-                "full_name": user[3],
-                "subscription_type": user[4]
-            }
-        return None
-    
-    # Client methods
-    def add_client(self, user_id, name, email, phone, company, address, notes):
-        client_id = str(uuid.uuid4())
-        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        self.cursor.execute(
-            "INSERT INTO clients (id, user_id, name, email, phone, company, address, notes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (client_id, user_id, name, email, phone, company, address, notes, created_at)
-        )
-        self.conn.commit()
-        return client_id
-    
-    def get_clients(self, user_id):
-        self.cursor.execute("SELECT * FROM clients WHERE user_id = ?", (user_id,))
-        clients = self.cursor.fetchall()
-        return clients
-    
-    def get_client(self, client_id):
-        self.cursor.execute("SELECT * FROM clients WHERE id = ?", (client_id,))
-        client = self.cursor.fetchone()
-        return client
-    
-    def update_client(self, client_id, name, email, phone, company, address, notes):
-        self.cursor.execute(
-            "UPDATE clients SET name = ?, email = ?, phone = ?, company = ?, address = ?, notes = ? WHERE id = ?",
-            (name, email, phone, company, address, notes, client_id)
-        )
-        self.conn.commit()
-    
-    def delete_client(self, client_id):
-        self.cursor.execute("DELETE FROM clients WHERE id = ?", (client_id,))
-        self.conn.commit()
-    
-    # Project methods
-    def add_project(self, user_id, client_id, name, description, start_date, end_date, status, budget):
-        project_id = str(uuid.uuid4())
-        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        self.cursor.execute(
-            "INSERT INTO projects (id, user_id, client_id, name, description, start_date, end_date, status, budget, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (project_id, user_id, client_id, name, description, start_date, end_date, status, budget, created_at)
-        )
-        self.conn.commit()
-        return project_id
-    
-    def get_projects(self, user_id):
-        self.cursor.execute("""
-            SELECT p.*, c.name as client_name 
-            FROM projects p
-            JOIN clients c ON p.client_id = c.id
-            WHERE p.user_id = ?
-        """, (user_id,))
-        projects = self.cursor.fetchall()
-        return projects
-    
-    def get_project(self, project_id):
-        self.cursor.execute("""
-            SELECT p.*, c.name as client_name 
-            FROM projects p
-            JOIN clients c ON p.client_id = c.id
-            WHERE p.id = ?
-        """, (project_id,))
-        project = self.cursor.fetchone()
-        return project
-    
-    def update_project(self, project_id, client_id, name, description, start_date, end_date, status, budget):
-        self.cursor.execute(
-            "UPDATE projects SET client_id = ?, name = ?, description = ?, start_date = ?, end_date = ?, status = ?, budget = ? WHERE id = ?",
-            (client_id, name, description, start_date, end_date, status, budget, project_id)
-        )
-        self.conn.commit()
-    
-    def delete_project(self, project_id):
-        self.cursor.execute("DELETE FROM projects WHERE id = ?", (project_id,))
-        self.conn.commit()
-    
-    # Task methods
-    def add_task(self, project_id, name, description, due_date, status):
-        task_id = str(uuid.uuid4())
-        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        self.cursor.execute(
-            "INSERT INTO tasks (id, project_id, name, description, due_date, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (task_id, project_id, name, description, due_date, status, created_at)
-        )
-        self.conn.commit()
-        return task_id
-    
-    def get_tasks(self, project_id):
-        self.cursor.execute("SELECT * FROM tasks WHERE project_id = ?", (project_id,))
-        tasks = self.cursor.fetchall()
-        return tasks
-    
-    def get_task(self, task_id):
-        self.cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-        task = self.cursor.fetchone()
-        return task
-    
-    def update_task(self, task_id, name, description, due_date, status):
-        self.cursor.execute(
-            "UPDATE tasks SET name = ?, description = ?, due_date = ?, status = ? WHERE id = ?",
-            (name, description, due_date, status, task_id)
-        )
-        self.conn.commit()
-    
-    def delete_task(self, task_id):
-        self.cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-        self.conn.commit()
-    
-    # Invoice methods
-    def add_invoice(self, project_id, amount, issue_date, due_date, status, notes):
-        invoice_id = str(uuid.uuid4())
-        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        self.cursor.execute(
-            "INSERT INTO invoices (id, project_id, amount, issue_date, due_date, status, notes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (invoice_id, project_id, amount, issue_date, due_date, status, notes, created_at)
-        )
-        self.conn.commit()
-        return invoice_id
-    
-    def get_invoices(self, project_id=None):
-        if project_id:
-            self.cursor.execute("""
-                SELECT i.*, p.name as project_name, c.name as client_name
-                FROM invoices i
-                JOIN projects p ON i.project_id = p.id
-                JOIN clients c ON p.client_id = c.id
-                WHERE i.project_id = ?
-            """, (project_id,))
-        else:
-            self.cursor.execute("""
-                SELECT i.*, p.name as project_name, c.name as client_name
-                FROM invoices i
-                JOIN projects p ON i.project_id = p.id
-                JOIN clients c ON p.client_id = c.id
-            """)
-        invoices = self.cursor.fetchall()
-        return invoices
-    
-    def get_invoice(self, invoice_id):
-        self.cursor.execute("""
-            SELECT i.*, p.name as project_name, c.name as client_name
-            FROM invoices i
-            JOIN projects p ON i.project_id = p.id
-            JOIN clients c ON p.client_id = c.id
-            WHERE i.id = ?
-        """, (invoice_id,))
-        invoice = self.cursor.fetchone()
-        return invoice
-    
-    def update_invoice(self, invoice_id, amount, issue_date, due_date, status, notes):
-        self.cursor.execute(
-            "UPDATE invoices SET amount = ?, issue_date = ?, due_date = ?, status = ?, notes = ? WHERE id = ?",
-            (amount, issue_date, due_date, status, notes, invoice_id)
-        )
-        self.conn.commit()
-    
-    def delete_invoice(self, invoice_id):
-        self.cursor.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
-        self.conn.commit()
-    
-    # Payment methods
-    def add_payment(self, invoice_id, amount, payment_date, payment_method, notes):
-        payment_id = str(uuid.uuid4())
-        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        self.cursor.execute(
-            "INSERT INTO payments (id, invoice_id, amount, payment_date, payment_method, notes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (payment_id, invoice_id, amount, payment_date, payment_method, notes, created_at)
-        )
-        self.conn.commit()
-        
-        # Update invoice status if fully paid
-        self.cursor.execute("SELECT amount FROM invoices WHERE id = ?", (invoice_id,))
-        invoice_amount = self.cursor.fetchone()[0]
-        
-        self.cursor.execute("SELECT SUM(amount) FROM payments WHERE invoice_id = ?", (invoice_id,))
-        total_paid = self.cursor.fetchone()[0] or 0
-        
-        if total_paid >= invoice_amount:
-            self.cursor.execute("UPDATE invoices SET status = 'Paid' WHERE id = ?", (invoice_id,))
-        elif total_paid > 0:
-            self.cursor.execute("UPDATE invoices SET status = 'Partially Paid' WHERE id = ?", (invoice_id,))
-        
-        self.conn.commit()
-        return payment_id
-    
-    def get_payments(self, invoice_id):
-        self.cursor.execute("SELECT * FROM payments WHERE invoice_id = ?", (invoice_id,))
-        payments = self.cursor.fetchall()
-        return payments
-    
-    def get_payment(self, payment_id):
-        self.cursor.execute("SELECT * FROM payments WHERE id = ?", (payment_id,))
-        payment = self.cursor.fetchone()
-        return payment
-    
-    def update_payment(self, payment_id, amount, payment_date, payment_method, notes):
-        self.cursor.execute(
-            "UPDATE payments SET amount = ?, payment_date = ?, payment_method = ?, notes = ? WHERE id = ?",
-            (amount, payment_date, payment_method, notes, payment_id)
-        )
-        self.conn.commit()
-    
-    def delete_payment(self, payment_id):
-        self.cursor.execute("SELECT invoice_id FROM payments WHERE id = ?", (payment_id,))
-        invoice_id = self.cursor.fetchone()[0]
-        
-        self.cursor.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
-        self.conn.commit()
-        
-        # Update invoice status
-        self.cursor.execute("SELECT amount FROM invoices WHERE id = ?", (invoice_id,))
-        invoice_amount = self.cursor.fetchone()[0]
-        
-        self.cursor.execute("SELECT SUM(amount) FROM payments WHERE invoice_id = ?", (invoice_id,))
-        total_paid = self.cursor.fetchone()[0] or 0
-        
-        if total_paid >= invoice_amount:
-            self.cursor.execute("UPDATE invoices SET status = 'Paid' WHERE id = ?", (invoice_id,))
-        elif total_paid > 0:
-            self.cursor.execute("UPDATE invoices SET status = 'Partially Paid' WHERE id = ?", (invoice_id,))
-        else:
-            self.cursor.execute("UPDATE invoices SET status = 'Unpaid' WHERE id = ?", (invoice_id,))
-        
-        self.conn.commit()
-    
-    # Dashboard methods
-    def get_dashboard_data(self, user_id):
-        # Total clients
-        self.cursor.execute("SELECT COUNT(*) FROM clients WHERE user_id = ?", (user_id,))
-        total_clients = self.cursor.fetchone()[0]
-        
-        # Total projects
-        self.cursor.execute("SELECT COUNT(*) FROM projects WHERE user_id = ?", (user_id,))
-        total_projects = self.cursor.fetchone()[0]
-        
-        # Total invoices
-        self.cursor.execute("""
-            SELECT COUNT(*) 
-            FROM invoices i
-            JOIN projects p ON i.project_id = p.id
-            WHERE p.user_id = ?
-        """, (user_id,))
-        total_invoices = self.cursor.fetchone()[0]
-        
-        # Total revenue - FIXED QUERY
-        self.cursor.execute("""
-            SELECT SUM(pa.amount) 
-            FROM payments pa
-            JOIN invoices i ON pa.invoice_id = i.id
-            JOIN projects p ON i.project_id = p.id
-            WHERE p.user_id = ?
-        """, (user_id,))
-        total_revenue = self.cursor.fetchone()[0] or 0
-        
-        # Pending invoices
-        self.cursor.execute("""
-            SELECT COUNT(*) 
-            FROM invoices i
-            JOIN projects p ON i.project_id = p.id
-            WHERE p.user_id = ? AND i.status != 'Paid'
-        """, (user_id,))
-        pending_invoices = self.cursor.fetchone()[0]
-        
-        # Pending amount
-        self.cursor.execute("""
-            SELECT SUM(i.amount - COALESCE((SELECT SUM(amount) FROM payments WHERE invoice_id = i.id), 0)) 
-            FROM invoices i
-            JOIN projects p ON i.project_id = p.id
-            WHERE p.user_id = ? AND i.status != 'Paid'
-        """, (user_id,))
-        pending_amount = self.cursor.fetchone()[0] or 0
-        
-        # Projects by status
-        self.cursor.execute("""
-            SELECT status, COUNT(*) 
-            FROM projects 
-            WHERE user_id = ? 
-            GROUP BY status
-        """, (user_id,))
-        projects_by_status = self.cursor.fetchall()
-        
-        # Recent projects
-        self.cursor.execute("""
-            SELECT p.*, c.name as client_name 
-            FROM projects p
-            JOIN clients c ON p.client_id = c.id
-            WHERE p.user_id = ?
-            ORDER BY p.created_at DESC
-            LIMIT 5
-        """, (user_id,))
-        recent_projects = self.cursor.fetchall()
-        
-        # Recent invoices
-        self.cursor.execute("""
-            SELECT i.*, p.name as project_name, c.name as client_name
-            FROM invoices i
-            JOIN projects p ON i.project_id = p.id
-            JOIN clients c ON p.client_id = c.id
-            WHERE p.user_id = ?
-            ORDER BY i.created_at DESC
-            LIMIT 5
-        """, (user_id,))
-        recent_invoices = self.cursor.fetchall()
-        
-        # Monthly revenue - FIXED QUERY
-        self.cursor.execute("""
-            SELECT strftime('%Y-%m', pa.payment_date) as month, SUM(pa.amount) as revenue
-            FROM payments pa
-            JOIN invoices i ON pa.invoice_id = i.id
-            JOIN projects p ON i.project_id = p.id
-            WHERE p.user_id = ?
-            GROUP BY month
-            ORDER BY month
-            LIMIT 12
-        """, (user_id,))
-        monthly_revenue = self.cursor.fetchall()
-        
-        return {
-            "total_clients": total_clients,
-            "total_projects": total_projects,
-            "total_invoices": total_invoices,
-            "total_revenue": total_revenue,
-            "pending_invoices": pending_invoices,
-            "pending_amount": pending_amount,
-            "projects_by_status": projects_by_status,
-            "recent_projects": recent_projects,
-            "recent_invoices": recent_invoices,
-            "monthly_revenue": monthly_revenue
-        }
-
 # Authentication class
 class Auth:
     def __init__(self, db):
@@ -541,59 +109,29 @@ class Auth:
     def is_premium(self, subscription_type):
         return subscription_type in ["premium", "enterprise"]
 
-# Payment class (simulated)
-class Payment:
-    def __init__(self):
-        pass
-    
-    def process_payment(self, amount, card_number, expiry, cvv):
-        # Simulate payment processing
-        # In a real app, this would integrate with Stripe, PayPal, etc.
-        if len(card_number) == 16 and len(expiry) == 5 and len(cvv) == 3:
-            return {
-                "success": True,
-                "transaction_id": str(uuid.uuid4()),
-                "amount": amount,
-                "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-        return {
-            "success": False,
-            "error": "Invalid payment details"
-        }
-    
-    def upgrade_subscription(self, user_id, plan_type, payment_details):
-        # Simulate subscription upgrade
-        # In a real app, this would create a subscription in Stripe, etc.
-        result = self.process_payment(
-            99.99 if plan_type == "annual" else 9.99,
-            payment_details["card_number"],
-            payment_details["expiry"],
-            payment_details["cvv"]
-        )
-        
-        if result["success"]:
-            # Calculate subscription end date
-            if plan_type == "annual":
-                end_date = (datetime.datetime.now() + datetime.timedelta(days=365)).strftime("%Y-%m-%d")
-            else:
-                end_date = (datetime.datetime.now() + datetime.timedelta(days=30)).strftime("%Y-%m-%d")
-            
-            return {
-                "success": True,
-                "subscription_type": "premium",
-                "subscription_end_date": end_date,
-                "transaction_id": result["transaction_id"]
-            }
-        
-        return {
-            "success": False,
-            "error": result["error"]
-        }
+# Money is stored as integer cents; floats only exist at the input widgets
+CURRENCY_SYMBOLS = rendering.CURRENCY_SYMBOLS
+CURRENCIES = list(CURRENCY_SYMBOLS)
 
-# Initialize database
-db = Database()
-auth = Auth(db)
-payment = Payment()
+# Task board columns, left to right
+TASK_STATUSES = ["Not Started", "In Progress", "Completed"]
+
+def format_money(cents, currency="USD"):
+    return rendering.money(cents, currency)
+
+@st.cache_resource
+def get_job_queue():
+    # One worker pool per server process, shared by all sessions
+    queue = jobs.build_queue()
+    queue.start()
+    return queue
+
+# Initialize database: the catalog, and the signed-in user's shard when tenants are sharded
+catalog = Database()
+tenants = Tenants(catalog)
+db = tenants.database(st.session_state.user["id"] if st.session_state.get("user") else None)
+auth = Auth(tenants)
+job_queue = get_job_queue()
 
 # Session state initialization
 if 'user' not in st.session_state:
@@ -634,6 +172,99 @@ def display_logo():
     st.image(buf, width=100)
     plt.close(fig)
 
+# Optimistic editing: the row as first shown is the base, saves only apply if it hasn't changed since
+def edit_base(table, row_id):
+    return st.session_state.temp_data.setdefault(f"edit_base_{row_id}", db.snapshot(table, [row_id])[row_id])
+
+def same_value(a, b):
+    # Text inputs return "" where the database has NULL
+    return (a if a is not None else "") == (b if b is not None else "")
+
+# Three-way merge of the base row, the form values and the row as it is now
+def merge_edits(base, mine, theirs):
+    merged, clashes = {}, []
+    for column, value in mine.items():
+        if same_value(value, base[column]):
+            merged[column] = theirs[column]
+        else:
+            merged[column] = value
+            if not same_value(theirs[column], base[column]) and not same_value(theirs[column], value):
+                clashes.append(column)
+    return merged, clashes
+
+def save_edit(table, row_id, values, update):
+    # update is the Database.update_* method; edits that don't overlap with another session's
+    # are merged and retried, overlapping fields are left for show_edit_conflict
+    temp_data = st.session_state.temp_data
+    for attempt in range(3):
+        conflict = update(row_id, **values, expected_version=edit_base(table, row_id)["version"])
+        if not conflict:
+            temp_data.pop(f"edit_base_{row_id}", None)
+            temp_data.pop(f"edit_conflict_{row_id}", None)
+            return True
+        current = conflict["current"]
+        if current is None:
+            st.error("This record was deleted in another session")
+            return False
+        values, clashes = merge_edits(edit_base(table, row_id), values, current)
+        temp_data[f"edit_base_{row_id}"] = current
+        if clashes:
+            temp_data[f"edit_conflict_{row_id}"] = {"values": values, "current": current, "clashes": clashes}
+            return False
+    st.error("The record keeps changing, please try again")
+    return False
+
+def show_edit_conflict(table, row_id, update, back_page):
+    conflict = st.session_state.temp_data.get(f"edit_conflict_{row_id}")
+    if not conflict:
+        return
+    
+    def display(column, value):
+        return f"{value / 100:,.2f}" if column.endswith("_cents") and value is not None else value
+    
+    st.warning("Someone else changed this record while you were editing it. "
+               "Your other changes were merged; these fields were changed on both sides:")
+    st.dataframe(pd.DataFrame(
+        [(column.replace("_cents", "").replace("_", " ").capitalize(),
+          str(display(column, conflict["values"][column])), str(display(column, conflict["current"][column])))
+         for column in conflict["clashes"]],
+        columns=["Field", "Your Value", "Current Value"]
+    ), use_container_width=True, hide_index=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Keep My Changes"):
+            st.session_state.temp_data.pop(f"edit_conflict_{row_id}", None)
+            if save_edit(table, row_id, conflict["values"], update):
+                navigate_to(back_page)
+            st.rerun()
+    with col2:
+        if st.button("Discard My Changes"):
+            navigate_to(back_page)
+            st.rerun()
+
+# Change history from the audit log, newest first
+AUDIT_RECORD_NAMES = {
+    "clients": "Client", "projects": "Project", "tasks": "Task", "invoices": "Invoice", "invoice_items": "Invoice item",
+    "payments": "Payment", "recurring_invoices": "Recurring invoice", "time_entries": "Time entry"
+}
+
+def show_change_history(entity, entity_id):
+    history = db.get_audit_history(entity, entity_id)
+    with st.expander(f"Change History ({len(history)})"):
+        if not history:
+            st.caption("No changes recorded yet")
+            return
+        rows = []
+        for created_at, actor, record, action, changes in history:
+            changes = json.loads(changes)
+            if action == "update":
+                summary = "; ".join(f"{column}: {before} → {after}" for column, (before, after) in changes.items())
+            else:
+                summary = ", ".join(f"{column}={value}" for column, value in changes.items() if column not in ("id", "created_at"))
+            rows.append((created_at, actor, AUDIT_RECORD_NAMES.get(record, record), action.capitalize(), summary))
+        st.dataframe(pd.DataFrame(rows, columns=["When", "Who", "Record", "Action", "Changes"]), use_container_width=True, hide_index=True)
+
 # Login page
 def login_page():
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -707,9 +338,21 @@ def register_page():
 def dashboard_page():
     st.markdown('<h1 class="main-header">Dashboard</h1>', unsafe_allow_html=True)
     
+    # Mark past-due invoices before reading the totals (no-op after the first run each day)
+    db.sweep_overdue_invoices()
+    
     # Get dashboard data
     dashboard_data = db.get_dashboard_data(st.session_state.user["id"])
     
+    # Money totals in the user's base currency
+    base_currency = st.session_state.user.get("base_currency") or "USD"
+    converter = CurrencyConverter(db)
+    revenue = converter.revenue(dashboard_data['revenue_by_day'], base_currency)
+    aging = converter.aging(dashboard_data['receivables'], base_currency)
+    missing_currencies = sorted(set(revenue['missing_currencies']) | set(aging['missing_currencies']))
+    if missing_currencies:
+        st.warning(f"No exchange rates for {', '.join(missing_currencies)}; those amounts are left out of the {base_currency} totals. Load rates in Settings.")
+    
     # Display metrics
     col1, col2, col3, col4 = st.columns(4)
     
@@ -732,7 +375,7 @@ def dashboard_page():
     with col3:
         st.markdown(f"""
         <div class="metric-card">
-            <h3>${dashboard_data['total_revenue']:,.2f}</h3>
+            <h3>{format_money(revenue['total_cents'], base_currency)}</h3>
             <p>Total Revenue</p>
         </div>
         """, unsafe_allow_html=True)
@@ -740,11 +383,22 @@ def dashboard_page():
     with col4:
         st.markdown(f"""
         <div class="metric-card">
-            <h3>${dashboard_data['pending_amount']:,.2f}</h3>
+            <h3>{format_money(aging['total_cents'], base_currency)}</h3>
             <p>Pending Payments</p>
         </div>
         """, unsafe_allow_html=True)
     
+    if dashboard_data['overdue_invoices']:
+        st.warning(f"{dashboard_data['overdue_invoices']} overdue invoice(s) totalling {format_money(aging['overdue_cents'], base_currency)}")
+    
+    # Receivables aging
+    if dashboard_data['receivables']:
+        st.markdown('<h2 class="sub-header">Receivables Aging</h2>', unsafe_allow_html=True)
+        aging_df = aging['buckets'].reset_index()
+        aging_df.columns = ['Age', 'Invoices', 'Amount']
+        aging_df['Amount'] = [format_money(cents, base_currency) for cents in aging_df['Amount']]
+        st.dataframe(aging_df, use_container_width=True, hide_index=True)
+    
     # Projects by status
     st.markdown('<h2 class="sub-header">Projects by Status</h2>', unsafe_allow_html=True)
     
@@ -761,23 +415,49 @@ def dashboard_page():
     else:
         st.info("No projects found. Create your first project to see statistics.")
     
-    # Monthly revenue
-    st.markdown('<h2 class="sub-header">Monthly Revenue</h2>', unsafe_allow_html=True)
+    # Cash flow: the last 12 months of payments and the expected inflows from open invoices
+    st.markdown('<h2 class="sub-header">Cash Flow</h2>', unsafe_allow_html=True)
     
-    if dashboard_data['monthly_revenue']:
-        # Create a DataFrame for the bar chart
-        revenue_df = pd.DataFrame(dashboard_data['monthly_revenue'], columns=['Month', 'Revenue'])
+    forecast = CashFlowForecast(db, converter).report(st.session_state.user["id"], base_currency)
+    monthly = forecast['monthly'] / 100
+    
+    if monthly.to_numpy().any():
+        trend_cols = st.columns(len(CashFlowForecast.TREND_WINDOWS) + 1)
+        for col, window in zip(trend_cols, CashFlowForecast.TREND_WINDOWS):
+            with col:
+                trend = forecast['trends'].get(window)
+                st.markdown(f"""
+                <div class="metric-card">
+                    <h3>{format_money(trend['average_cents'], base_currency) if trend else "—"}</h3>
+                    <p>{window}-month average{f" ({'+' if trend['slope_cents'] >= 0 else '-'}{format_money(abs(trend['slope_cents']), base_currency)}/month)" if trend else ""}</p>
+                </div>
+                """, unsafe_allow_html=True)
+        with trend_cols[-1]:
+            st.markdown(f"""
+            <div class="metric-card">
+                <h3>{format_money(forecast['expected_cents'], base_currency)}</h3>
+                <p>Expected from open invoices</p>
+            </div>
+            """, unsafe_allow_html=True)
         
-        # Create a bar chart
+        # Actual vs projected bar chart
         fig, ax = plt.subplots(figsize=(10, 4))
-        ax.bar(revenue_df['Month'], revenue_df['Revenue'], color='#4F8BF9')
+        ax.bar(monthly.index, monthly['actual'], color='#4F8BF9', label='Actual')
+        ax.bar(monthly.index, monthly['projected'], bottom=monthly['actual'], color='#f6c23e', label='Projected')
+        if 3 in forecast['trends']:
+            # Rolling averages cover complete months, which end just before the current one
+            rolling = forecast['trends'][3]['rolling'][-11:] / 100
+            ax.plot(monthly.index[11 - len(rolling):11], rolling, color='#e74a3b', marker='o', label='3-month average')
         ax.set_xlabel('Month')
-        ax.set_ylabel('Revenue ($)')
-        ax.set_title('Monthly Revenue')
+        ax.set_ylabel(f'Amount ({base_currency})')
+        ax.set_title('Actual vs Projected Cash Flow')
+        ax.legend()
         plt.xticks(rotation=45)
         plt.tight_layout()
         
         st.pyplot(fig)
+        if forecast['beyond_horizon_cents']:
+            st.caption(f"A further {format_money(forecast['beyond_horizon_cents'], base_currency)} is expected after {monthly.index[-1]}.")
     else:
         st.info("No revenue data available yet. Create invoices and record payments to see statistics.")
     
@@ -794,7 +474,7 @@ def dashboard_page():
                     <h3>{project[3]}</h3>
                     <p><strong>Client:</strong> {project[10]}</p>
                     <p><strong>Status:</strong> {project[7]}</p>
-                    <p><strong>Budget:</strong> ${project[8]:,.2f}</p>
+                    <p><strong>Budget:</strong> {format_money(project[8], project[11])}</p>
                 </div>
                 """, unsafe_allow_html=True)
         else:
@@ -810,6 +490,7 @@ def dashboard_page():
                 project_name = invoice[8] if len(invoice) > 8 else "N/A"
                 client_name = invoice[9] if len(invoice) > 9 else "N/A"
                 amount = invoice[2] if len(invoice) > 2 else 0
+                currency = invoice[10] if len(invoice) > 10 else "USD"
                 status = invoice[5] if len(invoice) > 5 else "Unknown"
                 
                 st.markdown(f"""
@@ -817,7 +498,7 @@ def dashboard_page():
                     <h3>Invoice #{invoice_id}</h3>
                     <p><strong>Project:</strong> {project_name}</p>
                     <p><strong>Client:</strong> {client_name}</p>
-                    <p><strong>Amount:</strong> ${amount:,.2f}</p>
+                    <p><strong>Amount:</strong> {format_money(amount, currency)}</p>
                     <p><strong>Status:</strong> {status}</p>
                 </div>
                 """, unsafe_allow_html=True)
@@ -838,11 +519,42 @@ def clients_page():
     if clients:
         # Convert to DataFrame for better display
         clients_df = pd.DataFrame(clients, columns=[
-            'ID', 'User ID', 'Name', 'Email', 'Phone', 'Company', 'Address', 'Notes', 'Created At'
+            'ID', 'User ID', 'Name', 'Email', 'Phone', 'Company', 'Address', 'Notes', 'Created At', 'Currency'
         ])
         
         # Display clients in a table
-        st.dataframe(clients_df[['Name', 'Email', 'Phone', 'Company']], use_container_width=True)
+        st.dataframe(clients_df[['Name', 'Email', 'Phone', 'Company', 'Currency']], use_container_width=True)
+        
+        # Client analytics, in the user's base currency
+        st.markdown('<h2 class="sub-header">Client Analytics</h2>', unsafe_allow_html=True)
+        base_currency = st.session_state.user.get("base_currency") or "USD"
+        analytics = ClientAnalytics(db).report(st.session_state.user["id"], base_currency)
+        if analytics['missing_currencies']:
+            st.warning(f"No exchange rates for {', '.join(analytics['missing_currencies'])}; those amounts are left out.")
+        
+        sort_by = st.selectbox("Sort by", list(ClientAnalytics.COLUMNS), format_func=ClientAnalytics.COLUMNS.get)
+        analytics_df = analytics['clients'].sort_values(sort_by, ascending=(sort_by == 'avg_days_to_pay'), na_position='last')
+        analytics_df = analytics_df.assign(
+            revenue=analytics_df['revenue'] / 100,
+            outstanding=analytics_df['outstanding'] / 100,
+            billed=analytics_df['billed'] / 100,
+            effective_rate=analytics_df['effective_rate'] / 100
+        )
+        st.dataframe(
+            analytics_df[['name', 'company', *ClientAnalytics.COLUMNS]],
+            column_config={
+                'name': "Client", 'company': "Company",
+                'revenue': st.column_config.NumberColumn(f"Lifetime Revenue ({base_currency})", format="%.2f"),
+                'outstanding': st.column_config.NumberColumn(f"Outstanding ({base_currency})", format="%.2f"),
+                'billed': st.column_config.NumberColumn(f"Billed ({base_currency})", format="%.2f"),
+                'avg_days_to_pay': st.column_config.NumberColumn("Avg Days to Pay", format="%.1f"),
+                'projects': "Projects",
+                'hours': st.column_config.NumberColumn("Hours", format="%.1f"),
+                'effective_rate': st.column_config.NumberColumn(f"Effective Hourly Rate ({base_currency})", format="%.2f")
+            },
+            hide_index=True,
+            use_container_width=True
+        )
         
         # Client details
         st.markdown('<h2 class="sub-header">Client Details</h2>', unsafe_allow_html=True)
@@ -865,6 +577,7 @@ def clients_page():
                     <p><strong>Phone:</strong> {selected_client[4]}</p>
                     <p><strong>Company:</strong> {selected_client[5]}</p>
                     <p><strong>Address:</strong> {selected_client[6]}</p>
+                    <p><strong>Currency:</strong> {selected_client[9]}</p>
                     <p><strong>Notes:</strong> {selected_client[7]}</p>
                 </div>
                 """, unsafe_allow_html=True)
@@ -879,7 +592,7 @@ def clients_page():
                 if st.button("Delete Client"):
                     if st.checkbox("Confirm deletion"):
                         db.delete_client(selected_client[0])
-                        st.success(f"Client '{selected_client[2]}' deleted successfully")
+                        st.success(f"Client '{selected_client[2]}' moved to the trash")
                         st.rerun()
                 
                 if st.button("Add Project for this Client"):
@@ -899,6 +612,7 @@ def add_client_page():
         phone = st.text_input("Phone")
         company = st.text_input("Company")
         address = st.text_area("Address")
+        currency = st.selectbox("Billing Currency", CURRENCIES)
         notes = st.text_area("Notes")
         
         submit = st.form_submit_button("Add Client")
@@ -912,7 +626,8 @@ def add_client_page():
                     phone,
                     company,
                     address,
-                    notes
+                    notes,
+                    currency
                 )
                 st.success(f"Client '{name}' added successfully")
                 navigate_to('clients')
@@ -944,33 +659,33 @@ def edit_client_page():
             st.rerun()
         return
     
+    edit_base("clients", client_id)
+    
     with st.form("edit_client_form"):
         name = st.text_input("Client Name", value=client[2])
         email = st.text_input("Email", value=client[3])
         phone = st.text_input("Phone", value=client[4])
         company = st.text_input("Company", value=client[5])
         address = st.text_area("Address", value=client[6])
+        currency = st.selectbox("Billing Currency", CURRENCIES, index=CURRENCIES.index(client[9]) if client[9] in CURRENCIES else 0)
         notes = st.text_area("Notes", value=client[7])
         
         submit = st.form_submit_button("Update Client")
         
         if submit:
             if name and email:
-                db.update_client(
-                    client_id,
-                    name,
-                    email,
-                    phone,
-                    company,
-                    address,
-                    notes
-                )
-                st.success(f"Client '{name}' updated successfully")
-                navigate_to('clients')
-                st.rerun()
+                values = {"name": name, "email": email, "phone": phone, "company": company,
+                          "address": address, "notes": notes, "currency": currency}
+                if save_edit("clients", client_id, values, db.update_client):
+                    st.success(f"Client '{name}' updated successfully")
+                    navigate_to('clients')
+                    st.rerun()
             else:
                 st.error("Client name and email are required")
     
+    show_edit_conflict("clients", client_id, db.update_client, 'clients')
+    show_change_history("clients", client_id)
+    
     if st.button("Cancel"):
         navigate_to('clients')
         st.rerun()
@@ -1000,8 +715,9 @@ def projects_page():
         # Convert to DataFrame for better display
         projects_df = pd.DataFrame(filtered_projects, columns=[
             'ID', 'User ID', 'Client ID', 'Name', 'Description', 'Start Date', 'End Date', 
-            'Status', 'Budget', 'Created At', 'Client Name'
+            'Status', 'Budget', 'Created At', 'Client Name', 'Currency'
         ])
+        projects_df['Budget'] = [format_money(cents, currency) for cents, currency in zip(projects_df['Budget'], projects_df['Currency'])]
         
         # Display projects in a table
         st.dataframe(projects_df[['Name', 'Client Name', 'Status', 'Budget', 'Start Date', 'End Date']], use_container_width=True)
@@ -1025,7 +741,7 @@ def projects_page():
                     <h3>{selected_project[3]}</h3>
                     <p><strong>Client:</strong> {selected_project[10]}</p>
                     <p><strong>Status:</strong> {selected_project[7]}</p>
-                    <p><strong>Budget:</strong> ${selected_project[8]:,.2f}</p>
+                    <p><strong>Budget:</strong> {format_money(selected_project[8], selected_project[11])}</p>
                     <p><strong>Start Date:</strong> {selected_project[5]}</p>
                     <p><strong>End Date:</strong> {selected_project[6]}</p>
                     <p><strong>Description:</strong> {selected_project[4]}</p>
@@ -1042,7 +758,7 @@ def projects_page():
                 if st.button("Delete Project"):
                     if st.checkbox("Confirm deletion"):
                         db.delete_project(selected_project[0])
-                        st.success(f"Project '{selected_project[3]}' deleted successfully")
+                        st.success(f"Project '{selected_project[3]}' moved to the trash")
                         st.rerun()
                 
                 if st.button("Manage Tasks"):
@@ -1085,6 +801,9 @@ def add_project_page():
         else:
             preselected_index = 0
         
+        # Projects default to the client's billing currency
+        default_currency = clients[preselected_index][9]
+        
         client_name = st.selectbox("Client", client_names, index=preselected_index)
         client_id = next((client[0] for client in clients if client[2] == client_name), None)
         
@@ -1098,7 +817,11 @@ def add_project_page():
             end_date = st.date_input("End Date")
         
         status = st.selectbox("Status", ["Not Started", "In Progress", "On Hold", "Completed", "Cancelled"])
-        budget = st.number_input("Budget ($)", min_value=0.0, step=100.0)
+        col1, col2 = st.columns(2)
+        with col1:
+            budget = st.number_input("Budget", min_value=0.0, step=100.0)
+        with col2:
+            currency = st.selectbox("Currency", CURRENCIES, index=CURRENCIES.index(default_currency) if default_currency in CURRENCIES else 0)
         
         submit = st.form_submit_button("Add Project")
         
@@ -1115,7 +838,8 @@ def add_project_page():
                         start_date.strftime("%Y-%m-%d"),
                         end_date.strftime("%Y-%m-%d"),
                         status,
-                        budget
+                        to_cents(budget),
+                        currency
                     )
                     st.success(f"Project '{name}' added successfully")
                     navigate_to('projects')
@@ -1150,6 +874,8 @@ def edit_project_page():
     # Get all clients
     clients = db.get_clients(st.session_state.user["id"])
     
+    edit_base("projects", project_id)
+    
     with st.form("edit_project_form"):
         client_names = [client[2] for client in clients]
         current_client = next((client for client in clients if client[0] == project[2]), None)
@@ -1172,7 +898,11 @@ def edit_project_page():
             end_date = st.date_input("End Date", value=datetime.datetime.strptime(project[6], "%Y-%m-%d").date())
         
         status = st.selectbox("Status", ["Not Started", "In Progress", "On Hold", "Completed", "Cancelled"], index=["Not Started", "In Progress", "On Hold", "Completed", "Cancelled"].index(project[7]))
-        budget = st.number_input("Budget ($)", min_value=0.0, step=100.0, value=float(project[8]))
+        col1, col2 = st.columns(2)
+        with col1:
+            budget = st.number_input("Budget", min_value=0.0, step=100.0, value=project[8] / 100)
+        with col2:
+            currency = st.selectbox("Currency", CURRENCIES, index=CURRENCIES.index(project[11]) if project[11] in CURRENCIES else 0)
         
         submit = st.form_submit_button("Update Project")
         
@@ -1181,22 +911,21 @@ def edit_project_page():
                 if end_date < start_date:
                     st.error("End date cannot be before start date")
                 else:
-                    db.update_project(
-                        project_id,
-                        client_id,
-                        name,
-                        description,
-                        start_date.strftime("%Y-%m-%d"),
-                        end_date.strftime("%Y-%m-%d"),
-                        status,
-                        budget
-                    )
-                    st.success(f"Project '{name}' updated successfully")
-                    navigate_to('projects')
-                    st.rerun()
+                    values = {
+                        "client_id": client_id, "name": name, "description": description,
+                        "start_date": start_date.strftime("%Y-%m-%d"), "end_date": end_date.strftime("%Y-%m-%d"),
+                        "status": status, "budget_cents": to_cents(budget), "currency": currency
+                    }
+                    if save_edit("projects", project_id, values, db.update_project):
+                        st.success(f"Project '{name}' updated successfully")
+                        navigate_to('projects')
+                        st.rerun()
             else:
                 st.error("Project name and client are required")
     
+    show_edit_conflict("projects", project_id, db.update_project, 'projects')
+    show_change_history("projects", project_id)
+    
     if st.button("Cancel"):
         navigate_to('projects')
         st.rerun()
@@ -1223,6 +952,24 @@ def tasks_page():
     
     st.markdown(f'<h2 class="sub-header">Tasks for Project: {project[3]}</h2>', unsafe_allow_html=True)
     
+    # Tracked time for the project
+    total_hours, billable_cents = db.get_project_time_totals(project_id)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown(f"""
+        <div class="metric-card">
+            <h3>{total_hours:,.1f} h</h3>
+            <p>Tracked Time</p>
+        </div>
+        """, unsafe_allow_html=True)
+    with col2:
+        st.markdown(f"""
+        <div class="metric-card">
+            <h3>{format_money(billable_cents, project[11])}</h3>
+            <p>Billable Amount</p>
+        </div>
+        """, unsafe_allow_html=True)
+    
     # Add task button
     if st.button("Add New Task"):
         st.session_state.temp_data["add_task"] = True
@@ -1238,7 +985,7 @@ def tasks_page():
             name = st.text_input("Task Name")
             description = st.text_area("Description")
             due_date = st.date_input("Due Date")
-            status = st.selectbox("Status", ["Not Started", "In Progress", "Completed"])
+            status = st.selectbox("Status", TASK_STATUSES)
             
             submit = st.form_submit_button("Add Task")
             
@@ -1267,9 +1014,10 @@ def tasks_page():
         tasks_df = pd.DataFrame(tasks, columns=[
             'ID', 'Project ID', 'Name', 'Description', 'Due Date', 'Status', 'Created At'
         ])
+        tasks_df['Hours'] = tasks_df['ID'].map(db.get_task_hours(project_id)).fillna(0).round(2)
         
         # Display tasks in a table
-        st.dataframe(tasks_df[['Name', 'Due Date', 'Status']], use_container_width=True)
+        st.dataframe(tasks_df[['Name', 'Due Date', 'Status', 'Hours']], use_container_width=True)
         
         # Task details and actions
         st.markdown('<h3>Task Details</h3>', unsafe_allow_html=True)
@@ -1306,16 +1054,42 @@ def tasks_page():
                         st.success(f"Task '{selected_task[2]}' deleted successfully")
                         st.rerun()
                 
+                # Timer
+                timer = st.session_state.get("timer")
+                if timer and timer["task_id"] == selected_task[0]:
+                    elapsed = datetime.datetime.now() - timer["started_at"]
+                    st.info(f"Timer running: {str(elapsed).split('.')[0]}")
+                    if st.button("Stop Timer"):
+                        db.add_time_entry(
+                            st.session_state.user["id"],
+                            project_id,
+                            selected_task[0],
+                            timer["started_at"].strftime("%Y-%m-%d %H:%M:%S"),
+                            int(elapsed.total_seconds()),
+                            to_cents(timer["hourly_rate"]),
+                            1,
+                            ""
+                        )
+                        st.session_state.pop("timer", None)
+                        st.success(f"Logged {elapsed.total_seconds() / 3600:.2f} h on '{selected_task[2]}'")
+                        st.rerun()
+                elif timer:
+                    st.caption("A timer is running on another task")
+                else:
+                    hourly_rate = st.number_input(f"Hourly Rate ({project[11]})", min_value=0.0, step=5.0, value=st.session_state.get("hourly_rate", 0.0))
+                    if st.button("Start Timer"):
+                        st.session_state.hourly_rate = hourly_rate
+                        st.session_state.timer = {
+                            "task_id": selected_task[0],
+                            "started_at": datetime.datetime.now(),
+                            "hourly_rate": hourly_rate
+                        }
+                        st.rerun()
+                
                 # Mark as complete button
                 if selected_task[5] != "Completed":
                     if st.button("Mark as Completed"):
-                        db.update_task(
-                            selected_task[0],
-                            selected_task[2],
-                            selected_task[3],
-                            selected_task[4],
-                            "Completed"
-                        )
+                        db.move_tasks(st.session_state.user["id"], [selected_task[0]], "Completed")
                         st.success(f"Task '{selected_task[2]}' marked as completed")
                         st.rerun()
         
@@ -1331,7 +1105,7 @@ def tasks_page():
                     name = st.text_input("Task Name", value=task[2])
                     description = st.text_area("Description", value=task[3])
                     due_date = st.date_input("Due Date", value=datetime.datetime.strptime(task[4], "%Y-%m-%d").date())
-                    status = st.selectbox("Status", ["Not Started", "In Progress", "Completed"], index=["Not Started", "In Progress", "Completed"].index(task[5]))
+                    status = st.selectbox("Status", TASK_STATUSES, index=TASK_STATUSES.index(task[5]))
                     
                     submit = st.form_submit_button("Update Task")
                     
@@ -1355,6 +1129,48 @@ def tasks_page():
                     st.session_state.temp_data.pop("edit_task", None)
                     st.session_state.temp_data.pop("task_id", None)
                     st.rerun()
+        # Manual time entry
+        with st.expander("Log Time Manually"):
+            with st.form("log_time_form"):
+                task_name = st.selectbox("Task", task_names)
+                col1, col2 = st.columns(2)
+                with col1:
+                    work_date = st.date_input("Date", value=datetime.datetime.now().date())
+                    hours = st.number_input("Hours", min_value=0.0, step=0.25)
+                with col2:
+                    hourly_rate = st.number_input(f"Hourly Rate ({project[11]})", min_value=0.0, step=5.0, value=st.session_state.get("hourly_rate", 0.0))
+                    billable = st.checkbox("Billable", value=True)
+                notes = st.text_input("Notes")
+                
+                submit = st.form_submit_button("Log Time")
+                
+                if submit:
+                    if hours > 0:
+                        db.add_time_entry(
+                            st.session_state.user["id"],
+                            project_id,
+                            tasks[task_names.index(task_name)][0],
+                            work_date.strftime("%Y-%m-%d 09:00:00"),
+                            int(hours * 3600),
+                            to_cents(hourly_rate),
+                            1 if billable else 0,
+                            notes
+                        )
+                        st.success(f"Logged {hours:.2f} h on '{task_name}'")
+                        st.rerun()
+                    else:
+                        st.error("Hours must be greater than zero")
+        
+        # Recent time entries
+        time_entries = db.get_time_entries(project_id, limit=20)
+        if time_entries:
+            st.markdown('<h3>Recent Time Entries</h3>', unsafe_allow_html=True)
+            entries_df = pd.DataFrame(time_entries, columns=[
+                'ID', 'Task ID', 'Task', 'Started At', 'Duration', 'Hourly Rate', 'Billable', 'Notes'
+            ])
+            entries_df['Hours'] = (entries_df['Duration'] / 3600).round(2)
+            entries_df['Hourly Rate'] = [format_money(cents, project[11]) for cents in entries_df['Hourly Rate']]
+            st.dataframe(entries_df[['Task', 'Started At', 'Hours', 'Hourly Rate', 'Billable', 'Notes']], use_container_width=True)
     else:
         st.info("No tasks found for this project. Add your first task.")
     
@@ -1362,6 +1178,197 @@ def tasks_page():
         navigate_to('projects')
         st.rerun()
 
+# Task board page
+def board_page():
+    st.markdown('<h1 class="main-header">Task Board</h1>', unsafe_allow_html=True)
+    user_id = st.session_state.user["id"]
+    
+    # The board stays in the session and is only re-read when someone else changed tasks;
+    # moves made here are applied to it in place
+    version = db.get_data_versions(user_id).get("tasks", 0)
+    board = st.session_state.get("board")
+    if not board or board["user_id"] != user_id or board["version"] != version:
+        board = {
+            "user_id": user_id,
+            "version": version,
+            "tasks": pd.DataFrame(
+                db.get_board(user_id),
+                columns=["id", "project_id", "project", "name", "due_date", "status", "position"]
+            ).set_index("id")
+        }
+        st.session_state.board = board
+    tasks = board["tasks"]
+    
+    if tasks.empty:
+        st.info("No tasks yet. Add tasks from a project's Manage Tasks page.")
+        return
+    
+    projects = st.multiselect("Projects", sorted(tasks["project"].unique()))
+    if projects:
+        tasks = tasks[tasks["project"].isin(projects)]
+    
+    # Long columns are rendered a page at a time
+    limits = st.session_state.temp_data.setdefault("board_limits", {})
+    for column, status in zip(st.columns(len(TASK_STATUSES)), TASK_STATUSES):
+        with column:
+            cards = tasks[tasks["status"] == status].sort_values("position")
+            st.markdown(f'<h3>{status} ({len(cards)})</h3>', unsafe_allow_html=True)
+            limit = limits.get(status, 50)
+            for task in cards.head(limit).itertuples():
+                st.markdown(f"""
+                <div class="card">
+                    <h4>{task.name}</h4>
+                    <p>{task.project}<br>Due: {task.due_date}</p>
+                </div>
+                """, unsafe_allow_html=True)
+            if len(cards) > limit:
+                st.caption(f"{len(cards) - limit} more")
+                if st.button("Show more", key=f"board_more_{status}"):
+                    limits[status] = limit + 50
+                    st.rerun()
+    
+    # Bulk move
+    st.markdown('<h2 class="sub-header">Move Tasks</h2>', unsafe_allow_html=True)
+    with st.form("move_tasks_form"):
+        task_ids = st.multiselect(
+            "Tasks",
+            tasks.sort_values(["status", "position"]).index.tolist(),
+            format_func=lambda task_id: f"{tasks.at[task_id, 'name']} · {tasks.at[task_id, 'project']} ({tasks.at[task_id, 'status']})"
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            status = st.selectbox("Move to", TASK_STATUSES)
+        with col2:
+            placement = st.radio("Place at", ["Bottom", "Top"], horizontal=True)
+        
+        submit = st.form_submit_button("Move Tasks")
+        
+        if submit:
+            if task_ids:
+                positions, version = db.move_tasks(user_id, task_ids, status, to_top=placement == "Top")
+                if version == board["version"] + 1:
+                    board["tasks"].loc[task_ids, "status"] = status
+                    board["tasks"].loc[list(positions), "position"] = list(positions.values())
+                    board["version"] = version
+                st.success(f"Moved {len(task_ids)} task(s) to {status}")
+                st.rerun()
+            else:
+                st.error("Select at least one task")
+
+# Calendar page
+def calendar_page():
+    st.markdown('<h1 class="main-header">Calendar</h1>', unsafe_allow_html=True)
+    user_id = st.session_state.user["id"]
+    deadlines = DeadlineCalendar(db)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        view = st.radio("View", ["Month", "Week"], horizontal=True)
+    with col2:
+        selected_date = st.date_input("Date", value=datetime.datetime.now().date())
+    
+    st.markdown(" &nbsp; ".join(
+        f'<span style="color: {color};">&#9632;</span> {label}' for label, color in DeadlineCalendar.KINDS.values()
+    ), unsafe_allow_html=True)
+    
+    if view == "Month":
+        st.markdown(f'<h2 class="sub-header">{selected_date.strftime("%B %Y")}</h2>', unsafe_allow_html=True)
+        st.markdown(deadlines.month_grid(user_id, selected_date.year, selected_date.month), unsafe_allow_html=True)
+        start_date = selected_date.replace(day=1)
+        end_date = start_date.replace(day=calendar.monthrange(start_date.year, start_date.month)[1])
+    else:
+        start_date = selected_date - datetime.timedelta(days=selected_date.weekday())
+        end_date = start_date + datetime.timedelta(days=6)
+        st.markdown(f'<h2 class="sub-header">Week of {start_date.strftime("%d %B %Y")}</h2>', unsafe_allow_html=True)
+        events = deadlines.events(user_id, start_date, end_date)
+        for offset in range(7):
+            day = start_date + datetime.timedelta(days=offset)
+            day_events = [event for event in events if event[3] == day.strftime("%Y-%m-%d")]
+            st.markdown(f"**{day.strftime('%A, %d %B')}**")
+            if day_events:
+                for kind, _, title, _, context, status in day_events:
+                    label, color = DeadlineCalendar.KINDS[kind]
+                    st.markdown(f'<span style="color: {color};">&#9632;</span> {label}: {title} &middot; {context or ""} ({status})', unsafe_allow_html=True)
+            else:
+                st.caption("Nothing due")
+    
+    st.download_button(
+        "Export to Calendar (.ics)",
+        deadlines.to_ics(deadlines.events(user_id, start_date, end_date)),
+        file_name=f"freelanceflow_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.ics",
+        mime="text/calendar"
+    )
+
+# Notifications page
+def notifications_page():
+    st.markdown('<h1 class="main-header">Notifications</h1>', unsafe_allow_html=True)
+    user_id = st.session_state.user["id"]
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Check for Reminders"):
+            created = ReminderEngine(db).run()["created"]
+            st.success(f"{created} new reminder(s)")
+    with col2:
+        if st.button("Mark All as Read"):
+            db.mark_notifications_read(user_id)
+            st.rerun()
+    
+    notifications = db.get_notifications(user_id)
+    if not notifications:
+        st.info("No reminders yet. Tasks and invoices coming due show up here.")
+        return
+    
+    for notification_id, kind, _, due_date, message, created_at, read_at in notifications:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            style = "" if read_at else ' style="border-left: 0.25rem solid #4F8BF9;"'
+            st.markdown(f"""
+            <div class="card"{style}>
+                <p>{'' if read_at else '<strong>'}{message}{'' if read_at else '</strong>'}</p>
+                <p><small>{created_at}</small></p>
+            </div>
+            """, unsafe_allow_html=True)
+        with col2:
+            if not read_at and st.button("Mark as Read", key=f"read_{notification_id}"):
+                db.mark_notifications_read(user_id, [notification_id])
+                st.rerun()
+
+# Trash page
+def trash_page():
+    st.markdown('<h1 class="main-header">Trash</h1>', unsafe_allow_html=True)
+    st.caption(f"Deleted clients, projects, invoices and payments are kept here for {jobs.TRASH_RETENTION_DAYS} days, then removed permanently.")
+    
+    trash = db.get_trash(st.session_state.user["id"])
+    if not trash:
+        st.info("The trash is empty.")
+        return
+    
+    trash_df = pd.DataFrame(trash, columns=['Kind', 'ID', 'Item', 'Deleted At'])
+    trash_df['Kind'] = trash_df['Kind'].map(AUDIT_RECORD_NAMES)
+    st.dataframe(trash_df[['Kind', 'Item', 'Deleted At']], use_container_width=True, hide_index=True)
+    
+    with st.form("restore_form"):
+        selected = st.multiselect(
+            "Items to restore",
+            list(range(len(trash))),
+            format_func=lambda i: f"{AUDIT_RECORD_NAMES[trash[i][0]]}: {trash[i][2]}"
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            restore = st.form_submit_button("Restore Selected")
+        with col2:
+            restore_all = st.form_submit_button("Restore All")
+        
+        if restore or restore_all:
+            items = trash if restore_all else [trash[i] for i in selected]
+            if items:
+                db.restore_from_trash(st.session_state.user["id"], [(kind, item_id) for kind, item_id, _, _ in items])
+                st.success(f"Restored {len(items)} item(s)")
+                st.rerun()
+            else:
+                st.error("Select at least one item")
+
 # Invoices page
 def invoices_page():
     st.markdown('<h1 class="main-header">Invoices</h1>', unsafe_allow_html=True)
@@ -1381,6 +1388,16 @@ def invoices_page():
         navigate_to('add_invoice')
         st.rerun()
     
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Export Invoices (CSV)"):
+            job_queue.submit(db, st.session_state.user["id"], "export_invoices")
+            st.success("Export started. Track it on the Background Jobs page.")
+    with col2:
+        if st.button("Download All as PDF (ZIP)"):
+            job_queue.submit(db, st.session_state.user["id"], "render_invoices", {"format": "pdf"})
+            st.success("Rendering started. Track it on the Background Jobs page.")
+    
     # Get all invoices
     invoices = db.get_invoices()
     
@@ -1397,11 +1414,16 @@ def invoices_page():
         # Convert to DataFrame for better display
         invoices_df = pd.DataFrame(filtered_invoices, columns=[
             'ID', 'Project ID', 'Amount', 'Issue Date', 'Due Date', 
-            'Status', 'Notes', 'Created At', 'Project Name', 'Client Name'
+            'Status', 'Notes', 'Created At', 'Project Name', 'Client Name', 'Currency'
         ])
+        base_currency = st.session_state.user.get("base_currency") or "USD"
+        base_amounts = CurrencyConverter(db).convert(invoices_df, base_currency, 'Amount', 'Currency', 'Issue Date')
+        invoices_df['Amount'] = [format_money(cents, currency) for cents, currency in zip(invoices_df['Amount'], invoices_df['Currency'])]
         
         # Display invoices in a table
         st.dataframe(invoices_df[['Project Name', 'Client Name', 'Amount', 'Due Date', 'Status']], use_container_width=True)
+        st.caption(f"Total: {format_money(round_half_up(base_amounts.sum()), base_currency)} at issue-date rates"
+                   + (f" ({base_amounts.isna().sum()} invoice(s) without a rate left out)" if base_amounts.isna().any() else ""))
         
         # Invoice details
         st.markdown('<h2 class="sub-header">Invoice Details</h2>', unsafe_allow_html=True)
@@ -1425,13 +1447,22 @@ def invoices_page():
                     <h3>Invoice #{selected_invoice[0][:8]}</h3>
                     <p><strong>Project:</strong> {selected_invoice[8]}</p>
                     <p><strong>Client:</strong> {selected_invoice[9]}</p>
-                    <p><strong>Amount:</strong> ${selected_invoice[2]:,.2f}</p>
+                    <p><strong>Amount:</strong> {format_money(selected_invoice[2], selected_invoice[10])}</p>
                     <p><strong>Issue Date:</strong> {selected_invoice[3]}</p>
                     <p><strong>Due Date:</strong> {selected_invoice[4]}</p>
                     <p><strong>Status:</strong> {selected_invoice[5]}</p>
                     <p><strong>Notes:</strong> {selected_invoice[6]}</p>
                 </div>
                 """, unsafe_allow_html=True)
+                
+                invoice_items = db.get_invoice_items(selected_invoice[0])
+                if invoice_items:
+                    items_df = pd.DataFrame(invoice_items, columns=[
+                        'ID', 'Description', 'Quantity', 'Unit Price', 'Amount', 'Source Type', 'Source ID', 'Tax Rate', 'Discount', 'Position'
+                    ])
+                    for column in ['Unit Price', 'Amount']:
+                        items_df[column] = [format_money(cents, selected_invoice[10]) for cents in items_df[column]]
+                    st.dataframe(items_df[['Description', 'Quantity', 'Unit Price', 'Amount']], use_container_width=True)
             
             with col2:
                 # Invoice actions
@@ -1443,7 +1474,7 @@ def invoices_page():
                 if st.button("Delete Invoice"):
                     if st.checkbox("Confirm deletion"):
                         db.delete_invoice(selected_invoice[0])
-                        st.success(f"Invoice deleted successfully")
+                        st.success("Invoice moved to the trash")
                         st.rerun()
                 
                 if st.button("Record Payment"):
@@ -1451,6 +1482,17 @@ def invoices_page():
                     navigate_to('add_payment')
                     st.rerun()
                 
+                # Invoice documents
+                renderer = rendering.InvoiceRenderer(db)
+                for fmt, mime in rendering.InvoiceRenderer.FORMATS.items():
+                    st.download_button(
+                        f"Download {fmt.upper()}",
+                        renderer.render(selected_invoice[0], fmt),
+                        file_name=f"invoice_{selected_invoice[0][:8]}.{fmt}",
+                        mime=mime,
+                        key=f"download_invoice_{fmt}"
+                    )
+                
                 # View payments button
                 payments = db.get_payments(selected_invoice[0])
                 if payments:
@@ -1491,9 +1533,15 @@ def add_invoice_page():
         
         project_name = st.selectbox("Project", project_names, index=preselected_index)
         
-        project_id = projects[project_names.index(project_name)][0]
+        project = projects[project_names.index(project_name)]
+        project_id = project[0]
         
-        amount = st.number_input("Amount ($)", min_value=0.0, step=100.0)
+        # Invoices are billed in the project's currency unless overridden
+        col1, col2 = st.columns(2)
+        with col1:
+            amount = st.number_input("Amount", min_value=0.0, step=100.0)
+        with col2:
+            currency = st.selectbox("Currency", ["Project currency"] + CURRENCIES)
         
         col1, col2 = st.columns(2)
         with col1:
@@ -1501,7 +1549,7 @@ def add_invoice_page():
         with col2:
             due_date = st.date_input("Due Date", value=(datetime.datetime.now() + datetime.timedelta(days=30)).date())
         
-        status = st.selectbox("Status", ["Unpaid", "Partially Paid", "Paid"])
+        status = st.selectbox("Status", ["Unpaid", "Partially Paid", "Paid", "Overdue"])
         notes = st.text_area("Notes")
         
         submit = st.form_submit_button("Create Invoice")
@@ -1513,11 +1561,12 @@ def add_invoice_page():
                 else:
                     invoice_id = db.add_invoice(
                         project_id,
-                        amount,
+                        to_cents(amount),
                         issue_date.strftime("%Y-%m-%d"),
                         due_date.strftime("%Y-%m-%d"),
                         status,
-                        notes
+                        notes,
+                        project[11] if currency == "Project currency" else currency
                     )
                     st.success("Invoice created successfully")
                     navigate_to('invoices')
@@ -1552,6 +1601,61 @@ def edit_invoice_page():
     # Get all projects
     projects = db.get_projects(st.session_state.user["id"])
     
+    # Line items grid, only the rows that changed are written back
+    st.markdown('<h2 class="sub-header">Line Items</h2>', unsafe_allow_html=True)
+    invoice_items = db.get_invoice_items(invoice_id)
+    if not invoice_items and invoice[2]:
+        st.caption(f"No line items yet. Saving items starts from one for the current amount of {format_money(invoice[2], invoice[10])}, "
+                   "so add to it or edit it rather than entering the whole invoice again.")
+    items_df = pd.DataFrame(
+        [(item[0], item[1], item[2], item[3] / 100, item[7], item[8]) for item in invoice_items],
+        columns=['ID', 'Description', 'Quantity', 'Unit Price', 'Tax %', 'Discount %']
+    )
+    edited_df = st.data_editor(
+        items_df,
+        num_rows="dynamic",
+        column_order=['Description', 'Quantity', 'Unit Price', 'Tax %', 'Discount %'],
+        use_container_width=True,
+        key=f"invoice_items_{invoice_id}"
+    )
+    
+    if not edited_df.empty:
+        # Unedited items keep their saved amounts, as update_invoice_items does on save
+        amounts = edited_line_amounts(
+            list(zip(edited_df['ID'], edited_df['Quantity'].fillna(0), [to_cents(price) for price in edited_df['Unit Price'].fillna(0)],
+                     edited_df['Tax %'].fillna(0), edited_df['Discount %'].fillna(0))),
+            {item[0]: (item[2], item[3], item[7], item[8], item[4]) for item in invoice_items}
+        )
+        currency = invoice[10]
+        st.markdown(
+            f"Subtotal: {format_money(amounts['net'].sum(), currency)} &nbsp; Discount: {format_money(amounts['discount'].sum(), currency)} &nbsp; "
+            f"Tax: {format_money(amounts['tax'].sum(), currency)} &nbsp; **Total: {format_money(amounts['total'].sum(), currency)}**"
+        )
+    
+    if st.button("Save Line Items"):
+        edited_df = edited_df.fillna({'Description': "", 'Quantity': 0, 'Unit Price': 0, 'Tax %': 0, 'Discount %': 0})
+        edited_df['Unit Price'] = [to_cents(price) for price in edited_df['Unit Price']]
+        edited_df = edited_df.astype({'Description': str, 'Quantity': float, 'Unit Price': float, 'Tax %': float, 'Discount %': float})
+        columns = ['Description', 'Quantity', 'Unit Price', 'Tax %', 'Discount %']
+        existing = edited_df[edited_df['ID'].notna()].set_index('ID')[columns]
+        original = items_df.assign(**{'Unit Price': [float(item[3]) for item in invoice_items]}).set_index('ID')[columns]
+        
+        added = [tuple(row) for row in edited_df[edited_df['ID'].isna()][columns].itertuples(index=False)]
+        deleted_ids = [item_id for item_id in original.index if item_id not in existing.index]
+        kept = original.loc[existing.index]
+        changed_mask = (existing != kept).any(axis=1)
+        changed = [(item_id, *row) for item_id, row in zip(existing.index[changed_mask], existing[changed_mask].itertuples(index=False))]
+        
+        try:
+            if added or changed or deleted_ids:
+                db.update_invoice_items(invoice_id, added, changed, deleted_ids)
+                st.success(f"Saved {len(added)} new, {len(changed)} changed and {len(deleted_ids)} removed line item(s)")
+            st.rerun()
+        except ValueError as e:
+            st.error(str(e))
+    
+    edit_base("invoices", invoice_id)
+    
     with st.form("edit_invoice_form"):
         project_names = [f"{project[3]} ({project[10]})" for project in projects]
         current_project = next((project for project in projects if project[0] == invoice[1]), None)
@@ -1564,7 +1668,8 @@ def edit_invoice_page():
         project_name = st.selectbox("Project", project_names, index=current_project_index)
         project_id = projects[project_names.index(project_name)][0]
         
-        amount = st.number_input("Amount ($)", min_value=0.0, step=100.0, value=float(invoice[2]))
+        # With line items the amount is their cached total
+        amount = st.number_input(f"Amount ({invoice[10]})", min_value=0.0, step=100.0, value=invoice[2] / 100, disabled=bool(invoice_items))
         
         col1, col2 = st.columns(2)
         with col1:
@@ -1572,7 +1677,7 @@ def edit_invoice_page():
         with col2:
             due_date = st.date_input("Due Date", value=datetime.datetime.strptime(invoice[4], "%Y-%m-%d").date())
         
-        status = st.selectbox("Status", ["Unpaid", "Partially Paid", "Paid"], index=["Unpaid", "Partially Paid", "Paid"].index(invoice[5]))
+        status = st.selectbox("Status", ["Unpaid", "Partially Paid", "Paid", "Overdue"], index=["Unpaid", "Partially Paid", "Paid", "Overdue"].index(invoice[5]))
         notes = st.text_area("Notes", value=invoice[6])
         
         submit = st.form_submit_button("Update Invoice")
@@ -1582,24 +1687,198 @@ def edit_invoice_page():
                 if due_date < issue_date:
                     st.error("Due date cannot be before issue date")
                 else:
-                    db.update_invoice(
-                        invoice_id,
-                        amount,
-                        issue_date.strftime("%Y-%m-%d"),
-                        due_date.strftime("%Y-%m-%d"),
-                        status,
-                        notes
-                    )
-                    st.success("Invoice updated successfully")
-                    navigate_to('invoices')
-                    st.rerun()
+                    values = {
+                        "amount_cents": to_cents(amount), "issue_date": issue_date.strftime("%Y-%m-%d"),
+                        "due_date": due_date.strftime("%Y-%m-%d"), "status": status, "notes": notes
+                    }
+                    if save_edit("invoices", invoice_id, values, db.update_invoice):
+                        st.success("Invoice updated successfully")
+                        navigate_to('invoices')
+                        st.rerun()
             else:
                 st.error("Amount must be greater than zero")
     
+    show_edit_conflict("invoices", invoice_id, db.update_invoice, 'invoices')
+    show_change_history("invoices", invoice_id)
+    
     if st.button("Cancel"):
         navigate_to('invoices')
         st.rerun()
 
+# Invoice builder page
+def invoice_builder_page():
+    st.markdown('<h1 class="main-header">Invoice Builder</h1>', unsafe_allow_html=True)
+    
+    projects = db.get_projects(st.session_state.user["id"])
+    clients = db.get_clients(st.session_state.user["id"])
+    
+    if not projects:
+        st.warning("You need to add a project first")
+        if st.button("Add Project"):
+            navigate_to('add_project')
+            st.rerun()
+        return
+    
+    # Scope of the billing run
+    scope = st.radio("Bill", ["All projects", "Selected projects", "One client"], horizontal=True)
+    project_ids = None
+    client_id = None
+    if scope == "Selected projects":
+        project_names = [f"{project[3]} ({project[10]})" for project in projects]
+        selected_names = st.multiselect("Projects", project_names)
+        project_ids = [projects[project_names.index(name)][0] for name in selected_names]
+    elif scope == "One client":
+        client_names = [client[2] for client in clients]
+        client_name = st.selectbox("Client", client_names)
+        client_id = clients[client_names.index(client_name)][0]
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        mode = st.selectbox("Include", list(InvoiceBuilder.MODES), format_func=InvoiceBuilder.MODES.get)
+    with col2:
+        until = st.date_input("Work Up To", value=datetime.datetime.now().date())
+    with col3:
+        due_days = st.number_input("Payment Terms (days)", min_value=0, value=30, step=1)
+    
+    if scope == "Selected projects" and not project_ids:
+        st.info("Select at least one project.")
+        return
+    
+    builder = InvoiceBuilder(db)
+    entries, lines = builder.preview(st.session_state.user["id"], project_ids, client_id, until.strftime("%Y-%m-%d"), mode)
+    
+    if lines.empty:
+        st.info("No unbilled billable time found for this selection.")
+        return
+    
+    st.markdown('<h2 class="sub-header">Line Items</h2>', unsafe_allow_html=True)
+    lines_display = lines.rename(columns={
+        'project_name': 'Project', 'task_name': 'Description', 'hours': 'Hours', 'entries': 'Time Entries'
+    })
+    lines_display['Rate'] = [format_money(cents, currency) for cents, currency in zip(lines['hourly_rate_cents'], lines['currency'])]
+    lines_display['Amount'] = [format_money(cents, currency) for cents, currency in zip(lines['amount_cents'], lines['currency'])]
+    st.dataframe(lines_display[['Project', 'Description', 'Hours', 'Rate', 'Amount', 'Time Entries']], use_container_width=True)
+    
+    invoice_count = lines['project_id'].nunique()
+    totals = lines.groupby('currency')['amount_cents'].sum()
+    st.markdown(f"**{invoice_count} invoice(s), total {', '.join(format_money(total, currency) for currency, total in totals.items())}**")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Create Invoices"):
+            invoice_ids = builder.build(
+                st.session_state.user["id"], project_ids, client_id, until.strftime("%Y-%m-%d"), mode, due_days=int(due_days)
+            )
+            st.success(f"Created {len(invoice_ids)} invoice(s)")
+            st.rerun()
+    with col2:
+        if st.button("Create in Background"):
+            job_queue.submit(db, st.session_state.user["id"], "build_invoices", {
+                "project_ids": project_ids,
+                "client_id": client_id,
+                "until": until.strftime("%Y-%m-%d"),
+                "mode": mode,
+                "due_days": int(due_days)
+            })
+            st.success("Billing run started. Track it on the Background Jobs page.")
+
+# Recurring invoices page
+def recurring_invoices_page():
+    st.markdown('<h1 class="main-header">Recurring Invoices</h1>', unsafe_allow_html=True)
+    
+    # Get all projects
+    projects = db.get_projects(st.session_state.user["id"])
+    
+    if not projects:
+        st.warning("You need to add a project first")
+        if st.button("Add Project"):
+            navigate_to('add_project')
+            st.rerun()
+        return
+    
+    if st.button("Generate Due Invoices Now"):
+        job_queue.submit(db, None, "recurring_invoices", priority=5)
+        st.success("Invoice generation started. New invoices will appear on the Invoices page.")
+    
+    recurring_invoices = db.get_recurring_invoices(st.session_state.user["id"])
+    
+    if recurring_invoices:
+        recurring_df = pd.DataFrame(recurring_invoices, columns=[
+            'ID', 'Project ID', 'Amount', 'Cadence', 'Start Date', 'Next Run', 'End Date',
+            'Due Days', 'Notes', 'Active', 'Project Name', 'Client Name', 'Currency'
+        ])
+        recurring_df['Amount'] = [format_money(cents, currency) for cents, currency in zip(recurring_df['Amount'], recurring_df['Currency'])]
+        recurring_df['Active'] = recurring_df['Active'].map({1: "Yes", 0: "No"})
+        
+        st.dataframe(recurring_df[['Project Name', 'Client Name', 'Amount', 'Cadence', 'Next Run', 'End Date', 'Active']], use_container_width=True)
+        
+        # Template actions
+        template_names = [f"{r[10]} - {format_money(r[2], r[12])} {r[3].lower()}" for r in recurring_invoices]
+        selected_template_name = st.selectbox("Select a recurring invoice", template_names)
+        selected_template = recurring_invoices[template_names.index(selected_template_name)]
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if selected_template[9]:
+                if st.button("Pause"):
+                    RecurringInvoiceScheduler(db).pause(selected_template[0])
+                    st.rerun()
+            else:
+                if st.button("Resume"):
+                    # Periods that passed while paused are not billed
+                    RecurringInvoiceScheduler(db).resume(selected_template[0])
+                    st.rerun()
+        with col2:
+            if st.button("Delete Recurring Invoice"):
+                db.delete_recurring_invoice(selected_template[0])
+                st.success("Recurring invoice deleted successfully")
+                st.rerun()
+    else:
+        st.info("No recurring invoices yet.")
+    
+    st.markdown('<h2 class="sub-header">New Recurring Invoice</h2>', unsafe_allow_html=True)
+    
+    with st.form("add_recurring_invoice_form"):
+        project_names = [f"{project[3]} ({project[10]})" for project in projects]
+        project_name = st.selectbox("Project", project_names)
+        project = projects[project_names.index(project_name)]
+        project_id = project[0]
+        
+        # Invoices are billed in the project's currency
+        amount = st.number_input("Amount", min_value=0.0, step=100.0)
+        cadence = st.selectbox("Cadence", RecurringInvoiceScheduler.CADENCES, index=1)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("First Invoice Date", value=datetime.datetime.now().date())
+        with col2:
+            end_date = st.date_input("End Date (optional)", value=None)
+        
+        due_days = st.number_input("Payment Terms (days)", min_value=0, value=30, step=1)
+        notes = st.text_area("Notes")
+        
+        submit = st.form_submit_button("Create Recurring Invoice")
+        
+        if submit:
+            if amount > 0:
+                if end_date and end_date < start_date:
+                    st.error("End date cannot be before the first invoice date")
+                else:
+                    db.add_recurring_invoice(
+                        st.session_state.user["id"],
+                        project_id,
+                        to_cents(amount),
+                        cadence,
+                        start_date.strftime("%Y-%m-%d"),
+                        end_date.strftime("%Y-%m-%d") if end_date else None,
+                        int(due_days),
+                        notes
+                    )
+                    st.success("Recurring invoice created successfully")
+                    st.rerun()
+            else:
+                st.error("Amount must be greater than zero")
+
 # Payments page
 def payments_page():
     st.markdown('<h1 class="main-header">Payments</h1>', unsafe_allow_html=True)
@@ -1628,7 +1907,7 @@ def payments_page():
         <h3>Invoice Details</h3>
         <p><strong>Project:</strong> {invoice[8]}</p>
         <p><strong>Client:</strong> {invoice[9]}</p>
-        <p><strong>Amount:</strong> ${invoice[2]:,.2f}</p>
+        <p><strong>Amount:</strong> {format_money(invoice[2], invoice[10])}</p>
         <p><strong>Status:</strong> {invoice[5]}</p>
     </div>
     """, unsafe_allow_html=True)
@@ -1644,13 +1923,13 @@ def payments_page():
     if payments:
         # Calculate total paid
         total_paid = sum(payment[2] for payment in payments)
-        remaining = float(invoice[2]) - total_paid
+        remaining = invoice[2] - total_paid
         
         col1, col2 = st.columns(2)
         with col1:
             st.markdown(f"""
             <div class="metric-card">
-                <h3>${total_paid:,.2f}</h3>
+                <h3>{format_money(total_paid, invoice[10])}</h3>
                 <p>Total Paid</p>
             </div>
             """, unsafe_allow_html=True)
@@ -1658,15 +1937,24 @@ def payments_page():
         with col2:
             st.markdown(f"""
             <div class="metric-card">
-                <h3>${remaining:,.2f}</h3>
+                <h3>{format_money(remaining, invoice[10])}</h3>
                 <p>Remaining</p>
             </div>
             """, unsafe_allow_html=True)
+            
+            base_currency = st.session_state.user.get("base_currency") or "USD"
+            if invoice[10] != base_currency:
+                balances = pd.DataFrame({'amount_cents': [total_paid, remaining], 'currency': invoice[10], 'day': None})
+                paid_base, remaining_base = CurrencyConverter(db).convert(balances, base_currency)
+                if not np.isnan(remaining_base):
+                    st.caption(f"≈ {format_money(round_half_up(paid_base), base_currency)} paid, "
+                               f"{format_money(round_half_up(remaining_base), base_currency)} remaining at today's rate")
         
         # Convert to DataFrame for better display
         payments_df = pd.DataFrame(payments, columns=[
             'ID', 'Invoice ID', 'Amount', 'Payment Date', 'Payment Method', 'Notes', 'Created At'
         ])
+        payments_df['Amount'] = [format_money(cents, invoice[10]) for cents in payments_df['Amount']]
         
         # Display payments in a table
         st.dataframe(payments_df[['Amount', 'Payment Date', 'Payment Method']], use_container_width=True)
@@ -1675,7 +1963,7 @@ def payments_page():
         st.markdown('<h3>Payment Details</h3>', unsafe_allow_html=True)
         
         # Select payment
-        payment_ids = [f"Payment of ${payment[2]:,.2f} on {payment[3]}" for payment in payments]
+        payment_ids = [f"Payment of {format_money(payment[2], invoice[10])} on {payment[3]}" for payment in payments]
         selected_payment_id_display = st.selectbox("Select a payment", payment_ids)
         
         # Extract the actual payment ID
@@ -1690,7 +1978,7 @@ def payments_page():
             with col1:
                 st.markdown(f"""
                 <div class="card">
-                    <h3>Payment of ${selected_payment[2]:,.2f}</h3>
+                    <h3>Payment of {format_money(selected_payment[2], invoice[10])}</h3>
                     <p><strong>Date:</strong> {selected_payment[3]}</p>
                     <p><strong>Method:</strong> {selected_payment[4]}</p>
                     <p><strong>Notes:</strong> {selected_payment[5]}</p>
@@ -1707,7 +1995,7 @@ def payments_page():
                 if st.button("Delete Payment"):
                     if st.checkbox("Confirm deletion"):
                         db.delete_payment(selected_payment[0])
-                        st.success("Payment deleted successfully")
+                        st.success("Payment moved to the trash")
                         st.rerun()
     else:
         st.info("No payments recorded for this invoice.")
@@ -1739,21 +2027,21 @@ def add_payment_page():
     # Calculate remaining amount
     payments = db.get_payments(invoice_id)
     total_paid = sum(payment[2] for payment in payments) if payments else 0
-    remaining = float(invoice[2]) - total_paid
+    remaining = invoice[2] - total_paid
     
     st.markdown(f"""
     <div class="card">
         <h3>Invoice Details</h3>
         <p><strong>Project:</strong> {invoice[8]}</p>
         <p><strong>Client:</strong> {invoice[9]}</p>
-        <p><strong>Total Amount:</strong> ${invoice[2]:,.2f}</p>
-        <p><strong>Paid So Far:</strong> ${total_paid:,.2f}</p>
-        <p><strong>Remaining:</strong> ${remaining:,.2f}</p>
+        <p><strong>Total Amount:</strong> {format_money(invoice[2], invoice[10])}</p>
+        <p><strong>Paid So Far:</strong> {format_money(total_paid, invoice[10])}</p>
+        <p><strong>Remaining:</strong> {format_money(remaining, invoice[10])}</p>
     </div>
     """, unsafe_allow_html=True)
     
     with st.form("add_payment_form"):
-        amount = st.number_input("Payment Amount ($)", min_value=0.01, max_value=float(remaining), step=0.01, value=float(remaining))
+        amount = st.number_input(f"Payment Amount ({invoice[10]})", min_value=0.01, max_value=remaining / 100, step=0.01, value=remaining / 100)
         payment_date = st.date_input("Payment Date", value=datetime.datetime.now().date())
         payment_method = st.selectbox("Payment Method", ["Credit Card", "Bank Transfer", "Cash", "Check", "PayPal", "Other"])
         notes = st.text_area("Notes")
@@ -1761,10 +2049,11 @@ def add_payment_page():
         submit = st.form_submit_button("Record Payment")
         
         if submit:
-            if amount > 0 and amount <= remaining:
+            amount_cents = to_cents(amount)
+            if 0 < amount_cents <= remaining:
                 payment_id = db.add_payment(
                     invoice_id,
-                    amount,
+                    amount_cents,
                     payment_date.strftime("%Y-%m-%d"),
                     payment_method,
                     notes
@@ -1805,10 +2094,12 @@ def edit_payment_page():
     # Calculate maximum amount (original amount + remaining)
     payments = db.get_payments(invoice_id)
     total_paid = sum(p[2] for p in payments if p[0] != payment_id) if payments else 0
-    max_amount = float(invoice[2]) - total_paid
+    max_amount = invoice[2] - total_paid
+    
+    edit_base("payments", payment_id)
     
     with st.form("edit_payment_form"):
-        amount = st.number_input("Payment Amount ($)", min_value=0.01, max_value=float(max_amount), step=0.01, value=float(payment[2]))
+        amount = st.number_input(f"Payment Amount ({invoice[10]})", min_value=0.01, max_value=max_amount / 100, step=0.01, value=payment[2] / 100)
         payment_date = st.date_input("Payment Date", value=datetime.datetime.strptime(payment[3], "%Y-%m-%d").date())
         payment_method = st.selectbox("Payment Method", ["Credit Card", "Bank Transfer", "Cash", "Check", "PayPal", "Other"], index=["Credit Card", "Bank Transfer", "Cash", "Check", "PayPal", "Other"].index(payment[4]))
         notes = st.text_area("Notes", value=payment[5])
@@ -1816,24 +2107,108 @@ def edit_payment_page():
         submit = st.form_submit_button("Update Payment")
         
         if submit:
-            if amount > 0 and amount <= max_amount:
-                db.update_payment(
-                    payment_id,
-                    amount,
-                    payment_date.strftime("%Y-%m-%d"),
-                    payment_method,
-                    notes
-                )
-                st.success("Payment updated successfully")
-                navigate_to('payments')
-                st.rerun()
+            amount_cents = to_cents(amount)
+            if 0 < amount_cents <= max_amount:
+                values = {
+                    "amount_cents": amount_cents, "payment_date": payment_date.strftime("%Y-%m-%d"),
+                    "payment_method": payment_method, "notes": notes
+                }
+                if save_edit("payments", payment_id, values, db.update_payment):
+                    st.success("Payment updated successfully")
+                    navigate_to('payments')
+                    st.rerun()
             else:
                 st.error("Invalid payment amount")
     
+    show_edit_conflict("payments", payment_id, db.update_payment, 'payments')
+    show_change_history("payments", payment_id)
+    
     if st.button("Cancel"):
         navigate_to('payments')
         st.rerun()
 
+# Job status widget, polls the jobs table instead of blocking the rerun
+def job_status_widget(job_id):
+    job = db.get_job(job_id)
+    if not job:
+        return None
+    
+    if job[2] in ("queued", "running"):
+        @st.fragment(run_every="2s")
+        def poll():
+            # Fragment reruns skip the end of the script, so they open and close their own connection
+            poll_db = Database(db.db_name)
+            try:
+                current = poll_db.get_job(job_id)
+            finally:
+                poll_db.close()
+            st.progress(current[3], text=f"{current[1].replace('_', ' ').capitalize()}: {current[2]}")
+            if current[2] not in ("queued", "running"):
+                st.rerun()
+        poll()
+    elif job[2] == "failed":
+        st.error(f"Job failed: {job[6]}")
+    return job
+
+# Jobs page
+def jobs_page():
+    st.markdown('<h1 class="main-header">Background Jobs</h1>', unsafe_allow_html=True)
+    
+    if st.button("Refresh"):
+        st.rerun()
+    
+    jobs = db.get_jobs(st.session_state.user["id"])
+    
+    if jobs:
+        jobs_df = pd.DataFrame(jobs, columns=[
+            'ID', 'Type', 'Status', 'Progress', 'Attempts', 'Result', 'Error', 'Created At', 'Finished At'
+        ])
+        st.dataframe(jobs_df[['Type', 'Status', 'Progress', 'Attempts', 'Error', 'Created At', 'Finished At']], use_container_width=True)
+        
+        # Downloads for finished export jobs
+        for job in jobs:
+            if job[2] == "succeeded" and job[5]:
+                result = json.loads(job[5])
+                if "path" in result and os.path.exists(result["path"]):
+                    with open(result["path"], "rb") as f:
+                        st.download_button(
+                            f"Download {os.path.basename(result['path'])}",
+                            f.read(),
+                            file_name=os.path.basename(result["path"]),
+                            key=f"download_{job[0]}"
+                        )
+    else:
+        st.info("No background jobs yet.")
+    
+    # Database health, from the last maintenance run (SQLite only)
+    if db.backend.name == "sqlite":
+        st.markdown('<h2 class="sub-header">Database Health</h2>', unsafe_allow_html=True)
+        
+        if st.button("Check Now"):
+            worker = maintenance.Maintenance(db.backend.path)
+            try:
+                report = worker.report()
+            finally:
+                worker.close()
+            db.set_meta("maintenance_report", json.dumps(report))
+        stored = db.get_meta("maintenance_report")
+        if stored:
+            report = json.loads(stored)
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("File Size", f"{report['file_bytes'] / 1048576:.1f} MB", help=f"WAL: {report['wal_bytes'] / 1048576:.1f} MB")
+            with col2:
+                st.metric("Free Pages", f"{report['free_pages']:,}", help=f"{report['free_ratio']:.1%} of {report['pages']:,} pages")
+            with col3:
+                fragmentation = report["fragmentation"]
+                st.metric("Fragmentation", "not measured" if fragmentation is None else f"{fragmentation:.1%}",
+                          help="Share of leaf pages out of sequence; measured off-peak or with Check Now")
+            stale = ", ".join(report["stale_tables"]) or "none"
+            st.caption(f"Checked {report['checked_at']}. Auto-vacuum: {report['auto_vacuum']}. Tables awaiting ANALYZE: {stale}. "
+                       f"Heavy maintenance runs between {'-'.join(f'{hour}:00' for hour in maintenance.off_peak_hours())}.")
+        else:
+            st.info("No maintenance run yet.")
+
 # Settings page
 def settings_page():
     st.markdown('<h1 class="main-header">Settings</h1>', unsafe_allow_html=True)
@@ -1853,9 +2228,109 @@ def settings_page():
         </div>
         """, unsafe_allow_html=True)
     
+    # Currency
+    st.markdown('<h2 class="sub-header">Currency</h2>', unsafe_allow_html=True)
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        base_currency = st.session_state.user.get("base_currency") or "USD"
+        new_base_currency = st.selectbox("Base Currency", CURRENCIES, index=CURRENCIES.index(base_currency) if base_currency in CURRENCIES else 0,
+                                         help="Dashboard totals and aging are reported in this currency")
+        if new_base_currency != base_currency and st.button("Save Base Currency"):
+            db.update_user_base_currency(st.session_state.user["id"], new_base_currency)
+            st.session_state.user["base_currency"] = new_base_currency
+            st.success(f"Base currency set to {new_base_currency}")
+            st.rerun()
+    
+    with col2:
+        currency_count, first_day, last_day = db.get_fx_summary()
+        if currency_count:
+            st.markdown(f"Exchange rates: {currency_count} currencies against {db.get_meta('fx_base')}, {first_day} to {last_day}")
+        else:
+            st.markdown("No exchange rates loaded yet.")
+        st.caption(f"CSV with date, base, currency and rate columns (units of currency per one base). "
+                   f"A {CurrencyConverter.RATES_FILE} file next to the app is loaded automatically.")
+        rates_file = st.file_uploader("Load Exchange Rates", type=["csv"])
+        if rates_file and st.button("Import Rates"):
+            try:
+                loaded = db.save_fx_rates(*CurrencyConverter.read_rates_file(rates_file))
+                st.success(f"Loaded {loaded} exchange rate(s)")
+            except (ValueError, KeyError) as e:
+                st.error(f"Could not read rates file: {e}")
+    
+    # API tokens (kept in the catalog, next to the login)
+    st.markdown('<h2 class="sub-header">API Tokens</h2>', unsafe_allow_html=True)
+    st.caption("Tokens give scripts and integrations access to your clients, projects, tasks, invoices and payments "
+               "through the REST API (api.py). Send one as \"Authorization: Bearer <token>\".")
+    
+    if st.session_state.temp_data.get("new_api_token"):
+        st.success("Token created. Copy it now, it won't be shown again.")
+        st.code(st.session_state.temp_data.pop("new_api_token"))
+    
+    with st.form("api_token_form", clear_on_submit=True):
+        token_name = st.text_input("Token Name", placeholder="e.g. Accounting sync")
+        if st.form_submit_button("Create Token"):
+            if token_name:
+                st.session_state.temp_data["new_api_token"] = catalog.add_api_token(st.session_state.user["id"], token_name)
+                st.rerun()
+            else:
+                st.error("Please give the token a name")
+    
+    for token_id, token_name, created_at in catalog.get_api_tokens(st.session_state.user["id"]):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.markdown(f"**{token_name}** · created {created_at}")
+        with col2:
+            if st.button("Revoke", key=f"revoke_token_{token_id}"):
+                catalog.delete_api_token(st.session_state.user["id"], token_id)
+                st.rerun()
+    
+    # Webhooks
+    st.markdown('<h2 class="sub-header">Webhooks</h2>', unsafe_allow_html=True)
+    st.caption("Every change to your clients, projects, tasks, invoices and payments is posted as JSON to these URLs, "
+               f"in order and in batches, within about {webhooks.DISPATCH_INTERVAL} seconds. Requests are signed with the "
+               f"webhook's secret in the {webhooks.SIGNATURE_HEADER} header; failed deliveries are retried with backoff, and "
+               f"after {webhooks.MAX_FAILURES} failures in a row the webhook is paused until you resume it.")
+    
+    if st.session_state.temp_data.get("new_webhook_secret"):
+        st.success("Webhook added. Copy its signing secret now, it won't be shown again.")
+        st.code(st.session_state.temp_data.pop("new_webhook_secret"))
+    
+    with st.form("webhook_form", clear_on_submit=True):
+        webhook_url = st.text_input("Endpoint URL", placeholder="https://example.com/freelanceflow")
+        if st.form_submit_button("Add Webhook"):
+            if webhook_url.startswith(("https://", "http://")):
+                st.session_state.temp_data["new_webhook_secret"] = db.add_webhook(st.session_state.user["id"], webhook_url)[1]
+                st.rerun()
+            else:
+                st.error("Please enter an http:// or https:// URL")
+    
+    for webhook_id, url, created_at, last_delivered_at, failures, last_error, next_attempt_at, disabled_at, pending in db.get_webhooks(st.session_state.user["id"]):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.markdown(f"**{url}** · {pending} pending · last delivery {last_delivered_at or 'never'}")
+            if disabled_at:
+                st.warning(f"Paused on {disabled_at} after {failures} failed attempts: {last_error}. "
+                           f"The {pending} undelivered event(s) are kept and sent when you resume.")
+            elif failures:
+                st.caption(f"{failures} failed attempt(s), retrying at {next_attempt_at}: {last_error}")
+        with col2:
+            if disabled_at and st.button("Resume", key=f"resume_webhook_{webhook_id}"):
+                db.resume_webhook(st.session_state.user["id"], webhook_id)
+                st.rerun()
+            if st.button("Remove", key=f"remove_webhook_{webhook_id}"):
+                db.delete_webhook(st.session_state.user["id"], webhook_id)
+                st.rerun()
+    
     # Subscription
     st.markdown('<h2 class="sub-header">Subscription</h2>', unsafe_allow_html=True)
     
+    # Set by the payment job's success below, which reruns straight away
+    upgrade_notice = st.session_state.temp_data.pop("upgrade_notice", None)
+    if upgrade_notice:
+        st.success(upgrade_notice)
+    
     if st.session_state.user["subscription_type"] == "free":
         st.markdown("""
         <div class="card">
@@ -1917,28 +2392,35 @@ def settings_page():
                 
                 if submit:
                     if len(card_number) == 16 and len(expiry) == 5 and len(cvv) == 3:
-                        # Simulate payment processing
-                        result = payment.upgrade_subscription(
+                        # Payment processing runs in the background job queue
+                        st.session_state.temp_data["payment_job_id"] = job_queue.submit(
+                            db,
                             st.session_state.user["id"],
-                            plan_type,
-                            {
+                            "upgrade_subscription",
+                            {"plan_type": plan_type},
+                            priority=10,
+                            max_attempts=1,
+                            transient={
                                 "card_number": card_number,
                                 "expiry": expiry,
                                 "cvv": cvv
                             }
                         )
-                        
-                        if result["success"]:
-                            st.success(f"Subscription upgraded to Premium! Valid until {result['subscription_end_date']}")
-                            st.session_state.user["subscription_type"] = "premium"
-                            st.session_state.temp_data.pop("show_payment_form", None)
-                            st.session_state.temp_data.pop("subscription_plan", None)
-                            st.rerun()
-                        else:
-                            st.error(result["error"])
                     else:
                         st.error("Invalid payment details")
             
+            payment_job_id = st.session_state.temp_data.get("payment_job_id")
+            if payment_job_id:
+                job = job_status_widget(payment_job_id)
+                if job and job[2] == "succeeded":
+                    result = json.loads(job[5])
+                    st.session_state.temp_data["upgrade_notice"] = f"Subscription upgraded to Premium! Valid until {result['subscription_end_date']}"
+                    st.session_state.user["subscription_type"] = result["subscription_type"]
+                    st.session_state.temp_data.pop("show_payment_form", None)
+                    st.session_state.temp_data.pop("subscription_plan", None)
+                    st.session_state.temp_data.pop("payment_job_id", None)
+                    st.rerun()
+            
             if st.button("Cancel Payment"):
                 st.session_state.temp_data.pop("show_payment_form", None)
                 st.session_state.temp_data.pop("subscription_plan", None)
@@ -1953,6 +2435,8 @@ def settings_page():
 
 # Main app
 def main():
+    db.actor = st.session_state.user["id"] if st.session_state.user else None
+    
     # Sidebar
     with st.sidebar:
         display_logo()
@@ -1964,6 +2448,11 @@ def main():
             
             st.markdown("### Navigation")
             
+            unread = db.get_unread_notification_count(st.session_state.user["id"])
+            if st.button(f"Notifications ({unread})" if unread else "Notifications"):
+                navigate_to('notifications')
+                st.rerun()
+            
             if st.button("Dashboard"):
                 navigate_to('dashboard')
                 st.rerun()
@@ -1976,12 +2465,36 @@ def main():
                 navigate_to('projects')
                 st.rerun()
             
+            if st.button("Task Board"):
+                navigate_to('board')
+                st.rerun()
+            
+            if st.button("Calendar"):
+                navigate_to('calendar')
+                st.rerun()
+            
             if st.button("Invoices"):
                 navigate_to('invoices')
                 st.rerun()
             
+            if st.button("Invoice Builder"):
+                navigate_to('invoice_builder')
+                st.rerun()
+            
+            if st.button("Recurring Invoices"):
+                navigate_to('recurring_invoices')
+                st.rerun()
+            
             st.markdown("### Settings")
             
+            if st.button("Trash"):
+                navigate_to('trash')
+                st.rerun()
+            
+            if st.button("Background Jobs"):
+                navigate_to('jobs')
+                st.rerun()
+            
             if st.button("Account Settings"):
                 navigate_to('settings')
                 st.rerun()
@@ -2014,23 +2527,43 @@ def main():
             edit_project_page()
         elif st.session_state.page == 'tasks':
             tasks_page()
+        elif st.session_state.page == 'board':
+            board_page()
+        elif st.session_state.page == 'calendar':
+            calendar_page()
+        elif st.session_state.page == 'notifications':
+            notifications_page()
         elif st.session_state.page == 'invoices':
             invoices_page()
         elif st.session_state.page == 'add_invoice':
             add_invoice_page()
         elif st.session_state.page == 'edit_invoice':
             edit_invoice_page()
+        elif st.session_state.page == 'invoice_builder':
+            invoice_builder_page()
+        elif st.session_state.page == 'recurring_invoices':
+            recurring_invoices_page()
         elif st.session_state.page == 'payments':
             payments_page()
         elif st.session_state.page == 'add_payment':
             add_payment_page()
         elif st.session_state.page == 'edit_payment':
             edit_payment_page()
+        elif st.session_state.page == 'trash':
+            trash_page()
+        elif st.session_state.page == 'jobs':
+            jobs_page()
         elif st.session_state.page == 'settings':
             settings_page()
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Give the run's connections back now; left to the garbage collector, the script's
+        # reference cycles keep them checked out long enough to drain the PostgreSQL pool
+        db.close()
+        catalog.close()
 
 
 
@@ -0,0 +1,82 @@
+# Benchmark of the audit log's write overhead (Database.audit): times the same update_client
+# calls with auditing on and with its snapshots and audit_log rows left out, and reports the cost
+# per write and the size of the history it leaves. Uses a scratch SQLite file unless --database
+# names another (its audit_log keeps the rows written here):
+#
+#   python auditbench.py --writes 2000 --rounds 3 [--database postgresql://...]
+#
+# Every write commits on its own, as the UI's do, so commit flushes are part of the figures.
+# Rounds alternate which variant goes first, so file growth and warm caches favour neither.
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+from database import Database
+
+
+class UnauditedDatabase(Database):
+    # The same writes without the before/after snapshots and audit_log rows
+    def snapshot(self, table, ids):
+        return {}
+
+    def audit(self, table, before, after=None):
+        pass
+
+
+def time_writes(db, client_id, writes):
+    # Seconds per update_client call; every call changes two columns
+    started = time.perf_counter()
+    for n in range(writes):
+        db.update_client(client_id, f"Client {n}", "billing@example.test", "", "Example Ltd", "", f"Edit {n}")
+    return (time.perf_counter() - started) / writes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="auditbench.py", description="FreelanceFlow audit log write overhead")
+    parser.add_argument("--database", help="SQLite path or postgresql:// URL (default: a scratch SQLite file)")
+    parser.add_argument("-n", "--writes", type=int, default=2000, help="update_client calls per variant and round")
+    parser.add_argument("-r", "--rounds", type=int, default=3, help="rounds of both variants")
+    args = parser.parse_args(argv)
+
+    scratch = None if args.database else tempfile.mkdtemp(prefix="auditbench-")
+    url = args.database or os.path.join(scratch, "auditbench.db")
+    audited = Database(url)
+    unaudited = UnauditedDatabase(url)
+    try:
+        name = f"auditbench-{uuid.uuid4().hex[:8]}"
+        user_id = audited.add_user(name, "secret", f"{name}@example.test", "Audit Benchmark")
+        client_id = audited.add_client(user_id, "Client", "billing@example.test", "", "Example Ltd", "", "")
+
+        timings = {"audited": [], "unaudited": []}
+        for n in range(args.rounds):
+            variants = [("audited", audited), ("unaudited", unaudited)]
+            for variant, db in variants if n % 2 == 0 else reversed(variants):
+                timings[variant].append(time_writes(db, client_id, args.writes))
+
+        audited.cursor.execute("SELECT COUNT(*), SUM(LENGTH(changes)) FROM audit_log WHERE entity = 'clients' AND entity_id = ?", (client_id,))
+        rows, changes_bytes = audited.cursor.fetchone()
+        # Ends the read's transaction, so a PostgreSQL connection goes back to its pool idle
+        audited.conn.rollback()
+    finally:
+        unaudited.close()
+        audited.close()
+        if scratch:
+            shutil.rmtree(scratch)
+
+    audited_us = statistics.median(timings["audited"]) * 1e6
+    unaudited_us = statistics.median(timings["unaudited"]) * 1e6
+    print(f"{args.writes} update_client calls x {args.rounds} round(s) per variant, median per write")
+    print(f"audited     {audited_us:8.1f} us   " + "  ".join(f"{t * 1e6:.1f}" for t in timings["audited"]))
+    print(f"unaudited   {unaudited_us:8.1f} us   " + "  ".join(f"{t * 1e6:.1f}" for t in timings["unaudited"]))
+    print(f"overhead    {audited_us - unaudited_us:8.1f} us   ({audited_us / unaudited_us:.2f}x)")
+    print(f"audit_log   {rows} rows, {changes_bytes / max(rows, 1):.0f} bytes of changes per row")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
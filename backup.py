@@ -0,0 +1,408 @@
+# Backups of the SQLite database, taken while the app keeps running: compressed snapshots made
+# with the online backup API, the WAL frames committed after each snapshot (for point-in-time
+# restore), integrity verification and restore. Kept free of Streamlit so it also runs as a CLI:
+#
+#   python backup.py snapshot                       take a snapshot now
+#   python backup.py archive                        archive the WAL frames committed since the last run
+#   python backup.py list                           snapshots and the restore window
+#   python backup.py verify                         rebuild the latest backup and run integrity_check on it
+#   python backup.py restore [--at "YYYY-MM-DD HH:MM:SS"] [--to PATH] [--force]
+#
+# A generation is one snapshot plus the WAL frames archived after it; restoring replays a
+# generation's frames onto its snapshot up to the requested time. The app's connections leave
+# checkpointing to the archiver (wal_autocheckpoint=0), so the WAL can't be reset before its
+# frames have been copied. Past WAL_SIZE_LIMIT_MB they checkpoint it themselves, for processes
+# that never run the archiver; the next archive run then starts a new generation.
+import argparse
+import datetime
+import gzip
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import uuid
+
+import storage
+
+SNAPSHOT_INTERVAL_SECONDS = 86400
+ARCHIVE_INTERVAL_SECONDS = 300
+SNAPSHOT_RETENTION_DAYS = 14
+# Pages copied per backup step; the pause in between keeps snapshot I/O from starving the app
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.005
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def now():
+    return datetime.datetime.now().strftime(TIME_FORMAT)
+
+
+# (page_size, checkpoint_seq, salts) from the WAL header, None when there is no WAL yet
+def read_wal_header(wal_path):
+    try:
+        with open(wal_path, "rb") as f:
+            header = f.read(WAL_HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    if len(header) < WAL_HEADER_SIZE:
+        return None
+    _, _, page_size, checkpoint_seq, salt1, salt2 = struct.unpack(">6I", header[:24])
+    return page_size, checkpoint_seq, [salt1, salt2]
+
+
+# Writes WAL frames (as archived) into a database file, truncating at each commit
+def apply_frames(db_path, frames, page_size):
+    frame_size = WAL_FRAME_HEADER_SIZE + page_size
+    with open(db_path, "r+b") as f:
+        for offset in range(0, len(frames) - frame_size + 1, frame_size):
+            page_number, commit_size = struct.unpack(">II", frames[offset:offset + 8])
+            f.seek((page_number - 1) * page_size)
+            f.write(frames[offset + WAL_FRAME_HEADER_SIZE:offset + frame_size])
+            if commit_size:
+                f.truncate(commit_size * page_size)
+
+
+def integrity_check(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return "; ".join(row[0] for row in conn.execute("PRAGMA integrity_check").fetchall())
+    finally:
+        conn.close()
+
+
+class BackupManager:
+    def __init__(self, db_path, directory=None):
+        self.db_path = db_path
+        self.wal_path = db_path + "-wal"
+        self.directory = directory or storage.backup_dir()
+        os.makedirs(self.directory, exist_ok=True)
+        # Catalog of generations and archived segments; its write lock also keeps two archivers
+        # (the app's jobs and the CLI) from interleaving
+        self.catalog = sqlite3.connect(os.path.join(self.directory, "catalog.db"), timeout=60, isolation_level=None)
+        self.catalog.execute('''
+        CREATE TABLE IF NOT EXISTS generations (
+            id TEXT PRIMARY KEY,
+            taken_at TEXT,
+            snapshot_file TEXT,
+            completed_at TEXT,
+            verified_at TEXT,
+            integrity TEXT
+        )
+        ''')
+        self.catalog.execute('''
+        CREATE TABLE IF NOT EXISTS segments (
+            generation_id TEXT,
+            seq INTEGER,
+            file TEXT,
+            archived_at TEXT,
+            page_size INTEGER,
+            frames INTEGER,
+            PRIMARY KEY (generation_id, seq)
+        )
+        ''')
+        # Where the archiver stopped: generation, WAL checkpoint sequence, salts and byte offset, and
+        # whether the WAL was fully checkpointed then (after which the next write may start it over)
+        self.catalog.execute('''
+        CREATE TABLE IF NOT EXISTS archive_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation_id TEXT,
+            checkpoint_seq INTEGER,
+            salt1 INTEGER,
+            salt2 INTEGER,
+            wal_offset INTEGER,
+            checkpointed INTEGER
+        )
+        ''')
+
+    def close(self):
+        self.catalog.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA wal_autocheckpoint=0")
+        return conn
+
+    def capture_wal(self, read_from=None):
+        # With writers held off: checkpoint what readers allow and read the WAL's committed end.
+        # Returns (header, end_offset, fully_checkpointed, frames from read_from to the end).
+        # Runs inside the caller's write lock, so nothing is appended or reset meanwhile.
+        checkpointer = self.connect()
+        try:
+            busy, log_frames, checkpointed = checkpointer.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        finally:
+            checkpointer.close()
+        if log_frames < 0:
+            raise RuntimeError(f"{self.db_path} is not in WAL mode")
+        header = read_wal_header(self.wal_path)
+        if not log_frames or header is None:
+            return header, WAL_HEADER_SIZE, True, b""
+        end = WAL_HEADER_SIZE + log_frames * (WAL_FRAME_HEADER_SIZE + header[0])
+        frames = b""
+        if read_from is not None and read_from < end:
+            with open(self.wal_path, "rb") as f:
+                f.seek(read_from)
+                frames = f.read(end - read_from)
+        return header, end, checkpointed == log_frames, frames
+
+    def set_state(self, generation_id, header, end, checkpointed):
+        checkpoint_seq, salts = (header[1], header[2]) if header else (None, [None, None])
+        self.catalog.execute(
+            "INSERT OR REPLACE INTO archive_state (id, generation_id, checkpoint_seq, salt1, salt2, wal_offset, checkpointed) VALUES (1, ?, ?, ?, ?, ?, ?)",
+            (generation_id, checkpoint_seq, *salts, end, int(checkpointed))
+        )
+
+    def snapshot(self, progress=None):
+        # New generation. The snapshot is pinned to a WAL position under a brief write lock, then
+        # copied a few pages at a time from that read transaction while the app keeps writing.
+        taken_at = now()
+        generation_id = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        generation_dir = os.path.join(self.directory, generation_id)
+        os.makedirs(generation_dir)
+
+        source = self.connect()
+        lock = self.connect()
+        try:
+            self.catalog.execute("BEGIN IMMEDIATE")
+            try:
+                lock.execute("BEGIN IMMEDIATE")
+                try:
+                    header, end, checkpointed, _ = self.capture_wal()
+                    source.execute("BEGIN")
+                    source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                finally:
+                    lock.execute("COMMIT")
+                self.catalog.execute("INSERT INTO generations (id, taken_at) VALUES (?, ?)", (generation_id, taken_at))
+                self.set_state(generation_id, header, end, checkpointed)
+                self.catalog.execute("COMMIT")
+            except Exception:
+                self.catalog.execute("ROLLBACK")
+                raise
+
+            copy_path = os.path.join(generation_dir, "snapshot.db")
+            target = sqlite3.connect(copy_path)
+            try:
+                source.backup(target, pages=PAGES_PER_STEP, sleep=STEP_SLEEP,
+                              progress=(lambda status, remaining, total: progress(1 - remaining / total)) if progress else None)
+            finally:
+                target.close()
+            source.execute("COMMIT")
+            with open(copy_path, "rb") as f, gzip.open(copy_path + ".gz", "wb", compresslevel=6) as out:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+            os.remove(copy_path)
+            self.catalog.execute(
+                "UPDATE generations SET snapshot_file = ?, completed_at = ? WHERE id = ?",
+                ("snapshot.db.gz", now(), generation_id)
+            )
+        except Exception:
+            # Dropping the generation leaves archive_state pointing nowhere, so the next archive run starts over
+            self.catalog.execute("DELETE FROM segments WHERE generation_id = ?", (generation_id,))
+            self.catalog.execute("DELETE FROM generations WHERE id = ?", (generation_id,))
+            shutil.rmtree(generation_dir, ignore_errors=True)
+            raise
+        finally:
+            source.close()
+            lock.close()
+        return generation_id
+
+    def snapshot_if_due(self, max_age_seconds=SNAPSHOT_INTERVAL_SECONDS, progress=None):
+        latest = self.catalog.execute("SELECT MAX(taken_at) FROM generations WHERE completed_at IS NOT NULL").fetchone()[0]
+        if latest and datetime.datetime.now() - datetime.datetime.strptime(latest, TIME_FORMAT) < datetime.timedelta(seconds=max_age_seconds):
+            return None
+        return self.snapshot(progress)
+
+    def archive(self):
+        # Copies the frames committed since the last run into a new segment of the current generation.
+        # When the WAL can't be shown to continue from there, a new snapshot starts a new generation.
+        self.catalog.execute("BEGIN IMMEDIATE")
+        try:
+            state = self.catalog.execute("""
+                SELECT s.generation_id, s.checkpoint_seq, s.salt1, s.salt2, s.wal_offset, s.checkpointed
+                FROM archive_state s JOIN generations g ON g.id = s.generation_id
+            """).fetchone()
+            if state is None:
+                self.catalog.execute("COMMIT")
+                return {"generation": self.snapshot(), "frames": 0}
+            generation_id, checkpoint_seq, salt1, salt2, offset, was_checkpointed = state
+
+            lock = self.connect()
+            try:
+                lock.execute("BEGIN IMMEDIATE")
+                try:
+                    header = read_wal_header(self.wal_path)
+                    if header and header[2] == [salt1, salt2]:
+                        start = offset
+                    elif header and was_checkpointed and checkpoint_seq is not None and header[1] == checkpoint_seq + 1:
+                        # Everything up to the last run was copied and checkpointed, and the WAL has started
+                        # over exactly once since: the first write after that checkpoint
+                        start = WAL_HEADER_SIZE
+                    else:
+                        # The WAL was deleted (last connection closed) or restarted by someone else, so
+                        # frames may have been checkpointed without being archived
+                        start = None
+                    if start is not None:
+                        header, end, checkpointed, frames = self.capture_wal(start)
+                finally:
+                    lock.execute("COMMIT")
+            finally:
+                lock.close()
+
+            if start is None:
+                self.catalog.execute("COMMIT")
+                return {"generation": self.snapshot(), "frames": 0, "restarted": True}
+
+            frame_count = 0
+            if frames:
+                page_size = header[0]
+                frame_count = len(frames) // (WAL_FRAME_HEADER_SIZE + page_size)
+                seq = self.catalog.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM segments WHERE generation_id = ?", (generation_id,)).fetchone()[0]
+                file_name = f"{seq:06d}.wal.gz"
+                with gzip.open(os.path.join(self.directory, generation_id, file_name), "wb", compresslevel=6) as out:
+                    out.write(frames)
+                self.catalog.execute(
+                    "INSERT INTO segments (generation_id, seq, file, archived_at, page_size, frames) VALUES (?, ?, ?, ?, ?, ?)",
+                    (generation_id, seq, file_name, now(), page_size, frame_count)
+                )
+            self.set_state(generation_id, header, end, checkpointed)
+            self.catalog.execute("COMMIT")
+            return {"generation": generation_id, "frames": frame_count}
+        except Exception:
+            if self.catalog.in_transaction:
+                self.catalog.execute("ROLLBACK")
+            raise
+
+    def generations(self):
+        # (id, taken_at, segments, last_archived_at, verified_at, integrity), oldest first
+        return self.catalog.execute("""
+            SELECT g.id, g.taken_at, COUNT(s.seq), MAX(s.archived_at), g.verified_at, g.integrity
+            FROM generations g LEFT JOIN segments s ON s.generation_id = g.id
+            WHERE g.completed_at IS NOT NULL
+            GROUP BY g.id
+            ORDER BY g.taken_at
+        """).fetchall()
+
+    def rebuild(self, target_path, at=None):
+        # Snapshot plus archived frames up to `at` (latest when None) written to target_path;
+        # returns (generation_id, time the result corresponds to)
+        at = at or "9999-12-31 23:59:59"
+        generation = self.catalog.execute("""
+            SELECT id, taken_at FROM generations
+            WHERE completed_at IS NOT NULL AND taken_at <= ?
+            ORDER BY taken_at DESC LIMIT 1
+        """, (at,)).fetchone()
+        if generation is None:
+            raise ValueError(f"No snapshot taken at or before {at}")
+        generation_id, restored_to = generation
+
+        with gzip.open(os.path.join(self.directory, generation_id, "snapshot.db.gz"), "rb") as f, open(target_path, "wb") as out:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        for file_name, archived_at, page_size in self.catalog.execute(
+            "SELECT file, archived_at, page_size FROM segments WHERE generation_id = ? AND archived_at <= ? ORDER BY seq",
+            (generation_id, at)
+        ).fetchall():
+            with gzip.open(os.path.join(self.directory, generation_id, file_name), "rb") as f:
+                apply_frames(target_path, f.read(), page_size)
+            restored_to = archived_at
+        return generation_id, restored_to
+
+    def verify(self):
+        # Rebuilds the newest generation from its snapshot and every archived segment and checks the result
+        generations = self.generations()
+        if not generations:
+            return None
+        generation_id = generations[-1][0]
+        check_path = os.path.join(self.directory, generation_id, "verify.db")
+        try:
+            self.rebuild(check_path)
+            result = integrity_check(check_path)
+        finally:
+            for path in (check_path, check_path + "-wal", check_path + "-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.catalog.execute("UPDATE generations SET verified_at = ?, integrity = ? WHERE id = ?", (now(), result, generation_id))
+        return {"generation": generation_id, "integrity": result}
+
+    def prune(self, retention_days=SNAPSHOT_RETENTION_DAYS):
+        # Generations older than the retention, never the newest one (it covers the present)
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days)).strftime(TIME_FORMAT)
+        expired = [row[0] for row in self.catalog.execute("""
+            SELECT id FROM generations
+            WHERE taken_at < ? AND id != (SELECT id FROM generations WHERE completed_at IS NOT NULL ORDER BY taken_at DESC LIMIT 1)
+        """, (cutoff,)).fetchall()]
+        for generation_id in expired:
+            self.catalog.execute("DELETE FROM segments WHERE generation_id = ?", (generation_id,))
+            self.catalog.execute("DELETE FROM generations WHERE id = ?", (generation_id,))
+            shutil.rmtree(os.path.join(self.directory, generation_id), ignore_errors=True)
+        return len(expired)
+
+    def restore(self, target_path, at=None, force=False):
+        # Rebuilds next to the target, checks it, then swaps it in; the replaced file and its
+        # WAL are kept with a .before-restore suffix. The app must be stopped first.
+        if os.path.exists(target_path) and not force:
+            raise FileExistsError(f"{target_path} exists, pass --force to replace it")
+        staging_path = target_path + ".restoring"
+        generation_id, restored_to = self.rebuild(staging_path, at)
+        result = integrity_check(staging_path)
+        if result != "ok":
+            os.remove(staging_path)
+            raise RuntimeError(f"Restored database failed integrity_check: {result}")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(target_path + suffix):
+                os.replace(target_path + suffix, target_path + ".before-restore" + suffix)
+        os.replace(staging_path, target_path)
+        return generation_id, restored_to
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="backup.py", description="FreelanceFlow database backups")
+    parser.add_argument("--db", default=storage.database_url().removeprefix("sqlite:///"), help="database file (default: $DATABASE_URL or freelance_flow.db)")
+    parser.add_argument("--dir", default=None, help="backup directory (default: $BACKUP_DIR or backups)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("snapshot", help="take a snapshot now")
+    commands.add_parser("archive", help="archive WAL frames committed since the last run")
+    commands.add_parser("list", help="list snapshots and the restore window")
+    commands.add_parser("verify", help="rebuild the latest backup and run integrity_check on it")
+    restore = commands.add_parser("restore", help="restore the database (stop the app first)")
+    restore.add_argument("--at", help='point in time, "YYYY-MM-DD HH:MM:SS" (default: latest)')
+    restore.add_argument("--to", help="file to restore into (default: the database file)")
+    restore.add_argument("--force", action="store_true", help="replace an existing file")
+    args = parser.parse_args(argv)
+
+    manager = BackupManager(args.db, args.dir)
+    try:
+        if args.command == "snapshot":
+            print(f"Snapshot {manager.snapshot()} taken")
+        elif args.command == "archive":
+            result = manager.archive()
+            print(f"Archived {result['frames']} WAL frame(s) into generation {result['generation']}")
+        elif args.command == "list":
+            generations = manager.generations()
+            if not generations:
+                print("No backups yet")
+            for generation_id, taken_at, segments, last_archived_at, verified_at, integrity in generations:
+                verified = f"verified {verified_at}: {integrity}" if verified_at else "not verified"
+                print(f"{generation_id}  snapshot {taken_at}  {segments} WAL segment(s) up to {last_archived_at or taken_at}  {verified}")
+            if generations:
+                print(f"Restore window: {generations[0][1]} to {generations[-1][3] or generations[-1][1]}")
+        elif args.command == "verify":
+            result = manager.verify()
+            print(f"{result['generation']}: {result['integrity']}" if result else "No backups yet")
+            return 0 if not result or result["integrity"] == "ok" else 1
+        elif args.command == "restore":
+            at = args.at
+            if at and len(at) == 10:
+                at += " 23:59:59"
+            generation_id, restored_to = manager.restore(args.to or args.db, at, args.force)
+            print(f"Restored {args.to or args.db} from generation {generation_id} as of {restored_to}")
+    except (ValueError, FileExistsError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# Invoice generation: unbilled time turned into invoices, and recurring invoice templates billed
+# period by period. Kept free of Streamlit so the job worker and the tests use it without loading the UI.
+import datetime
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+# Date helper, clamps to the last day of shorter months
+def add_months(date, months):
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    last_day = (next_month - datetime.timedelta(days=1)).day
+    return datetime.date(year, month, min(date.day, last_day))
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+# Recurring invoice scheduler
+class RecurringInvoiceScheduler:
+    CADENCES = ["Weekly", "Monthly", "Quarterly", "Yearly"]
+    CADENCE_MONTHS = {"Monthly": 1, "Quarterly": 3, "Yearly": 12}
+
+    def __init__(self, db, batch_size=1000):
+        self.db = db
+        self.batch_size = batch_size
+
+    def next_period(self, start_date, cadence, period):
+        # Periods are always counted from the start date so month-end dates do not drift
+        if cadence == "Weekly":
+            return period + datetime.timedelta(days=7)
+        step = self.CADENCE_MONTHS[cadence]
+        elapsed = (period.year - start_date.year) * 12 + period.month - start_date.month
+        return add_months(start_date, elapsed + step)
+
+    def pause(self, recurring_id):
+        self.db.set_recurring_invoice_active(recurring_id, False)
+
+    def resume(self, recurring_id, today=None):
+        # Pausing stops billing: the periods that passed meanwhile are skipped, not caught up,
+        # and billing picks up at the first period on or after today
+        today = today or datetime.datetime.now().date()
+        cadence, start_date, next_run_date, end_date = self.db.get_recurring_schedule(recurring_id)
+        start = parse_date(start_date)
+        end = parse_date(end_date)
+        period = parse_date(next_run_date)
+        while period < today:
+            period = self.next_period(start, cadence, period)
+        # A template whose end date passed while paused stays finished
+        active = end is None or period <= end
+        self.db.set_recurring_invoice_active(recurring_id, active, period.strftime("%Y-%m-%d"))
+        return active
+
+    def run(self, run_date=None):
+        run_date = run_date or datetime.datetime.now().date()
+        run_date_str = run_date.strftime("%Y-%m-%d")
+        generated = 0
+
+        while True:
+            templates = self.db.get_due_recurring_invoices(run_date_str, self.batch_size)
+            if not templates:
+                break
+
+            invoices = []
+            updates = []
+            for recurring_id, project_id, amount_cents, cadence, start_date, next_run_date, end_date, due_days, notes, currency in templates:
+                start = parse_date(start_date)
+                end = parse_date(end_date)
+                period = parse_date(next_run_date)
+
+                # Catch up every period missed while active (the job didn't run) in one go
+                while period <= run_date and (end is None or period <= end):
+                    invoices.append((
+                        project_id,
+                        amount_cents,
+                        period.strftime("%Y-%m-%d"),
+                        (period + datetime.timedelta(days=due_days)).strftime("%Y-%m-%d"),
+                        "Unpaid",
+                        notes,
+                        recurring_id,
+                        period.strftime("%Y-%m-%d"),
+                        currency
+                    ))
+                    period = self.next_period(start, cadence, period)
+
+                active = 0 if end is not None and period > end else 1
+                updates.append((period.strftime("%Y-%m-%d"), active, recurring_id))
+
+            # Invoices and template cursors move together, so a crash never double-bills
+            try:
+                generated += self.db.add_invoices(invoices, commit=False)
+                self.db.advance_recurring_invoices(updates, commit=False)
+                self.db.conn.commit()
+            except Exception:
+                self.db.conn.rollback()
+                raise
+
+        return generated
+
+
+# Builds invoices from unbilled tracked time
+class InvoiceBuilder:
+    MODES = {"time": "All unbilled time", "tasks": "Completed tasks only"}
+
+    def __init__(self, db):
+        self.db = db
+
+    def preview(self, user_id, project_ids=None, client_id=None, until=None, mode="time"):
+        rows = self.db.get_unbilled_time(user_id, project_ids, client_id, until)
+        entries = pd.DataFrame(rows, columns=[
+            'entry_id', 'project_id', 'project_name', 'currency', 'task_id', 'task_name', 'task_status', 'duration_seconds', 'hourly_rate_cents'
+        ])
+        if mode == "tasks":
+            entries = entries[entries['task_status'] == "Completed"]
+
+        # One line item per project, task and rate, computed for every project at once
+        entries = entries.assign(
+            task_id=entries['task_id'].fillna(""),
+            task_name=entries['task_name'].fillna("General work"),
+            hourly_rate_cents=entries['hourly_rate_cents'].fillna(0).astype(np.int64),
+            duration_seconds=entries['duration_seconds'].astype(np.int64)
+        )
+        lines = (entries
+                 .groupby(['project_id', 'project_name', 'currency', 'task_id', 'task_name', 'hourly_rate_cents'], as_index=False)
+                 .agg(seconds=('duration_seconds', 'sum'), entries=('entry_id', 'count')))
+        # The exact seconds are priced and rounded half up to the cent once per line, in integers
+        # as in entry_billable_cents; the rounded hours are only the quantity shown on the invoice
+        lines['hours'] = np.round(lines['seconds'].to_numpy() / 3600, 2)
+        lines['amount_cents'] = (lines['seconds'].to_numpy() * lines['hourly_rate_cents'].to_numpy() + 1800) // 3600
+        lines = lines[lines['amount_cents'] > 0]
+        return entries, lines
+
+    def build(self, user_id, project_ids=None, client_id=None, until=None, mode="time", issue_date=None, due_days=30):
+        entries, lines = self.preview(user_id, project_ids, client_id, until, mode)
+        if lines.empty:
+            return []
+
+        issue_date = issue_date or datetime.datetime.now().date()
+        due_date = issue_date + datetime.timedelta(days=due_days)
+        totals = lines.groupby(['project_id', 'currency'])['amount_cents'].sum()
+        invoice_ids = {project_id: str(uuid.uuid4()) for project_id, currency in totals.index}
+
+        invoices = [
+            (invoice_ids[project_id], project_id, int(total), issue_date.strftime("%Y-%m-%d"),
+             due_date.strftime("%Y-%m-%d"), "Unpaid", f"Work up to {until or issue_date}", currency)
+            for (project_id, currency), total in totals.items()
+        ]
+        items = [
+            (invoice_ids[line.project_id], line.task_name, float(line.hours), int(line.hourly_rate_cents),
+             int(line.amount_cents), "task" if line.task_id else "time", line.task_id or None)
+            for line in lines.itertuples()
+        ]
+
+        # Only entries that made it onto a line are marked billed
+        billed = entries.merge(lines[['project_id', 'task_id', 'hourly_rate_cents']], on=['project_id', 'task_id', 'hourly_rate_cents'])
+        billed_time_entries = [(invoice_ids[project_id], int(entry_id))
+                               for project_id, entry_id in zip(billed['project_id'], billed['entry_id'])]
+        completed = billed[(billed['task_status'] == "Completed") & (billed['task_id'] != "")]
+        billed_tasks = list({(invoice_ids[project_id], task_id)
+                             for project_id, task_id in zip(completed['project_id'], completed['task_id'])})
+
+        self.db.add_invoices_with_items(invoices, items, billed_time_entries, billed_tasks)
+        return list(invoice_ids.values())
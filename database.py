@@ -0,0 +1,2410 @@
+# Data access: the Database class and the money helpers its queries rely on
+# Kept free of Streamlit so the API service (api.py), the job workers and scripts share it with the UI
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import uuid
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+import sharding
+import storage
+
+
+# Amount as entered (a float or numeric string) to integer cents, rounded half up as written:
+# 2.675 is 268 cents even though the float is a hair below 2.675
+def to_cents(amount):
+    return int(Decimal(str(amount or 0)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+
+
+# Billable value of a time entry, rounded half up to the cent
+def entry_billable_cents(duration_seconds, hourly_rate_cents):
+    return (duration_seconds * (hourly_rate_cents or 0) + 1800) // 3600
+
+
+# Same rounding as to_cents, for arrays of cent values
+def round_half_up(values):
+    return np.floor(np.asarray(values, dtype=float) + 0.5).astype(np.int64)
+
+
+# Line item totals in cents for whole columns of items at once; rates are percentages.
+# Each step rounds to a whole cent, so totals add up exactly.
+# A given net (NaN where there is none) replaces quantity x unit price.
+def compute_line_amounts(quantity, unit_price_cents, tax_rate, discount, net=None):
+    quantity = np.asarray(quantity, dtype=float)
+    unit_price_cents = np.asarray(unit_price_cents, dtype=np.int64)
+    tax_rate = np.nan_to_num(np.asarray(tax_rate, dtype=float))
+    discount = np.nan_to_num(np.asarray(discount, dtype=float))
+    
+    priced = round_half_up(quantity * unit_price_cents)
+    net = priced if net is None else np.where(np.isnan(np.asarray(net, dtype=float)), priced, net).astype(np.int64)
+    discount_amount = round_half_up(net * discount / 100)
+    tax_amount = round_half_up((net - discount_amount) * tax_rate / 100)
+    return {
+        "net": net,
+        "discount": discount_amount,
+        "tax": tax_amount,
+        "total": net - discount_amount + tax_amount
+    }
+
+
+# Totals of edited line items: rows are (item_id or None, quantity, unit_price_cents, tax_rate, discount)
+# and stored is {item_id: (quantity, unit_price_cents, tax_rate, discount, amount_cents)} as saved.
+# Items billed from time hold rounded hours but were priced from the exact seconds, so an item
+# whose quantity and price weren't edited keeps the amount it was saved with.
+def edited_line_amounts(rows, stored):
+    net = []
+    kept = []
+    for item_id, quantity, unit_price_cents, tax_rate, discount in rows:
+        saved = stored.get(item_id)
+        same_price = saved is not None and (float(saved[0]), int(saved[1])) == (float(quantity), int(unit_price_cents))
+        same_rates = same_price and (float(saved[2] or 0), float(saved[3] or 0)) == (float(tax_rate or 0), float(discount or 0))
+        net.append(saved[4] if same_price and not saved[2] and not saved[3] else np.nan)
+        kept.append(saved[4] if same_rates else np.nan)
+    
+    amounts = compute_line_amounts(*list(zip(*rows))[1:], net=net)
+    kept = np.asarray(kept, dtype=float)
+    amounts["total"] = np.where(np.isnan(kept), amounts["total"], kept).astype(np.int64)
+    return amounts
+
+
+# Database class using OOP principles
+class Database:
+    # Invoice columns in the order the pages index them
+    # Money columns hold integer cents
+    INVOICE_COLUMNS = "i.id, i.project_id, i.amount_cents, i.issue_date, i.due_date, i.status, i.notes, i.created_at"
+    PROJECT_COLUMNS = "p.id, p.user_id, p.client_id, p.name, p.description, p.start_date, p.end_date, p.status, p.budget_cents, p.created_at"
+    TASK_COLUMNS = "id, project_id, name, description, due_date, status, created_at"
+    # Tables whose delete buttons move rows to the trash, children first (purge order)
+    TRASH_TABLES = ("payments", "invoices", "projects", "clients")
+    PAYMENT_COLUMNS = "id, invoice_id, amount_cents, payment_date, payment_method, notes, created_at"
+    CLIENT_COLUMNS = "id, user_id, name, email, phone, company, address, notes, created_at, currency"
+    # Seconds each kind of report may lag behind the latest writes
+    READ_STALENESS = {"dashboard": 5, "cash_flow": 30, "client_analytics": 60}
+    
+    def __init__(self, db_name=None):
+        # db_name is a SQLite path or a postgresql:// URL, DATABASE_URL by default
+        self.db_name = db_name or storage.database_url()
+        self.backend = storage.open_backend(self.db_name)
+        self.conn = self.backend.connect(self)
+        self.cursor = self.backend.cursor(self.conn)
+        # User recorded in the audit log for changes made through this connection (None for system jobs)
+        self.actor = None
+        # Once per file and process; page reruns and job polls open many short-lived Databases
+        with storage.prepared_lock:
+            if self.db_name not in storage.prepared:
+                self.create_tables()
+                storage.prepared.add(self.db_name)
+    
+    def create_tables(self):
+        # Users table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            username TEXT UNIQUE,
+            password TEXT,
+            email TEXT UNIQUE,
+            full_name TEXT,
+            subscription_type TEXT DEFAULT 'free',
+            subscription_end_date TEXT,
+            created_at TEXT,
+            base_currency TEXT DEFAULT 'USD'
+        )
+        ''')
+        
+        # Shard file holding each user's records; only used in the catalog of a sharded setup
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tenants (
+            user_id TEXT PRIMARY KEY,
+            shard TEXT,
+            created_at TEXT
+        )
+        ''')
+        
+        # API bearer tokens (catalog); only their SHA-256 is kept
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS api_tokens (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            name TEXT,
+            token_hash TEXT UNIQUE,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_api_tokens_user ON api_tokens (user_id)")
+        
+        # Clients table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS clients (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            name TEXT,
+            email TEXT,
+            phone TEXT,
+            company TEXT,
+            address TEXT,
+            notes TEXT,
+            created_at TEXT,
+            currency TEXT DEFAULT 'USD',
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''')
+        
+        # Projects table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            client_id TEXT,
+            name TEXT,
+            description TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            status TEXT,
+            budget_cents INTEGER,
+            created_at TEXT,
+            currency TEXT DEFAULT 'USD',
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (client_id) REFERENCES clients (id)
+        )
+        ''')
+        
+        # Tasks table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            project_id TEXT,
+            name TEXT,
+            description TEXT,
+            due_date TEXT,
+            status TEXT,
+            created_at TEXT,
+            billed_invoice_id TEXT,
+            FOREIGN KEY (project_id) REFERENCES projects (id),
+            FOREIGN KEY (billed_invoice_id) REFERENCES invoices (id)
+        )
+        ''')
+        
+        # Invoices table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoices (
+            id TEXT PRIMARY KEY,
+            project_id TEXT,
+            amount_cents INTEGER,
+            issue_date TEXT,
+            due_date TEXT,
+            status TEXT,
+            notes TEXT,
+            created_at TEXT,
+            recurring_id TEXT,
+            period_date TEXT,
+            currency TEXT DEFAULT 'USD',
+            FOREIGN KEY (project_id) REFERENCES projects (id),
+            FOREIGN KEY (recurring_id) REFERENCES recurring_invoices (id)
+        )
+        ''')
+        
+        # Payments table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id TEXT PRIMARY KEY,
+            invoice_id TEXT,
+            amount_cents INTEGER,
+            payment_date TEXT,
+            payment_method TEXT,
+            notes TEXT,
+            created_at TEXT,
+            FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+        )
+        ''')
+        
+        # Background jobs table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            job_type TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'queued',
+            priority INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 3,
+            progress REAL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            run_after TEXT,
+            heartbeat_at TEXT,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority DESC, run_after)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, created_at)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_type ON jobs (job_type, status)")
+        
+        # Recurring invoice templates table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recurring_invoices (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            project_id TEXT,
+            amount_cents INTEGER,
+            cadence TEXT,
+            start_date TEXT,
+            next_run_date TEXT,
+            end_date TEXT,
+            due_days INTEGER DEFAULT 30,
+            notes TEXT,
+            active INTEGER DEFAULT 1,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (project_id) REFERENCES projects (id)
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_recurring_invoices_due ON recurring_invoices (active, next_run_date)")
+        
+        # Time entries table; integer keys keep inserts appending to the end of the table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS time_entries (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT,
+            project_id TEXT,
+            task_id TEXT,
+            started_at TEXT,
+            duration_seconds INTEGER,
+            hourly_rate_cents INTEGER,
+            billable INTEGER DEFAULT 1,
+            notes TEXT,
+            created_at TEXT,
+            invoice_id TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (project_id) REFERENCES projects (id),
+            FOREIGN KEY (task_id) REFERENCES tasks (id),
+            FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_time_entries_project ON time_entries (project_id, started_at)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_time_entries_task ON time_entries (task_id)")
+        
+        # Daily time rollups per project, maintained with every time entry write
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS time_daily (
+            project_id TEXT,
+            day TEXT,
+            user_id TEXT,
+            seconds INTEGER DEFAULT 0,
+            billable_seconds INTEGER DEFAULT 0,
+            billable_cents INTEGER DEFAULT 0,
+            entries INTEGER DEFAULT 0,
+            PRIMARY KEY (project_id, day)
+        ) WITHOUT ROWID
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_time_daily_user ON time_daily (user_id, day)")
+        
+        # Invoice line items table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_items (
+            id TEXT PRIMARY KEY,
+            invoice_id TEXT,
+            description TEXT,
+            quantity REAL,
+            unit_price_cents INTEGER,
+            amount_cents INTEGER,
+            source_type TEXT,
+            source_id TEXT,
+            created_at TEXT,
+            tax_rate REAL DEFAULT 0,
+            discount REAL DEFAULT 0,
+            position INTEGER DEFAULT 0,
+            FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice ON invoice_items (invoice_id, position)")
+        
+        # Rendered invoice documents cache
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_documents (
+            invoice_id TEXT,
+            format TEXT,
+            content_hash TEXT,
+            content BLOB,
+            created_at TEXT,
+            PRIMARY KEY (invoice_id, format),
+            FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+        )
+        ''')
+        
+        # Key/value settings and bookkeeping
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''')
+        
+        # Per-user change counters; analytics caches compare them to decide what to recompute.
+        # "<scope>" moves on every write, "<scope>_edits" only on updates and deletes.
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            user_id TEXT,
+            scope TEXT,
+            version INTEGER,
+            PRIMARY KEY (user_id, scope)
+        ) WITHOUT ROWID
+        ''')
+        
+        # Append-only change history: one row per changed record, with a compact JSON diff
+        # ({column: [before, after]} for updates, the removed row for deletes)
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT,
+            entity_id TEXT,
+            parent_id TEXT,
+            action TEXT,
+            actor TEXT,
+            changes TEXT,
+            created_at TEXT
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_entity ON audit_log (entity, entity_id, id)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_log_parent ON audit_log (parent_id, id) WHERE parent_id IS NOT NULL")
+        self.backend.append_only(self.cursor, "audit_log")
+        # First audit_log id of each month; retention drops whole months by id range
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_partitions (
+            month TEXT PRIMARY KEY,
+            first_id INTEGER
+        ) WITHOUT ROWID
+        ''')
+        
+        # Event outbox: one row per created, changed or deleted record, written in the same
+        # transaction as the change and delivered to the owner's webhooks (webhooks.py)
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            entity TEXT,
+            entity_id TEXT,
+            action TEXT,
+            data TEXT,
+            created_at TEXT
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_user ON events (user_id, id)")
+        # Webhook subscribers; last_event_id is the delivery cursor into events
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhooks (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            url TEXT,
+            secret TEXT,
+            last_event_id INTEGER DEFAULT 0,
+            failures INTEGER DEFAULT 0,
+            next_attempt_at TEXT,
+            last_error TEXT,
+            last_delivered_at TEXT,
+            disabled_at TEXT,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_webhooks_user ON webhooks (user_id)")
+        # Named counters; change_seq:<user id> orders the changes in each user's feed (see
+        # next_change_seqs), change_seq numbered every change before feeds were counted per user
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sequences (
+            name TEXT PRIMARY KEY,
+            value INTEGER
+        )
+        ''')
+        self.cursor.execute("INSERT INTO sequences (name, value) VALUES ('change_seq', 0) ON CONFLICT DO NOTHING")
+        # What's left of hard-deleted records for the change feed
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tombstones (
+            user_id TEXT,
+            entity TEXT,
+            change_seq INTEGER,
+            entity_id TEXT,
+            deleted_at TEXT,
+            PRIMARY KEY (user_id, entity, change_seq)
+        ) WITHOUT ROWID
+        ''')
+        
+        # Reminders, one per subject and due date so repeated sweeps never duplicate them
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            kind TEXT,
+            subject_id TEXT,
+            due_date TEXT,
+            message TEXT,
+            created_at TEXT,
+            read_at TEXT,
+            emailed_at TEXT,
+            UNIQUE (user_id, kind, subject_id, due_date),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications (user_id, read_at)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_notifications_outbox ON notifications (created_at) WHERE emailed_at IS NULL")
+        
+        # Daily exchange rates, loaded from a file: units of currency per one unit of the rates' base currency
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            currency TEXT,
+            day TEXT,
+            rate REAL,
+            PRIMARY KEY (currency, day)
+        ) WITHOUT ROWID
+        ''')
+        
+        # Columns added after the first release
+        self.add_column("invoices", "recurring_id", "TEXT")
+        self.add_column("invoices", "period_date", "TEXT")
+        self.add_column("time_entries", "invoice_id", "TEXT")
+        self.add_column("tasks", "billed_invoice_id", "TEXT")
+        self.add_column("invoice_items", "tax_rate", "REAL DEFAULT 0")
+        self.add_column("invoice_items", "discount", "REAL DEFAULT 0")
+        self.add_column("invoice_items", "position", "INTEGER DEFAULT 0")
+        self.add_column("projects", "currency", "TEXT DEFAULT 'USD'")
+        self.add_column("invoices", "currency", "TEXT DEFAULT 'USD'")
+        self.add_column("clients", "currency", "TEXT DEFAULT 'USD'")
+        self.add_column("users", "base_currency", "TEXT DEFAULT 'USD'")
+        self.add_column("tasks", "position", "INTEGER DEFAULT 0")
+        # Kept in step with the notifications table so the sidebar badge is a primary-key read
+        self.add_column("users", "unread_notifications", "INTEGER DEFAULT 0")
+        # Set once a webhook has failed too often in a row; delivery waits for the user to resume it
+        self.add_column("webhooks", "disabled_at", "TEXT")
+        # Deleted records stay in the trash until the purge job removes them
+        for table in self.TRASH_TABLES:
+            self.add_column(table, "deleted_at", "TEXT")
+            # Bumped by every write, edits only apply if the row is still at the version they started from
+            self.add_column(table, "version", "INTEGER DEFAULT 1")
+        
+        # Money used to be stored as REAL dollars, it is now exact integer cents
+        self.migrate_money_column("projects", "budget", "budget_cents")
+        self.migrate_money_column("invoices", "amount", "amount_cents")
+        self.migrate_money_column("payments", "amount", "amount_cents")
+        self.migrate_money_column("recurring_invoices", "amount", "amount_cents")
+        self.migrate_money_column("time_entries", "hourly_rate", "hourly_rate_cents")
+        self.migrate_money_column("time_daily", "billable_amount", "billable_cents")
+        self.migrate_money_column("invoice_items", "unit_price", "unit_price_cents")
+        self.migrate_money_column("invoice_items", "amount", "amount_cents")
+        
+        # One invoice per template and period, so generation is safe to repeat
+        self.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_invoices_recurring_period ON invoices (recurring_id, period_date)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_status_due ON invoices (status, due_date)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_time_entries_unbilled ON time_entries (project_id) WHERE invoice_id IS NULL AND billable = 1")
+        # Live rows only: trashed records don't grow the indexes every page reads through
+        self.cursor.execute("DROP INDEX IF EXISTS idx_projects_user")
+        self.cursor.execute("DROP INDEX IF EXISTS idx_invoices_project_due")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_clients_live ON clients (user_id) WHERE deleted_at IS NULL")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_live ON projects (user_id, end_date) WHERE deleted_at IS NULL")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_live ON invoices (project_id, due_date) WHERE deleted_at IS NULL")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_live ON payments (invoice_id) WHERE deleted_at IS NULL")
+        # Trash page and purge job
+        for table in self.TRASH_TABLES:
+            self.cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_trash ON {table} (deleted_at) WHERE deleted_at IS NOT NULL")
+        # Task board: each project's tasks in column order
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_board ON tasks (project_id, status, position)")
+        # Calendar: task due dates within each of the user's projects
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_due ON tasks (project_id, due_date)")
+        # Reminder sweep: open tasks by due date (invoices use idx_invoices_status_due)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_open_due ON tasks (due_date) WHERE status != 'Completed'")
+        # Change feed: every write stamps the record with the next change_seq (see emit), and
+        # catch-up reads each user's records in change_seq index order. Records written before
+        # change tracking are numbered once, in table and insertion order.
+        for table, (source, owner) in self.CHANGE_FEED.items():
+            self.add_column(table, "change_seq", "INTEGER")
+            self.cursor.execute(f"SELECT COUNT(*), MAX(rowid) FROM {table} WHERE change_seq IS NULL")
+            missing, last_rowid = self.cursor.fetchone()
+            if missing:
+                self.cursor.execute(f"UPDATE {table} SET change_seq = rowid + (SELECT value FROM sequences WHERE name = 'change_seq') WHERE change_seq IS NULL")
+                self.cursor.execute("UPDATE sequences SET value = value + ? WHERE name = 'change_seq'", (last_rowid,))
+            if owner == "r.user_id":
+                self.cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_changes ON {table} (user_id, change_seq)")
+            else:
+                self.cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_changes ON {table} (change_seq)")
+        
+        self.conn.commit()
+    
+    def get_meta(self, key, default=None):
+        self.cursor.execute("SELECT value FROM app_meta WHERE key = ?", (key,))
+        row = self.cursor.fetchone()
+        return row[0] if row else default
+    
+    def set_meta(self, key, value, commit=True):
+        self.cursor.execute(
+            "INSERT INTO app_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+        if commit:
+            self.conn.commit()
+    
+    def bump_data_version(self, scopes, project_ids=(), invoice_ids=(), user_ids=()):
+        # Runs in the caller's transaction; owners are resolved through the project or invoice
+        rows = [(scope, project_id, None) for scope in scopes for project_id in set(project_ids)]
+        rows += [(scope, None, invoice_id) for scope in scopes for invoice_id in set(invoice_ids)]
+        self.cursor.executemany("""
+            INSERT INTO data_versions (user_id, scope, version)
+            SELECT user_id, ?, 1 FROM projects
+            WHERE id = COALESCE(?, (SELECT project_id FROM invoices WHERE id = ?))
+            ON CONFLICT(user_id, scope) DO UPDATE SET version = data_versions.version + 1
+        """, rows)
+        self.cursor.executemany("""
+            INSERT INTO data_versions (user_id, scope, version) VALUES (?, ?, 1)
+            ON CONFLICT(user_id, scope) DO UPDATE SET version = data_versions.version + 1
+        """, [(user_id, scope) for scope in scopes for user_id in set(user_ids)])
+    
+    def get_data_versions(self, user_id, kind=None):
+        # Caches filled from a report snapshot compare against that snapshot's versions (kind as in reading())
+        if kind:
+            with self.reading(kind) as cursor:
+                cursor.execute("SELECT scope, version FROM data_versions WHERE user_id = ?", (user_id,))
+                return dict(cursor.fetchall())
+        self.cursor.execute("SELECT scope, version FROM data_versions WHERE user_id = ?", (user_id,))
+        return dict(self.cursor.fetchall())
+    
+    def reading(self, kind):
+        # Cursor on the shared report snapshot, at most READ_STALENESS[kind] seconds behind the primary
+        # (override with READ_STALENESS_<KIND>); writes always go through self.cursor
+        max_staleness = float(os.environ.get(f"READ_STALENESS_{kind.upper()}", self.READ_STALENESS[kind]))
+        return storage.SnapshotReader.for_url(self.db_name, self.backend).read(max_staleness)
+    
+    def add_column(self, table, column, definition):
+        if column not in self.backend.columns(self.cursor, table):
+            self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    def migrate_money_column(self, table, column, cents_column):
+        columns = self.backend.columns(self.cursor, table)
+        if column in columns:
+            if cents_column not in columns:
+                self.cursor.execute(f"ALTER TABLE {table} ADD COLUMN {cents_column} INTEGER")
+            # Rounded to the cent first, as to_cents would: ROUND(1.005 * 100) alone gives 100, not 101
+            self.cursor.execute(f"UPDATE {table} SET {cents_column} = CAST(ROUND(ROUND(CAST({column} AS NUMERIC), 2) * 100) AS INTEGER)")
+            self.cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+            self.conn.commit()
+    
+    def close(self):
+        self.backend.release(self.conn)
+    
+    def update_versioned(self, table, row_id, values, expected_version=None):
+        # Writes values ({column: value}) and bumps the row's version. With expected_version the
+        # update only applies if nobody else changed or deleted the row since it was read;
+        # otherwise nothing is written and {"current": row or None} is returned for merging.
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        before = self.snapshot(table, [row_id])
+        if expected_version is None:
+            self.cursor.execute(f"UPDATE {table} SET {assignments}, version = version + 1 WHERE id = ?", (*values.values(), row_id))
+        else:
+            self.cursor.execute(
+                f"UPDATE {table} SET {assignments}, version = version + 1 WHERE id = ? AND version = ? AND deleted_at IS NULL",
+                (*values.values(), row_id, expected_version)
+            )
+            if self.cursor.rowcount == 0:
+                self.conn.rollback()
+                current = self.snapshot(table, [row_id]).get(row_id)
+                return {"current": current if current and not current["deleted_at"] else None}
+        self.audit(table, before, self.snapshot(table, [row_id]))
+        return None
+    
+    # Audit log methods
+    # Child records also appear in their parent's history
+    AUDIT_PARENTS = {"invoice_items": "invoice_id", "payments": "invoice_id", "tasks": "project_id"}
+    
+    def snapshot(self, table, ids):
+        # Current rows as {id: {column: value}}, taken before and after a change
+        ids = list(ids)
+        if not ids:
+            return {}
+        placeholders = ", ".join("?" for _ in ids)
+        self.cursor.execute(f"SELECT * FROM {table} WHERE id IN ({placeholders})", ids)
+        columns = [column[0] for column in self.cursor.description]
+        return {row[0]: dict(zip(columns, row)) for row in self.cursor.fetchall()}
+    
+    def audit(self, table, before, after=None):
+        # Runs in the caller's transaction; records missing from `after` were deleted
+        after = after or {}
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        parent_column = self.AUDIT_PARENTS.get(table)
+        rows = []
+        for entity_id, old in before.items():
+            new = after.get(entity_id)
+            if new is None:
+                action, changes = "delete", old
+            else:
+                action, changes = "update", {column: [old[column], value] for column, value in new.items()
+                                             if old.get(column) != value and column != "version"}
+                if not changes:
+                    continue
+            rows.append((table, entity_id, old.get(parent_column) if parent_column else None, action, self.actor,
+                         json.dumps(changes, separators=(",", ":"), default=str), created_at))
+        if not rows:
+            return
+        self.cursor.execute(f"""
+            INSERT INTO audit_partitions (month, first_id)
+            SELECT ?, COALESCE({self.backend.last_id("audit_log")}, 0) + 1 WHERE true
+            ON CONFLICT DO NOTHING
+        """, (created_at[:7],))
+        self.cursor.executemany(
+            "INSERT INTO audit_log (entity, entity_id, parent_id, action, actor, changes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+    
+    def get_audit_history(self, entity, entity_id, limit=200):
+        self.cursor.execute("""
+            SELECT a.created_at, COALESCE(u.username, 'System'), a.entity, a.action, a.changes
+            FROM (
+                SELECT * FROM audit_log WHERE entity = ? AND entity_id = ?
+                UNION ALL
+                SELECT * FROM audit_log WHERE parent_id = ?
+            ) a
+            LEFT JOIN users u ON a.actor = u.id
+            ORDER BY a.id DESC
+            LIMIT ?
+        """, (entity, entity_id, entity_id, limit))
+        return self.cursor.fetchall()
+    
+    def prune_audit_log(self, keep_months, batch_size=5000):
+        # Drops every month older than keep_months, oldest ids first, one short transaction per batch
+        today = datetime.date.today()
+        month_index = today.year * 12 + today.month - 1 - keep_months
+        cutoff = f"{month_index // 12:04d}-{month_index % 12 + 1:02d}"
+        self.cursor.execute("SELECT MIN(first_id) FROM audit_partitions WHERE month >= ?", (cutoff,))
+        boundary = self.cursor.fetchone()[0]
+        if boundary is None:
+            self.cursor.execute(f"SELECT COALESCE({self.backend.last_id('audit_log')}, 0) + 1")
+            boundary = self.cursor.fetchone()[0]
+        
+        pruned = 0
+        while True:
+            self.cursor.execute(
+                "DELETE FROM audit_log WHERE id IN (SELECT id FROM audit_log WHERE id < ? ORDER BY id LIMIT ?)",
+                (boundary, batch_size)
+            )
+            deleted = self.cursor.rowcount
+            pruned += deleted
+            self.conn.commit()
+            if deleted < batch_size:
+                break
+        self.cursor.execute("DELETE FROM audit_partitions WHERE month < ?", (cutoff,))
+        self.conn.commit()
+        return pruned
+    
+    # Change tracking and event outbox methods
+    # Where each tracked kind of record lives and the column holding its owner: (source, owner)
+    CHANGE_FEED = {
+        "clients": ("clients r", "r.user_id"),
+        "projects": ("projects r", "r.user_id"),
+        "tasks": ("tasks r JOIN projects p ON p.id = r.project_id", "p.user_id"),
+        "invoices": ("invoices r JOIN projects p ON p.id = r.project_id", "p.user_id"),
+        "payments": ("payments r JOIN invoices i ON i.id = r.invoice_id JOIN projects p ON p.id = i.project_id", "p.user_id"),
+    }
+    # Tombstones older than this are dropped; feeds read from before then have to start over
+    TOMBSTONE_RETENTION_DAYS = 90
+    
+    def next_change_seqs(self, user_id, count):
+        # Reserves count change_seq values of the user's feed in the caller's transaction. The
+        # user's counter row stays locked until commit, so change_seq order is commit order within
+        # a feed and its cursor never skips over a change that becomes visible late, while writes
+        # for different users don't queue behind one counter. A user's counter carries on from
+        # the shared change_seq, so cursors handed out before it was split stay valid.
+        self.cursor.execute("""
+            INSERT INTO sequences (name, value) VALUES (?, (SELECT value FROM sequences WHERE name = 'change_seq') + ?)
+            ON CONFLICT (name) DO UPDATE SET value = sequences.value + ?
+            RETURNING value
+        """, (f"change_seq:{user_id}", count, count))
+        last = self.cursor.fetchone()[0]
+        return range(last - count + 1, last + 1)
+    
+    def change_seqs(self, owners):
+        # {record id: change_seq} in each owner's feed, for owners as returned by owners(). Counter
+        # rows are taken in user order, so two writes touching the same users can't deadlock.
+        records = {}
+        for record_id, user_id in owners.items():
+            records.setdefault(user_id, []).append(record_id)
+        seqs = {}
+        for user_id in sorted(records):
+            seqs.update(zip(records[user_id], self.next_change_seqs(user_id, len(records[user_id]))))
+        return seqs
+    
+    def owners(self, table, ids):
+        # {record id: owning user id}
+        source, owner = self.CHANGE_FEED[table]
+        self.cursor.execute(f"SELECT r.id, {owner} FROM {source} WHERE r.id IN ({', '.join('?' for _ in ids)})", ids)
+        return dict(self.cursor.fetchall())
+    
+    def tombstone(self, table, ids):
+        # Call before hard-deleting the records
+        owners = self.owners(table, list(ids))
+        if owners:
+            deleted_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            seqs = self.change_seqs(owners)
+            self.cursor.executemany(
+                "INSERT INTO tombstones (user_id, entity, change_seq, entity_id, deleted_at) VALUES (?, ?, ?, ?, ?)",
+                [(user_id, table, seqs[entity_id], entity_id, deleted_at) for entity_id, user_id in owners.items()]
+            )
+        return owners
+    
+    def emit(self, table, ids, action):
+        # Records a change in the caller's transaction, so it exists exactly when the change was
+        # committed: the records get the next change_seq values (hard deletes leave a tombstone
+        # instead, so call this before deleting) and, for users with a webhook, an outbox event
+        # carrying the record as it is now.
+        ids = list(ids)
+        if not ids:
+            return
+        if action == "deleted" and table not in self.TRASH_TABLES:
+            owners = self.tombstone(table, ids)
+        else:
+            owners = self.owners(table, ids)
+            self.cursor.executemany(f"UPDATE {table} SET change_seq = ? WHERE id = ?",
+                                    [(change_seq, record_id) for record_id, change_seq in self.change_seqs(owners).items()])
+        if not owners:
+            return
+        self.cursor.execute(f"SELECT DISTINCT user_id FROM webhooks WHERE user_id IN ({', '.join('?' for _ in owners)})", list(owners.values()))
+        subscribed = {row[0] for row in self.cursor.fetchall()}
+        if not subscribed:
+            return
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.executemany(
+            "INSERT INTO events (user_id, entity, entity_id, action, data, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(owners[entity_id], table, entity_id, action, json.dumps(row, separators=(",", ":"), default=str), created_at)
+             for entity_id, row in self.snapshot(table, [entity_id for entity_id, user_id in owners.items() if user_id in subscribed]).items()]
+        )
+    
+    def get_changes(self, resource, user_id, since=0, limit=500, full=False):
+        # The user's records changed after change_seq `since`, oldest change first, trashed ones
+        # included (deleted_at set), merged with tombstones of hard-deleted ones
+        # ({"id", "change_seq", "deleted_at", "tombstone": True}), and the cursor to continue
+        # from. Returns None when tombstones the caller needs were already dropped, so it has to
+        # start over from 0. A full read (a copy that started empty at 0) can't hold anything
+        # those tombstones would remove.
+        pruned_seq = max(int(self.get_meta("tombstones_pruned_seq", "0")), int(self.get_meta(f"tombstones_pruned_seq:{user_id}", "0")))
+        if since and not full and since < pruned_seq:
+            return None
+        # Read before the changes: every change_seq of the feed up to it was committed by then, so
+        # a caught-up caller can move its cursor there even when none of them were its own
+        self.cursor.execute(
+            "SELECT COALESCE((SELECT value FROM sequences WHERE name = ?), (SELECT value FROM sequences WHERE name = 'change_seq'))",
+            (f"change_seq:{user_id}",)
+        )
+        head = self.cursor.fetchone()[0]
+        source, owner = self.CHANGE_FEED[resource]
+        self.cursor.execute(f"SELECT r.* FROM {source} WHERE {owner} = ? AND r.change_seq > ? ORDER BY r.change_seq LIMIT ?", (user_id, since, limit))
+        columns = [column[0] for column in self.cursor.description]
+        changes = [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+        self.cursor.execute("""
+            SELECT entity_id, change_seq, deleted_at FROM tombstones
+            WHERE user_id = ? AND entity = ? AND change_seq > ?
+            ORDER BY change_seq LIMIT ?
+        """, (user_id, resource, since, limit))
+        changes += [{"id": entity_id, "change_seq": change_seq, "deleted_at": deleted_at, "tombstone": True}
+                    for entity_id, change_seq, deleted_at in self.cursor.fetchall()]
+        changes = sorted(changes, key=lambda change: change["change_seq"])[:limit]
+        return changes, changes[-1]["change_seq"] if len(changes) == limit else max(head, since)
+    
+    def prune_tombstones(self, retention_days=None):
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days or self.TOMBSTONE_RETENTION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+        # Each feed has its own numbering, so each user's feed remembers how far it was pruned
+        self.cursor.execute("SELECT user_id, MAX(change_seq) FROM tombstones WHERE deleted_at < ? GROUP BY user_id", (cutoff,))
+        pruned = 0
+        for user_id, pruned_seq in self.cursor.fetchall():
+            self.cursor.execute("DELETE FROM tombstones WHERE user_id = ? AND change_seq <= ?", (user_id, pruned_seq))
+            pruned += self.cursor.rowcount
+            key = f"tombstones_pruned_seq:{user_id}"
+            self.set_meta(key, str(max(pruned_seq, int(self.get_meta(key, "0")))), commit=False)
+        self.conn.commit()
+        return pruned
+    
+    # User methods
+    def add_user(self, username, password, email, full_name):
+        user_id = str(uuid.uuid4())
+        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        try:
+            self.cursor.execute(
+                "INSERT INTO users (id, username, password, email, full_name, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, username, hashed_password, email, full_name, created_at)
+            )
+            self.conn.commit()
+            return user_id
+        except self.backend.IntegrityError:
+            self.conn.rollback()
+            return None
+    
+    def verify_user(self, username, password):
+        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+        self.cursor.execute(
+            "SELECT id, username, email, full_name, subscription_type, base_currency FROM users WHERE username = ? AND password = ?",
+            (username, hashed_password)
+        )
+        user = self.cursor.fetchone()
+        if user:
+            return {
+                "id": user[0],
+                "username": user[1],
+                "email": user[2],
+                "full_name": user[3],
+                "subscription_type": user[4],
+                "base_currency": user[5]
+            }
+        return None
+    
+    def import_rows(self, table, rows):
+        # Rows as dicts (see snapshot); ones already present are left alone
+        for row in rows:
+            columns = ", ".join(row)
+            placeholders = ", ".join("?" for _ in row)
+            self.cursor.execute(f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON CONFLICT DO NOTHING", list(row.values()))
+        self.conn.commit()
+    
+    # Tenant routing (catalog)
+    def get_tenant_shard(self, user_id):
+        self.cursor.execute("SELECT shard FROM tenants WHERE user_id = ?", (user_id,))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+    
+    def add_tenant(self, user_id, shard):
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.execute(
+            "INSERT INTO tenants (user_id, shard, created_at) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+            (user_id, shard, created_at)
+        )
+        self.conn.commit()
+        return self.get_tenant_shard(user_id)
+    
+    def update_user_subscription(self, user_id, subscription_type, subscription_end_date):
+        self.cursor.execute(
+            "UPDATE users SET subscription_type = ?, subscription_end_date = ? WHERE id = ?",
+            (subscription_type, subscription_end_date, user_id)
+        )
+        self.conn.commit()
+    
+    def update_user_base_currency(self, user_id, base_currency):
+        self.cursor.execute("UPDATE users SET base_currency = ? WHERE id = ?", (base_currency, user_id))
+        self.conn.commit()
+    
+    # Client methods
+    def add_client(self, user_id, name, email, phone, company, address, notes, currency="USD"):
+        client_id = str(uuid.uuid4())
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        self.cursor.execute(
+            "INSERT INTO clients (id, user_id, name, email, phone, company, address, notes, currency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (client_id, user_id, name, email, phone, company, address, notes, currency, created_at)
+        )
+        self.bump_data_version(["clients"], user_ids=[user_id])
+        self.emit("clients", [client_id], "created")
+        self.conn.commit()
+        return client_id
+    
+    def get_clients(self, user_id):
+        self.cursor.execute(f"SELECT {self.CLIENT_COLUMNS} FROM clients WHERE user_id = ? AND deleted_at IS NULL", (user_id,))
+        clients = self.cursor.fetchall()
+        return clients
+    
+    def get_client(self, client_id):
+        self.cursor.execute(f"SELECT {self.CLIENT_COLUMNS} FROM clients WHERE id = ? AND deleted_at IS NULL", (client_id,))
+        client = self.cursor.fetchone()
+        return client
+    
+    def update_client(self, client_id, name, email, phone, company, address, notes, currency="USD", expected_version=None):
+        conflict = self.update_versioned("clients", client_id, {
+            "name": name, "email": email, "phone": phone, "company": company,
+            "address": address, "notes": notes, "currency": currency
+        }, expected_version)
+        if conflict:
+            return conflict
+        self.bump_client_owner_version(client_id)
+        self.emit("clients", [client_id], "updated")
+        self.conn.commit()
+    
+    def delete_client(self, client_id):
+        self.audit("clients", self.snapshot("clients", [client_id]))
+        self.bump_client_owner_version(client_id)
+        self.cursor.execute("UPDATE clients SET deleted_at = ?, version = version + 1 WHERE id = ?", (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), client_id))
+        self.emit("clients", [client_id], "deleted")
+        self.conn.commit()
+    
+    def bump_client_owner_version(self, client_id):
+        self.cursor.execute("SELECT user_id FROM clients WHERE id = ?", (client_id,))
+        self.bump_data_version(["clients"], user_ids=[row[0] for row in self.cursor.fetchall()])
+    
+    # Project methods
+    def add_project(self, user_id, client_id, name, description, start_date, end_date, status, budget_cents, currency="USD"):
+        project_id = str(uuid.uuid4())
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        self.cursor.execute(
+            "INSERT INTO projects (id, user_id, client_id, name, description, start_date, end_date, status, budget_cents, currency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (project_id, user_id, client_id, name, description, start_date, end_date, status, budget_cents, currency, created_at)
+        )
+        self.bump_data_version(["projects"], user_ids=[user_id])
+        self.emit("projects", [project_id], "created")
+        self.conn.commit()
+        return project_id
+    
+    def get_projects(self, user_id):
+        self.cursor.execute(f"""
+            SELECT {self.PROJECT_COLUMNS}, c.name as client_name, p.currency
+            FROM projects p
+            JOIN clients c ON p.client_id = c.id
+            WHERE p.user_id = ? AND p.deleted_at IS NULL AND c.deleted_at IS NULL
+        """, (user_id,))
+        projects = self.cursor.fetchall()
+        return projects
+    
+    def get_project(self, project_id):
+        self.cursor.execute(f"""
+            SELECT {self.PROJECT_COLUMNS}, c.name as client_name, p.currency
+            FROM projects p
+            JOIN clients c ON p.client_id = c.id
+            WHERE p.id = ? AND p.deleted_at IS NULL AND c.deleted_at IS NULL
+        """, (project_id,))
+        project = self.cursor.fetchone()
+        return project
+    
+    def update_project(self, project_id, client_id, name, description, start_date, end_date, status, budget_cents, currency="USD", expected_version=None):
+        conflict = self.update_versioned("projects", project_id, {
+            "client_id": client_id, "name": name, "description": description, "start_date": start_date,
+            "end_date": end_date, "status": status, "budget_cents": budget_cents, "currency": currency
+        }, expected_version)
+        if conflict:
+            return conflict
+        self.bump_data_version(["projects"], project_ids=[project_id])
+        self.emit("projects", [project_id], "updated")
+        self.conn.commit()
+    
+    def delete_project(self, project_id):
+        self.audit("projects", self.snapshot("projects", [project_id]))
+        self.bump_data_version(["projects", "invoices", "invoice_edits", "tasks"], project_ids=[project_id])
+        self.cursor.execute("UPDATE projects SET deleted_at = ?, version = version + 1 WHERE id = ?", (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), project_id))
+        self.emit("projects", [project_id], "deleted")
+        self.conn.commit()
+    
+    # Task methods
+    def add_task(self, project_id, name, description, due_date, status):
+        task_id = str(uuid.uuid4())
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        # New tasks go to the bottom of their board column
+        self.cursor.execute(
+            """INSERT INTO tasks (id, project_id, name, description, due_date, status, created_at, position)
+            VALUES (?, ?, ?, ?, ?, ?, ?, (
+                SELECT COALESCE(MAX(t.position), 0) + 1 FROM tasks t JOIN projects p ON t.project_id = p.id
+                WHERE p.user_id = (SELECT user_id FROM projects WHERE id = ?) AND p.deleted_at IS NULL AND t.status = ?
+            ))""",
+            (task_id, project_id, name, description, due_date, status, created_at, project_id, status)
+        )
+        self.bump_data_version(["tasks"], project_ids=[project_id])
+        self.emit("tasks", [task_id], "created")
+        self.conn.commit()
+        return task_id
+    
+    def get_tasks(self, project_id):
+        self.cursor.execute(f"SELECT {self.TASK_COLUMNS} FROM tasks WHERE project_id = ?", (project_id,))
+        tasks = self.cursor.fetchall()
+        return tasks
+    
+    def get_task(self, task_id):
+        self.cursor.execute(f"SELECT {self.TASK_COLUMNS} FROM tasks WHERE id = ?", (task_id,))
+        task = self.cursor.fetchone()
+        return task
+    
+    def update_task(self, task_id, name, description, due_date, status):
+        before = self.snapshot("tasks", [task_id])
+        self.cursor.execute(
+            "UPDATE tasks SET name = ?, description = ?, due_date = ?, status = ? WHERE id = ?",
+            (name, description, due_date, status, task_id)
+        )
+        self.audit("tasks", before, self.snapshot("tasks", [task_id]))
+        self.bump_data_version(["tasks"], project_ids=[row[0] for row in self.cursor.execute("SELECT project_id FROM tasks WHERE id = ?", (task_id,))])
+        self.emit("tasks", [task_id], "updated")
+        self.conn.commit()
+    
+    def delete_task(self, task_id):
+        self.audit("tasks", self.snapshot("tasks", [task_id]))
+        self.bump_data_version(["tasks"], project_ids=[row[0] for row in self.cursor.execute("SELECT project_id FROM tasks WHERE id = ?", (task_id,))])
+        self.emit("tasks", [task_id], "deleted")
+        self.cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+        self.conn.commit()
+    
+    # Every task on the user's board in column order, one indexed query
+    def get_board(self, user_id):
+        self.cursor.execute("""
+            SELECT t.id, t.project_id, p.name, t.name, t.due_date, t.status, t.position
+            FROM projects p
+            JOIN tasks t ON t.project_id = p.id
+            WHERE p.user_id = ? AND p.deleted_at IS NULL
+            ORDER BY t.status, t.position
+        """, (user_id,))
+        return self.cursor.fetchall()
+    
+    # Task due dates, project end dates and invoice due dates between two days (inclusive):
+    # (kind, id, title, day, context, status), ordered by day
+    def get_calendar(self, user_id, start_date, end_date):
+        self.cursor.execute("""
+            SELECT 'task' AS kind, t.id, t.name, t.due_date AS day, p.name, t.status
+            FROM projects p JOIN tasks t ON t.project_id = p.id
+            WHERE p.user_id = ? AND p.deleted_at IS NULL AND t.due_date BETWEEN ? AND ?
+            UNION ALL
+            SELECT 'project', p.id, p.name, p.end_date, c.name, p.status
+            FROM projects p LEFT JOIN clients c ON p.client_id = c.id
+            WHERE p.user_id = ? AND p.deleted_at IS NULL AND p.end_date BETWEEN ? AND ?
+            UNION ALL
+            SELECT 'invoice', i.id, 'Invoice #' || substr(i.id, 1, 8), i.due_date, p.name, i.status
+            FROM projects p JOIN invoices i ON i.project_id = p.id
+            WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL AND i.due_date BETWEEN ? AND ?
+            ORDER BY day, kind
+        """, (user_id, start_date, end_date) * 3)
+        return self.cursor.fetchall()
+    
+    def move_tasks(self, user_id, task_ids, status, to_top=False):
+        # Only status and position change; the whole selection moves in one transaction
+        # and keeps its order. Returns the new positions and the user's "tasks" version.
+        try:
+            self.cursor.execute("""
+                SELECT COALESCE(MIN(t.position), 0), COALESCE(MAX(t.position), 0)
+                FROM projects p JOIN tasks t ON t.project_id = p.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND t.status = ?
+            """, (user_id, status))
+            lowest, highest = self.cursor.fetchone()
+            start = lowest - len(task_ids) if to_top else highest + 1
+            positions = {task_id: start + i for i, task_id in enumerate(task_ids)}
+            before = self.snapshot("tasks", task_ids)
+            self.cursor.executemany("""
+                UPDATE tasks SET status = ?, position = ?
+                WHERE id = ? AND project_id IN (SELECT id FROM projects WHERE user_id = ? AND deleted_at IS NULL)
+            """, [(status, position, task_id, user_id) for task_id, position in positions.items()])
+            self.audit("tasks", before, self.snapshot("tasks", task_ids))
+            self.bump_data_version(["tasks"], user_ids=[user_id])
+            self.emit("tasks", task_ids, "updated")
+            self.cursor.execute("SELECT version FROM data_versions WHERE user_id = ? AND scope = 'tasks'", (user_id,))
+            version = self.cursor.fetchone()[0]
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return positions, version
+    
+    # Invoice methods
+    def add_invoice(self, project_id, amount_cents, issue_date, due_date, status, notes, currency="USD"):
+        invoice_id = str(uuid.uuid4())
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        self.cursor.execute(
+            "INSERT INTO invoices (id, project_id, amount_cents, issue_date, due_date, status, notes, currency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (invoice_id, project_id, amount_cents, issue_date, due_date, status, notes, currency, created_at)
+        )
+        self.bump_data_version(["invoices"], project_ids=[project_id])
+        self.emit("invoices", [invoice_id], "created")
+        self.conn.commit()
+        return invoice_id
+    
+    def add_invoices(self, invoices, commit=True):
+        # Bulk insert of (project_id, amount_cents, issue_date, due_date, status, notes, recurring_id, period_date, currency);
+        # rows that already exist for a recurring period are skipped
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = [(str(uuid.uuid4()), *invoice, created_at) for invoice in invoices]
+        
+        self.cursor.executemany(
+            "INSERT INTO invoices (id, project_id, amount_cents, issue_date, due_date, status, notes, recurring_id, period_date, currency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
+            rows
+        )
+        inserted = self.cursor.rowcount
+        self.bump_data_version(["invoices"], project_ids=[invoice[0] for invoice in invoices])
+        # Rows skipped as duplicates don't exist under their new id, so they emit nothing
+        self.emit("invoices", [row[0] for row in rows], "created")
+        if commit:
+            self.conn.commit()
+        return inserted
+    
+    def get_invoices(self, project_id=None):
+        if project_id:
+            self.cursor.execute(f"""
+                SELECT {self.INVOICE_COLUMNS}, p.name as project_name, c.name as client_name, i.currency
+                FROM invoices i
+                JOIN projects p ON i.project_id = p.id
+                JOIN clients c ON p.client_id = c.id
+                WHERE i.project_id = ? AND i.deleted_at IS NULL AND p.deleted_at IS NULL AND c.deleted_at IS NULL
+            """, (project_id,))
+        else:
+            self.cursor.execute(f"""
+                SELECT {self.INVOICE_COLUMNS}, p.name as project_name, c.name as client_name, i.currency
+                FROM invoices i
+                JOIN projects p ON i.project_id = p.id
+                JOIN clients c ON p.client_id = c.id
+                WHERE i.deleted_at IS NULL AND p.deleted_at IS NULL AND c.deleted_at IS NULL
+            """)
+        invoices = self.cursor.fetchall()
+        return invoices
+    
+    def get_invoice(self, invoice_id):
+        self.cursor.execute(f"""
+            SELECT {self.INVOICE_COLUMNS}, p.name as project_name, c.name as client_name, i.currency
+            FROM invoices i
+            JOIN projects p ON i.project_id = p.id
+            JOIN clients c ON p.client_id = c.id
+            WHERE i.id = ? AND i.deleted_at IS NULL AND p.deleted_at IS NULL AND c.deleted_at IS NULL
+        """, (invoice_id,))
+        invoice = self.cursor.fetchone()
+        return invoice
+    
+    def update_invoice(self, invoice_id, amount_cents, issue_date, due_date, status, notes, expected_version=None):
+        conflict = self.update_versioned("invoices", invoice_id, {
+            "amount_cents": amount_cents, "issue_date": issue_date, "due_date": due_date, "status": status, "notes": notes
+        }, expected_version)
+        if conflict:
+            return conflict
+        self.invalidate_invoice_documents(invoice_id)
+        self.bump_data_version(["invoices", "invoice_edits"], invoice_ids=[invoice_id])
+        self.emit("invoices", [invoice_id], "updated")
+        self.conn.commit()
+    
+    def delete_invoice(self, invoice_id):
+        self.audit("invoices", self.snapshot("invoices", [invoice_id]))
+        self.bump_data_version(["invoices", "invoice_edits"], invoice_ids=[invoice_id])
+        self.cursor.execute("UPDATE invoices SET deleted_at = ?, version = version + 1 WHERE id = ?", (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), invoice_id))
+        self.invalidate_invoice_documents(invoice_id)
+        self.emit("invoices", [invoice_id], "deleted")
+        self.conn.commit()
+    
+    # Payment methods
+    def add_payment(self, invoice_id, amount_cents, payment_date, payment_method, notes):
+        payment_id = str(uuid.uuid4())
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        self.cursor.execute(
+            "INSERT INTO payments (id, invoice_id, amount_cents, payment_date, payment_method, notes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (payment_id, invoice_id, amount_cents, payment_date, payment_method, notes, created_at)
+        )
+        self.bump_data_version(["payments"], invoice_ids=[invoice_id])
+        self.emit("payments", [payment_id], "created")
+        self.conn.commit()
+        
+        # Update invoice status if fully paid
+        self.refresh_invoice_status(invoice_id)
+        return payment_id
+    
+    def get_payments(self, invoice_id):
+        self.cursor.execute(f"SELECT {self.PAYMENT_COLUMNS} FROM payments WHERE invoice_id = ? AND deleted_at IS NULL", (invoice_id,))
+        payments = self.cursor.fetchall()
+        return payments
+    
+    def get_payment(self, payment_id):
+        self.cursor.execute(f"SELECT {self.PAYMENT_COLUMNS} FROM payments WHERE id = ? AND deleted_at IS NULL", (payment_id,))
+        payment = self.cursor.fetchone()
+        return payment
+    
+    def update_payment(self, payment_id, amount_cents, payment_date, payment_method, notes, expected_version=None):
+        conflict = self.update_versioned("payments", payment_id, {
+            "amount_cents": amount_cents, "payment_date": payment_date, "payment_method": payment_method, "notes": notes
+        }, expected_version)
+        if conflict:
+            return conflict
+        self.cursor.execute("SELECT invoice_id FROM payments WHERE id = ?", (payment_id,))
+        invoice_id = self.cursor.fetchone()[0]
+        self.bump_data_version(["payments", "payment_edits"], invoice_ids=[invoice_id])
+        self.emit("payments", [payment_id], "updated")
+        self.conn.commit()
+        
+        self.refresh_invoice_status(invoice_id)
+    
+    def delete_payment(self, payment_id):
+        self.cursor.execute("SELECT invoice_id FROM payments WHERE id = ?", (payment_id,))
+        invoice_id = self.cursor.fetchone()[0]
+        
+        self.audit("payments", self.snapshot("payments", [payment_id]))
+        self.cursor.execute("UPDATE payments SET deleted_at = ?, version = version + 1 WHERE id = ?", (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), payment_id))
+        self.bump_data_version(["payments", "payment_edits"], invoice_ids=[invoice_id])
+        self.emit("payments", [payment_id], "deleted")
+        self.conn.commit()
+        
+        # Update invoice status
+        self.refresh_invoice_status(invoice_id)
+    
+    def refresh_invoice_status(self, invoice_id, commit=True):
+        self.cursor.execute("SELECT amount_cents, due_date FROM invoices WHERE id = ?", (invoice_id,))
+        invoice_amount, due_date = self.cursor.fetchone()
+        
+        # Integer sums, so a fully paid invoice compares exactly equal
+        self.cursor.execute("SELECT SUM(amount_cents) FROM payments WHERE invoice_id = ? AND deleted_at IS NULL", (invoice_id,))
+        total_paid = self.cursor.fetchone()[0] or 0
+        
+        # Paid amounts are printed on the documents
+        self.invalidate_invoice_documents(invoice_id)
+        
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        if total_paid >= invoice_amount:
+            status = "Paid"
+        elif due_date and due_date < today:
+            status = "Overdue"
+        elif total_paid > 0:
+            status = "Partially Paid"
+        else:
+            status = "Unpaid"
+        
+        self.cursor.execute("UPDATE invoices SET status = ?, version = version + 1 WHERE id = ? AND status IS DISTINCT FROM ?", (status, invoice_id, status))
+        if self.cursor.rowcount:
+            self.emit("invoices", [invoice_id], "updated")
+        if commit:
+            self.conn.commit()
+    
+    def sweep_overdue_invoices(self, force=False):
+        # Runs at most once a day; the (status, due_date) index keeps the update
+        # proportional to the invoices that just became overdue
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        if not force and self.get_meta("last_overdue_sweep") == today:
+            return None
+        
+        self.cursor.execute("""
+            UPDATE invoices SET status = 'Overdue', version = version + 1
+            WHERE status IN ('Unpaid', 'Partially Paid') AND due_date < ? AND deleted_at IS NULL
+            RETURNING id
+        """, (today,))
+        swept_ids = [row[0] for row in self.cursor.fetchall()]
+        swept = len(swept_ids)
+        self.emit("invoices", swept_ids, "updated")
+        self.bump_data_version(["invoices"], invoice_ids=swept_ids)
+        self.set_meta("last_overdue_sweep", today, commit=False)
+        self.conn.commit()
+        return swept
+    
+    # Notification methods
+    def add_due_notifications(self, today, task_days, invoice_days):
+        # Open tasks and unpaid invoices falling due inside their reminder window
+        last_task_day = (today + datetime.timedelta(days=task_days)).strftime("%Y-%m-%d")
+        last_invoice_day = (today + datetime.timedelta(days=invoice_days)).strftime("%Y-%m-%d")
+        today = today.strftime("%Y-%m-%d")
+        self.cursor.execute("""
+            SELECT p.user_id, 'task_due', t.id, t.due_date, 'Task "' || t.name || '" (' || p.name || ') is due on ' || t.due_date
+            FROM tasks t JOIN projects p ON t.project_id = p.id
+            WHERE t.status != 'Completed' AND t.due_date BETWEEN ? AND ? AND p.deleted_at IS NULL
+            UNION ALL
+            SELECT p.user_id, 'invoice_due', i.id, i.due_date, 'Invoice #' || substr(i.id, 1, 8) || ' (' || p.name || ') is due on ' || i.due_date
+            FROM invoices i JOIN projects p ON i.project_id = p.id
+            WHERE i.status IN ('Unpaid', 'Partially Paid') AND i.due_date BETWEEN ? AND ? AND i.deleted_at IS NULL AND p.deleted_at IS NULL
+        """, (today, last_task_day, today, last_invoice_day))
+        due = self.cursor.fetchall()
+        
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.executemany(
+            "INSERT INTO notifications (id, user_id, kind, subject_id, due_date, message, created_at) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
+            [(str(uuid.uuid4()), *row, created_at) for row in due]
+        )
+        created = self.cursor.rowcount if due else 0
+        if created:
+            self.refresh_unread_counts({row[0] for row in due}, commit=False)
+        self.conn.commit()
+        return created
+    
+    def refresh_unread_counts(self, user_ids, commit=True):
+        self.cursor.executemany("""
+            UPDATE users SET unread_notifications = (
+                SELECT COUNT(*) FROM notifications WHERE user_id = users.id AND read_at IS NULL
+            ) WHERE id = ?
+        """, [(user_id,) for user_id in user_ids])
+        if commit:
+            self.conn.commit()
+    
+    def get_unread_notification_count(self, user_id):
+        self.cursor.execute("SELECT unread_notifications FROM users WHERE id = ?", (user_id,))
+        row = self.cursor.fetchone()
+        return (row[0] or 0) if row else 0
+    
+    def get_notifications(self, user_id, limit=100):
+        self.cursor.execute("""
+            SELECT id, kind, subject_id, due_date, message, created_at, read_at
+            FROM notifications
+            WHERE user_id = ?
+            ORDER BY read_at IS NOT NULL, created_at DESC
+            LIMIT ?
+        """, (user_id, limit))
+        return self.cursor.fetchall()
+    
+    def mark_notifications_read(self, user_id, notification_ids=None):
+        read_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if notification_ids is None:
+            self.cursor.execute("UPDATE notifications SET read_at = ? WHERE user_id = ? AND read_at IS NULL", (read_at, user_id))
+            read = self.cursor.rowcount
+        else:
+            self.cursor.executemany(
+                "UPDATE notifications SET read_at = ? WHERE id = ? AND user_id = ? AND read_at IS NULL",
+                [(read_at, notification_id, user_id) for notification_id in notification_ids]
+            )
+            read = self.cursor.rowcount
+        self.cursor.execute("UPDATE users SET unread_notifications = CASE WHEN unread_notifications > ? THEN unread_notifications - ? ELSE 0 END WHERE id = ?", (read, read, user_id))
+        self.conn.commit()
+    
+    # Outbox: reminders not yet emailed, with the recipient's address
+    # Reminders that are already past their due date are not sent any more
+    def get_undelivered_notifications(self, today, limit=500):
+        self.cursor.execute("""
+            SELECT n.id, u.email, u.full_name, n.message
+            FROM notifications n
+            JOIN users u ON n.user_id = u.id
+            WHERE n.emailed_at IS NULL AND n.due_date >= ?
+            ORDER BY n.created_at
+            LIMIT ?
+        """, (today.strftime("%Y-%m-%d"), limit))
+        return self.cursor.fetchall()
+    
+    def mark_notifications_emailed(self, notification_ids):
+        emailed_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.executemany(
+            "UPDATE notifications SET emailed_at = ? WHERE id = ?",
+            [(emailed_at, notification_id) for notification_id in notification_ids]
+        )
+        self.conn.commit()
+    
+    # Time tracking methods
+    def add_time_entry(self, user_id, project_id, task_id, started_at, duration_seconds, hourly_rate_cents, billable, notes):
+        return self.add_time_entries([(user_id, project_id, task_id, started_at, duration_seconds, hourly_rate_cents, billable, notes)])[0]
+    
+    def add_time_entries(self, entries):
+        # Bulk insert of (user_id, project_id, task_id, started_at, duration_seconds, hourly_rate_cents, billable, notes)
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        entry_ids = []
+        for entry in entries:
+            self.cursor.execute(
+                "INSERT INTO time_entries (user_id, project_id, task_id, started_at, duration_seconds, hourly_rate_cents, billable, notes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id",
+                (*entry, created_at)
+            )
+            entry_ids.append(self.cursor.fetchone()[0])
+        self._apply_time_buckets(entries, 1)
+        self.conn.commit()
+        return entry_ids
+    
+    def delete_time_entry(self, entry_id):
+        self.cursor.execute(
+            "SELECT user_id, project_id, task_id, started_at, duration_seconds, hourly_rate_cents, billable, notes FROM time_entries WHERE id = ?",
+            (entry_id,)
+        )
+        entry = self.cursor.fetchone()
+        if entry:
+            self.audit("time_entries", self.snapshot("time_entries", [entry_id]))
+            self.cursor.execute("DELETE FROM time_entries WHERE id = ?", (entry_id,))
+            self._apply_time_buckets([entry], -1)
+            self.conn.commit()
+    
+    def _apply_time_buckets(self, entries, sign):
+        self.bump_data_version(["time"], user_ids=[entry[0] for entry in entries])
+        # Fold the entries into one delta per (project, day) before touching the rollup table
+        deltas = {}
+        for user_id, project_id, task_id, started_at, duration_seconds, hourly_rate_cents, billable, notes in entries:
+            key = (project_id, started_at[:10], user_id)
+            bucket = deltas.setdefault(key, [0, 0, 0, 0])
+            bucket[0] += duration_seconds
+            if billable:
+                bucket[1] += duration_seconds
+                bucket[2] += entry_billable_cents(duration_seconds, hourly_rate_cents)
+            bucket[3] += 1
+        
+        self.cursor.executemany("""
+            INSERT INTO time_daily (project_id, day, user_id, seconds, billable_seconds, billable_cents, entries)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(project_id, day) DO UPDATE SET
+                seconds = time_daily.seconds + excluded.seconds,
+                billable_seconds = time_daily.billable_seconds + excluded.billable_seconds,
+                billable_cents = time_daily.billable_cents + excluded.billable_cents,
+                entries = time_daily.entries + excluded.entries
+        """, [(*key, sign * b[0], sign * b[1], sign * b[2], sign * b[3]) for key, b in deltas.items()])
+    
+    def rebuild_time_daily(self):
+        # Recomputes every rollup from the raw entries
+        self.cursor.execute("DELETE FROM time_daily")
+        self.cursor.execute("""
+            INSERT INTO time_daily (project_id, day, user_id, seconds, billable_seconds, billable_cents, entries)
+            SELECT project_id, substr(started_at, 1, 10), user_id,
+                   SUM(duration_seconds),
+                   SUM(CASE WHEN billable = 1 THEN duration_seconds ELSE 0 END),
+                   SUM(CASE WHEN billable = 1 THEN (duration_seconds * COALESCE(hourly_rate_cents, 0) + 1800) / 3600 ELSE 0 END),
+                   COUNT(*)
+            FROM time_entries
+            GROUP BY project_id, substr(started_at, 1, 10)
+        """)
+        self.conn.commit()
+    
+    def get_time_entries(self, project_id, limit=100):
+        self.cursor.execute("""
+            SELECT te.id, te.task_id, t.name as task_name, te.started_at, te.duration_seconds, te.hourly_rate_cents, te.billable, te.notes
+            FROM time_entries te
+            LEFT JOIN tasks t ON te.task_id = t.id
+            WHERE te.project_id = ?
+            ORDER BY te.started_at DESC
+            LIMIT ?
+        """, (project_id, limit))
+        time_entries = self.cursor.fetchall()
+        return time_entries
+    
+    def get_task_hours(self, project_id):
+        self.cursor.execute("""
+            SELECT task_id, SUM(duration_seconds) / 3600.0
+            FROM time_entries
+            WHERE project_id = ?
+            GROUP BY task_id
+        """, (project_id,))
+        return dict(self.cursor.fetchall())
+    
+    def get_project_time_totals(self, project_id):
+        self.cursor.execute("""
+            SELECT COALESCE(SUM(seconds), 0) / 3600.0, COALESCE(SUM(billable_cents), 0)
+            FROM time_daily
+            WHERE project_id = ?
+        """, (project_id,))
+        return self.cursor.fetchone()
+    
+    def get_time_summary(self, user_id, group_by="project", start_date=None, end_date=None):
+        # Reads the daily rollups only, so the cost does not grow with the number of entries
+        group_columns = {
+            "project": "p.id, p.name",
+            "client": "c.id, c.name",
+            "week": f"{self.backend.week('d.day')}, {self.backend.week('d.day')}",
+            "day": "d.day, d.day"
+        }[group_by]
+        
+        self.cursor.execute(f"""
+            SELECT {group_columns},
+                   SUM(d.seconds) / 3600.0 as hours,
+                   SUM(d.billable_seconds) / 3600.0 as billable_hours,
+                   SUM(d.billable_cents) as billable_cents
+            FROM time_daily d
+            JOIN projects p ON d.project_id = p.id
+            JOIN clients c ON p.client_id = c.id
+            WHERE d.user_id = ? AND d.day >= ? AND d.day <= ? AND p.deleted_at IS NULL AND c.deleted_at IS NULL
+            GROUP BY {group_columns}
+            ORDER BY 2
+        """, (user_id, start_date or "0000-00-00", end_date or "9999-12-31"))
+        summary = self.cursor.fetchall()
+        return summary
+    
+    # Invoice builder methods
+    def get_unbilled_time(self, user_id, project_ids=None, client_id=None, until=None):
+        query = """
+            SELECT te.id, te.project_id, p.name, p.currency, te.task_id, t.name, t.status, te.duration_seconds, te.hourly_rate_cents
+            FROM time_entries te
+            JOIN projects p ON te.project_id = p.id
+            LEFT JOIN tasks t ON te.task_id = t.id
+            WHERE p.user_id = ? AND p.deleted_at IS NULL AND te.invoice_id IS NULL AND te.billable = 1 AND te.started_at <= ?
+        """
+        params = [user_id, (until or "9999-12-31") + " 23:59:59"]
+        if project_ids:
+            query += f" AND te.project_id IN ({', '.join('?' for _ in project_ids)})"
+            params.extend(project_ids)
+        if client_id:
+            query += " AND p.client_id = ?"
+            params.append(client_id)
+        
+        self.cursor.execute(query, params)
+        unbilled_time = self.cursor.fetchall()
+        return unbilled_time
+    
+    def add_invoices_with_items(self, invoices, items, billed_time_entries, billed_tasks):
+        # invoices: (id, project_id, amount_cents, issue_date, due_date, status, notes, currency)
+        # items: (invoice_id, description, quantity, unit_price_cents, amount_cents, source_type, source_id)
+        # billed_time_entries / billed_tasks: (invoice_id, source row id)
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            self.cursor.executemany(
+                "INSERT INTO invoices (id, project_id, amount_cents, issue_date, due_date, status, notes, currency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*invoice, created_at) for invoice in invoices]
+            )
+            self.cursor.executemany(
+                "INSERT INTO invoice_items (id, invoice_id, description, quantity, unit_price_cents, amount_cents, source_type, source_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(str(uuid.uuid4()), *item, created_at) for item in items]
+            )
+            # The IS NULL guard stops two concurrent runs from billing the same work twice
+            self.cursor.executemany(
+                "UPDATE time_entries SET invoice_id = ? WHERE id = ? AND invoice_id IS NULL",
+                billed_time_entries
+            )
+            if billed_time_entries and self.cursor.rowcount != len(billed_time_entries):
+                raise self.backend.IntegrityError("Some time entries were billed by another run")
+            self.cursor.executemany(
+                "UPDATE tasks SET billed_invoice_id = ? WHERE id = ? AND billed_invoice_id IS NULL",
+                billed_tasks
+            )
+            self.bump_data_version(["invoices"], project_ids=[invoice[1] for invoice in invoices])
+            self.emit("invoices", [invoice[0] for invoice in invoices], "created")
+            self.emit("tasks", [task_id for _, task_id in billed_tasks], "updated")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def get_invoice_items(self, invoice_id):
+        self.cursor.execute("""
+            SELECT id, description, quantity, unit_price_cents, amount_cents, source_type, source_id, tax_rate, discount, position
+            FROM invoice_items
+            WHERE invoice_id = ?
+            ORDER BY position, created_at, description
+        """, (invoice_id,))
+        invoice_items = self.cursor.fetchall()
+        return invoice_items
+    
+    def add_invoice_items(self, invoice_id, items, commit=True):
+        # items: (description, quantity, unit_price_cents, tax_rate, discount)
+        return self.update_invoice_items(invoice_id, added=items, commit=commit)
+    
+    def update_invoice_items(self, invoice_id, added=(), changed=(), deleted_ids=(), commit=True):
+        # Writes only the deltas: added rows are (description, quantity, unit_price_cents, tax_rate, discount),
+        # changed rows are (id, description, quantity, unit_price_cents, tax_rate, discount)
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        added = list(added)
+        changed = list(changed)
+        
+        try:
+            # An invoice entered as a plain amount gets that amount as its first item, so the
+            # items' total doesn't replace it
+            self.cursor.execute("""
+                INSERT INTO invoice_items (id, invoice_id, description, quantity, unit_price_cents, tax_rate, discount, amount_cents, source_type, position, created_at)
+                SELECT ?, id, 'Invoice amount', 1, amount_cents, 0, 0, amount_cents, 'manual', 1, ?
+                FROM invoices
+                WHERE id = ? AND amount_cents > 0 AND NOT EXISTS (SELECT 1 FROM invoice_items WHERE invoice_id = invoices.id)
+            """, (str(uuid.uuid4()), created_at, invoice_id))
+            before = self.snapshot("invoice_items", [*deleted_ids, *[item[0] for item in changed]])
+            if deleted_ids:
+                self.cursor.executemany("DELETE FROM invoice_items WHERE id = ? AND invoice_id = ?",
+                                        [(item_id, invoice_id) for item_id in deleted_ids])
+            if changed:
+                stored = {item_id: (row["quantity"], row["unit_price_cents"], row["tax_rate"], row["discount"], row["amount_cents"])
+                          for item_id, row in before.items()}
+                amounts = edited_line_amounts([(item[0], *item[2:6]) for item in changed], stored)["total"]
+                self.cursor.executemany("""
+                    UPDATE invoice_items
+                    SET description = ?, quantity = ?, unit_price_cents = ?, tax_rate = ?, discount = ?, amount_cents = ?
+                    WHERE id = ? AND invoice_id = ?
+                """, [(*item[1:6], int(amount), item[0], invoice_id) for item, amount in zip(changed, amounts)])
+            if added:
+                self.cursor.execute("SELECT COALESCE(MAX(position), 0) FROM invoice_items WHERE invoice_id = ?", (invoice_id,))
+                position = self.cursor.fetchone()[0]
+                amounts = compute_line_amounts(*zip(*[item[1:5] for item in added]))["total"]
+                self.cursor.executemany("""
+                    INSERT INTO invoice_items (id, invoice_id, description, quantity, unit_price_cents, tax_rate, discount, amount_cents, source_type, position, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'manual', ?, ?)
+                """, [(str(uuid.uuid4()), invoice_id, *item[:5], int(amount), position + i + 1, created_at)
+                      for i, (item, amount) in enumerate(zip(added, amounts))])
+            
+            self.cursor.execute("SELECT COUNT(*) FROM invoice_items WHERE invoice_id = ?", (invoice_id,))
+            if not self.cursor.fetchone()[0]:
+                raise ValueError("An invoice needs at least one line item; delete the invoice instead")
+            
+            self.audit("invoice_items", before, self.snapshot("invoice_items", list(before)))
+            self.update_invoice_totals([invoice_id])
+            if commit:
+                self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def update_invoice_totals(self, invoice_ids):
+        # invoices.amount_cents is a cached total of the line items, kept in the caller's transaction;
+        # invoices without items keep the amount they were entered with
+        placeholders = ", ".join("?" for _ in invoice_ids)
+        self.cursor.execute(f"""
+            UPDATE invoices
+            SET amount_cents = (SELECT SUM(amount_cents) FROM invoice_items WHERE invoice_id = invoices.id),
+                version = version + 1
+            WHERE id IN ({placeholders}) AND EXISTS (SELECT 1 FROM invoice_items WHERE invoice_id = invoices.id)
+            RETURNING id
+        """, list(invoice_ids))
+        invoice_ids = [row[0] for row in self.cursor.fetchall()]
+        self.bump_data_version(["invoices"], invoice_ids=invoice_ids)
+        self.emit("invoices", invoice_ids, "updated")
+        for invoice_id in invoice_ids:
+            self.refresh_invoice_status(invoice_id, commit=False)
+    
+    # Invoice document methods
+    def get_invoice_render_data(self, invoice_ids):
+        # Everything printed on the given invoices, fetched in chunked IN queries
+        documents = {}
+        for start in range(0, len(invoice_ids), 500):
+            chunk = invoice_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            
+            self.cursor.execute(f"""
+                SELECT i.id, i.amount_cents, i.issue_date, i.due_date, i.status, i.notes,
+                       p.name, c.name, c.email, c.company, c.address, i.currency
+                FROM invoices i
+                JOIN projects p ON i.project_id = p.id
+                JOIN clients c ON p.client_id = c.id
+                WHERE i.id IN ({placeholders})
+            """, chunk)
+            for row in self.cursor.fetchall():
+                documents[row[0]] = {
+                    "invoice": {
+                        "id": row[0],
+                        "amount_cents": row[1],
+                        "currency": row[11],
+                        "issue_date": row[2],
+                        "due_date": row[3],
+                        "status": row[4],
+                        "notes": row[5]
+                    },
+                    "project": {"name": row[6]},
+                    "client": {"name": row[7], "email": row[8], "company": row[9], "address": row[10]},
+                    "items": [],
+                    "payments": []
+                }
+            
+            self.cursor.execute(f"""
+                SELECT invoice_id, description, quantity, unit_price_cents, amount_cents
+                FROM invoice_items
+                WHERE invoice_id IN ({placeholders})
+                ORDER BY position, created_at, description
+            """, chunk)
+            for invoice_id, description, quantity, unit_price_cents, amount_cents in self.cursor.fetchall():
+                documents[invoice_id]["items"].append({
+                    "description": description,
+                    "quantity": quantity,
+                    "unit_price_cents": unit_price_cents,
+                    "amount_cents": amount_cents
+                })
+            
+            self.cursor.execute(f"""
+                SELECT invoice_id, amount_cents, payment_date, payment_method
+                FROM payments
+                WHERE invoice_id IN ({placeholders}) AND deleted_at IS NULL
+                ORDER BY payment_date
+            """, chunk)
+            for invoice_id, amount_cents, payment_date, payment_method in self.cursor.fetchall():
+                documents[invoice_id]["payments"].append({
+                    "amount_cents": amount_cents,
+                    "payment_date": payment_date,
+                    "payment_method": payment_method
+                })
+        return documents
+    
+    def get_invoice_documents(self, invoice_ids, fmt):
+        documents = {}
+        for start in range(0, len(invoice_ids), 500):
+            chunk = invoice_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            self.cursor.execute(
+                f"SELECT invoice_id, content_hash, content FROM invoice_documents WHERE format = ? AND invoice_id IN ({placeholders})",
+                (fmt, *chunk)
+            )
+            for invoice_id, content_hash, content in self.cursor.fetchall():
+                documents[invoice_id] = (content_hash, content)
+        return documents
+    
+    def save_invoice_documents(self, documents):
+        # Bulk upsert of (invoice_id, format, content_hash, content)
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.executemany(
+            """
+            INSERT INTO invoice_documents (invoice_id, format, content_hash, content, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(invoice_id, format) DO UPDATE SET
+                content_hash = excluded.content_hash, content = excluded.content, created_at = excluded.created_at
+            """,
+            [(*document, created_at) for document in documents]
+        )
+        self.conn.commit()
+    
+    def invalidate_invoice_documents(self, invoice_id):
+        # Part of the caller's transaction
+        self.cursor.execute("DELETE FROM invoice_documents WHERE invoice_id = ?", (invoice_id,))
+    
+    # Recurring invoice methods
+    def add_recurring_invoice(self, user_id, project_id, amount_cents, cadence, start_date, end_date, due_days, notes):
+        recurring_id = str(uuid.uuid4())
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        self.cursor.execute(
+            "INSERT INTO recurring_invoices (id, user_id, project_id, amount_cents, cadence, start_date, next_run_date, end_date, due_days, notes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (recurring_id, user_id, project_id, amount_cents, cadence, start_date, start_date, end_date, due_days, notes, created_at)
+        )
+        self.conn.commit()
+        return recurring_id
+    
+    def get_recurring_invoices(self, user_id):
+        self.cursor.execute("""
+            SELECT r.id, r.project_id, r.amount_cents, r.cadence, r.start_date, r.next_run_date, r.end_date,
+                   r.due_days, r.notes, r.active, p.name as project_name, c.name as client_name, p.currency
+            FROM recurring_invoices r
+            JOIN projects p ON r.project_id = p.id
+            JOIN clients c ON p.client_id = c.id
+            WHERE r.user_id = ? AND p.deleted_at IS NULL AND c.deleted_at IS NULL
+            ORDER BY r.next_run_date
+        """, (user_id,))
+        recurring_invoices = self.cursor.fetchall()
+        return recurring_invoices
+    
+    def get_due_recurring_invoices(self, run_date, limit):
+        self.cursor.execute("""
+            SELECT r.id, r.project_id, r.amount_cents, r.cadence, r.start_date, r.next_run_date, r.end_date, r.due_days, r.notes, p.currency
+            FROM recurring_invoices r
+            JOIN projects p ON r.project_id = p.id
+            WHERE r.active = 1 AND r.next_run_date <= ? AND p.deleted_at IS NULL
+            ORDER BY r.next_run_date
+            LIMIT ?
+        """, (run_date, limit))
+        recurring_invoices = self.cursor.fetchall()
+        return recurring_invoices
+    
+    def advance_recurring_invoices(self, updates, commit=True):
+        # Bulk update of (next_run_date, active, recurring_id)
+        self.cursor.executemany(
+            "UPDATE recurring_invoices SET next_run_date = ?, active = ? WHERE id = ?",
+            updates
+        )
+        if commit:
+            self.conn.commit()
+    
+    def get_recurring_schedule(self, recurring_id):
+        # (cadence, start_date, next_run_date, end_date) of one template
+        self.cursor.execute("SELECT cadence, start_date, next_run_date, end_date FROM recurring_invoices WHERE id = ?", (recurring_id,))
+        return self.cursor.fetchone()
+    
+    def set_recurring_invoice_active(self, recurring_id, active, next_run_date=None):
+        # Resuming moves next_run_date past the paused periods (RecurringInvoiceScheduler.resume)
+        self.cursor.execute(
+            "UPDATE recurring_invoices SET active = ?, next_run_date = COALESCE(?, next_run_date) WHERE id = ?",
+            (1 if active else 0, next_run_date, recurring_id)
+        )
+        self.conn.commit()
+    
+    def delete_recurring_invoice(self, recurring_id):
+        self.audit("recurring_invoices", self.snapshot("recurring_invoices", [recurring_id]))
+        self.cursor.execute("DELETE FROM recurring_invoices WHERE id = ?", (recurring_id,))
+        self.conn.commit()
+    
+    # Job methods
+    def enqueue_job(self, user_id, job_type, payload, priority=0, max_attempts=3, delay_seconds=0):
+        job_id = str(uuid.uuid4())
+        now = datetime.datetime.now()
+        created_at = now.strftime("%Y-%m-%d %H:%M:%S")
+        run_after = (now + datetime.timedelta(seconds=delay_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        
+        self.cursor.execute(
+            "INSERT INTO jobs (id, user_id, job_type, payload, priority, max_attempts, run_after, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, user_id, job_type, json.dumps(payload or {}), priority, max_attempts, run_after, created_at)
+        )
+        self.conn.commit()
+        return job_id
+    
+    def claim_job(self, job_types, stale_after_seconds=300):
+        # Atomically take the highest priority runnable job; jobs whose worker
+        # stopped sending heartbeats are handed out again while they have attempts left
+        if not job_types:
+            return None
+        now = datetime.datetime.now()
+        now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+        stale_cutoff = (now - datetime.timedelta(seconds=stale_after_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        placeholders = ", ".join("?" for _ in job_types)
+        
+        # A stale job without attempts left may still be running (a slow payment gateway call), so it
+        # fails instead of running twice
+        self.cursor.execute(f"""
+            UPDATE jobs
+            SET status = 'failed', error = 'Worker stopped responding', finished_at = ?
+            WHERE job_type IN ({placeholders}) AND status = 'running' AND heartbeat_at < ? AND attempts >= max_attempts
+        """, (now_str, *job_types, stale_cutoff))
+        self.cursor.execute(f"""
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, started_at = ?, heartbeat_at = ?, error = NULL
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE job_type IN ({placeholders})
+                  AND ((status = 'queued' AND run_after <= ?) OR (status = 'running' AND heartbeat_at < ? AND attempts < max_attempts))
+                ORDER BY priority DESC, run_after
+                LIMIT 1
+                {self.backend.skip_locked}
+            )
+            RETURNING id, user_id, job_type, payload, attempts, max_attempts
+        """, (now_str, now_str, *job_types, now_str, stale_cutoff))
+        job = self.cursor.fetchone()
+        self.conn.commit()
+        if job:
+            return {
+                "id": job[0],
+                "user_id": job[1],
+                "job_type": job[2],
+                "payload": json.loads(job[3] or "{}"),
+                "attempts": job[4],
+                "max_attempts": job[5]
+            }
+        return None
+    
+    def update_job_progress(self, job_id, progress):
+        heartbeat_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.execute(
+            "UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ?",
+            (progress, heartbeat_at, job_id)
+        )
+        self.conn.commit()
+    
+    def complete_job(self, job_id, result):
+        finished_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.execute(
+            "UPDATE jobs SET status = 'succeeded', progress = 1, result = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result), finished_at, job_id)
+        )
+        self.conn.commit()
+    
+    def fail_job(self, job_id, error, retry_delay_seconds=None):
+        now = datetime.datetime.now()
+        if retry_delay_seconds is None:
+            self.cursor.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (error, now.strftime("%Y-%m-%d %H:%M:%S"), job_id)
+            )
+        else:
+            run_after = (now + datetime.timedelta(seconds=retry_delay_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+            self.cursor.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, run_after = ? WHERE id = ?",
+                (error, run_after, job_id)
+            )
+        self.conn.commit()
+    
+    def has_pending_job(self, job_type):
+        self.cursor.execute(
+            "SELECT 1 FROM jobs WHERE job_type = ? AND status IN ('queued', 'running') LIMIT 1",
+            (job_type,)
+        )
+        return self.cursor.fetchone() is not None
+    
+    def get_job(self, job_id):
+        self.cursor.execute(
+            "SELECT id, job_type, status, progress, attempts, result, error, created_at, finished_at FROM jobs WHERE id = ?",
+            (job_id,)
+        )
+        job = self.cursor.fetchone()
+        return job
+    
+    def get_jobs(self, user_id, limit=20):
+        self.cursor.execute("""
+            SELECT id, job_type, status, progress, attempts, result, error, created_at, finished_at
+            FROM jobs
+            WHERE user_id = ?
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (user_id, limit))
+        jobs = self.cursor.fetchall()
+        return jobs
+    
+    # Trash methods
+    def get_trash(self, user_id):
+        # (kind, id, label, deleted_at) for everything the user has deleted, newest first
+        self.cursor.execute(f"""
+            SELECT 'clients', id, name, deleted_at FROM clients
+            WHERE user_id = ? AND deleted_at IS NOT NULL
+            UNION ALL
+            SELECT 'projects', id, name, deleted_at FROM projects
+            WHERE user_id = ? AND deleted_at IS NOT NULL
+            UNION ALL
+            SELECT 'invoices', i.id, 'Invoice #' || substr(i.id, 1, 8) || ' (' || p.name || ')', i.deleted_at
+            FROM invoices i JOIN projects p ON i.project_id = p.id
+            WHERE p.user_id = ? AND i.deleted_at IS NOT NULL
+            UNION ALL
+            SELECT 'payments', pa.id, 'Payment of ' || {self.backend.decimal_text('pa.amount_cents / 100.0')} || ' ' || i.currency || ' on ' || pa.payment_date, pa.deleted_at
+            FROM payments pa JOIN invoices i ON pa.invoice_id = i.id JOIN projects p ON i.project_id = p.id
+            WHERE p.user_id = ? AND pa.deleted_at IS NOT NULL
+            ORDER BY 4 DESC
+        """, (user_id,) * 4)
+        return self.cursor.fetchall()
+    
+    def restore_from_trash(self, user_id, items):
+        # items: (kind, id) pairs from get_trash; restored together in one transaction. Records
+        # that don't belong to user_id are left alone.
+        by_table = {}
+        for kind, item_id in items:
+            if kind not in self.TRASH_TABLES:
+                raise ValueError(f"Unknown trash kind: {kind}")
+            by_table.setdefault(kind, []).append(item_id)
+        try:
+            for table in list(by_table):
+                ids = [item_id for item_id, owner in self.owners(table, by_table[table]).items() if owner == user_id]
+                by_table[table] = ids
+                if not ids:
+                    continue
+                before = self.snapshot(table, ids)
+                self.cursor.executemany(
+                    f"UPDATE {table} SET deleted_at = NULL, version = version + 1 WHERE id = ? AND deleted_at IS NOT NULL",
+                    [(item_id,) for item_id in ids]
+                )
+                self.audit(table, before, self.snapshot(table, ids))
+                self.emit(table, ids, "restored")
+            
+            # Same data versions as the delete methods
+            self.bump_data_version(["clients"], user_ids=[user_id] if by_table.get("clients") else [])
+            self.bump_data_version(["projects", "invoices", "invoice_edits", "tasks"], project_ids=by_table.get("projects", []))
+            self.bump_data_version(["invoices", "invoice_edits"], invoice_ids=by_table.get("invoices", []))
+            invoice_ids = []
+            if by_table.get("payments"):
+                placeholders = ", ".join("?" for _ in by_table["payments"])
+                self.cursor.execute(f"SELECT DISTINCT invoice_id FROM payments WHERE id IN ({placeholders})", by_table["payments"])
+                invoice_ids = [row[0] for row in self.cursor.fetchall()]
+                self.bump_data_version(["payments", "payment_edits"], invoice_ids=invoice_ids)
+            for invoice_id in set(invoice_ids) | set(by_table.get("invoices", [])):
+                self.refresh_invoice_status(invoice_id, commit=False)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def purge_trash(self, retention_days, batch_size=500):
+        # Hard-deletes rows trashed more than retention_days ago, with everything that belongs
+        # to them, a batch per transaction so the write lock on the shared file is only ever
+        # held briefly. Returns the rows removed per table.
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+        purged = dict.fromkeys(self.TRASH_TABLES, 0)
+        for table in self.TRASH_TABLES:
+            while True:
+                self.cursor.execute(f"SELECT id FROM {table} WHERE deleted_at IS NOT NULL AND deleted_at < ? LIMIT ?", (cutoff, batch_size))
+                ids = [row[0] for row in self.cursor.fetchall()]
+                if not ids:
+                    break
+                try:
+                    for purged_table, count in self.purge_rows(table, ids).items():
+                        purged[purged_table] = purged.get(purged_table, 0) + count
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+                if len(ids) < batch_size:
+                    break
+        return purged
+    
+    # What goes with a purged record: (table, column referring to it). Tables with dependents of
+    # their own or in the change feed are purged row by row through purge_rows.
+    PURGE_DEPENDENTS = {
+        "clients": [("projects", "client_id")],
+        "projects": [("tasks", "project_id"), ("invoices", "project_id"), ("recurring_invoices", "project_id"),
+                     ("time_entries", "project_id"), ("time_daily", "project_id")],
+        "invoices": [("payments", "invoice_id"), ("invoice_items", "invoice_id"), ("invoice_documents", "invoice_id")],
+    }
+    
+    def purge_rows(self, table, ids):
+        # Hard-deletes the rows, live or trashed, in the caller's transaction: their dependents
+        # first, while the joins to their owner still resolve, so every record of the change
+        # feed leaves a tombstone. Returns {table: rows removed}.
+        purged = {}
+        placeholders = ", ".join("?" for _ in ids)
+        for child, column in self.PURGE_DEPENDENTS.get(table, []):
+            if child in self.PURGE_DEPENDENTS or child in self.CHANGE_FEED:
+                self.cursor.execute(f"SELECT id FROM {child} WHERE {column} IN ({placeholders})", ids)
+                child_ids = [row[0] for row in self.cursor.fetchall()]
+                if child_ids:
+                    for purged_table, count in self.purge_rows(child, child_ids).items():
+                        purged[purged_table] = purged.get(purged_table, 0) + count
+            else:
+                self.cursor.execute(f"DELETE FROM {child} WHERE {column} IN ({placeholders})", ids)
+        if table in self.CHANGE_FEED:
+            self.tombstone(table, ids)
+        self.cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+        purged[table] = purged.get(table, 0) + self.cursor.rowcount
+        return purged
+    
+    # API methods
+    # Where each resource's rows come from and the condition tying them to their user; rows
+    # under a trashed parent are hidden, as they are in the pages. (source, condition, parent column)
+    API_RESOURCES = {
+        "clients": ("clients r", "r.user_id = ? AND r.deleted_at IS NULL", None),
+        "projects": (
+            "projects r JOIN clients c ON c.id = r.client_id",
+            "r.user_id = ? AND r.deleted_at IS NULL AND c.deleted_at IS NULL",
+            "client_id"
+        ),
+        "tasks": (
+            "tasks r JOIN projects p ON p.id = r.project_id JOIN clients c ON c.id = p.client_id",
+            "p.user_id = ? AND p.deleted_at IS NULL AND c.deleted_at IS NULL",
+            "project_id"
+        ),
+        "invoices": (
+            "invoices r JOIN projects p ON p.id = r.project_id JOIN clients c ON c.id = p.client_id",
+            "p.user_id = ? AND r.deleted_at IS NULL AND p.deleted_at IS NULL AND c.deleted_at IS NULL",
+            "project_id"
+        ),
+        "payments": (
+            "payments r JOIN invoices i ON i.id = r.invoice_id JOIN projects p ON p.id = i.project_id JOIN clients c ON c.id = p.client_id",
+            "p.user_id = ? AND r.deleted_at IS NULL AND i.deleted_at IS NULL AND p.deleted_at IS NULL AND c.deleted_at IS NULL",
+            "invoice_id"
+        ),
+    }
+    
+    def get_records(self, resource, user_id, ids=None, parent_id=None, after_rowid=0, limit=None):
+        # The user's rows as dicts in insertion order; page with after_rowid (the last row's rowid)
+        source, condition, parent_column = self.API_RESOURCES[resource]
+        sql = f"SELECT r.rowid, r.* FROM {source} WHERE {condition} AND r.rowid > ?"
+        params = [user_id, after_rowid]
+        if ids is not None:
+            sql += f" AND r.id IN ({', '.join('?' for _ in ids)})"
+            params += ids
+        if parent_id is not None:
+            sql += f" AND r.{parent_column} = ?"
+            params.append(parent_id)
+        sql += " ORDER BY r.rowid"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        self.cursor.execute(sql, params)
+        columns = [column[0] for column in self.cursor.description]
+        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+    
+    def add_api_token(self, user_id, name):
+        # The token itself is only ever shown once, to the user who created it
+        token = "ff_" + secrets.token_urlsafe(32)
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.execute(
+            "INSERT INTO api_tokens (id, user_id, name, token_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+            (str(uuid.uuid4()), user_id, name, hashlib.sha256(token.encode()).hexdigest(), created_at)
+        )
+        self.conn.commit()
+        return token
+    
+    def get_api_tokens(self, user_id):
+        self.cursor.execute("SELECT id, name, created_at FROM api_tokens WHERE user_id = ? ORDER BY created_at", (user_id,))
+        return self.cursor.fetchall()
+    
+    def delete_api_token(self, user_id, token_id):
+        self.cursor.execute("DELETE FROM api_tokens WHERE id = ? AND user_id = ?", (token_id, user_id))
+        self.conn.commit()
+    
+    def get_api_token_user(self, token):
+        self.cursor.execute("SELECT user_id FROM api_tokens WHERE token_hash = ?", (hashlib.sha256(token.encode()).hexdigest(),))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+    
+    # Webhook methods
+    def add_webhook(self, user_id, url):
+        # New subscribers start at the latest event; earlier history is in the API. Returns (id, secret).
+        webhook_id = str(uuid.uuid4())
+        secret = secrets.token_hex(32)
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cursor.execute(
+            f"INSERT INTO webhooks (id, user_id, url, secret, last_event_id, created_at) VALUES (?, ?, ?, ?, COALESCE({self.backend.last_id('events')}, 0), ?)",
+            (webhook_id, user_id, url, secret, created_at)
+        )
+        self.conn.commit()
+        return webhook_id, secret
+    
+    def get_webhooks(self, user_id):
+        # (id, url, created_at, last_delivered_at, failures, last_error, next_attempt_at, disabled_at, pending events)
+        self.cursor.execute("""
+            SELECT w.id, w.url, w.created_at, w.last_delivered_at, w.failures, w.last_error, w.next_attempt_at, w.disabled_at,
+                   (SELECT COUNT(*) FROM events e WHERE e.user_id = w.user_id AND e.id > w.last_event_id)
+            FROM webhooks w
+            WHERE w.user_id = ?
+            ORDER BY w.created_at
+        """, (user_id,))
+        return self.cursor.fetchall()
+    
+    def delete_webhook(self, user_id, webhook_id):
+        self.cursor.execute("DELETE FROM webhooks WHERE id = ? AND user_id = ?", (webhook_id, user_id))
+        self.conn.commit()
+        self.prune_events()
+    
+    def get_due_webhooks(self, now):
+        # (id, user_id, url, secret, last_event_id, failures) of subscribers not waiting out a retry or disabled
+        self.cursor.execute("""
+            SELECT id, user_id, url, secret, last_event_id, failures FROM webhooks
+            WHERE disabled_at IS NULL AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+            ORDER BY next_attempt_at, created_at
+        """, (now,))
+        return self.cursor.fetchall()
+    
+    def get_events(self, user_id, after_id, limit, created_before=None):
+        # The user's next events after the cursor, oldest first: (id, entity, entity_id, action, data, created_at)
+        sql = "SELECT id, entity, entity_id, action, data, created_at FROM events WHERE user_id = ? AND id > ?"
+        params = [user_id, after_id]
+        if created_before:
+            sql += " AND created_at < ?"
+            params.append(created_before)
+        self.cursor.execute(sql + " ORDER BY id LIMIT ?", (*params, limit))
+        return self.cursor.fetchall()
+    
+    def advance_webhook(self, webhook_id, last_event_id, delivered_at):
+        # The cursor only moves forward, and only after the subscriber acknowledged the batch
+        self.cursor.execute("""
+            UPDATE webhooks SET last_event_id = ?, last_delivered_at = ?, failures = 0, next_attempt_at = NULL, last_error = NULL
+            WHERE id = ? AND last_event_id < ?
+        """, (last_event_id, delivered_at, webhook_id, last_event_id))
+        self.conn.commit()
+    
+    def fail_webhook(self, webhook_id, error, next_attempt_at, disabled_at=None):
+        # With disabled_at the subscriber stops being tried; its undelivered events stay for resume_webhook
+        self.cursor.execute(
+            "UPDATE webhooks SET failures = failures + 1, last_error = ?, next_attempt_at = ?, disabled_at = ? WHERE id = ?",
+            (error[:500], next_attempt_at, disabled_at, webhook_id)
+        )
+        self.conn.commit()
+    
+    def resume_webhook(self, user_id, webhook_id):
+        # Delivery picks up at the cursor, with the events held since the webhook was disabled
+        self.cursor.execute(
+            "UPDATE webhooks SET failures = 0, next_attempt_at = NULL, disabled_at = NULL WHERE id = ? AND user_id = ?",
+            (webhook_id, user_id)
+        )
+        self.conn.commit()
+    
+    def prune_events(self):
+        # Events every subscriber of their user has received; all of them once a user has none left.
+        # A disabled subscriber's cursor holds back the events it missed until it is resumed or removed.
+        self.cursor.execute("""
+            DELETE FROM events
+            WHERE id <= COALESCE((SELECT MIN(w.last_event_id) FROM webhooks w WHERE w.user_id = events.user_id), id)
+        """)
+        pruned = self.cursor.rowcount
+        self.conn.commit()
+        return pruned
+    
+    # Dashboard methods
+    def get_dashboard_data(self, user_id):
+        # One snapshot for the whole dashboard, so the figures agree with each other
+        with self.reading("dashboard") as cursor:
+            # Total clients
+            cursor.execute("SELECT COUNT(*) FROM clients WHERE user_id = ? AND deleted_at IS NULL", (user_id,))
+            total_clients = cursor.fetchone()[0]
+            
+            # Total projects
+            cursor.execute("SELECT COUNT(*) FROM projects WHERE user_id = ? AND deleted_at IS NULL", (user_id,))
+            total_projects = cursor.fetchone()[0]
+            
+            # Total invoices
+            cursor.execute("""
+                SELECT COUNT(*) 
+                FROM invoices i
+                JOIN projects p ON i.project_id = p.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL
+            """, (user_id,))
+            total_invoices = cursor.fetchone()[0]
+            
+            # Revenue per currency and day, converted to the base currency by the caller
+            cursor.execute("""
+                SELECT i.currency, pa.payment_date, SUM(pa.amount_cents)
+                FROM payments pa
+                JOIN invoices i ON pa.invoice_id = i.id
+                JOIN projects p ON i.project_id = p.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL AND pa.deleted_at IS NULL
+                GROUP BY i.currency, pa.payment_date
+            """, (user_id,))
+            revenue_by_day = cursor.fetchall()
+            
+            # Pending invoices
+            cursor.execute("""
+                SELECT COUNT(*) 
+                FROM invoices i
+                JOIN projects p ON i.project_id = p.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL AND i.status != 'Paid'
+            """, (user_id,))
+            pending_invoices = cursor.fetchone()[0]
+            
+            # Outstanding balance of every unpaid invoice, in its own currency
+            receivables = self.get_receivables(user_id)
+            
+            # Overdue invoices
+            cursor.execute("""
+                SELECT COUNT(*)
+                FROM invoices i
+                JOIN projects p ON i.project_id = p.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL AND i.status = 'Overdue'
+            """, (user_id,))
+            overdue_invoices = cursor.fetchone()[0]
+            
+            # Projects by status
+            cursor.execute("""
+                SELECT status, COUNT(*) 
+                FROM projects 
+                WHERE user_id = ? AND deleted_at IS NULL
+                GROUP BY status
+            """, (user_id,))
+            projects_by_status = cursor.fetchall()
+            
+            # Recent projects
+            cursor.execute(f"""
+                SELECT {self.PROJECT_COLUMNS}, c.name as client_name, p.currency
+                FROM projects p
+                JOIN clients c ON p.client_id = c.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND c.deleted_at IS NULL
+                ORDER BY p.created_at DESC
+                LIMIT 5
+            """, (user_id,))
+            recent_projects = cursor.fetchall()
+            
+            # Recent invoices
+            cursor.execute(f"""
+                SELECT {self.INVOICE_COLUMNS}, p.name as project_name, c.name as client_name, i.currency
+                FROM invoices i
+                JOIN projects p ON i.project_id = p.id
+                JOIN clients c ON p.client_id = c.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND c.deleted_at IS NULL AND i.deleted_at IS NULL
+                ORDER BY i.created_at DESC
+                LIMIT 5
+            """, (user_id,))
+            recent_invoices = cursor.fetchall()
+            
+            return {
+                "total_clients": total_clients,
+                "total_projects": total_projects,
+                "total_invoices": total_invoices,
+                "revenue_by_day": revenue_by_day,
+                "pending_invoices": pending_invoices,
+                "receivables": receivables,
+                "overdue_invoices": overdue_invoices,
+                "projects_by_status": projects_by_status,
+                "recent_projects": recent_projects,
+                "recent_invoices": recent_invoices
+            }
+    
+    def get_receivables(self, user_id, kind="dashboard"):
+        # (invoice_id, currency, due_date, outstanding_cents, client_id) for every invoice not yet paid
+        with self.reading(kind) as cursor:
+            cursor.execute("""
+                SELECT i.id, i.currency, i.due_date, i.amount_cents - COALESCE(pa.paid_cents, 0), p.client_id
+                FROM invoices i
+                JOIN projects p ON i.project_id = p.id
+                LEFT JOIN (
+                    SELECT invoice_id, SUM(amount_cents) as paid_cents FROM payments WHERE deleted_at IS NULL GROUP BY invoice_id
+                ) pa ON pa.invoice_id = i.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL AND i.status != 'Paid'
+            """, (user_id,))
+            return cursor.fetchall()
+    
+    def get_client_stats(self, user_id):
+        # One row per client and invoice currency:
+        # (client_id, name, company, currency, projects, tracked_seconds, billed_cents, paid_cents,
+        #  outstanding_cents, paid_invoices, days_to_pay_total)
+        with self.reading("client_analytics") as cursor:
+            cursor.execute(f"""
+                WITH paid AS (
+                    SELECT invoice_id, SUM(amount_cents) as paid_cents, MAX(payment_date) as last_payment
+                    FROM payments
+                    WHERE deleted_at IS NULL
+                    GROUP BY invoice_id
+                ),
+                client_invoices AS (
+                    SELECT p.client_id, i.currency, i.amount_cents, i.issue_date, i.status,
+                           COALESCE(paid.paid_cents, 0) as paid_cents, paid.last_payment
+                    FROM invoices i
+                    JOIN projects p ON i.project_id = p.id
+                    LEFT JOIN paid ON paid.invoice_id = i.id
+                    WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL
+                ),
+                client_projects AS (
+                    SELECT client_id, COUNT(*) as projects FROM projects WHERE user_id = ? AND deleted_at IS NULL GROUP BY client_id
+                ),
+                client_time AS (
+                    SELECT p.client_id, SUM(d.seconds) as seconds
+                    FROM time_daily d
+                    JOIN projects p ON d.project_id = p.id
+                    WHERE d.user_id = ? AND p.deleted_at IS NULL
+                    GROUP BY p.client_id
+                )
+                SELECT c.id, c.name, c.company, COALESCE(ci.currency, c.currency),
+                       COALESCE(cp.projects, 0), COALESCE(ct.seconds, 0),
+                       COALESCE(SUM(ci.amount_cents), 0),
+                       COALESCE(SUM(ci.paid_cents), 0),
+                       COALESCE(SUM(ci.amount_cents - ci.paid_cents) FILTER (WHERE ci.status != 'Paid'), 0),
+                       COUNT(*) FILTER (WHERE ci.status = 'Paid'),
+                       COALESCE(SUM({self.backend.days_between('ci.last_payment', 'ci.issue_date')}) FILTER (WHERE ci.status = 'Paid'), 0)
+                FROM clients c
+                LEFT JOIN client_invoices ci ON ci.client_id = c.id
+                LEFT JOIN client_projects cp ON cp.client_id = c.id
+                LEFT JOIN client_time ct ON ct.client_id = c.id
+                WHERE c.user_id = ? AND c.deleted_at IS NULL
+                GROUP BY c.id, ci.currency, cp.projects, ct.seconds
+            """, (user_id, user_id, user_id, user_id))
+            return cursor.fetchall()
+    
+    def get_payment_history(self, user_id, after_rowid=0):
+        # (rowid, currency, payment_date, amount_cents, client_id, days_after_due) in insertion order,
+        # so callers can fold in only the payments recorded since their last read
+        with self.reading("cash_flow") as cursor:
+            cursor.execute(f"""
+                SELECT pa.rowid, i.currency, pa.payment_date, pa.amount_cents, p.client_id,
+                       {self.backend.days_between('pa.payment_date', 'i.due_date')}
+                FROM payments pa
+                JOIN invoices i ON pa.invoice_id = i.id
+                JOIN projects p ON i.project_id = p.id
+                WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL AND pa.deleted_at IS NULL AND pa.rowid > ?
+                ORDER BY pa.rowid
+            """, (user_id, after_rowid))
+            return cursor.fetchall()
+    
+    # Exchange rate methods
+    def save_fx_rates(self, base_currency, rates):
+        # rates: (day, currency, rate) with rate in units of currency per one base_currency.
+        # Rates quoted against a different base can't be mixed, so switching base replaces the table.
+        if self.get_meta("fx_base", base_currency) != base_currency:
+            self.cursor.execute("DELETE FROM fx_rates")
+        days = {day for day, currency, rate in rates}
+        self.cursor.executemany(
+            "INSERT INTO fx_rates (currency, day, rate) VALUES (?, ?, ?) ON CONFLICT(currency, day) DO UPDATE SET rate = excluded.rate",
+            [(currency, day, rate) for day, currency, rate in rates] + [(base_currency, day, 1.0) for day in days]
+        )
+        self.set_meta("fx_base", base_currency, commit=False)
+        self.set_meta("fx_version", str(int(self.get_meta("fx_version", "0")) + 1), commit=False)
+        self.conn.commit()
+        return len(rates)
+    
+    def get_fx_rates(self):
+        self.cursor.execute("SELECT currency, day, rate FROM fx_rates ORDER BY day")
+        return self.cursor.fetchall()
+    
+    def get_fx_summary(self):
+        self.cursor.execute("SELECT COUNT(DISTINCT currency), MIN(day), MAX(day) FROM fx_rates")
+        return self.cursor.fetchone()
+
+
+# Tenant routing
+class Tenants:
+    # Finds the database holding a user's records. With SHARDS set (SQLite only) the DATABASE_URL
+    # file is the catalog of logins and routes, and each user lives in a shard file (sharding.py);
+    # otherwise everything is in the catalog itself.
+    # Routes never change once assigned, so they are cached for the life of the process
+    _routes = {}
+    
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.sharded = sharding.enabled(catalog.db_name)
+        self.routes = self._routes.setdefault(catalog.db_name, {})
+    
+    def shard(self, user_id):
+        if user_id not in self.routes:
+            self.routes[user_id] = self.catalog.get_tenant_shard(user_id) or self.attach(user_id)
+        return self.routes[user_id]
+    
+    def attach(self, user_id):
+        # New tenants go to their hash bucket, with a copy of their users row for the shard's joins
+        shard = sharding.shard_path(sharding.bucket(user_id, storage.shard_count()))
+        os.makedirs(os.path.dirname(shard), exist_ok=True)
+        shard_db = Database(shard)
+        try:
+            shard_db.import_rows("users", self.catalog.snapshot("users", [user_id]).values())
+        finally:
+            shard_db.close()
+        return self.catalog.add_tenant(user_id, shard)
+    
+    def database(self, user_id):
+        if not self.sharded or not user_id:
+            return self.catalog
+        return Database(self.shard(user_id))
+    
+    def add_user(self, username, password, email, full_name):
+        # Usernames and emails are unique across all tenants, so accounts are created in the catalog
+        user_id = self.catalog.add_user(username, password, email, full_name)
+        if user_id and self.sharded:
+            self.shard(user_id)
+        return user_id
+    
+    def verify_user(self, username, password):
+        user = self.catalog.verify_user(username, password)
+        if user and self.sharded:
+            # Subscription and currency settings are kept up to date in the shard
+            shard_db = self.database(user["id"])
+            try:
+                user = shard_db.verify_user(username, password)
+            finally:
+                shard_db.close()
+        return user
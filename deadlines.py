@@ -0,0 +1,98 @@
+# Deadline calendar: task due dates, project end dates and invoice due dates as an HTML month grid
+# and as an iCalendar feed. Kept free of Streamlit so the calendar page and the tests use it
+# without loading the UI.
+import calendar
+import datetime
+
+
+# Tasks, project end dates and invoice due dates on one calendar
+class DeadlineCalendar:
+    SCOPES = ("tasks", "projects", "invoices", "payments")
+    KINDS = {
+        'task': ("Task due", "#4F8BF9"),
+        'project': ("Project ends", "#1cc88a"),
+        'invoice': ("Invoice due", "#e74a3b")
+    }
+
+    # Rendered month grids, reused until one of the scopes above changes or the overdue sweep runs
+    _cache = {}
+
+    def __init__(self, db):
+        self.db = db
+
+    def events(self, user_id, start_date, end_date):
+        return self.db.get_calendar(user_id, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+
+    # Monday-first weeks covering the month, including the days around it
+    @staticmethod
+    def month_weeks(year, month):
+        return calendar.Calendar().monthdatescalendar(year, month)
+
+    def month_grid(self, user_id, year, month):
+        versions = self.db.get_data_versions(user_id)
+        stamp = (tuple(versions.get(scope, 0) for scope in self.SCOPES), self.db.get_meta("last_overdue_sweep"))
+        key = (self.db.db_name, user_id, year, month)
+        cached = self._cache.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+        weeks = self.month_weeks(year, month)
+        by_day = {}
+        for event in self.events(user_id, weeks[0][0], weeks[-1][-1]):
+            by_day.setdefault(event[3], []).append(event)
+
+        rows = []
+        for week in weeks:
+            cells = []
+            for day in week:
+                events = "".join(
+                    f'<span class="event" style="background-color: {self.KINDS[kind][1]};" title="{self.KINDS[kind][0]}: {title} ({context or ""})">{title}</span>'
+                    for kind, _, title, _, context, _ in by_day.get(day.strftime("%Y-%m-%d"), [])
+                )
+                css = "" if day.month == month else ' class="other-month"'
+                cells.append(f"<td{css}><strong>{day.day}</strong>{events}</td>")
+            rows.append(f"<tr>{''.join(cells)}</tr>")
+        header = "".join(f"<th>{name}</th>" for name in calendar.day_abbr)
+        grid = f'<table class="calendar"><tr>{header}</tr>{"".join(rows)}</table>'
+
+        self._cache[key] = (stamp, grid)
+        return grid
+
+    # iCalendar export: one all-day event per row of get_calendar
+    def to_ics(self, events):
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//FreelanceFlow//Calendar//EN", "CALSCALE:GREGORIAN"]
+        for kind, event_id, title, day, context, status in events:
+            start = datetime.datetime.strptime(day, "%Y-%m-%d").date()
+            summary = self.ics_text(f"{self.KINDS[kind][0]}: {title}")
+            description = self.ics_text(f"{context or ''} ({status})")
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:{kind}-{event_id}@freelanceflow",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}",
+                f"DTEND;VALUE=DATE:{(start + datetime.timedelta(days=1)).strftime('%Y%m%d')}",
+                f"SUMMARY:{summary}",
+                f"DESCRIPTION:{description}",
+                "END:VEVENT"
+            ]
+        lines.append("END:VCALENDAR")
+        return "".join(self.ics_fold(line) + "\r\n" for line in lines).encode("utf-8")
+
+    @staticmethod
+    def ics_text(value):
+        return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+    # Lines longer than 75 octets continue on the next line after a space
+    @staticmethod
+    def ics_fold(line):
+        parts, current, size = [], "", 0
+        for char in line:
+            width = len(char.encode("utf-8"))
+            if size + width > 75:
+                parts.append(current)
+                current, size = " ", 1
+            current += char
+            size += width
+        parts.append(current)
+        return "\r\n".join(parts)
@@ -0,0 +1,119 @@
+# Cash flow forecast: actual inflows per month, and open invoices spread over the months each
+# client's past payment delays suggest. Kept free of Streamlit so the dashboard and the tests use
+# it without loading the UI.
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+
+from database import round_half_up
+from fx import CurrencyConverter
+
+
+# Actual vs expected inflows, with open invoices spread over each client's payment habits
+class CashFlowForecast:
+    DELAY_QUANTILES = np.linspace(0.05, 0.95, 10)
+    TREND_WINDOWS = (3, 6, 12)
+
+    # Per-user payment history, kept between reruns and topped up as payments arrive
+    _cache = {}
+
+    def __init__(self, db, converter=None):
+        self.db = db
+        self.converter = converter or CurrencyConverter(db)
+
+    def history(self, user_id):
+        # Paid cents per (currency, day) and amount-weighted payment delays per client.
+        # New payments are folded in by rowid; edits or deletes anywhere force a rebuild.
+        with self._cache.setdefault("lock", threading.Lock()):
+            versions = self.db.get_data_versions(user_id, "cash_flow")
+            edits = (versions.get("payment_edits", 0), versions.get("invoice_edits", 0))
+            key = (self.db.db_name, user_id)
+            state = self._cache.get(key)
+            if state is None or state["edits"] != edits:
+                state = {"edits": edits, "payments": None, "last_rowid": 0, "revenue": {}, "delays": {}}
+
+            if state["payments"] != versions.get("payments", 0):
+                for rowid, currency, day, amount_cents, client_id, days_after_due in self.db.get_payment_history(user_id, state["last_rowid"]):
+                    state["revenue"][(currency, day)] = state["revenue"].get((currency, day), 0) + amount_cents
+                    delays, weights = state["delays"].setdefault(client_id, ([], []))
+                    delays.append(days_after_due or 0)
+                    weights.append(amount_cents)
+                    state["last_rowid"] = rowid
+                state["payments"] = versions.get("payments", 0)
+
+            self._cache[key] = state
+            return state
+
+    @classmethod
+    def delay_profile(cls, delays, weights):
+        # Weighted quantiles of days paid after the due date
+        delays = np.asarray(delays, dtype=float)
+        weights = np.asarray(weights, dtype=float)
+        if not weights.sum():
+            weights = np.ones_like(delays)
+        order = np.argsort(delays)
+        delays, weights = delays[order], weights[order]
+        positions = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return np.interp(cls.DELAY_QUANTILES, positions, delays)
+
+    def report(self, user_id, base_currency, today=None, months_back=12, horizon=6):
+        today = pd.Timestamp(today or datetime.datetime.now().date())
+        current = today.to_period('M')
+        state = self.history(user_id)
+
+        # Actual inflows per month, converted at each payment's date
+        revenue = pd.DataFrame([(currency, day, cents) for (currency, day), cents in state["revenue"].items()],
+                               columns=['currency', 'day', 'amount_cents'])
+        revenue['converted'] = self.converter.convert(revenue, base_currency)
+        actual = revenue.groupby(pd.to_datetime(revenue['day']).dt.to_period('M'))['converted'].sum()
+
+        # Expected inflows: each open balance is split over its client's delay quantiles
+        # (or everyone's when the client has no history), never earlier than today
+        receivables = pd.DataFrame(self.db.get_receivables(user_id, "cash_flow"),
+                                   columns=['invoice_id', 'currency', 'due_date', 'amount_cents', 'client_id'])
+        receivables = receivables[receivables['amount_cents'] > 0].reset_index(drop=True)
+        receivables['day'] = today
+        receivables['converted'] = self.converter.convert(receivables, base_currency)
+
+        profiles = {client_id: self.delay_profile(*delays) for client_id, delays in state["delays"].items()}
+        if state["delays"]:
+            everyone = [np.concatenate(values) for values in zip(*state["delays"].values())]
+            fallback = self.delay_profile(*everyone)
+        else:
+            fallback = np.zeros(len(self.DELAY_QUANTILES))
+        offsets = np.array([profiles.get(client_id, fallback) for client_id in receivables['client_id']]).reshape(-1, len(self.DELAY_QUANTILES))
+
+        due = pd.to_datetime(receivables['due_date'], errors='coerce').fillna(today).to_numpy(dtype='datetime64[D]')
+        expected = np.maximum(due[:, None] + np.rint(offsets).astype('timedelta64[D]'), today.to_datetime64().astype('datetime64[D]'))
+        shares = np.repeat(receivables['converted'].fillna(0).to_numpy() / len(self.DELAY_QUANTILES), len(self.DELAY_QUANTILES))
+        projected = pd.Series(shares).groupby(pd.PeriodIndex(expected.ravel(), freq='M')).sum()
+
+        months = pd.period_range(current - (months_back - 1), current + horizon, freq='M')
+        monthly = pd.DataFrame({
+            'actual': round_half_up(actual.reindex(months).fillna(0).where(months <= current, 0).to_numpy()),
+            'projected': round_half_up(projected.reindex(months).fillna(0).to_numpy())
+        }, index=months.strftime('%Y-%m'))
+
+        # Rolling averages and linear trend over complete months
+        trends = {}
+        if not actual.empty:
+            history = actual.reindex(pd.period_range(min(actual.index.min(), current - 1), current - 1, freq='M')).fillna(0).to_numpy()
+            for window in self.TREND_WINDOWS:
+                if len(history) >= window:
+                    recent = history[-window:]
+                    trends[window] = {
+                        "average_cents": int(round_half_up(recent.mean())),
+                        "slope_cents": int(round_half_up(np.polyfit(np.arange(window), recent, 1)[0])),
+                        "rolling": np.convolve(history, np.ones(window) / window, mode='valid')
+                    }
+
+        missing = set(revenue.loc[revenue['converted'].isna(), 'currency']) | set(receivables.loc[receivables['converted'].isna(), 'currency'])
+        return {
+            "monthly": monthly,
+            "trends": trends,
+            "expected_cents": int(round_half_up(projected.sum())),
+            "beyond_horizon_cents": int(round_half_up(projected[projected.index > months[-1]].sum())),
+            "missing_currencies": sorted(missing)
+        }
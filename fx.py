@@ -0,0 +1,116 @@
+# Currency conversion with the fx_rates table: amounts valued at the rate of their day, revenue
+# and receivables aging in one currency. Kept free of Streamlit so the reports and the tests use
+# it without loading the UI.
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from database import round_half_up
+
+
+# Converts amounts between currencies with the fx_rates table
+class CurrencyConverter:
+    RATES_FILE = "fx_rates.csv"
+    AGING_BUCKETS = ["Current", "1-30 days", "31-60 days", "61-90 days", "90+ days"]
+
+    # Rates are read once per process and reloaded only when fx_version changes
+    _cache = {}
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def read_rates_file(source):
+        # CSV with date, base, currency, rate columns; returns (base_currency, [(day, currency, rate)])
+        frame = pd.read_csv(source, dtype={"base": str, "currency": str})
+        missing = {"date", "base", "currency", "rate"} - set(frame.columns)
+        if missing:
+            raise ValueError(f"Missing column(s): {', '.join(sorted(missing))}")
+        bases = frame["base"].str.upper().unique()
+        if len(bases) != 1:
+            raise ValueError("All rates must be quoted against the same base currency")
+        days = pd.to_datetime(frame["date"]).dt.strftime("%Y-%m-%d")
+        rates = list(zip(days, frame["currency"].str.upper(), frame["rate"].astype(float)))
+        return bases[0], rates
+
+    def sync_rates_file(self):
+        # Picks up a dropped-in rates file once per modification
+        if not os.path.exists(self.RATES_FILE):
+            return
+        modified = str(os.path.getmtime(self.RATES_FILE))
+        if self.db.get_meta("fx_file_mtime") != modified:
+            self.db.save_fx_rates(*self.read_rates_file(self.RATES_FILE))
+            self.db.set_meta("fx_file_mtime", modified)
+
+    def rates(self):
+        self.sync_rates_file()
+        version = self.db.get_meta("fx_version", "0")
+        cached = self._cache.get(self.db.db_name)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        rates = pd.DataFrame(self.db.get_fx_rates(), columns=['currency', 'day', 'rate'])
+        rates['day'] = pd.to_datetime(rates['day']).astype('datetime64[ns]')
+        rates = rates.sort_values('day', kind='stable').reset_index(drop=True)
+        self._cache[self.db.db_name] = (version, rates)
+        return rates
+
+    def _lookup(self, rows, rates):
+        # Latest rate on or before each day, falling back to the first later one
+        if rates.empty:
+            return np.full(len(rows), np.nan)
+        rate = pd.merge_asof(rows, rates, on='day', by='currency', direction='backward')['rate']
+        if rate.isna().any():
+            later = pd.merge_asof(rows, rates, on='day', by='currency', direction='forward')['rate']
+            rate = rate.fillna(later)
+        return rate.to_numpy()
+
+    def convert(self, frame, to_currency, amount_column="amount_cents", currency_column="currency", date_column="day"):
+        # Whole column at once; rows without a usable rate come back as NaN
+        if frame.empty:
+            return pd.Series(np.nan, index=frame.index, dtype=float)
+
+        today = pd.Timestamp(datetime.datetime.now().date())
+        rows = pd.DataFrame({
+            'row': np.arange(len(frame)),
+            'currency': frame[currency_column].fillna("USD").to_numpy(),
+            'day': pd.to_datetime(frame[date_column].to_numpy(), errors='coerce').fillna(today).astype('datetime64[ns]')
+        }).sort_values('day', kind='stable')
+        rates = self.rates()
+        from_rate = self._lookup(rows, rates)
+        to_rate = self._lookup(rows.assign(currency=to_currency), rates)
+
+        amounts = frame[amount_column].to_numpy(dtype=float)[rows['row'].to_numpy()]
+        converted = np.where(rows['currency'].to_numpy() == to_currency, amounts, amounts * to_rate / from_rate)
+        result = np.empty(len(frame))
+        result[rows['row'].to_numpy()] = converted
+        return pd.Series(result, index=frame.index)
+
+    def revenue(self, rows, to_currency):
+        # rows: (currency, day, amount_cents)
+        frame = pd.DataFrame(rows, columns=['currency', 'day', 'amount_cents'])
+        frame['converted'] = self.convert(frame, to_currency)
+        return {
+            "total_cents": int(round_half_up(frame['converted'].sum())),
+            "missing_currencies": sorted(frame.loc[frame['converted'].isna(), 'currency'].unique())
+        }
+
+    def aging(self, rows, to_currency, today=None):
+        # rows: (invoice_id, currency, due_date, outstanding_cents, client_id), valued at today's rates
+        today = pd.Timestamp(today or datetime.datetime.now().date())
+        frame = pd.DataFrame(rows, columns=['invoice_id', 'currency', 'due_date', 'amount_cents', 'client_id'])
+        frame['day'] = today
+        frame['converted'] = self.convert(frame, to_currency)
+        days_overdue = (today - pd.to_datetime(frame['due_date'], errors='coerce')).dt.days.fillna(0)
+        frame['bucket'] = pd.cut(days_overdue, bins=[-np.inf, 0, 30, 60, 90, np.inf], labels=self.AGING_BUCKETS)
+
+        buckets = frame.groupby('bucket', observed=False).agg(invoices=('invoice_id', 'count'), amount=('converted', 'sum'))
+        buckets['amount'] = round_half_up(buckets['amount'].to_numpy())
+        return {
+            "buckets": buckets,
+            "total_cents": int(buckets['amount'].sum()),
+            "overdue_cents": int(buckets['amount'].iloc[1:].sum()),
+            "missing_currencies": sorted(frame.loc[frame['converted'].isna(), 'currency'].unique())
+        }
@@ -0,0 +1,397 @@
+# Background jobs: the worker pool that runs queued jobs from every database file, and the job
+# handlers. Kept free of Streamlit so the app, the tests and scripts share one queue implementation.
+import csv
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+import backup
+import maintenance
+import sharding
+import storage
+import webhooks
+from billing import InvoiceBuilder, RecurringInvoiceScheduler
+from database import Database
+from rendering import InvoiceRenderer
+from reminders import ReminderEngine, SmtpOutbox
+
+
+# Payment class (simulated)
+class Payment:
+    def __init__(self):
+        pass
+
+    def process_payment(self, amount, card_number, expiry, cvv):
+        # Simulate payment processing
+        # In a real app, this would integrate with Stripe, PayPal, etc.
+        if len(card_number) == 16 and len(expiry) == 5 and len(cvv) == 3:
+            return {
+                "success": True,
+                "transaction_id": str(uuid.uuid4()),
+                "amount": amount,
+                "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+        return {
+            "success": False,
+            "error": "Invalid payment details"
+        }
+
+    def upgrade_subscription(self, user_id, plan_type, payment_details):
+        # Simulate subscription upgrade
+        # In a real app, this would create a subscription in Stripe, etc.
+        result = self.process_payment(
+            99.99 if plan_type == "annual" else 9.99,
+            payment_details["card_number"],
+            payment_details["expiry"],
+            payment_details["cvv"]
+        )
+
+        if result["success"]:
+            # Calculate subscription end date
+            if plan_type == "annual":
+                end_date = (datetime.datetime.now() + datetime.timedelta(days=365)).strftime("%Y-%m-%d")
+            else:
+                end_date = (datetime.datetime.now() + datetime.timedelta(days=30)).strftime("%Y-%m-%d")
+
+            return {
+                "success": True,
+                "subscription_type": "premium",
+                "subscription_end_date": end_date,
+                "transaction_id": result["transaction_id"]
+            }
+
+        return {
+            "success": False,
+            "error": result["error"]
+        }
+
+
+payment = Payment()
+
+
+# Background job queue
+class JobQueue:
+    def __init__(self, db_name=None, workers=4, poll_interval=1.0, shards=None):
+        self.db_name = db_name
+        # With tenant sharding each shard file has its own jobs table; shards() lists them
+        self.shards = shards or (lambda: [])
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.handlers = {}
+        self.running = {}
+        # Card details and other secrets are kept in memory only, never in the jobs table
+        self.transient = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.threads = []
+        self.periodic = {}
+
+    def register(self, job_type, handler, concurrency=1):
+        self.handlers[job_type] = (handler, concurrency)
+        self.running.setdefault(job_type, 0)
+
+    def schedule(self, job_type, interval_seconds):
+        # System jobs enqueued every interval_seconds, at most one pending at a time
+        self.periodic[job_type] = {"interval": interval_seconds, "last_enqueued": 0}
+
+    def submit(self, db, user_id, job_type, payload=None, priority=0, max_attempts=3, transient=None):
+        job_id = db.enqueue_job(user_id, job_type, payload, priority, max_attempts)
+        if transient:
+            self.transient[job_id] = transient
+        self.wakeup.set()
+        return job_id
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        if self.periodic:
+            thread = threading.Thread(target=self._scheduler, name="job-scheduler", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def databases(self):
+        return [self.db_name] + self.shards()
+
+    def _scheduler(self):
+        while not self.stopped.is_set():
+            now = time.time()
+            for job_type, schedule in self.periodic.items():
+                if now - schedule["last_enqueued"] >= schedule["interval"]:
+                    # System jobs run in every database file, the catalog and each shard
+                    for db_name in self.databases():
+                        db = Database(db_name)
+                        if not db.has_pending_job(job_type):
+                            db.enqueue_job(None, job_type, {})
+                            self.wakeup.set()
+                        db.close()
+                    schedule["last_enqueued"] = now
+            self.stopped.wait(self.poll_interval)
+
+    def _claim(self, db):
+        # Only ask for job types that are below their concurrency limit
+        with self.lock:
+            available = [job_type for job_type, (handler, concurrency) in self.handlers.items()
+                         if self.running[job_type] < concurrency]
+            job = db.claim_job(available)
+            if job:
+                self.running[job["job_type"]] += 1
+        return job
+
+    def _worker(self):
+        turn = 0
+        while not self.stopped.is_set():
+            # Files take turns being polled first, so one busy shard can't starve the rest
+            db_names = self.databases()
+            turn = (turn + 1) % len(db_names)
+            job = None
+            for db_name in db_names[turn:] + db_names[:turn]:
+                db = Database(db_name)
+                job = self._claim(db)
+                if job:
+                    break
+                db.close()
+            if not job:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+            try:
+                self._run(db, job)
+            finally:
+                with self.lock:
+                    self.running[job["job_type"]] -= 1
+                db.close()
+
+    def _run(self, db, job):
+        handler = self.handlers[job["job_type"]][0]
+        payload = dict(job["payload"])
+        payload.update(self.transient.get(job["id"], {}))
+
+        def progress(fraction):
+            db.update_job_progress(job["id"], min(max(fraction, 0.0), 1.0))
+
+        try:
+            result = handler(db, job["user_id"], payload, progress)
+        except Exception as e:
+            if job["attempts"] < job["max_attempts"]:
+                # Exponential backoff between retries
+                db.fail_job(job["id"], str(e), retry_delay_seconds=2 ** job["attempts"])
+            else:
+                db.fail_job(job["id"], str(e))
+                self.transient.pop(job["id"], None)
+            return
+        db.complete_job(job["id"], result)
+        self.transient.pop(job["id"], None)
+
+
+# Job handlers
+def upgrade_subscription_job(db, user_id, payload, progress):
+    if "card_number" not in payload:
+        raise ValueError("Payment details expired, please submit the payment again")
+    progress(0.1)
+    result = payment.upgrade_subscription(user_id, payload["plan_type"], payload)
+    if not result["success"]:
+        raise ValueError(result["error"])
+    progress(0.8)
+    db.update_user_subscription(user_id, result["subscription_type"], result["subscription_end_date"])
+    return {
+        "subscription_type": result["subscription_type"],
+        "subscription_end_date": result["subscription_end_date"],
+        "transaction_id": result["transaction_id"]
+    }
+
+
+def export_invoices_job(db, user_id, payload, progress):
+    joins = """
+        FROM invoices i
+        JOIN projects p ON i.project_id = p.id
+        JOIN clients c ON p.client_id = c.id
+        WHERE p.user_id = ? AND p.deleted_at IS NULL AND c.deleted_at IS NULL AND i.deleted_at IS NULL
+    """
+    # Its own read-only snapshot: the export may run for a while and must not hold up writers or other reports
+    reader = db.backend.connect_reader()
+    try:
+        db.backend.begin_snapshot(reader)
+        cursor = db.backend.cursor(reader)
+        cursor.execute(f"SELECT COUNT(*) {joins}", (user_id,))
+        total = cursor.fetchone()[0]
+
+        os.makedirs("exports", exist_ok=True)
+        path = os.path.join("exports", f"invoices_{user_id[:8]}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.csv")
+        rows = 0
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Invoice ID", "Project", "Client", "Amount", "Currency", "Issue Date", "Due Date", "Status", "Notes"])
+            # Streamed from the database so large exports never sit in memory at once
+            for rows, invoice in enumerate(db.backend.stream(reader, f"""
+                SELECT i.id, p.name, c.name, {db.backend.decimal_text('i.amount_cents / 100.0')}, i.currency, i.issue_date, i.due_date, i.status, i.notes
+                {joins}
+                ORDER BY i.issue_date
+            """, (user_id,)), 1):
+                writer.writerow(invoice)
+                if rows % 500 == 0:
+                    progress(rows / total)
+        db.backend.end_snapshot(reader)
+    finally:
+        reader.close()
+    return {"path": path, "rows": rows}
+
+
+def recurring_invoices_job(db, user_id, payload, progress):
+    generated = RecurringInvoiceScheduler(db).run()
+    if generated:
+        # Caught-up periods may already be past due
+        db.sweep_overdue_invoices(force=True)
+    return {"generated": generated}
+
+
+def render_invoices_job(db, user_id, payload, progress):
+    fmt = payload.get("format", "pdf")
+    invoice_ids = payload.get("invoice_ids")
+    if not invoice_ids:
+        db.cursor.execute("""
+            SELECT i.id FROM invoices i
+            JOIN projects p ON i.project_id = p.id
+            WHERE p.user_id = ? AND p.deleted_at IS NULL AND i.deleted_at IS NULL
+        """, (user_id,))
+        invoice_ids = [row[0] for row in db.cursor.fetchall()]
+
+    os.makedirs("exports", exist_ok=True)
+    path = os.path.join("exports", f"invoices_{user_id[:8]}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{fmt}.zip")
+    count = InvoiceRenderer(db).render_zip(invoice_ids, path, fmt, progress)
+    return {"path": path, "rows": count}
+
+
+def build_invoices_job(db, user_id, payload, progress):
+    until = payload.get("until")
+    invoice_ids = InvoiceBuilder(db).build(
+        user_id,
+        payload.get("project_ids"),
+        payload.get("client_id"),
+        until,
+        payload.get("mode", "time"),
+        due_days=payload.get("due_days", 30)
+    )
+    return {"invoices": len(invoice_ids)}
+
+
+def reminders_job(db, user_id, payload, progress):
+    return ReminderEngine(db, SmtpOutbox.from_env()).run()
+
+
+# Invoice disputes can surface long after the fact, so history is kept for two years
+AUDIT_RETENTION_MONTHS = 24
+TRASH_RETENTION_DAYS = 30
+
+
+def purge_trash_job(db, user_id, payload, progress):
+    purged = db.purge_trash(TRASH_RETENTION_DAYS)
+    purged["tombstones"] = db.prune_tombstones()
+    return purged
+
+
+# Backups (SQLite only, PostgreSQL has its own base backups and WAL archiving)
+def backup_manager(db):
+    # Each shard keeps its generations in a subdirectory named after its file
+    directory = storage.backup_dir()
+    if db.db_name != storage.database_url():
+        directory = os.path.join(directory, os.path.splitext(os.path.basename(db.backend.path))[0])
+    return backup.BackupManager(db.backend.path, directory)
+
+
+def backup_snapshot_job(db, user_id, payload, progress):
+    manager = backup_manager(db)
+    try:
+        generation = manager.snapshot_if_due(progress=progress)
+        return {"generation": generation, "pruned": manager.prune()}
+    finally:
+        manager.close()
+
+
+def wal_archive_job(db, user_id, payload, progress):
+    manager = backup_manager(db)
+    try:
+        return manager.archive()
+    finally:
+        manager.close()
+
+
+def verify_backups_job(db, user_id, payload, progress):
+    manager = backup_manager(db)
+    try:
+        result = manager.verify()
+    finally:
+        manager.close()
+    if result and result["integrity"] != "ok":
+        raise RuntimeError(f"Backup {result['generation']} failed integrity_check: {result['integrity']}")
+    return result
+
+
+# VACUUM, ANALYZE and the health report (SQLite only, PostgreSQL runs autovacuum)
+def maintenance_job(db, user_id, payload, progress):
+    worker = maintenance.Maintenance(db.backend.path)
+    try:
+        result = worker.run(last_vacuum_at=db.get_meta("maintenance_vacuumed_at"), progress=progress)
+    finally:
+        worker.close()
+    if result["vacuumed"]:
+        db.set_meta("maintenance_vacuumed_at", result["report"]["checked_at"])
+    db.set_meta("maintenance_report", json.dumps(result["report"]))
+    return result
+
+
+def audit_retention_job(db, user_id, payload, progress):
+    return {"pruned": db.prune_audit_log(AUDIT_RETENTION_MONTHS)}
+
+
+def overdue_sweep_job(db, user_id, payload, progress):
+    swept = db.sweep_overdue_invoices()
+    return {"swept": swept}
+
+
+def webhooks_job(db, user_id, payload, progress):
+    return webhooks.Dispatcher(db).run(progress=progress)
+
+
+# The queue with every job type registered and the system jobs scheduled; the caller starts it
+def build_queue():
+    queue = JobQueue(shards=sharding.shard_files if sharding.enabled() else None)
+    queue.register("upgrade_subscription", upgrade_subscription_job, concurrency=2)
+    queue.register("export_invoices", export_invoices_job, concurrency=1)
+    queue.register("recurring_invoices", recurring_invoices_job, concurrency=1)
+    queue.register("overdue_sweep", overdue_sweep_job, concurrency=1)
+    queue.register("render_invoices", render_invoices_job, concurrency=1)
+    queue.register("build_invoices", build_invoices_job, concurrency=1)
+    queue.register("reminders", reminders_job, concurrency=1)
+    queue.register("audit_retention", audit_retention_job, concurrency=1)
+    queue.register("purge_trash", purge_trash_job, concurrency=1)
+    queue.register("webhooks", webhooks_job, concurrency=1)
+    queue.schedule("recurring_invoices", 3600)
+    queue.schedule("overdue_sweep", 3600)
+    queue.schedule("reminders", 3600)
+    queue.schedule("audit_retention", 86400)
+    queue.schedule("purge_trash", 86400)
+    queue.schedule("webhooks", webhooks.DISPATCH_INTERVAL)
+    if storage.backup_dir() and not storage.is_postgres(storage.database_url()):
+        queue.register("backup_snapshot", backup_snapshot_job, concurrency=1)
+        queue.register("wal_archive", wal_archive_job, concurrency=1)
+        queue.register("verify_backups", verify_backups_job, concurrency=1)
+        queue.schedule("backup_snapshot", 3600)
+        queue.schedule("wal_archive", backup.ARCHIVE_INTERVAL_SECONDS)
+        queue.schedule("verify_backups", 86400)
+    if not storage.is_postgres(storage.database_url()):
+        queue.register("maintenance", maintenance_job, concurrency=1)
+        queue.schedule("maintenance", 900)
+    return queue
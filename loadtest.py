@@ -0,0 +1,80 @@
+# Load test for the REST API (api.py): keeps N requests in flight against one or more GET paths
+# for a fixed time and reports throughput, latency percentiles and status codes. Needs httpx
+# (pip install httpx):
+#
+#   python loadtest.py --token ff_... --path /v1/invoices --path "/v1/clients?limit=20" -c 32 -d 20
+#
+# With --etag each worker sends back the ETag it last saw for a path as If-None-Match, the way a
+# polling integration would, so unchanged collections are answered with 304s.
+import argparse
+import asyncio
+import collections
+import statistics
+import sys
+import time
+
+import httpx
+
+
+async def worker(client, paths, deadline, latencies, statuses, etags, use_etag, offset):
+    i = offset
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        headers = {"If-None-Match": etags[path]} if use_etag and path in etags else None
+        started = time.perf_counter()
+        try:
+            response = await client.get(path, headers=headers)
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] += 1
+        if "etag" in response.headers:
+            etags[path] = response.headers["etag"]
+
+
+async def run(url, token, paths, concurrency, duration, use_etag):
+    latencies = []
+    statuses = collections.Counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=30) as client:
+        started = time.monotonic()
+        deadline = started + duration
+        etags = [{} for _ in range(concurrency)]
+        await asyncio.gather(*[
+            worker(client, paths, deadline, latencies, statuses, etags[n], use_etag, n) for n in range(concurrency)
+        ])
+        elapsed = time.monotonic() - started
+    return latencies, statuses, elapsed
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="loadtest.py", description="FreelanceFlow API load test")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="API base URL")
+    parser.add_argument("--token", required=True, help="API token (Settings > API Tokens)")
+    parser.add_argument("--path", action="append", help="GET path to request, repeatable (default: /v1/invoices)")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--etag", action="store_true", help="revalidate with If-None-Match")
+    args = parser.parse_args(argv)
+
+    latencies, statuses, elapsed = asyncio.run(run(args.url, args.token, args.path or ["/v1/invoices"], args.concurrency, args.duration, args.etag))
+    if not latencies:
+        print(f"No responses: {dict(statuses)}", file=sys.stderr)
+        return 1
+    latencies.sort()
+    print(f"{len(latencies)} requests in {elapsed:.1f}s at concurrency {args.concurrency}: {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency ms  p50 {percentile(latencies, 0.5) * 1000:.1f}  p95 {percentile(latencies, 0.95) * 1000:.1f}  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f}  mean {statistics.mean(latencies) * 1000:.1f}")
+    print("status      " + "  ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
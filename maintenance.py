@@ -0,0 +1,234 @@
+# Housekeeping for the SQLite database file: planner statistics (ANALYZE), returning freed pages
+# to the OS in small incremental-vacuum steps, and a health report (file size, free pages,
+# fragmentation). Kept free of Streamlit so it also runs as a CLI:
+#
+#   python maintenance.py report                    file size, free pages and fragmentation
+#   python maintenance.py run [--off-peak]          one maintenance pass, as the scheduled job does
+#   python maintenance.py vacuum                    rebuild the file now (holds the write lock throughout)
+#
+# Every step takes the write lock only if it is free within LOCK_TIMEOUT_MS and gives it back
+# after a bounded amount of work, so maintenance runs while the app is idle and stops as soon as
+# it isn't. Work that needs the lock for long (a full VACUUM, unsampled ANALYZE) only happens in
+# the off-peak window. PostgreSQL is left to its own autovacuum and autoanalyze.
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import storage
+
+# Local hours (start-end) when long-running work is allowed; overridden by MAINTENANCE_WINDOW
+OFF_PEAK_HOURS = "22-6"
+# Pages returned per incremental-vacuum step and seconds spent per pass, by time of day
+PEAK_STEP_PAGES = 64
+OFF_PEAK_STEP_PAGES = 2048
+PEAK_BUDGET_SECONDS = 2
+OFF_PEAK_BUDGET_SECONDS = 120
+STEP_SLEEP = 0.05
+LOCK_TIMEOUT_MS = 50
+# Rows sampled per index by ANALYZE during the day (0 = all)
+PEAK_ANALYSIS_LIMIT = 1000
+# Tables are re-analyzed once their row count has moved this far from the last ANALYZE
+STALE_RATIO = 0.25
+# Off-peak VACUUM when the file is this fragmented, at most once per interval
+FRAGMENTATION_LIMIT = 0.3
+VACUUM_INTERVAL_DAYS = 7
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+class Busy(Exception):
+    pass
+
+
+def off_peak_hours():
+    start, end = os.environ.get("MAINTENANCE_WINDOW", OFF_PEAK_HOURS).split("-")
+    return int(start), int(end)
+
+
+def is_off_peak(moment=None):
+    hour = (moment or datetime.datetime.now()).hour
+    start, end = off_peak_hours()
+    # The window may wrap past midnight (22-6)
+    return start <= hour < end if start < end else hour >= start or hour < end
+
+
+class Maintenance:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # Autocommit: every write below opens and closes its own short transaction
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        if storage.backup_dir():
+            # Leave checkpoints to the WAL archiver, as the app's connections do, up to wal_size_limit()
+            self.conn.execute("PRAGMA wal_autocheckpoint=0")
+            self.conn.execute(f"PRAGMA journal_size_limit={storage.wal_size_limit()}")
+
+    def close(self):
+        # A rebuild writes the whole file to the WAL; run from the CLI, no archiver may follow
+        if storage.backup_dir():
+            storage.limit_wal(self.conn, self.db_path)
+        self.conn.close()
+
+    def pragma(self, name):
+        return self.conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    def report(self, scan=True):
+        # scan=False skips the fragmentation measurement, which reads the whole file
+        page_count = self.pragma("page_count")
+        free_pages = self.pragma("freelist_count")
+        wal_path = self.db_path + "-wal"
+        return {
+            "checked_at": datetime.datetime.now().strftime(TIME_FORMAT),
+            "file_bytes": os.path.getsize(self.db_path),
+            "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+            "page_size": self.pragma("page_size"),
+            "pages": page_count,
+            "free_pages": free_pages,
+            "free_ratio": round(free_pages / page_count, 4) if page_count else 0.0,
+            "fragmentation": self.fragmentation() if scan else None,
+            "auto_vacuum": AUTO_VACUUM_MODES.get(self.pragma("auto_vacuum"), "unknown"),
+            "stale_tables": [table for table, rows, analyzed_rows in self.statistics() if self.is_stale(rows, analyzed_rows)],
+        }
+
+    def fragmentation(self):
+        # Share of table and index leaf pages that don't directly follow the previous leaf of the
+        # same b-tree, i.e. how often a sequential scan has to seek. None without the dbstat table.
+        try:
+            scattered, leaves = self.conn.execute("""
+                SELECT SUM(pageno != previous + 1), COUNT(*) FROM (
+                    SELECT pageno, LAG(pageno) OVER (PARTITION BY name ORDER BY path) AS previous
+                    FROM dbstat WHERE pagetype = 'leaf'
+                ) WHERE previous IS NOT NULL
+            """).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return round(scattered / leaves, 4) if leaves else 0.0
+
+    def statistics(self):
+        # (table, rows now, rows at the last ANALYZE or None)
+        tables = [row[0] for row in self.conn.execute(
+            "SELECT name FROM sqlite_schema WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        analyzed = {}
+        if self.conn.execute("SELECT 1 FROM sqlite_schema WHERE name = 'sqlite_stat1'").fetchone():
+            # The first number of each stat row is the table's row count
+            analyzed = dict(self.conn.execute("SELECT tbl, MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 GROUP BY tbl"))
+        return [(table, self.conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0], analyzed.get(table)) for table in tables]
+
+    @staticmethod
+    def is_stale(rows, analyzed_rows):
+        if analyzed_rows is None:
+            return rows > 0
+        return abs(rows - analyzed_rows) > STALE_RATIO * max(analyzed_rows, 1)
+
+    def write(self, sql):
+        # One statement in its own write transaction, only if the lock is free right now
+        self.conn.execute(f"PRAGMA busy_timeout={LOCK_TIMEOUT_MS}")
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                raise Busy() from e
+            raise
+        finally:
+            self.conn.execute("PRAGMA busy_timeout=30000")
+        try:
+            self.conn.execute(sql).fetchall()
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def analyze(self, off_peak, deadline):
+        # Stale tables only, one table per transaction; sampled during the day
+        self.conn.execute(f"PRAGMA analysis_limit={0 if off_peak else PEAK_ANALYSIS_LIMIT}")
+        analyzed = []
+        for table, rows, analyzed_rows in self.statistics():
+            if time.monotonic() > deadline:
+                break
+            if self.is_stale(rows, analyzed_rows):
+                self.write(f'ANALYZE "{table}"')
+                analyzed.append(table)
+                time.sleep(STEP_SLEEP)
+        return analyzed
+
+    def reclaim(self, off_peak, deadline):
+        # Returns free pages to the OS a few at a time (needs auto_vacuum=INCREMENTAL)
+        if self.pragma("auto_vacuum") != 2:
+            return 0
+        step = OFF_PEAK_STEP_PAGES if off_peak else PEAK_STEP_PAGES
+        reclaimed = 0
+        while time.monotonic() < deadline:
+            free_pages = self.pragma("freelist_count")
+            if not free_pages:
+                break
+            self.write(f"PRAGMA incremental_vacuum({min(step, free_pages)})")
+            reclaimed += free_pages - self.pragma("freelist_count")
+            time.sleep(STEP_SLEEP)
+        return reclaimed
+
+    def vacuum(self):
+        # Rebuilds the file: defragments it and switches it to incremental auto-vacuum. Holds the
+        # write lock until done, so it waits for the regular busy timeout instead of LOCK_TIMEOUT_MS.
+        self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.conn.execute("VACUUM")
+
+    def run(self, off_peak=None, last_vacuum_at=None, progress=None):
+        # One maintenance pass; stops early, without error, once the app needs the write lock
+        off_peak = is_off_peak() if off_peak is None else off_peak
+        deadline = time.monotonic() + (OFF_PEAK_BUDGET_SECONDS if off_peak else PEAK_BUDGET_SECONDS)
+        result = {"off_peak": off_peak, "analyzed": [], "reclaimed_pages": 0, "vacuumed": False, "interrupted": False}
+        try:
+            if off_peak:
+                report = self.report()
+                vacuum_due = last_vacuum_at is None or (
+                    datetime.datetime.now() - datetime.datetime.strptime(last_vacuum_at, TIME_FORMAT)
+                ).days >= VACUUM_INTERVAL_DAYS
+                # Files created before incremental auto-vacuum only switch over with a VACUUM
+                if report["auto_vacuum"] == "none" or (vacuum_due and (report["fragmentation"] or 0) > FRAGMENTATION_LIMIT):
+                    self.vacuum()
+                    result["vacuumed"] = True
+            if progress:
+                progress(0.3)
+            result["analyzed"] = self.analyze(off_peak, deadline)
+            if progress:
+                progress(0.6)
+            result["reclaimed_pages"] = self.reclaim(off_peak, deadline)
+        except Busy:
+            result["interrupted"] = True
+        result["report"] = self.report(scan=off_peak)
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="maintenance.py", description="FreelanceFlow database maintenance")
+    parser.add_argument("--db", default=storage.database_url().removeprefix("sqlite:///"), help="database file (default: $DATABASE_URL or freelance_flow.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("report", help="file size, free pages and fragmentation")
+    run = commands.add_parser("run", help="run one maintenance pass")
+    run.add_argument("--off-peak", action="store_true", help="use the off-peak limits regardless of the time")
+    commands.add_parser("vacuum", help="rebuild the database file now")
+    args = parser.parse_args(argv)
+
+    if storage.is_postgres(args.db):
+        print("Error: PostgreSQL databases are maintained by autovacuum", file=sys.stderr)
+        return 1
+    maintenance = Maintenance(args.db)
+    try:
+        if args.command == "report":
+            print(json.dumps(maintenance.report(), indent=2))
+        elif args.command == "run":
+            print(json.dumps(maintenance.run(off_peak=args.off_peak or None), indent=2))
+        elif args.command == "vacuum":
+            maintenance.vacuum()
+            print(json.dumps(maintenance.report(), indent=2))
+    finally:
+        maintenance.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# Deadline reminders: notifications for tasks and invoices falling due, shown in the app and,
+# with an SMTP outbox configured, emailed once. Kept free of Streamlit so the job worker and the
+# tests use it without loading the UI.
+import datetime
+import os
+import smtplib
+from email.message import EmailMessage
+
+
+# Email delivery for reminders; any object with the same send() can replace it
+class SmtpOutbox:
+    def __init__(self, host, port=25, sender="reminders@freelanceflow.local", username=None, password=None, use_tls=False):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+
+    # Configured through SMTP_HOST / SMTP_PORT / SMTP_SENDER / SMTP_USER / SMTP_PASSWORD / SMTP_TLS,
+    # e.g. SMTP_HOST=localhost SMTP_PORT=1025 with `python -m aiosmtpd -n` as a debug server
+    @classmethod
+    def from_env(cls):
+        if not os.environ.get("SMTP_HOST"):
+            return None
+        return cls(
+            os.environ["SMTP_HOST"],
+            int(os.environ.get("SMTP_PORT", 25)),
+            os.environ.get("SMTP_SENDER", "reminders@freelanceflow.local"),
+            os.environ.get("SMTP_USER"),
+            os.environ.get("SMTP_PASSWORD"),
+            os.environ.get("SMTP_TLS") == "1"
+        )
+
+    # messages: (to_address, to_name, lines); one connection for the whole batch
+    def send(self, messages):
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for to_address, to_name, lines in messages:
+                message = EmailMessage()
+                message["From"] = self.sender
+                message["To"] = to_address
+                message["Subject"] = f"FreelanceFlow: {len(lines)} upcoming deadline(s)"
+                message.set_content(f"Hi {to_name or ''},\n\n" + "\n".join(f"- {line}" for line in lines) + "\n")
+                smtp.send_message(message)
+
+
+# Deadline reminders: shown in the app and, with an outbox, emailed once
+class ReminderEngine:
+    TASK_DAYS = 2
+    INVOICE_DAYS = 3
+
+    def __init__(self, db, outbox=None):
+        self.db = db
+        self.outbox = outbox
+
+    def run(self, today=None):
+        today = today or datetime.datetime.now().date()
+        created = self.db.add_due_notifications(today, self.TASK_DAYS, self.INVOICE_DAYS)
+        return {"created": created, "emailed": self.deliver(today) if self.outbox else 0}
+
+    def deliver(self, today):
+        pending = self.db.get_undelivered_notifications(today)
+        recipients = {}
+        for notification_id, email, full_name, message in pending:
+            recipient = recipients.setdefault(email, {"name": full_name, "ids": [], "lines": []})
+            recipient["ids"].append(notification_id)
+            recipient["lines"].append(message)
+        messages = [(email, r["name"], r["lines"]) for email, r in recipients.items() if email]
+        if messages:
+            # A failed send raises before anything is marked, so the job retry resends it
+            self.outbox.send(messages)
+        # Users without an address are marked too, so they don't stay in the outbox
+        self.db.mark_notifications_emailed([notification_id for notification_id, *_ in pending])
+        return sum(len(lines) for _, _, lines in messages)
@@ -0,0 +1,245 @@
+# Invoice document rendering (HTML and PDF)
+# Kept free of Streamlit so batch renders can run in worker processes
+import functools
+import hashlib
+import html
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+PAGE_SIZE = (1240, 1754)  # A4 at 150 dpi
+BRAND_COLOR = "#4F8BF9"
+
+
+# Hash of everything that ends up on the document
+def content_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+CURRENCY_SYMBOLS = {"USD": "$", "EUR": "€", "GBP": "£", "CAD": "CA$", "AUD": "A$", "INR": "₹", "PKR": "Rs "}
+
+
+# Amounts are integer cents; unknown currencies fall back to the ISO code
+def money(cents, currency="USD"):
+    cents = int(cents or 0)
+    sign = "-" if cents < 0 else ""
+    units, remainder = divmod(abs(cents), 100)
+    symbol = CURRENCY_SYMBOLS.get(currency, f"{currency} ")
+    return f"{sign}{symbol}{units:,}.{remainder:02d}"
+
+
+# Fonts and the logo are reused across every document a worker renders
+@functools.lru_cache(maxsize=None)
+def font(size):
+    return ImageFont.load_default(size=size)
+
+
+# Logo drawn with Pillow, matching the sidebar logo
+@functools.lru_cache(maxsize=None)
+def draw_logo(size):
+    logo = Image.new("RGBA", (size, size), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(logo)
+    draw.ellipse((0, 0, size - 1, size - 1), fill=BRAND_COLOR)
+    draw.text((size / 2, size / 2), "FF", fill="white", font=font(size // 2), anchor="mm")
+    return logo
+
+
+def render_invoice_html(data):
+    invoice = data["invoice"]
+    client = data["client"]
+    currency = invoice["currency"]
+    payment_rows = "".join(
+        f"<tr><td>{html.escape(p['payment_date'])}</td><td>{html.escape(p['payment_method'] or '')}</td>"
+        f"<td style=\"text-align: right;\">{money(p['amount_cents'], currency)}</td></tr>"
+        for p in data["payments"]
+    )
+    total_paid = sum(p["amount_cents"] for p in data["payments"])
+    item_rows = "".join(
+        f"<tr><td>{html.escape(item['description'] or '')}</td><td>{item['quantity']:g}</td>"
+        f"<td>{money(item['unit_price_cents'], currency)}</td><td style=\"text-align: right;\">{money(item['amount_cents'], currency)}</td></tr>"
+        for item in data.get("items", [])
+    )
+    items_table = (
+        "<table>\n<tr><th>Description</th><th>Quantity</th><th>Unit Price</th><th style=\"text-align: right;\">Amount</th></tr>\n"
+        f"{item_rows}\n</table>"
+    ) if item_rows else ""
+
+    document = f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Invoice #{invoice['id'][:8]}</title>
+<style>
+    body {{ font-family: sans-serif; margin: 2rem; color: #333; }}
+    h1 {{ color: {BRAND_COLOR}; }}
+    table {{ width: 100%; border-collapse: collapse; margin-top: 1rem; }}
+    td, th {{ padding: 0.4rem; border-bottom: 1px solid #ddd; text-align: left; }}
+</style>
+</head>
+<body>
+<h1>Invoice #{invoice['id'][:8]}</h1>
+<p><strong>Bill to:</strong> {html.escape(client['name'] or '')}<br>
+{html.escape(client['company'] or '')}<br>
+{html.escape(client['address'] or '')}<br>
+{html.escape(client['email'] or '')}</p>
+<p><strong>Project:</strong> {html.escape(data['project']['name'] or '')}</p>
+<p><strong>Issue Date:</strong> {invoice['issue_date']}<br>
+<strong>Due Date:</strong> {invoice['due_date']}<br>
+<strong>Status:</strong> {html.escape(invoice['status'] or '')}</p>
+{items_table}
+<h2>Amount Due: {money(invoice['amount_cents'] - total_paid, currency)}</h2>
+<p><strong>Total:</strong> {money(invoice['amount_cents'], currency)} &nbsp; <strong>Paid:</strong> {money(total_paid, currency)}</p>
+<table>
+<tr><th>Payment Date</th><th>Method</th><th style="text-align: right;">Amount</th></tr>
+{payment_rows}
+</table>
+<p>{html.escape(invoice['notes'] or '')}</p>
+</body>
+</html>
+"""
+    return document.encode("utf-8")
+
+
+def render_invoice_pdf(data):
+    invoice = data["invoice"]
+    client = data["client"]
+    currency = invoice["currency"]
+    total_paid = sum(p["amount_cents"] for p in data["payments"])
+
+    page = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(page)
+    title_font = font(56)
+    heading_font = font(34)
+    body_font = font(26)
+
+    logo = draw_logo(140)
+    page.paste(logo, (PAGE_SIZE[0] - 240, 100), logo)
+    draw.text((100, 120), f"Invoice #{invoice['id'][:8]}", fill=BRAND_COLOR, font=title_font)
+
+    y = 300
+    lines = [
+        ("Bill to", client["name"]),
+        ("Company", client["company"]),
+        ("Address", client["address"]),
+        ("Email", client["email"]),
+        ("Project", data["project"]["name"]),
+        ("Issue Date", invoice["issue_date"]),
+        ("Due Date", invoice["due_date"]),
+        ("Status", invoice["status"]),
+    ]
+    for label, value in lines:
+        draw.text((100, y), f"{label}:", fill="#333333", font=body_font)
+        draw.text((340, y), str(value or ""), fill="#333333", font=body_font)
+        y += 44
+
+    if data.get("items"):
+        y += 30
+        draw.line((100, y, PAGE_SIZE[0] - 100, y), fill="#dddddd", width=2)
+        for item in data["items"][:12]:
+            y += 14
+            draw.text((100, y), (item["description"] or "")[:40], fill="#333333", font=body_font)
+            draw.text((720, y), f"{item['quantity']:g} x {money(item['unit_price_cents'], currency)}", fill="#333333", font=body_font)
+            draw.text((PAGE_SIZE[0] - 100, y), money(item["amount_cents"], currency), fill="#333333", font=body_font, anchor="ra")
+            y += 36
+        if len(data["items"]) > 12:
+            draw.text((100, y + 10), f"... and {len(data['items']) - 12} more item(s)", fill="#666666", font=body_font)
+            y += 46
+
+    y += 30
+    draw.text((100, y), f"Amount Due: {money(invoice['amount_cents'] - total_paid, currency)}", fill=BRAND_COLOR, font=heading_font)
+    y += 60
+    draw.text((100, y), f"Total: {money(invoice['amount_cents'], currency)}    Paid: {money(total_paid, currency)}", fill="#333333", font=body_font)
+
+    if data["payments"]:
+        y += 80
+        draw.text((100, y), "Payments", fill="#333333", font=heading_font)
+        y += 56
+        draw.line((100, y, PAGE_SIZE[0] - 100, y), fill="#dddddd", width=2)
+        for p in data["payments"]:
+            y += 14
+            draw.text((100, y), p["payment_date"], fill="#333333", font=body_font)
+            draw.text((400, y), p["payment_method"] or "", fill="#333333", font=body_font)
+            draw.text((PAGE_SIZE[0] - 100, y), money(p["amount_cents"], currency), fill="#333333", font=body_font, anchor="ra")
+            y += 36
+            if y > PAGE_SIZE[1] - 200:
+                break
+
+    if invoice["notes"]:
+        draw.text((100, PAGE_SIZE[1] - 160), invoice["notes"][:120], fill="#666666", font=body_font)
+
+    buf = io.BytesIO()
+    page.save(buf, format="PDF", resolution=150)
+    return buf.getvalue()
+
+
+RENDERERS = {
+    "pdf": render_invoice_pdf,
+    "html": render_invoice_html,
+}
+
+
+# Process pool entry point: (invoice_id, format, data) -> (invoice_id, format, content)
+def render_invoice_document(task):
+    invoice_id, fmt, data = task
+    return invoice_id, fmt, RENDERERS[fmt](data)
+
+
+# Invoice documents, cached by content hash
+class InvoiceRenderer:
+    FORMATS = {"pdf": "application/pdf", "html": "text/html"}
+
+    def __init__(self, db, workers=None):
+        self.db = db
+        self.workers = workers or os.cpu_count()
+
+    def render(self, invoice_id, fmt="pdf"):
+        return self.render_many([invoice_id], fmt)[invoice_id]
+
+    def render_many(self, invoice_ids, fmt="pdf", progress=None):
+        render_data = self.db.get_invoice_render_data(invoice_ids)
+        cached = self.db.get_invoice_documents(list(render_data), fmt)
+
+        documents = {}
+        misses = []
+        hashes = {}
+        for invoice_id, data in render_data.items():
+            hashes[invoice_id] = content_hash(data)
+            if invoice_id in cached and cached[invoice_id][0] == hashes[invoice_id]:
+                documents[invoice_id] = cached[invoice_id][1]
+            else:
+                misses.append((invoice_id, fmt, data))
+
+        # Small batches are not worth the process start-up cost
+        if len(misses) < 20:
+            rendered = map(render_invoice_document, misses)
+            self._collect(rendered, documents, hashes, len(misses), progress)
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                chunksize = max(1, len(misses) // (self.workers * 4))
+                rendered = pool.map(render_invoice_document, misses, chunksize=chunksize)
+                self._collect(rendered, documents, hashes, len(misses), progress)
+        return documents
+
+    def _collect(self, rendered, documents, hashes, total, progress):
+        batch = []
+        for done, (invoice_id, fmt, content) in enumerate(rendered, start=1):
+            documents[invoice_id] = content
+            batch.append((invoice_id, fmt, hashes[invoice_id], content))
+            if len(batch) >= 200:
+                self.db.save_invoice_documents(batch)
+                batch = []
+                if progress:
+                    progress(done / total)
+        if batch:
+            self.db.save_invoice_documents(batch)
+
+    def render_zip(self, invoice_ids, path, fmt="pdf", progress=None):
+        documents = self.render_many(invoice_ids, fmt, progress)
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for invoice_id, content in documents.items():
+                archive.writestr(f"invoice_{invoice_id[:8]}.{fmt}", content)
+        return len(documents)
@@ -0,0 +1,210 @@
+# Tenant sharding for SQLite: with SHARDS set, each user's records live in one of SHARDS database
+# files in SHARD_DIR, picked by a hash of the user id, so tenants in different shards never wait
+# on each other's write lock. The DATABASE_URL file becomes the catalog: it keeps every user's
+# login and the tenants table that routes them to their shard. Each shard is a full app database
+# with its own users' rows (including a copy of their users row), jobs and reference data.
+# Kept free of Streamlit so it also runs as a CLI (stop the app first):
+#
+#   python sharding.py split [--shards N]           move tenants of the catalog into shard files
+#   python sharding.py list                         shards and the tenants routed to them
+#
+# Routes are recorded once and never recomputed, so changing SHARDS only affects new users.
+import argparse
+import collections
+import glob
+import hashlib
+import os
+import sqlite3
+import sys
+
+import storage
+
+PROJECT_OWNER = "(SELECT user_id FROM projects WHERE id = {})"
+INVOICE_OWNER = "(SELECT p.user_id FROM invoices i JOIN projects p ON p.id = i.project_id WHERE i.id = {})"
+# The owning user of each tenant row. Children come first: they find their owner through their
+# parents, which must still be there when the children are deleted from the catalog.
+OWNERS = {
+    # Deleted time entries and recurring invoices are only left in the change record itself
+    "audit_log": f"""COALESCE(CASE audit_log.entity
+        WHEN 'clients' THEN (SELECT user_id FROM clients WHERE id = audit_log.entity_id)
+        WHEN 'projects' THEN {PROJECT_OWNER.format("audit_log.entity_id")}
+        WHEN 'invoices' THEN {INVOICE_OWNER.format("audit_log.entity_id")}
+        WHEN 'tasks' THEN {PROJECT_OWNER.format("audit_log.parent_id")}
+        WHEN 'payments' THEN {INVOICE_OWNER.format("audit_log.parent_id")}
+        WHEN 'invoice_items' THEN {INVOICE_OWNER.format("audit_log.parent_id")}
+        ELSE json_extract(audit_log.changes, '$.user_id')
+    END, audit_log.actor)""",
+    "invoice_documents": INVOICE_OWNER.format("invoice_documents.invoice_id"),
+    "invoice_items": INVOICE_OWNER.format("invoice_items.invoice_id"),
+    "payments": INVOICE_OWNER.format("payments.invoice_id"),
+    "invoices": PROJECT_OWNER.format("invoices.project_id"),
+    "tasks": PROJECT_OWNER.format("tasks.project_id"),
+    "time_entries": "time_entries.user_id",
+    "time_daily": "time_daily.user_id",
+    "recurring_invoices": "recurring_invoices.user_id",
+    "notifications": "notifications.user_id",
+    "data_versions": "data_versions.user_id",
+    "jobs": "jobs.user_id",
+    "events": "events.user_id",
+    "tombstones": "tombstones.user_id",
+    "webhooks": "webhooks.user_id",
+    "projects": "projects.user_id",
+    "clients": "clients.user_id",
+    "users": "users.id",
+}
+# Copied to every shard; users also stay in the catalog for login
+SHARED_TABLES = ("app_meta", "fx_rates", "audit_partitions", "sequences")
+CATALOG_TABLES = ("tenants", "api_tokens")
+
+
+def enabled(url=None):
+    return storage.shard_count() > 0 and not storage.is_postgres(url or storage.database_url())
+
+
+def bucket(user_id, shards):
+    return int(hashlib.sha256(user_id.encode()).hexdigest(), 16) % shards
+
+
+def shard_path(shard, directory=None):
+    return os.path.join(directory or storage.shard_dir(), f"shard-{shard:03d}.db")
+
+
+def shard_files(directory=None):
+    return sorted(glob.glob(os.path.join(directory or storage.shard_dir(), "shard-*.db")))
+
+
+def create_schema(source, target_path):
+    # A new shard gets the catalog's tables, indexes and triggers as they are now
+    target = sqlite3.connect(target_path, isolation_level=None)
+    try:
+        target.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        target.execute("PRAGMA journal_mode=WAL")
+        target.execute("BEGIN")
+        for (sql,) in source.execute(
+            "SELECT sql FROM sqlite_schema WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END"
+        ):
+            target.execute(sql)
+        target.execute("COMMIT")
+    finally:
+        target.close()
+
+
+def columns(conn, table):
+    return ", ".join(f'"{row[1]}"' for row in conn.execute(f'PRAGMA table_info("{table}")'))
+
+
+def split(catalog_path, shards, directory=None):
+    # Moves every user without a route into shard bucket(user) and records the route. Shards are
+    # filled and committed first, then the catalog routes and deletes in one transaction, so an
+    # interrupted split can simply be run again.
+    directory = directory or storage.shard_dir()
+    os.makedirs(directory, exist_ok=True)
+    catalog = sqlite3.connect(catalog_path, isolation_level=None)
+    try:
+        catalog.execute("CREATE TABLE IF NOT EXISTS tenants (user_id TEXT PRIMARY KEY, shard TEXT, created_at TEXT)")
+        tables = [row[0] for row in catalog.execute("SELECT name FROM sqlite_schema WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        unknown = set(tables) - set(OWNERS) - set(SHARED_TABLES) - set(CATALOG_TABLES)
+        if unknown:
+            raise RuntimeError(f"No sharding rule for table(s): {', '.join(sorted(unknown))}")
+
+        buckets = collections.defaultdict(list)
+        for (user_id,) in catalog.execute("SELECT id FROM users WHERE id NOT IN (SELECT user_id FROM tenants)"):
+            buckets[shard_path(bucket(user_id, shards), directory)].append(user_id)
+
+        moved = {}
+        for path, user_ids in sorted(buckets.items()):
+            if not os.path.exists(path):
+                create_schema(catalog, path)
+            catalog.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                catalog.execute("CREATE TEMP TABLE moving (id TEXT PRIMARY KEY)")
+                catalog.executemany("INSERT INTO moving VALUES (?)", [(user_id,) for user_id in user_ids])
+                catalog.execute("BEGIN")
+                try:
+                    for table in SHARED_TABLES:
+                        if table in tables:
+                            catalog.execute(f'INSERT OR IGNORE INTO shard."{table}" ({columns(catalog, table)}) SELECT {columns(catalog, table)} FROM main."{table}"')
+                    if "sequences" in tables:
+                        # Counters carry on from the catalog's, so change-feed cursors stay valid after the move
+                        catalog.execute("""
+                            UPDATE shard.sequences AS s SET value = MAX(s.value, (SELECT m.value FROM main.sequences m WHERE m.name = s.name))
+                            WHERE s.name IN (SELECT name FROM main.sequences)
+                        """)
+                    for table in reversed(OWNERS):
+                        if table in tables:
+                            catalog.execute(
+                                f'INSERT OR REPLACE INTO shard."{table}" ({columns(catalog, table)}) '
+                                f'SELECT {columns(catalog, table)} FROM main."{table}" WHERE {OWNERS[table]} IN (SELECT id FROM moving)'
+                            )
+                    catalog.execute("COMMIT")
+                except Exception:
+                    catalog.execute("ROLLBACK")
+                    raise
+            finally:
+                catalog.execute("DROP TABLE IF EXISTS moving")
+                catalog.execute("DETACH DATABASE shard")
+            moved[path] = len(user_ids)
+
+        # Routes in, moved rows out; users keep their catalog row for login
+        catalog.execute("BEGIN")
+        try:
+            catalog.executemany(
+                "INSERT INTO tenants (user_id, shard, created_at) VALUES (?, ?, datetime('now', 'localtime'))",
+                [(user_id, path) for path, user_ids in buckets.items() for user_id in user_ids]
+            )
+            for table in OWNERS:
+                if table in tables and table != "users":
+                    catalog.execute(f'DELETE FROM "{table}" WHERE {OWNERS[table]} IN (SELECT user_id FROM tenants)')
+            catalog.execute("COMMIT")
+        except Exception:
+            catalog.execute("ROLLBACK")
+            raise
+        return moved
+    finally:
+        catalog.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="sharding.py", description="FreelanceFlow tenant shards")
+    parser.add_argument("--db", default=storage.database_url().removeprefix("sqlite:///"), help="catalog database file (default: $DATABASE_URL or freelance_flow.db)")
+    parser.add_argument("--dir", default=None, help="shard directory (default: $SHARD_DIR or shards)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    split_command = commands.add_parser("split", help="move tenants into shard files (stop the app first)")
+    split_command.add_argument("--shards", type=int, default=storage.shard_count(), help="number of shards (default: $SHARDS)")
+    commands.add_parser("list", help="shards and their tenants")
+    args = parser.parse_args(argv)
+
+    if storage.is_postgres(args.db):
+        print("Error: tenant sharding is for SQLite databases", file=sys.stderr)
+        return 1
+    if args.command == "split":
+        if args.shards < 1:
+            print("Error: pass --shards or set SHARDS", file=sys.stderr)
+            return 1
+        try:
+            moved = split(args.db, args.shards, args.dir)
+        except RuntimeError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        for path, count in moved.items():
+            print(f"{path}: {count} tenant(s) moved")
+        print(f"{sum(moved.values())} tenant(s) moved into {len(moved)} shard(s)" if moved else "Every tenant already has a shard")
+    elif args.command == "list":
+        catalog = sqlite3.connect(args.db)
+        try:
+            routes = dict(catalog.execute("SELECT shard, COUNT(*) FROM tenants GROUP BY shard").fetchall())
+        except sqlite3.OperationalError:
+            routes = {}
+        finally:
+            catalog.close()
+        for path in sorted(set(routes) | set(shard_files(args.dir))):
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            print(f"{path}  {routes.get(path, 0)} tenant(s)  {size / 1048576:.1f} MB")
+        if not routes:
+            print("No tenants routed to shards")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,461 @@
+# Storage backends: connections and the SQL that differs between SQLite and PostgreSQL
+# Database writes SQLite-flavoured SQL with ? placeholders; each backend adapts it to its engine
+import collections
+import contextlib
+import functools
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+
+DEFAULT_URL = "freelance_flow.db"
+
+
+# DATABASE_URL is a SQLite file path (the default) or a postgresql:// connection URL
+def database_url():
+    return os.environ.get("DATABASE_URL", DEFAULT_URL)
+
+
+# BACKUP_DIR holds snapshots and archived WAL (see backup.py); an empty value turns backups off
+def backup_dir():
+    return os.environ.get("BACKUP_DIR", "backups")
+
+
+# Size past which a connection checkpoints the WAL itself, when backups left it to the archiver
+# but no archiver has run in time (see limit_wal)
+def wal_size_limit():
+    return int(os.environ.get("WAL_SIZE_LIMIT_MB", 64)) * 1024 * 1024
+
+
+def limit_wal(conn, path):
+    # Only the Streamlit app schedules the WAL archiver; the API server, the CLIs and an app whose
+    # jobs stopped would otherwise grow the WAL without end. A PASSIVE checkpoint never waits for
+    # readers or writers. The archiver notices the restart and begins a new generation.
+    try:
+        size = os.path.getsize(path + "-wal")
+    except OSError:
+        return
+    if size > wal_size_limit():
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+# SHARDS > 0 spreads tenants over that many SQLite files in SHARD_DIR (see sharding.py)
+def shard_count():
+    return int(os.environ.get("SHARDS", 0))
+
+
+def shard_dir():
+    return os.environ.get("SHARD_DIR", "shards")
+
+
+# Database files that keep idle connections (and a report reader) open; the least recently
+# used beyond this are closed
+def connection_cache_size():
+    return int(os.environ.get("CONNECTION_CACHE_SIZE", 32))
+
+
+# Database files whose schema this process has already created or migrated
+prepared = set()
+prepared_lock = threading.Lock()
+
+
+def is_postgres(url):
+    return url.startswith(("postgres://", "postgresql://"))
+
+
+def open_backend(url):
+    if is_postgres(url):
+        return PostgresBackend(url)
+    return SqliteBackend(url.removeprefix("sqlite:///"))
+
+
+class SqliteBackend:
+    name = "sqlite"
+    IntegrityError = sqlite3.IntegrityError
+    # SQLite has a single writer, so claimed rows can't be taken twice anyway
+    skip_locked = ""
+    # Idle connections per file, least recently used file first
+    _idle = collections.OrderedDict()
+    _idle_lock = threading.Lock()
+    IDLE_PER_FILE = 8
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self, owner):
+        with self._idle_lock:
+            idle = self._idle.get(self.path)
+            conn = idle.pop() if idle else None
+        conn = conn or self.open()
+        # Page reruns drop their Database without closing it; the connection goes back to the cache then
+        self._release = weakref.finalize(owner, self.check_in, conn)
+        return conn
+
+    def check_in(self, conn):
+        try:
+            conn.rollback()
+            if backup_dir():
+                limit_wal(conn, self.path)
+        except sqlite3.Error:
+            conn.close()
+            return
+        closing = []
+        with self._idle_lock:
+            idle = self._idle.setdefault(self.path, [])
+            self._idle.move_to_end(self.path)
+            if len(idle) < self.IDLE_PER_FILE:
+                idle.append(conn)
+            else:
+                closing.append(conn)
+            while len(self._idle) > connection_cache_size():
+                closing += self._idle.popitem(last=False)[1]
+        for conn in closing:
+            conn.close()
+
+    def open(self):
+        # Handed from one Database to the next, so not tied to the thread that opened it
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # Only takes effect on a new file; older ones switch at their next VACUUM (see maintenance.py)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL lets background workers write while the UI keeps reading
+        conn.execute("PRAGMA journal_mode=WAL")
+        if backup_dir():
+            # The WAL archiver checkpoints after copying new frames, so none are lost to an early reset.
+            # Past wal_size_limit() connections checkpoint on check-in instead, and the reset WAL
+            # file is cut back to that size
+            conn.execute("PRAGMA wal_autocheckpoint=0")
+            conn.execute(f"PRAGMA journal_size_limit={wal_size_limit()}")
+        return conn
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def release(self, conn):
+        self._release()
+
+    # Read-only WAL reader; it sees the last commit as of its first read and never blocks the writer
+    def connect_reader(self):
+        uri = pathlib.Path(self.path).absolute().as_uri() + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False, isolation_level=None)
+
+    def begin_snapshot(self, conn):
+        conn.execute("BEGIN")
+
+    def end_snapshot(self, conn):
+        conn.execute("COMMIT")
+
+    def columns(self, cursor, table):
+        cursor.execute(f"PRAGMA table_info({table})")
+        return [row[1] for row in cursor.fetchall()]
+
+    def append_only(self, cursor, table):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_append_only BEFORE UPDATE ON {table}
+        BEGIN
+            SELECT RAISE(ABORT, '{table} is append-only');
+        END
+        """)
+
+    # SQL expressions
+    def last_id(self, table):
+        return f"(SELECT seq FROM sqlite_sequence WHERE name = '{table}')"
+
+    def week(self, column):
+        return f"strftime('%Y-%W', {column})"
+
+    def days_between(self, later, earlier):
+        return f"(julianday({later}) - julianday({earlier}))"
+
+    def decimal_text(self, expression):
+        return f"printf('%.2f', {expression})"
+
+    def stream(self, conn, sql, params=(), size=1000):
+        # SQLite steps through the result lazily, fetchmany keeps memory flat
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        while rows := cursor.fetchmany(size):
+            yield from rows
+
+
+# SQLite schema spellings PostgreSQL doesn't accept. Foreign keys are dropped because SQLite
+# never enforced them here (foreign_keys is off) and the trash/purge code relies on that.
+DDL_REWRITES = [
+    (re.compile(r"\bINTEGER PRIMARY KEY( AUTOINCREMENT)?"), "BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY"),
+    (re.compile(r"\bINTEGER\b"), "BIGINT"),
+    (re.compile(r"\bREAL\b"), "DOUBLE PRECISION"),
+    (re.compile(r"\bBLOB\b"), "BYTEA"),
+    (re.compile(r",\s*FOREIGN KEY \([^)]*\) REFERENCES \w+ \([^)]*\)"), ""),
+]
+
+
+@functools.lru_cache(maxsize=1024)
+def to_postgres(sql, has_params):
+    # ? placeholders become %s outside string literals; with parameters, literal % must be doubled
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    for i in range(0, len(parts), 2):
+        if has_params:
+            parts[i] = parts[i].replace("%", "%%")
+        parts[i] = parts[i].replace("?", "%s")
+    if has_params:
+        parts[1::2] = [literal.replace("%", "%%") for literal in parts[1::2]]
+    sql = "".join(parts)
+
+    statement = sql.lstrip().upper()
+    if statement.startswith(("CREATE TABLE", "ALTER TABLE")):
+        for pattern, replacement in DDL_REWRITES:
+            sql = pattern.sub(replacement, sql)
+        if statement.startswith("CREATE TABLE"):
+            if "WITHOUT ROWID" in statement:
+                sql = sql.replace("WITHOUT ROWID", "")
+            elif "IDENTITY PRIMARY KEY" not in sql:
+                # Ordinary SQLite tables have an implicit, increasing rowid that readers page by
+                sql = sql[:sql.rindex(")")].rstrip() + ",\n    rowid BIGINT GENERATED ALWAYS AS IDENTITY\n)"
+    return sql
+
+
+class PostgresCursor:
+    # Translates the SQLite-flavoured SQL on its way through; everything else is psycopg's cursor
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=None):
+        self._cursor.execute(to_postgres(sql, params is not None), params)
+        return self
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(to_postgres(sql, True), rows)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PostgresBackend:
+    name = "postgresql"
+    # Concurrent claimers pass over rows another transaction is already updating
+    skip_locked = "FOR UPDATE SKIP LOCKED"
+    # One connection pool per URL and server process
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, url):
+        try:
+            import psycopg
+            import psycopg_pool
+        except ImportError as e:
+            raise RuntimeError("PostgreSQL support needs psycopg: pip install 'psycopg[binary,pool]'") from e
+        self.url = url
+        self.IntegrityError = psycopg.IntegrityError
+        with self._pools_lock:
+            if url not in self._pools:
+                self._pools[url] = psycopg_pool.ConnectionPool(
+                    url,
+                    min_size=1,
+                    max_size=int(os.environ.get("DATABASE_POOL_SIZE", 10)),
+                    configure=self.configure,
+                    open=True
+                )
+        self.pool = self._pools[url]
+
+    @staticmethod
+    def configure(conn):
+        from psycopg.adapt import Dumper, Loader
+        from psycopg.postgres import types
+
+        # SUM() and division come back as numeric; the app does its arithmetic on int and float
+        class NumberLoader(Loader):
+            def load(self, data):
+                text = bytes(data).decode()
+                return int(text) if text.lstrip("-").isdigit() else float(text)
+
+        # Flags are stored as 0/1 integers, as they are in SQLite
+        class FlagDumper(Dumper):
+            oid = types["int8"].oid
+
+            def dump(self, obj):
+                return b"1" if obj else b"0"
+
+        conn.adapters.register_loader("numeric", NumberLoader)
+        conn.adapters.register_dumper(bool, FlagDumper)
+
+    def connect(self, owner):
+        conn = self.pool.getconn()
+        # Page reruns drop their Database without closing it; the connection goes back to the pool then
+        self._release = weakref.finalize(owner, self.pool.putconn, conn)
+        return conn
+
+    def cursor(self, conn):
+        return PostgresCursor(conn.cursor())
+
+    def release(self, conn):
+        self._release()
+
+    # Reports read from DATABASE_REPLICA_URL when set, otherwise from the primary
+    def connect_reader(self):
+        import psycopg
+        conn = psycopg.connect(os.environ.get("DATABASE_REPLICA_URL", self.url))
+        self.configure(conn)
+        conn.read_only = True
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        return conn
+
+    def begin_snapshot(self, conn):
+        # The transaction, and with it the snapshot, starts with the first query
+        pass
+
+    def end_snapshot(self, conn):
+        conn.commit()
+
+    def columns(self, cursor, table):
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = ? AND table_schema = current_schema()", (table,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def append_only(self, cursor, table):
+        cursor.execute("""
+        CREATE OR REPLACE FUNCTION append_only() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            RAISE EXCEPTION '% is append-only', TG_TABLE_NAME;
+        END
+        $$
+        """)
+        cursor.execute(f"CREATE OR REPLACE TRIGGER {table}_append_only BEFORE UPDATE ON {table} FOR EACH ROW EXECUTE FUNCTION append_only()")
+
+    # SQL expressions
+    def last_id(self, table):
+        return f"pg_sequence_last_value(pg_get_serial_sequence('{table}', 'id')::regclass)"
+
+    def week(self, column):
+        return f"to_char(date_trunc('week', {column}::date), 'IYYY-IW')"
+
+    def days_between(self, later, earlier):
+        return f"({later}::date - {earlier}::date)"
+
+    def decimal_text(self, expression):
+        return f"to_char({expression}, 'FM999999999990.00')"
+
+    def stream(self, conn, sql, params=(), size=1000):
+        # Named cursors stay on the server, rows arrive `size` at a time
+        with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = size
+            cursor.execute(to_postgres(sql, True), params)
+            yield from cursor
+
+
+class SnapshotReader:
+    # Read-only connections for reports, shared by the threads reading one file. A thread reads on
+    # a snapshot of its own until it is older than the caller allows, so a report's queries agree
+    # with each other and never queue behind writes or behind another thread's report
+    _readers = collections.OrderedDict()
+    _readers_lock = threading.Lock()
+    # Idle connections kept per file; more only open while that many reports run at once
+    IDLE_PER_FILE = 4
+
+    @classmethod
+    def for_url(cls, url, backend):
+        with cls._readers_lock:
+            if url not in cls._readers:
+                cls._readers[url] = cls(backend)
+            cls._readers.move_to_end(url)
+            # Readers of the least recently used files let go of their connections until next needed
+            for reader in list(cls._readers.values())[:-connection_cache_size()]:
+                reader.close()
+            return cls._readers[url]
+
+    def __init__(self, backend):
+        self.backend = backend
+        # Guards the idle list and each snapshot's state, never a query
+        self.lock = threading.Lock()
+        self.idle = []
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def read(self, max_staleness):
+        # Nested reads stay on the outer read's snapshot
+        snapshot = getattr(self.local, "snapshot", None)
+        if snapshot is not None:
+            yield snapshot.cursor
+            return
+        with self.lock:
+            # The thread's previous snapshot when it is free, so its reads keep agreeing
+            last = getattr(self.local, "last", None)
+            if last in self.idle:
+                self.idle.remove(last)
+                snapshot = last
+            elif self.idle:
+                snapshot = self.idle.pop()
+        if snapshot is None:
+            snapshot = Snapshot(self.backend)
+        with self.lock:
+            snapshot.busy = True
+            if snapshot.taken_at is None or time.monotonic() - snapshot.taken_at > max_staleness:
+                self.refresh(snapshot, max_staleness)
+        self.local.snapshot = self.local.last = snapshot
+        failed = False
+        try:
+            yield snapshot.cursor
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.local.snapshot = None
+            closing = None
+            with self.lock:
+                snapshot.busy = False
+                if failed or time.monotonic() - snapshot.taken_at > max_staleness:
+                    self.end(snapshot)
+                self.idle.append(snapshot)
+                if len(self.idle) > self.IDLE_PER_FILE:
+                    closing = self.idle.pop(0)
+            if closing is not None:
+                closing.close()
+
+    def refresh(self, snapshot, max_staleness):
+        self.end(snapshot)
+        self.backend.begin_snapshot(snapshot.conn)
+        snapshot.taken_at = time.monotonic()
+        # An open snapshot pins old pages (the WAL can't be checkpointed past it), so idle ones are let go
+        timer = threading.Timer(max_staleness, self.expire, (snapshot, snapshot.taken_at))
+        timer.daemon = True
+        timer.start()
+
+    def expire(self, snapshot, taken_at):
+        with self.lock:
+            if not snapshot.busy and snapshot.taken_at == taken_at:
+                self.end(snapshot)
+
+    def end(self, snapshot):
+        if snapshot.taken_at is None:
+            return
+        snapshot.taken_at = None
+        try:
+            self.backend.end_snapshot(snapshot.conn)
+        except Exception:
+            snapshot.conn.rollback()
+
+    def close(self):
+        # Connections in use by a read are kept; they are closed on a later call instead
+        with self.lock:
+            closing, self.idle = self.idle, []
+            for snapshot in closing:
+                self.end(snapshot)
+        for snapshot in closing:
+            snapshot.close()
+
+
+class Snapshot:
+    # One read-only connection and the snapshot it holds, if any
+    def __init__(self, backend):
+        self.conn = backend.connect_reader()
+        self.cursor = backend.cursor(self.conn)
+        self.taken_at = None
+        self.busy = False
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,133 @@
+# Sync client for the API's change feed (GET /v1/{resource}/changes, see api.py): keeps a local
+# SQLite replica of a user's clients, projects, tasks, invoices and payments up to date. Each
+# pass asks for what changed after the cursor it stored last time and applies every page together
+# with its new cursor in one transaction, so an interrupted sync resumes where it stopped and
+# catching up costs only the changes, never a full re-read. Standard library only:
+#
+#   python sync.py --token ff_... [--url http://127.0.0.1:8000] [--replica replica.db] [--loop]
+#
+# The replica has one table per resource (id, change_seq, deleted, data as JSON). Trashed records
+# are kept with deleted = 1, as the server keeps them; hard-deleted ones are removed. A record
+# restored from the trash comes back with its next change.
+import argparse
+import json
+import sqlite3
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+RESOURCES = ("clients", "projects", "tasks", "invoices", "payments")
+PAGE_SIZE = 500
+TIMEOUT_SECONDS = 30
+
+
+class Replica:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        # full = 1 until a read that started from an empty copy has caught up once
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cursors (resource TEXT PRIMARY KEY, change_seq INTEGER, full INTEGER)")
+        for resource in RESOURCES:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {resource} (id TEXT PRIMARY KEY, change_seq INTEGER, deleted INTEGER, data TEXT)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def cursor(self, resource):
+        # (change_seq, full); a resource never synced starts a full read at 0
+        row = self.conn.execute("SELECT change_seq, full FROM cursors WHERE resource = ?", (resource,)).fetchone()
+        return (row[0], bool(row[1])) if row else (0, True)
+
+    def apply(self, resource, changes, change_seq, full):
+        # One page and the cursor after it, all or nothing
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO {resource} (id, change_seq, deleted, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET change_seq = excluded.change_seq, deleted = excluded.deleted, data = excluded.data",
+                [(change["id"], change["change_seq"], int(change["deleted"]), json.dumps(change))
+                 for change in changes if not change.get("tombstone")]
+            )
+            self.conn.executemany(
+                f"DELETE FROM {resource} WHERE id = ?",
+                [(change["id"],) for change in changes if change.get("tombstone")]
+            )
+            self.conn.execute(
+                "INSERT INTO cursors (resource, change_seq, full) VALUES (?, ?, ?) "
+                "ON CONFLICT(resource) DO UPDATE SET change_seq = excluded.change_seq, full = excluded.full",
+                (resource, change_seq, int(full))
+            )
+
+    def reset(self, resource):
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {resource}")
+            self.conn.execute("DELETE FROM cursors WHERE resource = ?", (resource,))
+
+    def records(self, resource, include_deleted=False):
+        sql = f"SELECT data FROM {resource}" + ("" if include_deleted else " WHERE deleted = 0") + " ORDER BY change_seq"
+        return [json.loads(data) for (data,) in self.conn.execute(sql)]
+
+
+class SyncClient:
+    def __init__(self, url, token, replica, page_size=PAGE_SIZE):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.replica = replica
+        self.page_size = page_size
+
+    def fetch(self, resource, since, full):
+        query = urllib.parse.urlencode({"since": since, "full": int(full), "limit": self.page_size})
+        request = urllib.request.Request(f"{self.url}/v1/{resource}/changes?{query}", headers={
+            "Authorization": f"Bearer {self.token}", "Accept": "application/json"
+        })
+        with urllib.request.urlopen(request, timeout=TIMEOUT_SECONDS) as response:
+            return json.load(response)
+
+    def sync(self, resources=RESOURCES):
+        # Applied changes per resource; a page at a time until the feed has nothing more
+        applied = {}
+        for resource in resources:
+            applied[resource] = 0
+            while True:
+                since, full = self.replica.cursor(resource)
+                try:
+                    page = self.fetch(resource, since, full)
+                except urllib.error.HTTPError as e:
+                    if e.code != 410:
+                        raise
+                    # The server no longer knows every deletion since our cursor: start over
+                    self.replica.reset(resource)
+                    continue
+                self.replica.apply(resource, page["data"], page["next"], full and page["more"])
+                applied[resource] += len(page["data"])
+                if not page["more"]:
+                    break
+        return applied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="sync.py", description="FreelanceFlow replica sync")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="API base URL")
+    parser.add_argument("--token", required=True, help="API token (Settings > API Tokens)")
+    parser.add_argument("--replica", default="replica.db", help="local replica file (default: replica.db)")
+    parser.add_argument("--loop", action="store_true", help="keep syncing until interrupted")
+    parser.add_argument("--interval", type=float, default=30, help="seconds between passes with --loop (default: 30)")
+    args = parser.parse_args(argv)
+
+    replica = Replica(args.replica)
+    try:
+        while True:
+            applied = SyncClient(args.url, args.token, replica).sync()
+            if any(applied.values()) or not args.loop:
+                print("  ".join(f"{resource}: {count}" for resource, count in applied.items()))
+            if not args.loop:
+                break
+            time.sleep(args.interval)
+    finally:
+        replica.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# Shared fixtures: every test gets its own SQLite file, created and migrated by Database
+import os
+import uuid
+
+import pytest
+
+import storage
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.delenv("SHARDS", raising=False)
+    database = Database(str(tmp_path / "freelance_flow.db"))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def user_id(db):
+    return db.add_user("alice", "secret", "alice@example.com", "Alice Example")
+
+
+@pytest.fixture
+def project_id(db, user_id):
+    client_id = db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "")
+    return db.add_project(user_id, client_id, "Website", "", "2026-01-01", "2026-12-31", "In Progress", 500000)
+
+
+# The REST API (api.py, optional "api" extra) over the db fixture's file, and a token for user_id
+@pytest.fixture
+def api_client(db, monkeypatch):
+    pytest.importorskip("fastapi")
+    testclient = pytest.importorskip("fastapi.testclient")
+    import api
+    # By its absolute path: connections are cached by URL, and every test's file is freelance_flow.db
+    monkeypatch.setenv("DATABASE_URL", db.db_name)
+    with testclient.TestClient(api.app) as client:
+        yield client
+
+
+@pytest.fixture
+def token(db, user_id):
+    return db.add_api_token(user_id, "tests")
+
+
+# The storage conformance tests run on every backend: SQLite always, PostgreSQL when
+# TEST_DATABASE_URL points at a server (any database on it; each test gets a scratch one)
+@pytest.fixture(params=["sqlite", "postgresql"])
+def backend_db(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("SHARDS", raising=False)
+    if request.param == "sqlite":
+        url = str(tmp_path / "freelance_flow.db")
+        yield Database(url)
+        return
+
+    admin_url = os.environ.get("TEST_DATABASE_URL")
+    if not admin_url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    psycopg = pytest.importorskip("psycopg")
+    name = f"ff_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(admin_url, autocommit=True) as admin:
+        admin.execute(f"CREATE DATABASE {name}")
+    url = admin_url.rsplit("/", 1)[0] + "/" + name
+    database = Database(url)
+    try:
+        yield database
+    finally:
+        database.close()
+        storage.PostgresBackend._pools.pop(url).close()
+        storage.prepared.discard(url)
+        reader = storage.SnapshotReader._readers.pop(url, None)
+        if reader:
+            reader.close()
+        with psycopg.connect(admin_url, autocommit=True) as admin:
+            admin.execute(f"DROP DATABASE {name} WITH (FORCE)")
@@ -0,0 +1,63 @@
+# Client analytics (analytics.ClientAnalytics): per-client revenue, outstanding balance, payment
+# speed and effective rate in one currency, and the report cache that follows the data versions
+import numpy as np
+import pytest
+
+from analytics import ClientAnalytics
+
+
+@pytest.fixture(autouse=True)
+def fresh_reads(monkeypatch):
+    monkeypatch.setenv("READ_STALENESS_CLIENT_ANALYTICS", "0")
+
+
+def paid_invoice(db, project_id, amount_cents, issue_date, paid_on, currency="USD"):
+    invoice_id = db.add_invoice(project_id, amount_cents, issue_date, issue_date, "Unpaid", "", currency)
+    return db.add_payment(invoice_id, amount_cents, paid_on, "Bank Transfer", "")
+
+
+def test_clients_are_valued_in_one_currency_and_ranked_by_revenue(db, user_id, project_id):
+    db.save_fx_rates("USD", [("2026-01-01", "EUR", 0.8)])
+    paid_invoice(db, project_id, 10000, "2026-01-01", "2026-01-11")
+    paid_invoice(db, project_id, 4000, "2026-02-01", "2026-02-21", "EUR")
+    db.add_invoice(project_id, 800, "2026-03-01", "2026-03-31", "Unpaid", "", "EUR")
+    db.add_time_entry(user_id, project_id, None, "2026-01-05 09:00:00", 4 * 3600, 5000, 1, "")
+    globex = db.add_client(user_id, "Globex", "ap@globex.test", "", "Globex", "", "")
+    audit = db.add_project(user_id, globex, "Audit", "", "2026-01-01", "2026-12-31", "In Progress", 0)
+    paid_invoice(db, audit, 2000, "2026-01-01", "2026-01-01")
+    db.add_invoice(audit, 9999, "2026-03-01", "2026-03-31", "Unpaid", "", "JPY")
+    idle = db.add_client(user_id, "Initech", "ap@initech.test", "", "Initech", "", "")
+
+    report = ClientAnalytics(db).report(user_id, "USD")
+
+    clients = report["clients"]
+    assert clients["name"].tolist() == ["Acme", "Globex", "Initech"]
+    acme, globex_row, idle_row = clients.to_dict("records")
+    # 4000 euro cents are 5000 US cents; the open 800 are 1000
+    assert (acme["billed"], acme["revenue"], acme["outstanding"]) == (16000, 15000, 1000)
+    assert (acme["projects"], acme["hours"], acme["effective_rate"]) == (1, 4, 3750)
+    assert acme["avg_days_to_pay"] == 15
+    # No rate for yen: left out of the totals and reported
+    assert (globex_row["revenue"], globex_row["outstanding"], globex_row["avg_days_to_pay"]) == (2000, 0, 0)
+    assert np.isnan(globex_row["effective_rate"])
+    assert idle_row["client_id"] == idle and idle_row["revenue"] == 0 and np.isnan(idle_row["avg_days_to_pay"])
+    assert report["missing_currencies"] == ["JPY"]
+
+
+def test_reports_are_reused_until_the_data_or_the_rates_change(db, user_id, project_id):
+    analytics = ClientAnalytics(db)
+    paid_invoice(db, project_id, 10000, "2026-01-01", "2026-01-11")
+
+    report = analytics.report(user_id, "USD")
+    assert analytics.report(user_id, "USD") is report
+
+    invoice_id = db.add_invoice(project_id, 500, "2026-02-01", "2026-03-01", "Unpaid", "")
+    report = analytics.report(user_id, "USD")
+    assert report["clients"]["outstanding"].tolist() == [500]
+
+    db.add_payment(invoice_id, 500, "2026-02-10", "Bank Transfer", "")
+    report = analytics.report(user_id, "USD")
+    assert report["clients"]["revenue"].tolist() == [10500]
+
+    db.save_fx_rates("USD", [("2026-01-01", "EUR", 0.8)])
+    assert analytics.report(user_id, "USD") is not report
@@ -0,0 +1,93 @@
+# The REST API (api.py) through TestClient: bearer tokens, keyset paging, ETags for reads and
+# writes, and users who can never see or change each other's records
+import pytest
+
+
+def auth(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def client_id(db, user_id):
+    return db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "")
+
+
+def test_requests_without_a_valid_token_are_rejected(api_client, token):
+    for headers in [{}, {"Authorization": token}, auth("ff_not-a-token")]:
+        response = api_client.get("/v1/clients", headers=headers)
+        assert response.status_code == 401
+        assert response.headers["WWW-Authenticate"] == "Bearer"
+    assert api_client.get("/v1/clients", headers=auth(token)).status_code == 200
+
+
+def test_collections_page_with_next_until_null(db, user_id, api_client, token):
+    for n in range(5):
+        db.add_client(user_id, f"Client {n}", "", "", "", "", "")
+
+    pages = []
+    after = 0
+    while after is not None:
+        page = api_client.get("/v1/clients", params={"limit": 2, "after": after}, headers=auth(token)).json()
+        pages.append([record["name"] for record in page["data"]])
+        after = page["next"]
+
+    assert pages == [["Client 0", "Client 1"], ["Client 2", "Client 3"], ["Client 4"]]
+    assert api_client.get("/v1/clients", params={"limit": 0}, headers=auth(token)).status_code == 422
+
+
+def test_if_none_match_answers_304_until_something_changes(db, user_id, client_id, api_client, token):
+    record = api_client.get(f"/v1/clients/{client_id}", headers=auth(token))
+    collection = api_client.get("/v1/clients", headers=auth(token))
+
+    for path, response in [(f"/v1/clients/{client_id}", record), ("/v1/clients", collection)]:
+        unchanged = api_client.get(path, headers={**auth(token), "If-None-Match": response.headers["ETag"]})
+        assert (unchanged.status_code, unchanged.content) == (304, b"")
+        assert unchanged.headers["ETag"] == response.headers["ETag"]
+
+    db.update_client(client_id, "Acme Inc", "billing@acme.test", "", "Acme Ltd", "", "")
+    for path, response in [(f"/v1/clients/{client_id}", record), ("/v1/clients", collection)]:
+        changed = api_client.get(path, headers={**auth(token), "If-None-Match": response.headers["ETag"]})
+        assert changed.status_code == 200 and changed.headers["ETag"] != response.headers["ETag"]
+
+
+def test_if_match_refuses_writes_over_a_newer_version(db, client_id, api_client, token):
+    etag = api_client.get(f"/v1/clients/{client_id}", headers=auth(token)).headers["ETag"]
+    db.update_client(client_id, "Acme Inc", "billing@acme.test", "", "Acme Ltd", "", "")
+
+    stale = api_client.patch(f"/v1/clients/{client_id}", json={"name": "Acme Corp"}, headers={**auth(token), "If-Match": etag})
+    assert stale.status_code == 412
+    assert api_client.delete(f"/v1/clients/{client_id}", headers={**auth(token), "If-Match": etag}).status_code == 412
+
+    fresh = api_client.get(f"/v1/clients/{client_id}", headers=auth(token)).headers["ETag"]
+    updated = api_client.patch(f"/v1/clients/{client_id}", json={"name": "Acme Corp"}, headers={**auth(token), "If-Match": fresh})
+    assert updated.status_code == 200
+    assert updated.json()["name"] == "Acme Corp" and updated.headers["ETag"] != fresh
+
+
+def test_patch_only_validates_the_fields_sent(db, client_id, api_client, token):
+    # Rows from before the API can hold NULLs the model doesn't accept
+    db.cursor.execute("UPDATE clients SET phone = NULL, notes = NULL WHERE id = ?", (client_id,))
+    db.conn.commit()
+
+    response = api_client.patch(f"/v1/clients/{client_id}", json={"email": "ap@acme.test"}, headers=auth(token))
+    assert response.status_code == 200
+    assert (response.json()["email"], response.json()["phone"], response.json()["notes"]) == ("ap@acme.test", None, None)
+
+    invalid = api_client.patch(f"/v1/clients/{client_id}", json={"name": None, "notes": "ok"}, headers=auth(token))
+    assert invalid.status_code == 422
+    assert [error["loc"] for error in invalid.json()["detail"]] == [["name"]]
+    assert db.get_client(client_id)[2] == "Acme"
+
+
+def test_other_users_records_are_not_found(db, user_id, client_id, project_id, api_client, token):
+    mallory = db.add_user("mallory", "secret", "mallory@example.com", "Mallory")
+    theirs = auth(db.add_api_token(mallory, "tests"))
+
+    assert api_client.get(f"/v1/clients/{client_id}", headers=theirs).status_code == 404
+    assert api_client.patch(f"/v1/clients/{client_id}", json={"name": "Mine now"}, headers=theirs).status_code == 404
+    assert api_client.delete(f"/v1/clients/{client_id}", headers=theirs).status_code == 404
+    assert api_client.get("/v1/clients", headers=theirs).json() == {"data": [], "next": None}
+    # Nor can they file records under it
+    task = api_client.post("/v1/tasks", json={"project_id": project_id, "name": "Snoop"}, headers=theirs)
+    assert task.status_code == 422
+    assert db.get_client(client_id)[2] == "Acme"
@@ -0,0 +1,83 @@
+# The audit log (Database.audit / prune_audit_log): compact diffs of every change, and retention
+# that drops whole months by id range in short batches
+import datetime
+import json
+
+import pytest
+
+
+def months_ago(months):
+    today = datetime.date.today()
+    index = today.year * 12 + today.month - 1 - months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def edit(db, client_id, n):
+    db.update_client(client_id, f"Acme {n}", "billing@acme.test", "", "Acme Ltd", "", "")
+
+
+def audit_ids(db):
+    db.cursor.execute("SELECT id FROM audit_log ORDER BY id")
+    return [row[0] for row in db.cursor.fetchall()]
+
+
+def partitions(db):
+    db.cursor.execute("SELECT month, first_id FROM audit_partitions ORDER BY month")
+    return db.cursor.fetchall()
+
+
+def backdate_partition(db, month):
+    # Rows can't be rewritten (audit_log is append-only), so the current month's partition is
+    # moved back instead; the next write starts a new one for this month
+    db.cursor.execute("UPDATE audit_partitions SET month = ? WHERE month = ?", (month, datetime.date.today().strftime("%Y-%m")))
+    db.conn.commit()
+
+
+@pytest.fixture
+def client_id(db, user_id):
+    return db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "")
+
+
+def test_updates_record_only_the_changed_columns(db, user_id, client_id):
+    db.actor = user_id
+    edit(db, client_id, 1)
+    db.delete_client(client_id)
+
+    history = db.get_audit_history("clients", client_id)
+    assert [(actor, action) for created_at, actor, entity, action, changes in history] == [("alice", "delete"), ("alice", "update")]
+    assert json.loads(history[1][4]) == {"name": ["Acme", "Acme 1"]}
+    assert json.loads(history[0][4])["name"] == "Acme 1"
+
+
+def test_pruning_drops_only_months_past_retention(db, client_id):
+    for n in range(5):
+        edit(db, client_id, n)
+    backdate_partition(db, months_ago(30))
+    old = audit_ids(db)
+    for n in range(2):
+        edit(db, client_id, 10 + n)
+    # The oldest month still kept
+    backdate_partition(db, months_ago(24))
+    edit(db, client_id, 20)
+    kept = [audit_id for audit_id in audit_ids(db) if audit_id not in old]
+
+    # Batches of two: several passes, the last one short
+    assert db.prune_audit_log(24, batch_size=2) == len(old) == 5
+
+    assert audit_ids(db) == kept
+    assert [month for month, first_id in partitions(db)] == [months_ago(24), months_ago(0)]
+    assert db.prune_audit_log(24) == 0
+    assert audit_ids(db) == kept
+
+
+def test_pruning_with_every_month_expired_empties_the_log(db, client_id):
+    for n in range(3):
+        edit(db, client_id, n)
+    backdate_partition(db, months_ago(25))
+
+    assert db.prune_audit_log(24, batch_size=2) == 3
+    assert audit_ids(db) == [] and partitions(db) == []
+
+    # New writes start a partition for this month again
+    edit(db, client_id, 9)
+    assert [month for month, first_id in partitions(db)] == [months_ago(0)]
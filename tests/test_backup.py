@@ -0,0 +1,38 @@
+# WAL growth when backups leave checkpoints to the archiver but no archiver runs
+import os
+
+import pytest
+
+from database import Database
+
+
+@pytest.fixture
+def wal_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.delenv("SHARDS", raising=False)
+    monkeypatch.setenv("BACKUP_DIR", str(tmp_path / "backups"))
+    monkeypatch.setenv("WAL_SIZE_LIMIT_MB", "1")
+    return str(tmp_path / "freelance_flow.db")
+
+
+def write(path, size, fill="x"):
+    db = Database(path)
+    try:
+        for i in range(size // 65536):
+            db.set_meta(f"blob{i}", fill * 65536)
+    finally:
+        db.close()
+
+
+def test_wal_is_left_to_the_archiver_below_the_limit(wal_db):
+    write(wal_db, 256 * 1024)
+    write(wal_db, 256 * 1024, "y")
+    assert os.path.getsize(wal_db + "-wal") > 512 * 1024
+
+
+def test_wal_is_checkpointed_and_cut_back_past_the_limit(wal_db):
+    write(wal_db, 3 * 1024 * 1024)
+    assert os.path.getsize(wal_db + "-wal") > 1024 * 1024
+    write(wal_db, 65536, "y")
+    assert os.path.getsize(wal_db + "-wal") <= 1024 * 1024
@@ -0,0 +1,63 @@
+# Deadline calendar (deadlines.DeadlineCalendar): Monday-first month grids of task, project and
+# invoice dates, the grid cache, and the iCalendar export's escaping and line folding
+import datetime
+
+from deadlines import DeadlineCalendar
+
+
+def test_weeks_start_on_monday_and_cover_the_whole_month():
+    weeks = DeadlineCalendar.month_weeks(2026, 2)
+    assert (weeks[0][0], weeks[-1][-1]) == (datetime.date(2026, 1, 26), datetime.date(2026, 3, 1))
+    assert all(len(week) == 7 and week[0].weekday() == 0 for week in weeks)
+
+
+def test_month_grid_places_each_deadline_on_its_day(db, user_id, project_id):
+    db.add_task(project_id, "Homepage copy", "", "2026-12-03", "Not Started")
+    db.add_task(project_id, "Kickoff", "", "2027-01-02", "Not Started")
+    db.add_task(project_id, "Out of range", "", "2027-01-10", "Not Started")
+    db.add_invoice(project_id, 1000, "2026-11-30", "2026-12-30", "Unpaid", "")
+
+    grid = DeadlineCalendar(db).month_grid(user_id, 2026, 12)
+
+    cells = grid.split("<td")
+    day = next(cell for cell in cells if cell.startswith("><strong>3</strong>"))
+    assert 'title="Task due: Homepage copy (Website)"' in day
+    end = next(cell for cell in cells if "Project ends: Website (Acme)" in cell)
+    assert end.startswith("><strong>31</strong>")
+    # The last week runs into January, shown greyed out
+    kickoff = next(cell for cell in cells if "Kickoff" in cell)
+    assert kickoff.startswith(' class="other-month"><strong>2</strong>')
+    assert sum("Invoice due" in cell for cell in cells) == 1
+    assert "Out of range" not in grid
+
+
+def test_month_grids_are_reused_until_a_deadline_changes(db, user_id, project_id):
+    deadlines = DeadlineCalendar(db)
+    grid = deadlines.month_grid(user_id, 2026, 12)
+    assert deadlines.month_grid(user_id, 2026, 12) is grid
+
+    db.add_task(project_id, "Launch", "", "2026-12-15", "Not Started")
+    assert "Launch" in deadlines.month_grid(user_id, 2026, 12)
+
+    # The overdue sweep changes invoice statuses without going through a scope
+    grid = deadlines.month_grid(user_id, 2026, 12)
+    db.set_meta("last_overdue_sweep", "2026-12-01")
+    assert deadlines.month_grid(user_id, 2026, 12) is not grid
+
+
+def test_ics_export_escapes_text_and_folds_long_lines():
+    title = "Copy, layout; and \\ review" + " é" * 40
+    events = [("task", "t1", title, "2026-12-31", "Website\nPhase 2", "Not Started")]
+
+    ics = DeadlineCalendar(None).to_ics(events)
+
+    lines = ics.split(b"\r\n")
+    assert lines[:4] == [b"BEGIN:VCALENDAR", b"VERSION:2.0", b"PRODID:-//FreelanceFlow//Calendar//EN", b"CALSCALE:GREGORIAN"]
+    assert lines[-2:] == [b"END:VCALENDAR", b""]
+    assert b"DTSTART;VALUE=DATE:20261231" in lines and b"DTEND;VALUE=DATE:20270101" in lines
+    assert b"UID:task-t1@freelanceflow" in lines
+    # No line (or continuation) is over 75 octets, and multibyte characters are never split
+    assert all(len(line) <= 75 for line in lines)
+    unfolded = ics.decode("utf-8").replace("\r\n ", "")
+    assert "SUMMARY:Task due: Copy\\, layout\\; and \\\\ review" + " é" * 40 + "\r\n" in unfolded
+    assert "DESCRIPTION:Website\\nPhase 2 (Not Started)\r\n" in unfolded
@@ -0,0 +1,87 @@
+# Cash flow forecast (forecast.CashFlowForecast): actual inflows per month, open balances spread
+# over each client's weighted payment delays and bucketed into the months they should land in
+import datetime
+
+import numpy as np
+import pytest
+
+from forecast import CashFlowForecast
+
+TODAY = datetime.date(2026, 6, 15)
+
+
+@pytest.fixture(autouse=True)
+def fresh_reads(monkeypatch):
+    monkeypatch.setenv("READ_STALENESS_CASH_FLOW", "0")
+
+
+def paid_invoice(db, project_id, amount_cents, due_date, paid_on):
+    invoice_id = db.add_invoice(project_id, amount_cents, "2026-01-01", due_date, "Unpaid", "")
+    return db.add_payment(invoice_id, amount_cents, paid_on, "Bank Transfer", "")
+
+
+def test_delay_quantiles_are_weighted_by_amount():
+    profile = CashFlowForecast.delay_profile([30, 0], [1, 3])
+    assert np.allclose(profile, [0, 0, 0, 0, 4.5, 10.5, 16.5, 22.5, 28.5, 30])
+    # Without amounts every payment counts the same
+    assert np.allclose(CashFlowForecast.delay_profile([0, 30], [0, 0]), CashFlowForecast.delay_profile([0, 30], [1, 1]))
+
+
+def test_open_balances_land_in_the_months_clients_usually_pay(db, user_id, project_id):
+    # This client pays ten days after the due date
+    paid_invoice(db, project_id, 10000, "2026-04-01", "2026-04-11")
+    paid_invoice(db, project_id, 10000, "2026-05-01", "2026-05-11")
+    db.add_invoice(project_id, 30000, "2026-06-01", "2026-06-25", "Unpaid", "")
+    # Overdue and expected before today: counted from today, not in the past
+    db.add_invoice(project_id, 5000, "2026-05-01", "2026-05-20", "Unpaid", "")
+    db.add_invoice(project_id, 2000, "2026-08-01", "2026-08-28", "Unpaid", "")
+    # A client without history is expected to pay like everyone else
+    newcomer = db.add_client(user_id, "Globex", "ap@globex.test", "", "Globex", "", "")
+    other_project = db.add_project(user_id, newcomer, "Audit", "", "2026-01-01", "2026-12-31", "In Progress", 0)
+    db.add_invoice(other_project, 1000, "2026-07-01", "2026-07-20", "Unpaid", "")
+
+    report = CashFlowForecast(db).report(user_id, "USD", today=TODAY, months_back=3, horizon=2)
+
+    monthly = report["monthly"]
+    assert list(monthly.index) == ["2026-04", "2026-05", "2026-06", "2026-07", "2026-08"]
+    assert monthly["actual"].tolist() == [10000, 10000, 0, 0, 0]
+    assert monthly["projected"].tolist() == [0, 0, 5000, 31000, 0]
+    # The August invoice is expected in September, past the horizon
+    assert (report["expected_cents"], report["beyond_horizon_cents"], report["missing_currencies"]) == (38000, 2000, [])
+
+
+def test_a_spread_out_client_is_split_across_months(db, user_id, project_id):
+    paid_invoice(db, project_id, 10000, "2026-03-01", "2026-03-01")
+    paid_invoice(db, project_id, 10000, "2026-04-01", "2026-05-11")
+    db.add_invoice(project_id, 10001, "2026-06-01", "2026-06-20", "Unpaid", "")
+
+    report = CashFlowForecast(db).report(user_id, "USD", today=TODAY, months_back=1, horizon=2)
+
+    # Delays of 0 and 40 days: the quantiles interpolate 0, 0, 0, 8, 16, ... 40, so four tenths
+    # land by June 28 and six in July; each month's share is rounded once
+    assert report["monthly"]["projected"].tolist() == [4000, 6001, 0]
+    assert report["expected_cents"] == 10001
+
+
+def test_trends_average_complete_months(db, user_id, project_id):
+    for month, amount in [(3, 30000), (4, 60000), (5, 90000)]:
+        paid_invoice(db, project_id, amount, f"2026-{month:02d}-01", f"2026-{month:02d}-10")
+
+    trends = CashFlowForecast(db).report(user_id, "USD", today=TODAY)["trends"]
+
+    assert list(trends) == [3]
+    assert (trends[3]["average_cents"], trends[3]["slope_cents"]) == (60000, 30000)
+
+
+def test_history_folds_in_new_payments_and_rebuilds_after_edits(db, user_id, project_id):
+    forecast = CashFlowForecast(db)
+    paid_invoice(db, project_id, 10000, "2026-04-01", "2026-04-11")
+    assert forecast.history(user_id)["revenue"] == {("USD", "2026-04-11"): 10000}
+
+    later = paid_invoice(db, project_id, 5000, "2026-05-01", "2026-05-06")
+    state = forecast.history(user_id)
+    assert state["revenue"] == {("USD", "2026-04-11"): 10000, ("USD", "2026-05-06"): 5000}
+    assert state["delays"][next(iter(state["delays"]))] == ([10, 5], [10000, 5000])
+
+    db.delete_payment(later)
+    assert forecast.history(user_id)["revenue"] == {("USD", "2026-04-11"): 10000}
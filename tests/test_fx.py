@@ -0,0 +1,85 @@
+# Currency conversion (fx.CurrencyConverter): the rate of each amount's day, totals rounded half
+# up once, receivables aging in one currency, and the drop-in rates file
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fx import CurrencyConverter
+
+
+@pytest.fixture
+def converter(db):
+    # Units of each currency per US dollar
+    db.save_fx_rates("USD", [
+        ("2026-01-01", "EUR", 0.8), ("2026-02-01", "EUR", 0.5),
+        ("2026-02-01", "GBP", 0.25),
+    ])
+    return CurrencyConverter(db)
+
+
+def test_amounts_use_the_latest_rate_on_or_before_their_day(converter):
+    frame = pd.DataFrame({
+        "amount_cents": [800, 800, 500, 100, 100, 100],
+        "currency": ["EUR", "EUR", "EUR", "GBP", "USD", "JPY"],
+        "day": ["2026-01-15", "2025-06-01", "2026-03-01", "2026-01-15", "2026-01-15", "2026-01-15"],
+    })
+
+    converted = converter.convert(frame, "USD")
+
+    # 2025 predates every EUR rate, so the first one stands in; GBP's first rate is a later one too
+    assert converted.tolist()[:5] == [1000.0, 1000.0, 1000.0, 400.0, 100.0]
+    assert np.isnan(converted.iloc[5])
+
+    # Between two non-base currencies, through the base, at the day's rates
+    euros = converter.convert(pd.DataFrame({"amount_cents": [250], "currency": ["GBP"], "day": ["2026-02-15"]}), "EUR")
+    assert euros.tolist() == [500.0]
+
+
+def test_revenue_is_rounded_half_up_once_for_the_total(converter):
+    # 1 euro cent is 1.25 US cents in January: rounding each would give 3, not 4
+    rows = [("EUR", "2026-01-10", 1)] * 3 + [("JPY", "2026-01-10", 5000)]
+
+    revenue = converter.revenue(rows, "USD")
+
+    assert revenue == {"total_cents": 4, "missing_currencies": ["JPY"]}
+    assert converter.revenue([("EUR", "2026-01-10", 2)], "USD")["total_cents"] == 3
+
+
+def test_aging_buckets_outstanding_amounts_at_todays_rates(converter):
+    today = datetime.date(2026, 3, 31)
+    rows = [
+        ("a", "USD", "2026-04-15", 1000, "c1"),
+        ("b", "EUR", "2026-03-21", 500, "c1"),
+        ("c", "USD", "2026-02-14", 300, "c2"),
+        ("d", "GBP", "2026-01-10", 100, "c2"),
+        ("e", "USD", "2025-11-01", 700, "c3"),
+        ("f", "JPY", "2025-11-01", 9999, "c3"),
+    ]
+
+    aging = converter.aging(rows, "USD", today=today)
+
+    buckets = aging["buckets"]
+    assert list(buckets.index) == CurrencyConverter.AGING_BUCKETS
+    assert buckets["invoices"].tolist() == [1, 1, 1, 1, 2]
+    assert buckets["amount"].tolist() == [1000, 1000, 300, 400, 700]
+    assert (aging["total_cents"], aging["overdue_cents"], aging["missing_currencies"]) == (3400, 2400, ["JPY"])
+
+
+def test_rates_file_is_loaded_once_per_change(db, tmp_path):
+    path = tmp_path / CurrencyConverter.RATES_FILE
+    path.write_text("date,base,currency,rate\n2026-01-01,usd,eur,0.8\n")
+    converter = CurrencyConverter(db)
+
+    rates = converter.rates()
+    assert sorted(zip(rates["currency"], rates["rate"])) == [("EUR", 0.8), ("USD", 1.0)]
+    version = db.get_meta("fx_version")
+    converter.rates()
+    assert db.get_meta("fx_version") == version
+
+    with pytest.raises(ValueError, match="same base"):
+        CurrencyConverter.read_rates_file(io.StringIO("date,base,currency,rate\n2026-01-01,USD,EUR,0.8\n2026-01-01,EUR,GBP,0.9\n"))
+    with pytest.raises(ValueError, match="rate"):
+        CurrencyConverter.read_rates_file(io.StringIO("date,base,currency\n2026-01-01,USD,EUR\n"))
@@ -0,0 +1,101 @@
+# Invoices built from unbilled time: one line per project, task and rate priced from the exact
+# seconds, only the billed entries and completed tasks marked, and grid edits that keep those amounts
+import datetime
+
+from billing import InvoiceBuilder
+
+
+def log(db, user_id, project_id, task_id, seconds, rate_cents, billable=1, started_at="2026-03-02 09:00:00"):
+    return db.add_time_entry(user_id, project_id, task_id, started_at, seconds, rate_cents, billable, "")
+
+
+def invoice_of_entries(db, entry_ids):
+    placeholders = ", ".join("?" for _ in entry_ids)
+    db.cursor.execute(f"SELECT id, invoice_id FROM time_entries WHERE id IN ({placeholders}) ORDER BY id", list(entry_ids))
+    return dict(db.cursor.fetchall())
+
+
+def billed_invoice_of_task(db, task_id):
+    db.cursor.execute("SELECT billed_invoice_id FROM tasks WHERE id = ?", (task_id,))
+    return db.cursor.fetchone()[0]
+
+
+def invoice_amount(db, invoice_id):
+    db.cursor.execute("SELECT amount_cents FROM invoices WHERE id = ?", (invoice_id,))
+    return db.cursor.fetchone()[0]
+
+
+def test_lines_group_by_task_and_rate_and_price_the_exact_seconds(db, user_id, project_id):
+    design = db.add_task(project_id, "Design", "", None, "Completed")
+    log(db, user_id, project_id, design, 1000, 10000)
+    log(db, user_id, project_id, design, 1000, 10000)
+    log(db, user_id, project_id, design, 3600, 15000)
+    log(db, user_id, project_id, None, 1800, 10000)
+    log(db, user_id, project_id, None, 7200, 10000, billable=0)
+
+    entries, lines = InvoiceBuilder(db).preview(user_id)
+
+    assert len(entries) == 4
+    assert sorted(zip(lines['task_name'], lines['hourly_rate_cents'], lines['seconds'], lines['entries'], lines['hours'], lines['amount_cents'])) == [
+        # 2000 s at $100/h is 5555.55... cents: rounded once per line, not per entry
+        ("Design", 10000, 2000, 2, 0.56, 5556),
+        ("Design", 15000, 3600, 1, 1.0, 15000),
+        ("General work", 10000, 1800, 1, 0.5, 5000),
+    ]
+
+
+def test_tasks_mode_bills_only_completed_tasks(db, user_id, project_id):
+    done = db.add_task(project_id, "Logo", "", None, "Completed")
+    open_task = db.add_task(project_id, "Homepage", "", None, "In Progress")
+    log(db, user_id, project_id, done, 3600, 10000)
+    log(db, user_id, project_id, open_task, 3600, 10000)
+    log(db, user_id, project_id, None, 3600, 10000)
+
+    entries, lines = InvoiceBuilder(db).preview(user_id, mode="tasks")
+
+    assert list(lines['task_name']) == ["Logo"]
+    assert list(entries['task_id']) == [done]
+
+
+def test_build_marks_only_the_billed_entries_and_tasks(db, user_id, project_id):
+    done = db.add_task(project_id, "Logo", "", None, "Completed")
+    open_task = db.add_task(project_id, "Homepage", "", None, "In Progress")
+    billed = [log(db, user_id, project_id, done, 1000, 10000), log(db, user_id, project_id, done, 1000, 10000)]
+    later = log(db, user_id, project_id, done, 3600, 10000, started_at="2026-04-01 09:00:00")
+    open_entry = log(db, user_id, project_id, open_task, 3600, 10000)
+    free = log(db, user_id, project_id, None, 3600, 10000, billable=0)
+
+    [invoice_id] = InvoiceBuilder(db).build(user_id, until="2026-03-31", mode="tasks", issue_date=datetime.date(2026, 3, 31))
+
+    assert invoice_of_entries(db, [*billed, later, open_entry, free]) == {
+        billed[0]: invoice_id, billed[1]: invoice_id, later: None, open_entry: None, free: None
+    }
+    assert billed_invoice_of_task(db, done) == invoice_id
+    assert billed_invoice_of_task(db, open_task) is None
+    assert invoice_amount(db, invoice_id) == 5556
+    assert [(item[1], item[2], item[3], item[4], item[5]) for item in db.get_invoice_items(invoice_id)] == [
+        ("Logo", 0.56, 10000, 5556, "task")
+    ]
+
+    # Billed entries are not offered again
+    assert InvoiceBuilder(db).build(user_id, until="2026-03-31", mode="tasks") == []
+
+
+def test_editing_a_built_item_keeps_its_amount_unless_it_is_repriced(db, user_id, project_id):
+    log(db, user_id, project_id, None, 1000, 10000)
+    [invoice_id] = InvoiceBuilder(db).build(user_id)
+    [item] = db.get_invoice_items(invoice_id)
+    assert (item[2], item[4]) == (0.28, 2778)
+
+    # 0.28 h x $100 would be 2800: a description edit must not reprice the rounded hours
+    db.update_invoice_items(invoice_id, changed=[(item[0], "Support", item[2], item[3], 0, 0)])
+    assert invoice_amount(db, invoice_id) == 2778
+
+    # Tax applies to the saved amount while the hours and rate stay as they were
+    db.update_invoice_items(invoice_id, changed=[(item[0], "Support", item[2], item[3], 10, 0)])
+    assert invoice_amount(db, invoice_id) == 3056
+    db.update_invoice_items(invoice_id, changed=[(item[0], "Support hours", item[2], item[3], 10, 0)])
+    assert invoice_amount(db, invoice_id) == 3056
+
+    db.update_invoice_items(invoice_id, changed=[(item[0], "Support hours", 0.5, item[3], 10, 0)])
+    assert invoice_amount(db, invoice_id) == 5500
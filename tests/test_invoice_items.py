@@ -0,0 +1,73 @@
+# Invoice line items and the cached invoice total (Database.update_invoice_items)
+import pytest
+
+
+def invoice(db, invoice_id):
+    db.cursor.execute("SELECT amount_cents, status FROM invoices WHERE id = ?", (invoice_id,))
+    return db.cursor.fetchone()
+
+
+def test_line_amounts_round_each_step_to_the_cent(db, project_id):
+    invoice_id = db.add_invoice(project_id, 0, "2026-01-01", "2999-01-31", "Unpaid", "")
+
+    db.add_invoice_items(invoice_id, [("Design", 1.5, 3333, 20, 10), ("Hosting", 1, 1000, 0, 0)])
+
+    items = db.get_invoice_items(invoice_id)
+    # 1.5 x 33.33 = 49.995 -> 50.00, less 10% = 45.00, plus 20% tax = 54.00
+    assert [item[4] for item in items] == [5400, 1000]
+    assert invoice(db, invoice_id) == (6400, "Unpaid")
+
+
+def test_first_item_on_a_manual_invoice_adds_to_its_amount(db, project_id):
+    invoice_id = db.add_invoice(project_id, 20000, "2026-01-01", "2999-01-31", "Unpaid", "")
+    db.add_payment(invoice_id, 20000, "2026-01-15", "Bank Transfer", "")
+    assert invoice(db, invoice_id) == (20000, "Paid")
+
+    db.add_invoice_items(invoice_id, [("Extra revision", 1, 2090, 0, 0)])
+
+    items = db.get_invoice_items(invoice_id)
+    assert [(item[1], item[4]) for item in items] == [("Invoice amount", 20000), ("Extra revision", 2090)]
+    assert invoice(db, invoice_id) == (22090, "Partially Paid")
+
+
+def test_editing_the_seeded_item_changes_the_amount(db, project_id):
+    invoice_id = db.add_invoice(project_id, 20000, "2026-01-01", "2999-01-31", "Unpaid", "")
+    db.add_invoice_items(invoice_id, [("Extra revision", 1, 2090, 0, 0)])
+    seeded = db.get_invoice_items(invoice_id)[0]
+
+    db.update_invoice_items(invoice_id, changed=[(seeded[0], "Website build", 1, 18000, 0, 0)])
+
+    assert invoice(db, invoice_id) == (20090, "Unpaid")
+
+
+def test_removing_the_last_item_is_refused(db, project_id):
+    invoice_id = db.add_invoice(project_id, 20000, "2026-01-01", "2999-01-31", "Unpaid", "")
+    db.add_payment(invoice_id, 5000, "2026-01-15", "Bank Transfer", "")
+    db.add_invoice_items(invoice_id, [("Extra revision", 1, 2090, 0, 0)])
+    item_ids = [item[0] for item in db.get_invoice_items(invoice_id)]
+
+    with pytest.raises(ValueError):
+        db.update_invoice_items(invoice_id, deleted_ids=item_ids)
+
+    assert len(db.get_invoice_items(invoice_id)) == 2
+    assert invoice(db, invoice_id) == (22090, "Partially Paid")
+
+
+def test_items_can_be_replaced_in_one_save(db, project_id):
+    invoice_id = db.add_invoice(project_id, 0, "2026-01-01", "2999-01-31", "Unpaid", "")
+    db.add_invoice_items(invoice_id, [("Draft", 1, 1000, 0, 0)])
+    draft = db.get_invoice_items(invoice_id)[0][0]
+
+    db.update_invoice_items(invoice_id, added=[("Final", 2, 1500, 0, 0)], deleted_ids=[draft])
+
+    assert [item[1] for item in db.get_invoice_items(invoice_id)] == ["Final"]
+    assert invoice(db, invoice_id) == (3000, "Unpaid")
+
+
+def test_totals_leave_invoices_without_items_alone(db, project_id):
+    invoice_id = db.add_invoice(project_id, 20000, "2026-01-01", "2999-01-31", "Unpaid", "")
+
+    db.update_invoice_totals([invoice_id])
+    db.conn.commit()
+
+    assert invoice(db, invoice_id) == (20000, "Unpaid")
@@ -0,0 +1,105 @@
+# The worker pool (jobs.JobQueue): per-type concurrency caps, exponential retry backoff, and
+# card details that only ever live in memory
+import datetime
+import threading
+
+import jobs
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def job_row(db, job_id):
+    db.cursor.execute("SELECT status, attempts, error, run_after, payload FROM jobs WHERE id = ?", (job_id,))
+    return db.cursor.fetchone()
+
+
+def seconds_until(run_after):
+    return (datetime.datetime.strptime(run_after, TIME_FORMAT) - datetime.datetime.now()).total_seconds()
+
+
+def noop(db, user_id, payload, progress):
+    return {}
+
+
+def test_claims_stop_at_each_types_concurrency_limit(db):
+    queue = jobs.JobQueue(db.db_name)
+    queue.register("export", noop, concurrency=1)
+    queue.register("upgrade", noop, concurrency=2)
+    for job_type in ["export", "export", "upgrade", "upgrade", "upgrade"]:
+        db.enqueue_job(None, job_type, {})
+
+    claimed = [queue._claim(db) for _ in range(5)]
+
+    # The second export and third upgrade wait for a slot
+    assert [job["job_type"] if job else None for job in claimed] == ["export", "upgrade", "upgrade", None, None]
+    assert queue.running == {"export": 1, "upgrade": 2}
+
+    queue.running["export"] -= 1
+    assert queue._claim(db)["job_type"] == "export"
+
+
+def test_failures_back_off_exponentially_then_fail(db):
+    queue = jobs.JobQueue(db.db_name)
+
+    def flaky(db, user_id, payload, progress):
+        raise RuntimeError("gateway timeout")
+
+    queue.register("report", flaky)
+    job_id = db.enqueue_job(None, "report", {}, max_attempts=3)
+
+    delays = []
+    for attempt in range(1, 3):
+        job = db.claim_job(["report"])
+        assert job["attempts"] == attempt
+        queue._run(db, job)
+        status, attempts, error, run_after, payload = job_row(db, job_id)
+        assert (status, error) == ("queued", "gateway timeout")
+        delays.append(seconds_until(run_after))
+        db.cursor.execute("UPDATE jobs SET run_after = ? WHERE id = ?", ("2000-01-01 00:00:00", job_id))
+        db.conn.commit()
+
+    # 2 ** attempts seconds, to the second
+    assert 1 <= delays[0] <= 2 and 3 <= delays[1] <= 4
+
+    queue._run(db, db.claim_job(["report"]))
+    assert job_row(db, job_id)[:3] == ("failed", 3, "gateway timeout")
+    assert db.claim_job(["report"]) is None
+
+
+def test_transient_payload_reaches_the_handler_but_not_the_table(db, user_id):
+    queue = jobs.JobQueue(db.db_name, workers=1, poll_interval=0.05)
+    seen = []
+    done = threading.Event()
+
+    def charge(db, user_id, payload, progress):
+        seen.append(payload)
+        done.set()
+        return {"charged": True}
+
+    queue.register("charge", charge)
+    queue.start()
+    try:
+        job_id = queue.submit(db, user_id, "charge", {"plan_type": "monthly"}, transient={"card_number": "4242424242424242"})
+        assert done.wait(5)
+    finally:
+        queue.stop()
+
+    assert seen == [{"plan_type": "monthly", "card_number": "4242424242424242"}]
+    status, attempts, error, run_after, payload = job_row(db, job_id)
+    assert status == "succeeded" and "4242" not in payload
+    assert queue.transient == {}
+
+
+def test_upgrade_job_refuses_to_run_without_card_details(db, user_id):
+    queue = jobs.build_queue()
+    queue.db_name = db.db_name
+    job_id = queue.submit(db, user_id, "upgrade_subscription", {"plan_type": "annual"}, max_attempts=1)
+
+    # As after a restart: the card details were only ever in the old process's memory
+    queue.transient.clear()
+    queue._run(db, db.claim_job(["upgrade_subscription"]))
+
+    status, attempts, error, run_after, payload = job_row(db, job_id)
+    assert status == "failed" and "Payment details expired" in error
+    db.cursor.execute("SELECT subscription_type FROM users WHERE id = ?", (user_id,))
+    assert db.cursor.fetchone() == ("free",)
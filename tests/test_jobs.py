@@ -0,0 +1,118 @@
+# Job queue claims, retries and lease expiry (Database.claim_job / fail_job, used by jobs.JobQueue)
+import datetime
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def ago(seconds):
+    return (datetime.datetime.now() - datetime.timedelta(seconds=seconds)).strftime(TIME_FORMAT)
+
+
+def job_row(db, job_id):
+    db.cursor.execute("SELECT status, attempts, error, run_after FROM jobs WHERE id = ?", (job_id,))
+    return db.cursor.fetchone()
+
+
+def test_claim_takes_highest_priority_first(db):
+    low = db.enqueue_job(None, "report", {"n": 1})
+    high = db.enqueue_job(None, "report", {"n": 2}, priority=5)
+
+    first = db.claim_job(["report"])
+    second = db.claim_job(["report"])
+
+    assert (first["id"], first["payload"], first["attempts"]) == (high, {"n": 2}, 1)
+    assert second["id"] == low
+    assert db.claim_job(["report"]) is None
+
+
+def test_claim_only_hands_out_requested_types_once(db):
+    job_id = db.enqueue_job(None, "email", {})
+
+    assert db.claim_job(["report"]) is None
+    assert db.claim_job([]) is None
+    assert db.claim_job(["email"])["id"] == job_id
+    assert db.claim_job(["email"]) is None
+    assert job_row(db, job_id)[0] == "running"
+
+
+def test_delayed_job_waits_for_run_after(db):
+    job_id = db.enqueue_job(None, "report", {}, delay_seconds=60)
+
+    assert db.claim_job(["report"]) is None
+    db.cursor.execute("UPDATE jobs SET run_after = ? WHERE id = ?", (ago(1), job_id))
+    db.conn.commit()
+    assert db.claim_job(["report"])["id"] == job_id
+
+
+def test_failed_job_is_retried_after_its_delay(db):
+    job_id = db.enqueue_job(None, "report", {}, max_attempts=2)
+    db.claim_job(["report"])
+
+    db.fail_job(job_id, "timeout", retry_delay_seconds=30)
+
+    status, attempts, error, run_after = job_row(db, job_id)
+    assert (status, attempts, error) == ("queued", 1, "timeout")
+    assert run_after > datetime.datetime.now().strftime(TIME_FORMAT)
+    assert db.claim_job(["report"]) is None
+
+    db.cursor.execute("UPDATE jobs SET run_after = ? WHERE id = ?", (ago(1), job_id))
+    db.conn.commit()
+    retry = db.claim_job(["report"])
+    assert (retry["id"], retry["attempts"], retry["max_attempts"]) == (job_id, 2, 2)
+    assert job_row(db, job_id)[2] is None
+
+
+def test_job_without_retry_fails_for_good(db):
+    job_id = db.enqueue_job(None, "report", {})
+    db.claim_job(["report"])
+
+    db.fail_job(job_id, "bad payload")
+
+    assert job_row(db, job_id)[:3] == ("failed", 1, "bad payload")
+    assert db.claim_job(["report"]) is None
+    assert not db.has_pending_job("report")
+
+
+def test_job_whose_worker_stopped_heartbeating_is_reclaimed(db):
+    job_id = db.enqueue_job(None, "report", {})
+    db.claim_job(["report"])
+    assert db.claim_job(["report"], stale_after_seconds=300) is None
+
+    db.cursor.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (ago(301), job_id))
+    db.conn.commit()
+    reclaimed = db.claim_job(["report"], stale_after_seconds=300)
+
+    assert (reclaimed["id"], reclaimed["attempts"]) == (job_id, 2)
+
+
+def test_progress_renews_the_lease(db):
+    job_id = db.enqueue_job(None, "report", {})
+    db.claim_job(["report"])
+    db.cursor.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (ago(301), job_id))
+    db.conn.commit()
+
+    db.update_job_progress(job_id, 0.5)
+
+    assert db.claim_job(["report"], stale_after_seconds=300) is None
+
+
+def test_completed_job_keeps_its_result(db):
+    job_id = db.enqueue_job(None, "report", {})
+    db.claim_job(["report"])
+
+    db.complete_job(job_id, {"rows": 3})
+
+    job = db.get_job(job_id)
+    assert (job[2], job[3], job[5]) == ("succeeded", 1, '{"rows": 3}')
+    assert not db.has_pending_job("report")
+
+
+def test_stale_job_without_attempts_left_is_failed_not_rerun(db):
+    # A payment (max_attempts=1) whose worker missed its heartbeat may still be charging the card
+    job_id = db.enqueue_job(None, "upgrade_subscription", {}, max_attempts=1)
+    db.claim_job(["upgrade_subscription"])
+    db.cursor.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (ago(301), job_id))
+    db.conn.commit()
+
+    assert db.claim_job(["upgrade_subscription"], stale_after_seconds=300) is None
+    assert job_row(db, job_id)[:3] == ("failed", 1, "Worker stopped responding")
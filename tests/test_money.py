@@ -0,0 +1,121 @@
+# Integer-cent money: input conversion, the REAL column migration and exact payment totals
+import random
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from database import Database, to_cents
+
+SHIPPED_DB = Path(__file__).resolve().parent.parent / "freelance_flow.db"
+
+
+@pytest.mark.parametrize("amount, cents", [
+    (0, 0), (None, 0), (19.99, 1999), ("19.99", 1999), (0.1 + 0.2, 30),
+    (1.005, 101), (2.675, 268), (0.285, 29), (0.125, 13), (1234567.895, 123456790), (-1.005, -101),
+])
+def test_to_cents_rounds_half_up_as_written(amount, cents):
+    assert to_cents(amount) == cents
+
+
+def test_real_columns_migrate_to_cents_like_to_cents(tmp_path, monkeypatch):
+    # The shipped database still has the original REAL columns
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "legacy.db"
+    shutil.copy(SHIPPED_DB, path)
+    amounts = [1.005, 2.675, 0.285, 0.1 + 0.2, 19.99, 1234567.895, 1e-9, 0.0]
+    legacy = sqlite3.connect(path)
+    invoice_id, invoice_amount = legacy.execute("SELECT id, amount FROM invoices LIMIT 1").fetchone()
+    project_id, budget = legacy.execute("SELECT id, budget FROM projects LIMIT 1").fetchone()
+    legacy.executemany(
+        "INSERT INTO payments (id, invoice_id, amount, payment_date, payment_method, notes, created_at) VALUES (?, ?, ?, '2026-01-01', 'Cash', '', '2026-01-01 00:00:00')",
+        [(f"legacy-{i}", invoice_id, amount) for i, amount in enumerate(amounts)]
+    )
+    legacy.commit()
+    legacy.close()
+
+    db = Database(str(path))
+    try:
+        db.cursor.execute("SELECT id, amount_cents FROM payments WHERE id LIKE 'legacy-%'")
+        migrated = dict(db.cursor.fetchall())
+        assert [migrated[f"legacy-{i}"] for i in range(len(amounts))] == [to_cents(amount) for amount in amounts]
+        db.cursor.execute("SELECT amount_cents FROM invoices WHERE id = ?", (invoice_id,))
+        assert db.cursor.fetchone()[0] == to_cents(invoice_amount)
+        db.cursor.execute("SELECT budget_cents FROM projects WHERE id = ?", (project_id,))
+        assert db.cursor.fetchone()[0] == to_cents(budget)
+        assert "amount" not in db.backend.columns(db.cursor, "payments")
+    finally:
+        db.close()
+
+
+def invoice_status(db, invoice_id):
+    db.cursor.execute("SELECT status FROM invoices WHERE id = ?", (invoice_id,))
+    return db.cursor.fetchone()[0]
+
+
+def test_thousands_of_dimes_settle_an_invoice_exactly(db, project_id):
+    # As floats, 3000 x 0.1 sums to 300.0000000000056 and 2999 x 0.1 to 299.90000000000555
+    invoice_id = db.add_invoice(project_id, to_cents(300), "2026-01-01", "2999-01-31", "Unpaid", "")
+    for _ in range(2999):
+        db.add_payment(invoice_id, to_cents(0.1), "2026-01-15", "Card", "")
+    assert invoice_status(db, invoice_id) == "Partially Paid"
+
+    db.add_payment(invoice_id, to_cents(0.1), "2026-01-15", "Card", "")
+
+    db.cursor.execute("SELECT COUNT(*), SUM(amount_cents) FROM payments WHERE invoice_id = ?", (invoice_id,))
+    assert db.cursor.fetchone() == (3000, 30000)
+    assert invoice_status(db, invoice_id) == "Paid"
+
+
+def test_invoice_split_into_fractional_payments_sums_exactly(db, project_id):
+    total = to_cents(98765.43)
+    invoice_id = db.add_invoice(project_id, total, "2026-01-01", "2999-01-31", "Unpaid", "")
+    rng = random.Random(33)
+    # Random fractional shares entered as decimal amounts; the last payment settles the rest
+    shares = [rng.uniform(0.01, 49.99) for _ in range(2500)]
+    paid = 0
+    for share in shares:
+        cents = to_cents(round(share, 2))
+        db.add_payment(invoice_id, cents, "2026-01-15", "Card", "")
+        paid += cents
+    assert 0 < paid < total
+    assert invoice_status(db, invoice_id) == "Partially Paid"
+
+    db.add_payment(invoice_id, total - paid, "2026-01-16", "Bank Transfer", "")
+
+    db.cursor.execute("SELECT SUM(amount_cents) FROM payments WHERE invoice_id = ?", (invoice_id,))
+    assert db.cursor.fetchone()[0] == total
+    assert invoice_status(db, invoice_id) == "Paid"
+
+
+@pytest.mark.parametrize("paid, due_date, status", [
+    (0, "2999-01-31", "Unpaid"),
+    (0, "2026-01-31", "Overdue"),
+    (1, "2999-01-31", "Partially Paid"),
+    (9999, "2999-01-31", "Partially Paid"),
+    (9999, "2026-01-31", "Overdue"),
+    (10000, "2999-01-31", "Paid"),
+    (10000, "2026-01-31", "Paid"),
+    (10001, "2999-01-31", "Paid"),
+])
+def test_refresh_invoice_status_boundaries(db, project_id, paid, due_date, status):
+    invoice_id = db.add_invoice(project_id, 10000, "2026-01-01", due_date, "Unpaid", "")
+    if paid:
+        db.add_payment(invoice_id, paid, "2026-01-15", "Card", "")
+
+    db.refresh_invoice_status(invoice_id)
+
+    assert invoice_status(db, invoice_id) == status
+
+
+def test_trashed_payment_no_longer_counts(db, project_id):
+    invoice_id = db.add_invoice(project_id, 10000, "2026-01-01", "2999-01-31", "Unpaid", "")
+    db.add_payment(invoice_id, 4000, "2026-01-15", "Card", "")
+    db.add_payment(invoice_id, 6000, "2026-01-16", "Card", "")
+    assert invoice_status(db, invoice_id) == "Paid"
+
+    db.cursor.execute("SELECT id FROM payments WHERE invoice_id = ? AND amount_cents = 6000", (invoice_id,))
+    db.delete_payment(db.cursor.fetchone()[0])
+
+    assert invoice_status(db, invoice_id) == "Partially Paid"
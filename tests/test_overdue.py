@@ -0,0 +1,44 @@
+# Daily overdue sweep (Database.sweep_overdue_invoices)
+def status(db, invoice_id):
+    db.cursor.execute("SELECT status FROM invoices WHERE id = ?", (invoice_id,))
+    return db.cursor.fetchone()[0]
+
+
+def test_sweep_marks_open_past_due_invoices_overdue(db, user_id, project_id):
+    late = db.add_invoice(project_id, 10000, "2026-01-01", "2026-01-31", "Unpaid", "")
+    partly_paid = db.add_invoice(project_id, 10000, "2026-01-01", "2026-01-31", "Partially Paid", "")
+    paid = db.add_invoice(project_id, 10000, "2026-01-01", "2026-01-31", "Paid", "")
+    not_due = db.add_invoice(project_id, 10000, "2026-01-01", "2999-01-31", "Unpaid", "")
+
+    assert db.sweep_overdue_invoices() == 2
+
+    assert [status(db, i) for i in (late, partly_paid, paid, not_due)] == ["Overdue", "Overdue", "Paid", "Unpaid"]
+
+
+def test_sweep_runs_once_a_day_unless_forced(db, user_id, project_id):
+    assert db.sweep_overdue_invoices() == 0
+    db.add_invoice(project_id, 10000, "2026-01-01", "2026-01-31", "Unpaid", "")
+
+    assert db.sweep_overdue_invoices() is None
+    assert db.sweep_overdue_invoices(force=True) == 1
+
+
+def test_sweep_leaves_trashed_invoices_alone(db, user_id, project_id):
+    trashed = db.add_invoice(project_id, 10000, "2026-01-01", "2026-01-31", "Unpaid", "")
+    db.delete_invoice(trashed)
+    db.cursor.execute("SELECT version FROM invoices WHERE id = ?", (trashed,))
+    version = db.cursor.fetchone()[0]
+
+    assert db.sweep_overdue_invoices() == 0
+
+    db.cursor.execute("SELECT status, version FROM invoices WHERE id = ?", (trashed,))
+    assert db.cursor.fetchone() == ("Unpaid", version)
+
+
+def test_sweep_invalidates_cached_invoice_lists(db, user_id, project_id):
+    db.add_invoice(project_id, 10000, "2026-01-01", "2026-01-31", "Unpaid", "")
+    before = db.get_data_versions(user_id)["invoices"]
+
+    db.sweep_overdue_invoices()
+
+    assert db.get_data_versions(user_id)["invoices"] > before
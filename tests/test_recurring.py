@@ -0,0 +1,100 @@
+# Recurring invoice templates: cadences counted from the start date, month-end clamping,
+# end dates, and pause/resume skipping the paused periods instead of billing them
+import datetime
+
+import pytest
+
+from billing import RecurringInvoiceScheduler, add_months
+
+
+def billed_dates(db, project_id):
+    db.cursor.execute("SELECT issue_date FROM invoices WHERE project_id = ? ORDER BY issue_date", (project_id,))
+    return [row[0] for row in db.cursor.fetchall()]
+
+
+def template_state(db, recurring_id):
+    db.cursor.execute("SELECT next_run_date, active FROM recurring_invoices WHERE id = ?", (recurring_id,))
+    return db.cursor.fetchone()
+
+
+@pytest.mark.parametrize("cadence, expected", [
+    ("Weekly", ["2026-01-05", "2026-01-12", "2026-01-19", "2026-01-26"]),
+    ("Monthly", ["2026-01-05", "2026-02-05", "2026-03-05", "2026-04-05"]),
+    ("Quarterly", ["2026-01-05", "2026-04-05", "2026-07-05", "2026-10-05"]),
+    ("Yearly", ["2026-01-05", "2027-01-05", "2028-01-05", "2029-01-05"]),
+])
+def test_cadences(cadence, expected):
+    scheduler = RecurringInvoiceScheduler(db=None)
+    start = datetime.date(2026, 1, 5)
+    periods = [start]
+    for index in range(3):
+        periods.append(scheduler.next_period(start, cadence, periods[-1]))
+    assert [period.isoformat() for period in periods] == expected
+
+
+def test_month_end_start_dates_clamp_without_drifting():
+    assert add_months(datetime.date(2026, 1, 31), 1) == datetime.date(2026, 2, 28)
+    assert add_months(datetime.date(2028, 1, 31), 1) == datetime.date(2028, 2, 29)
+    assert add_months(datetime.date(2026, 11, 30), 3) == datetime.date(2027, 2, 28)
+
+    scheduler = RecurringInvoiceScheduler(db=None)
+    start = datetime.date(2026, 1, 31)
+    periods = [start]
+    for index in range(3):
+        periods.append(scheduler.next_period(start, "Monthly", periods[-1]))
+    # Back to the 31st after February rather than sticking to the 28th
+    assert [period.isoformat() for period in periods] == ["2026-01-31", "2026-02-28", "2026-03-31", "2026-04-30"]
+
+
+def test_run_catches_up_and_stops_at_the_end_date(db, user_id, project_id):
+    recurring_id = db.add_recurring_invoice(user_id, project_id, 100000, "Monthly", "2026-01-31", "2026-04-15", 14, "Retainer")
+    scheduler = RecurringInvoiceScheduler(db)
+
+    assert scheduler.run(datetime.date(2026, 2, 28)) == 2
+    assert billed_dates(db, project_id) == ["2026-01-31", "2026-02-28"]
+    assert template_state(db, recurring_id) == ("2026-03-31", 1)
+
+    # The April 30 period is past the end date: the template finishes instead of billing it
+    assert scheduler.run(datetime.date(2026, 12, 31)) == 1
+    assert billed_dates(db, project_id) == ["2026-01-31", "2026-02-28", "2026-03-31"]
+    assert template_state(db, recurring_id) == ("2026-04-30", 0)
+    assert scheduler.run(datetime.date(2027, 12, 31)) == 0
+
+    db.cursor.execute("SELECT due_date, amount_cents, notes FROM invoices WHERE issue_date = '2026-02-28'")
+    assert db.cursor.fetchone() == ("2026-03-14", 100000, "Retainer")
+
+
+def test_paused_periods_are_not_billed_on_resume(db, user_id, project_id):
+    recurring_id = db.add_recurring_invoice(user_id, project_id, 50000, "Weekly", "2026-03-02", None, 7, "")
+    scheduler = RecurringInvoiceScheduler(db)
+    assert scheduler.run(datetime.date(2026, 3, 2)) == 1
+
+    scheduler.pause(recurring_id)
+    assert scheduler.run(datetime.date(2026, 4, 1)) == 0
+
+    # Resumed on Wednesday April 1: March 9..30 are skipped, billing picks up on Monday April 6
+    assert scheduler.resume(recurring_id, today=datetime.date(2026, 4, 1))
+    assert template_state(db, recurring_id) == ("2026-04-06", 1)
+    assert scheduler.run(datetime.date(2026, 4, 6)) == 1
+    assert billed_dates(db, project_id) == ["2026-03-02", "2026-04-06"]
+
+
+def test_resume_on_a_period_date_bills_that_period(db, user_id, project_id):
+    recurring_id = db.add_recurring_invoice(user_id, project_id, 50000, "Monthly", "2026-01-15", None, 7, "")
+    scheduler = RecurringInvoiceScheduler(db)
+    scheduler.pause(recurring_id)
+
+    scheduler.resume(recurring_id, today=datetime.date(2026, 3, 15))
+    assert template_state(db, recurring_id) == ("2026-03-15", 1)
+    assert scheduler.run(datetime.date(2026, 3, 15)) == 1
+    assert billed_dates(db, project_id) == ["2026-03-15"]
+
+
+def test_resume_after_the_end_date_leaves_the_template_finished(db, user_id, project_id):
+    recurring_id = db.add_recurring_invoice(user_id, project_id, 50000, "Monthly", "2026-01-15", "2026-03-01", 7, "")
+    scheduler = RecurringInvoiceScheduler(db)
+    scheduler.pause(recurring_id)
+
+    assert not scheduler.resume(recurring_id, today=datetime.date(2026, 6, 1))
+    assert template_state(db, recurring_id) == ("2026-06-15", 0)
+    assert scheduler.run(datetime.date(2026, 12, 31)) == 0
@@ -0,0 +1,114 @@
+# Deadline reminders: notifications and their delivery through an SMTP debug server (aiosmtpd)
+import datetime
+import email
+import smtplib
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from reminders import ReminderEngine, SmtpOutbox
+
+TODAY = datetime.date(2026, 3, 10)
+
+
+class Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, email.message_from_bytes(envelope.content)))
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    inbox = Inbox()
+    controller = Controller(inbox, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield inbox, SmtpOutbox("127.0.0.1", controller.port)
+    controller.stop()
+
+
+@pytest.fixture
+def due_soon(db, project_id):
+    # Due inside the reminder windows (tasks 2 days, invoices 3), and some that are not
+    db.add_task(project_id, "Homepage copy", "", "2026-03-11", "In Progress")
+    db.add_task(project_id, "Old task", "", "2026-03-11", "Completed")
+    db.add_task(project_id, "Later task", "", "2026-03-20", "Not Started")
+    db.add_invoice(project_id, 10000, "2026-03-01", "2026-03-13", "Unpaid", "")
+    db.add_invoice(project_id, 10000, "2026-03-01", "2026-03-13", "Paid", "")
+    trashed = db.add_invoice(project_id, 10000, "2026-03-01", "2026-03-12", "Unpaid", "")
+    db.delete_invoice(trashed)
+
+
+def notifications(db):
+    db.cursor.execute("SELECT kind, message, emailed_at IS NOT NULL FROM notifications ORDER BY kind")
+    return db.cursor.fetchall()
+
+
+def test_reminders_are_created_once_per_deadline(db, user_id, due_soon):
+    assert ReminderEngine(db).run(TODAY) == {"created": 2, "emailed": 0}
+    assert ReminderEngine(db).run(TODAY)["created"] == 0
+
+    kinds = [(kind, emailed) for kind, message, emailed in notifications(db)]
+    assert kinds == [("invoice_due", 0), ("task_due", 0)]
+    assert db.get_unread_notification_count(user_id) == 2
+
+
+def test_reminders_are_emailed_once_through_smtp(db, user_id, due_soon, smtp_server):
+    inbox, outbox = smtp_server
+
+    assert ReminderEngine(db, outbox).run(TODAY) == {"created": 2, "emailed": 2}
+
+    assert len(inbox.messages) == 1
+    recipients, message = inbox.messages[0]
+    assert recipients == ["alice@example.com"]
+    assert message["Subject"] == "FreelanceFlow: 2 upcoming deadline(s)"
+    body = message.get_payload()
+    assert body.startswith("Hi Alice Example,")
+    assert 'Task "Homepage copy" (Website) is due on 2026-03-11' in body
+    assert "(Website) is due on 2026-03-13" in body
+    assert all(emailed for *_, emailed in notifications(db))
+
+    assert ReminderEngine(db, outbox).run(TODAY) == {"created": 0, "emailed": 0}
+    assert len(inbox.messages) == 1
+
+
+def test_failed_delivery_is_retried_on_the_next_run(db, user_id, due_soon, smtp_server):
+    inbox, outbox = smtp_server
+    unreachable = SmtpOutbox("127.0.0.1", free_port())
+
+    with pytest.raises((smtplib.SMTPException, OSError)):
+        ReminderEngine(db, unreachable).run(TODAY)
+    assert not any(emailed for *_, emailed in notifications(db))
+
+    assert ReminderEngine(db, outbox).run(TODAY)["emailed"] == 2
+    assert len(inbox.messages) == 1
+
+
+def test_reminders_past_their_due_date_are_not_emailed(db, user_id, due_soon, smtp_server):
+    inbox, outbox = smtp_server
+    ReminderEngine(db).run(TODAY)
+
+    assert ReminderEngine(db, outbox).run(TODAY + datetime.timedelta(days=2)) == {"created": 0, "emailed": 1}
+
+    assert "2026-03-13" in inbox.messages[0][1].get_payload()
+    assert "2026-03-11" not in inbox.messages[0][1].get_payload()
+
+
+def test_smtp_outbox_is_configured_from_the_environment(monkeypatch):
+    monkeypatch.delenv("SMTP_HOST", raising=False)
+    assert SmtpOutbox.from_env() is None
+
+    monkeypatch.setenv("SMTP_HOST", "localhost")
+    monkeypatch.setenv("SMTP_PORT", "1025")
+    monkeypatch.setenv("SMTP_TLS", "1")
+    outbox = SmtpOutbox.from_env()
+    assert (outbox.host, outbox.port, outbox.use_tls, outbox.sender) == ("localhost", 1025, True, "reminders@freelanceflow.local")
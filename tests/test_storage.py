@@ -0,0 +1,289 @@
+# Storage conformance: the same Database calls give the same results on every backend
+# (see backend_db in conftest.py; PostgreSQL runs when TEST_DATABASE_URL is set)
+import datetime
+import threading
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def owner(backend_db):
+    db = backend_db
+    user_id = db.add_user("alice", "secret", "alice@example.com", "Alice Example")
+    client_id = db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "", "EUR")
+    project_id = db.add_project(user_id, client_id, "Website", "", "2026-01-01", "2026-12-31", "In Progress", 500000, "EUR")
+    return user_id, client_id, project_id
+
+
+def test_schema_is_created_and_migrations_are_repeatable(backend_db):
+    db = backend_db
+    columns = db.backend.columns(db.cursor, "invoices")
+    assert {"id", "project_id", "amount_cents", "currency", "deleted_at", "version", "change_seq"} <= set(columns)
+    assert "amount" not in columns
+
+    db.create_tables()
+
+    assert db.backend.columns(db.cursor, "invoices") == columns
+    db.cursor.execute("SELECT value FROM sequences WHERE name = 'change_seq'")
+    assert db.cursor.fetchone() == (0,)
+
+
+def test_crud_round_trips_values_unchanged(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+
+    assert db.get_client(client_id)[2:6] == ("Acme", "billing@acme.test", "", "Acme Ltd")
+    project = db.get_project(project_id)
+    assert (project[3], project[5], project[8]) == ("Website", "2026-01-01", 500000)
+    assert isinstance(project[8], int)
+
+    db.update_client(client_id, "Acme GmbH", "ap@acme.test", "+49 30 1234", "Acme GmbH", "Berlin", "Net 30", "EUR")
+    assert db.get_client(client_id)[2:8] == ("Acme GmbH", "ap@acme.test", "+49 30 1234", "Acme GmbH", "Berlin", "Net 30")
+
+    task_id = db.add_task(project_id, "O'Brien's 100% review?", "", "2026-02-01", "Not Started")
+    assert db.get_task(task_id)[2] == "O'Brien's 100% review?"
+    db.delete_task(task_id)
+    assert db.get_task(task_id) is None
+
+    db.delete_client(client_id)
+    assert [client[0] for client in db.get_clients(user_id)] == []
+    assert [item[:2] for item in db.get_trash(user_id)] == [("clients", client_id)]
+
+
+def test_invoice_and_payment_amounts_stay_exact_integers(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+    invoice_id = db.add_invoice(project_id, 10001, "2026-01-01", "2999-01-31", "Unpaid", "", "EUR")
+    db.add_payment(invoice_id, 3333, "2026-01-10", "Card", "")
+    db.add_payment(invoice_id, 3334, "2026-01-11", "Card", "")
+
+    db.cursor.execute("SELECT SUM(amount_cents), AVG(amount_cents), COUNT(*) FROM payments WHERE invoice_id = ?", (invoice_id,))
+    total, average, count = db.cursor.fetchone()
+    assert (total, count) == (6667, 2)
+    assert type(total) is int and average == pytest.approx(3333.5)
+    db.cursor.execute("SELECT status FROM invoices WHERE id = ?", (invoice_id,))
+    assert db.cursor.fetchone()[0] == "Partially Paid"
+
+    db.add_payment(invoice_id, 3334, "2026-01-12", "Card", "")
+    db.cursor.execute("SELECT status FROM invoices WHERE id = ?", (invoice_id,))
+    assert db.cursor.fetchone()[0] == "Paid"
+
+
+def test_returning_hands_back_generated_ids(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+
+    entry_ids = db.add_time_entries([
+        (user_id, project_id, None, "2026-01-05 09:00:00", 5400, 8000, True, ""),
+        (user_id, project_id, None, "2026-01-05 14:00:00", 1800, 8000, False, ""),
+    ])
+    assert len(entry_ids) == 2 and all(isinstance(entry_id, int) for entry_id in entry_ids)
+    assert entry_ids[1] > entry_ids[0]
+
+    job_id = db.enqueue_job(user_id, "report", {"n": 1})
+    job = db.claim_job(["report"])
+    assert (job["id"], job["payload"], job["attempts"]) == (job_id, {"n": 1}, 1)
+
+    # Each feed counts on its own, starting from the shared change_seq
+    reserved = db.next_change_seqs(user_id, 3)
+    assert list(db.next_change_seqs("another user", 2)) == [1, 2]
+    assert list(db.next_change_seqs(user_id, 1)) == [reserved[-1] + 1]
+
+
+def test_flags_are_stored_as_integers(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+    db.add_time_entries([
+        (user_id, project_id, None, "2026-01-05 09:00:00", 5400, 8000, True, ""),
+        (user_id, project_id, None, "2026-01-06 09:00:00", 1800, 8000, False, ""),
+    ])
+
+    db.cursor.execute("SELECT billable FROM time_entries ORDER BY started_at")
+    assert db.cursor.fetchall() == [(1,), (0,)]
+    hours, billable_cents = db.get_project_time_totals(project_id)
+    assert (hours, billable_cents) == (2.0, 12000)
+    summary = db.get_time_summary(user_id, "day")
+    assert [(row[0], row[3], row[4]) for row in summary] == [("2026-01-05", 1.5, 12000), ("2026-01-06", 0.0, 0)]
+
+
+def test_upserts_insert_then_update(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+
+    db.set_meta("greeting", "hello")
+    db.set_meta("greeting", "hallo")
+    assert db.get_meta("greeting") == "hallo"
+
+    before = db.get_data_versions(user_id).get("invoices", 0)
+    db.add_invoice(project_id, 100, "2026-01-01", "2026-01-31", "Unpaid", "")
+    db.add_invoice(project_id, 100, "2026-01-01", "2026-01-31", "Unpaid", "")
+    assert db.get_data_versions(user_id)["invoices"] == before + 2
+
+    db.save_fx_rates("USD", [("2026-01-01", "EUR", 0.9), ("2026-01-01", "GBP", 0.8)])
+    db.save_fx_rates("USD", [("2026-01-01", "EUR", 0.95)])
+    assert sorted(db.get_fx_rates()) == [("EUR", "2026-01-01", 0.95), ("GBP", "2026-01-01", 0.8), ("USD", "2026-01-01", 1.0)]
+
+
+def test_conflicting_inserts_are_skipped(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+    db.add_task(project_id, "Launch", "", "2026-03-11", "In Progress")
+    today = datetime.date(2026, 3, 10)
+
+    assert db.add_due_notifications(today, 2, 3) == 1
+    assert db.add_due_notifications(today, 2, 3) == 0
+    assert db.get_unread_notification_count(user_id) == 1
+
+
+def test_sql_expressions_agree(backend_db):
+    db = backend_db
+    backend = db.backend
+    db.cursor.execute(f"""
+        SELECT {backend.days_between("'2026-03-01'", "'2026-02-01'")},
+               {backend.week("'2026-01-07'")},
+               {backend.decimal_text("12345 / 100.0")},
+               {backend.decimal_text("5 / 100.0")}
+    """)
+    days, week, amount, small = db.cursor.fetchone()
+    assert (days, amount, small) == (28, "123.45", "0.05")
+    assert week in ("2026-01", "2026-02")
+
+
+def test_placeholders_and_percent_signs_survive_translation(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+    db.add_task(project_id, "50% done?", "", "2026-02-01", "Not Started")
+
+    db.cursor.execute("SELECT name FROM tasks WHERE name LIKE '%done?' AND project_id = ?", (project_id,))
+    assert db.cursor.fetchall() == [("50% done?",)]
+    db.cursor.execute("SELECT COUNT(*) FROM tasks WHERE name LIKE '50%'")
+    assert db.cursor.fetchone() == (1,)
+
+
+def test_audit_log_is_append_only(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+    db.update_client(client_id, "Acme GmbH", "", "", "", "", "", "EUR")
+    assert db.get_audit_history("clients", client_id)
+
+    with pytest.raises(Exception, match="append-only"):
+        db.cursor.execute("UPDATE audit_log SET entity = 'x'")
+    db.conn.rollback()
+
+
+def test_integrity_errors_use_the_backend_exception(backend_db, owner):
+    db = backend_db
+    assert db.add_user("alice", "other", "a2@example.com", "Alice Two") is None
+    assert db.verify_user("alice", "secret")
+
+
+def test_snapshot_reads_see_committed_data(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+    db.add_invoice(project_id, 2500, "2026-01-01", "2026-01-31", "Unpaid", "", "EUR")
+
+    with db.reading("dashboard") as cursor:
+        cursor.execute("SELECT COUNT(*), SUM(amount_cents) FROM invoices")
+        assert cursor.fetchone() == (1, 2500)
+
+
+
+def test_snapshot_reads_agree_until_stale(backend_db, owner, monkeypatch):
+    db = backend_db
+    user_id, client_id, project_id = owner
+    monkeypatch.setenv("READ_STALENESS_DASHBOARD", "60")
+    with db.reading("dashboard") as cursor:
+        cursor.execute("SELECT COUNT(*) FROM invoices")
+        assert cursor.fetchone() == (0,)
+        with db.reading("dashboard") as nested:
+            assert nested is cursor
+    db.add_invoice(project_id, 2500, "2026-01-01", "2026-01-31", "Unpaid", "", "EUR")
+    with db.reading("dashboard") as cursor:
+        cursor.execute("SELECT COUNT(*) FROM invoices")
+        assert cursor.fetchone() == (0,)
+
+    monkeypatch.setenv("READ_STALENESS_DASHBOARD", "0")
+    with db.reading("dashboard") as cursor:
+        cursor.execute("SELECT COUNT(*) FROM invoices")
+        assert cursor.fetchone() == (1,)
+
+
+def test_a_slow_report_does_not_hold_up_other_readers(backend_db, owner):
+    db = backend_db
+    inside, release, done = threading.Event(), threading.Event(), threading.Event()
+
+    def slow_report():
+        with db.reading("dashboard") as cursor:
+            cursor.execute("SELECT COUNT(*) FROM invoices")
+            cursor.fetchone()
+            inside.set()
+            release.wait(10)
+
+    def quick_report():
+        with db.reading("cash_flow") as cursor:
+            cursor.execute("SELECT COUNT(*) FROM projects")
+            assert cursor.fetchone() == (1,)
+        done.set()
+
+    slow = threading.Thread(target=slow_report)
+    slow.start()
+    try:
+        assert inside.wait(10)
+        quick = threading.Thread(target=quick_report)
+        quick.start()
+        assert done.wait(5)
+        quick.join()
+    finally:
+        release.set()
+        slow.join()
+
+def test_change_feed_pages_in_commit_order(backend_db, owner):
+    db = backend_db
+    user_id, client_id, project_id = owner
+    first = db.add_task(project_id, "First", "", None, "Not Started")
+    second = db.add_task(project_id, "Second", "", None, "Not Started")
+    db.delete_task(first)
+
+    changes, cursor = db.get_changes("tasks", user_id)
+    assert [(change["id"], bool(change.get("tombstone"))) for change in changes] == [(second, False), (first, True)]
+    assert db.get_changes("tasks", user_id, cursor) == ([], cursor)
+
+
+def test_feed_counters_only_hold_up_writers_of_the_same_user(backend_db, owner):
+    db = backend_db
+    if not storage.is_postgres(db.db_name):
+        pytest.skip("SQLite has a single writer anyway")
+    user_id, client_id, project_id = owner
+    other_user = db.add_user("bob", "secret", "bob@example.com", "Bob Example")
+    # Alice's write is in flight: her feed's counter row is locked until it commits
+    db.next_change_seqs(user_id, 1)
+    finished = {"bob": threading.Event(), "alice": threading.Event()}
+
+    def write(user, name):
+        other = type(db)(db.db_name)
+        try:
+            other.add_client(user, name, "", "", name, "", "")
+        finally:
+            other.close()
+        finished[name.lower()].set()
+
+    writers = [threading.Thread(target=write, args=(other_user, "Bob")), threading.Thread(target=write, args=(user_id, "Alice"))]
+    for writer in writers:
+        writer.start()
+    try:
+        assert finished["bob"].wait(5)
+        assert not finished["alice"].wait(0.5)
+    finally:
+        db.conn.commit()
+        for writer in writers:
+            writer.join()
+    assert finished["alice"].is_set()
+    assert [change["name"] for change in db.get_changes("clients", user_id)[0]] == ["Acme", "Alice"]
+
+
+def test_backend_is_picked_from_the_url():
+    assert isinstance(storage.open_backend("freelance_flow.db"), storage.SqliteBackend)
+    assert storage.open_backend("sqlite:///data/app.db").path == "data/app.db"
+    assert storage.is_postgres("postgresql://localhost/ff") and not storage.is_postgres("postgres.db")
@@ -0,0 +1,102 @@
+# sync.py against the API's change feed (api.py through TestClient): a replica that follows
+# creates, trashing and hard deletes, resumes after an interrupted page and starts over on 410
+import io
+import urllib.error
+
+import pytest
+
+import sync
+
+@pytest.fixture
+def requests(api_client, monkeypatch):
+    # SyncClient's own urllib requests, answered by the app in process; the list logs their query strings
+    seen = []
+
+    def urlopen(request, timeout=None):
+        response = api_client.get(request.full_url, headers=dict(request.header_items()))
+        seen.append(request.full_url.split("?", 1)[1])
+        if response.status_code >= 400:
+            raise urllib.error.HTTPError(request.full_url, response.status_code, response.text, response.headers, io.BytesIO(response.content))
+        return io.BytesIO(response.content)
+
+    monkeypatch.setattr(sync.urllib.request, "urlopen", urlopen)
+    return seen
+
+
+@pytest.fixture
+def replica(tmp_path):
+    replica = sync.Replica(str(tmp_path / "replica.db"))
+    yield replica
+    replica.close()
+
+
+def names(replica, resource, include_deleted=False):
+    return [record["name"] for record in replica.records(resource, include_deleted)]
+
+
+def test_replica_follows_creates_trashing_and_deletes(db, user_id, project_id, token, requests, replica):
+    client = sync.SyncClient("http://testserver", token, replica)
+    keep = db.add_task(project_id, "Keep", "", None, "Not Started")
+    drop = db.add_task(project_id, "Drop", "", None, "Not Started")
+    invoice_id = db.add_invoice(project_id, 10000, "2026-01-01", "2026-01-31", "Unpaid", "")
+
+    assert client.sync() == {"clients": 1, "projects": 1, "tasks": 2, "invoices": 1, "payments": 0}
+    assert names(replica, "tasks") == ["Keep", "Drop"]
+
+    db.update_task(keep, "Keep going", "", None, "In Progress")
+    db.delete_task(drop)
+    db.delete_invoice(invoice_id)
+    # Only what changed comes back: the edit, the tombstone and the trashed invoice
+    assert client.sync() == {"clients": 0, "projects": 0, "tasks": 2, "invoices": 1, "payments": 0}
+    assert names(replica, "tasks", include_deleted=True) == ["Keep going"]
+    assert replica.records("invoices") == []
+    [trashed] = replica.records("invoices", include_deleted=True)
+    assert (trashed["id"], trashed["deleted"]) == (invoice_id, True)
+
+    assert client.sync() == {resource: 0 for resource in sync.RESOURCES}
+
+
+def test_an_interrupted_sync_resumes_after_the_last_applied_page(db, user_id, project_id, token, requests, replica, monkeypatch):
+    for n in range(5):
+        db.add_task(project_id, f"Task {n}", "", None, "Not Started")
+    client = sync.SyncClient("http://testserver", token, replica, page_size=2)
+    fetch = client.fetch
+    calls = []
+
+    def fetch_then_drop(resource, since, full):
+        calls.append(since)
+        if len(calls) == 2:
+            raise urllib.error.URLError("connection reset")
+        return fetch(resource, since, full)
+
+    monkeypatch.setattr(client, "fetch", fetch_then_drop)
+    with pytest.raises(urllib.error.URLError):
+        client.sync(["tasks"])
+    # The first page and its cursor were applied together
+    assert names(replica, "tasks") == ["Task 0", "Task 1"]
+    cursor, full = replica.cursor("tasks")
+    assert full
+
+    assert client.sync(["tasks"]) == {"tasks": 3}
+    assert calls[2] == cursor
+    assert names(replica, "tasks") == [f"Task {n}" for n in range(5)]
+    assert replica.cursor("tasks")[1] is False
+
+
+def test_a_cursor_behind_pruned_tombstones_starts_over(db, user_id, project_id, token, requests, replica):
+    client = sync.SyncClient("http://testserver", token, replica)
+    gone = db.add_task(project_id, "Gone", "", None, "Not Started")
+    db.add_task(project_id, "Stays", "", None, "Not Started")
+    client.sync(["tasks"])
+    # Deleted long ago: its tombstone is pruned before this replica saw it
+    db.delete_task(gone)
+    db.cursor.execute("UPDATE tombstones SET deleted_at = '2000-01-01 00:00:00'")
+    db.conn.commit()
+    assert db.prune_tombstones() == 1
+    cursor = replica.cursor("tasks")[0]
+    requests.clear()
+
+    assert client.sync(["tasks"]) == {"tasks": 1}
+    assert names(replica, "tasks") == ["Stays"]
+    # Refused with 410, then read again from scratch
+    assert requests == [f"since={cursor}&full=0&limit=500", "since=0&full=1&limit=500"]
@@ -0,0 +1,127 @@
+# Trash: purging expired records with everything that belongs to them, and restoring
+import pytest
+
+
+def age_trash(db, table, record_id):
+    db.cursor.execute(f"UPDATE {table} SET deleted_at = '2000-01-01 00:00:00' WHERE id = ?", (record_id,))
+    db.conn.commit()
+
+
+def count(db, table, column, value):
+    db.cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} = ?", (value,))
+    return db.cursor.fetchone()[0]
+
+
+def tombstones(db):
+    db.cursor.execute("SELECT entity, entity_id FROM tombstones")
+    return set(db.cursor.fetchall())
+
+
+def project_with_records(db, user_id, project_id):
+    task_id = db.add_task(project_id, "Wireframes", "", "2026-02-01", "In Progress")
+    invoice_id = db.add_invoice(project_id, 10000, "2026-01-01", "2026-01-31", "Unpaid", "")
+    db.add_invoice_items(invoice_id, [("Design", 1, 10000, 0, 0)])
+    db.add_payment(invoice_id, 2500, "2026-01-10", "Card", "")
+    db.cursor.execute("SELECT id FROM payments WHERE invoice_id = ?", (invoice_id,))
+    payment_id = db.cursor.fetchone()[0]
+    db.add_time_entry(user_id, project_id, task_id, "2026-01-05 09:00:00", 3600, 5000, 1, "")
+    db.add_recurring_invoice(user_id, project_id, 10000, "Monthly", "2026-01-01", None, 30, "")
+    return task_id, invoice_id, payment_id
+
+
+def test_purging_a_project_removes_its_records_and_leaves_tombstones(db, user_id, project_id):
+    task_id, invoice_id, payment_id = project_with_records(db, user_id, project_id)
+    db.delete_project(project_id)
+    age_trash(db, "projects", project_id)
+
+    purged = db.purge_trash(30)
+
+    assert (purged["projects"], purged["invoices"], purged["payments"], purged["tasks"]) == (1, 1, 1, 1)
+    for table, column in [("projects", "id"), ("tasks", "project_id"), ("invoices", "project_id"), ("time_entries", "project_id"),
+                          ("time_daily", "project_id"), ("recurring_invoices", "project_id"), ("invoice_items", "invoice_id"),
+                          ("payments", "invoice_id")]:
+        assert count(db, table, column, invoice_id if column == "invoice_id" else project_id) == 0, table
+    assert {("projects", project_id), ("tasks", task_id), ("invoices", invoice_id), ("payments", payment_id)} <= tombstones(db)
+
+
+def test_purging_a_client_removes_its_live_projects(db, user_id, project_id):
+    task_id, invoice_id, payment_id = project_with_records(db, user_id, project_id)
+    db.cursor.execute("SELECT client_id FROM projects WHERE id = ?", (project_id,))
+    client_id = db.cursor.fetchone()[0]
+    db.delete_client(client_id)
+    age_trash(db, "clients", client_id)
+
+    purged = db.purge_trash(30)
+
+    assert (purged["clients"], purged["projects"], purged["tasks"], purged["invoices"], purged["payments"]) == (1, 1, 1, 1, 1)
+    assert count(db, "projects", "client_id", client_id) == 0
+    assert {("clients", client_id), ("projects", project_id), ("tasks", task_id), ("invoices", invoice_id), ("payments", payment_id)} <= tombstones(db)
+
+
+def test_change_feed_reports_purged_children_as_deleted(db, user_id, project_id):
+    task_id, invoice_id, payment_id = project_with_records(db, user_id, project_id)
+    changes, cursor = db.get_changes("tasks", user_id)
+    db.delete_project(project_id)
+    age_trash(db, "projects", project_id)
+
+    db.purge_trash(30)
+
+    for resource, record_id in [("tasks", task_id), ("invoices", invoice_id), ("payments", payment_id)]:
+        changes, _ = db.get_changes(resource, user_id, cursor)
+        assert [(change["id"], change.get("tombstone")) for change in changes] == [(record_id, True)], resource
+    assert db.get_records("tasks", user_id) == []
+
+
+def test_purge_keeps_recent_trash_and_live_records(db, user_id, project_id):
+    task_id, invoice_id, payment_id = project_with_records(db, user_id, project_id)
+    other = db.add_invoice(project_id, 5000, "2026-01-01", "2026-01-31", "Unpaid", "")
+    db.delete_invoice(other)
+
+    assert db.purge_trash(30) == {"payments": 0, "invoices": 0, "projects": 0, "clients": 0}
+
+    age_trash(db, "invoices", other)
+    assert db.purge_trash(30)["invoices"] == 1
+    assert count(db, "invoices", "id", other) == 0
+    assert count(db, "invoices", "id", invoice_id) == 1
+    assert count(db, "payments", "id", payment_id) == 1
+    assert count(db, "tasks", "id", task_id) == 1
+
+
+def deleted_at(db, table, record_id):
+    db.cursor.execute(f"SELECT deleted_at FROM {table} WHERE id = ?", (record_id,))
+    return db.cursor.fetchone()[0]
+
+
+def test_restore_brings_back_the_users_records(db, user_id, project_id):
+    invoice_id = db.add_invoice(project_id, 10000, "2026-01-01", "2999-01-31", "Unpaid", "")
+    db.delete_project(project_id)
+    db.delete_invoice(invoice_id)
+    assert {(kind, item_id) for kind, item_id, *_ in db.get_trash(user_id)} == {("projects", project_id), ("invoices", invoice_id)}
+
+    db.restore_from_trash(user_id, [("projects", project_id), ("invoices", invoice_id)])
+
+    assert deleted_at(db, "projects", project_id) is None
+    assert deleted_at(db, "invoices", invoice_id) is None
+    assert db.get_trash(user_id) == []
+
+
+def test_restore_ignores_other_users_records(db, user_id, project_id):
+    invoice_id = db.add_invoice(project_id, 10000, "2026-01-01", "2999-01-31", "Unpaid", "")
+    db.delete_invoice(invoice_id)
+    intruder = db.add_user("mallory", "secret", "mallory@example.com", "Mallory")
+
+    db.restore_from_trash(intruder, [("invoices", invoice_id), ("projects", project_id)])
+
+    assert deleted_at(db, "invoices", invoice_id) is not None
+    assert [item_id for kind, item_id, *_ in db.get_trash(user_id)] == [invoice_id]
+
+
+def test_restore_refuses_tables_outside_the_trash(db, user_id, project_id):
+    task_id = db.add_task(project_id, "Wireframes", "", "2026-02-01", "In Progress")
+
+    with pytest.raises(ValueError):
+        db.restore_from_trash(user_id, [("tasks", task_id)])
+    with pytest.raises(ValueError):
+        db.restore_from_trash(user_id, [("users; DROP TABLE invoices; --", "x")])
+
+    assert count(db, "tasks", "id", task_id) == 1
@@ -0,0 +1,207 @@
+# Webhook delivery of the event outbox to a stub receiver (http.server): the outbox shares the
+# business write's transaction, requests are signed, failures back off and end in the dead letters
+import datetime
+import hashlib
+import hmac
+import http.server
+import json
+import sqlite3
+import threading
+
+import pytest
+
+import webhooks
+
+
+class Receiver(http.server.ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ReceiverHandler)
+        self.requests = []
+        # Status answered to each request; 200 once the list runs out
+        self.statuses = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/hook"
+
+    def events(self):
+        return [event for headers, body in self.requests for event in json.loads(body)["events"]]
+
+
+class ReceiverHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.headers, body))
+        self.send_response(self.server.statuses.pop(0) if self.server.statuses else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def receiver():
+    server = Receiver()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def webhook(db, user_id, receiver):
+    return db.add_webhook(user_id, receiver.url)
+
+
+def webhook_state(db, webhook_id):
+    db.cursor.execute("SELECT last_event_id, failures, next_attempt_at, last_error, disabled_at FROM webhooks WHERE id = ?", (webhook_id,))
+    return db.cursor.fetchone()
+
+
+def pending_events(db):
+    db.cursor.execute("SELECT entity, action FROM events ORDER BY id")
+    return db.cursor.fetchall()
+
+
+def make_due(db, webhook_id):
+    # Stands in for waiting out the backoff
+    db.cursor.execute("UPDATE webhooks SET next_attempt_at = '2000-01-01 00:00:00' WHERE id = ? AND next_attempt_at IS NOT NULL", (webhook_id,))
+    db.conn.commit()
+
+
+def test_events_are_written_with_the_change(db, user_id, webhook):
+    db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "")
+    assert pending_events(db) == [("clients", "created")]
+
+
+def test_a_write_that_fails_leaves_no_event(db, user_id, webhook, monkeypatch):
+    emit = db.emit
+
+    def emit_then_fail(*args):
+        emit(*args)
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(db, "emit", emit_then_fail)
+    with pytest.raises(RuntimeError):
+        db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "")
+    # Nothing is visible outside the failed transaction, and rolling it back takes the event too
+    other = sqlite3.connect(db.db_name)
+    try:
+        assert other.execute("SELECT COUNT(*) FROM clients").fetchone() == (0,)
+        assert other.execute("SELECT COUNT(*) FROM events").fetchone() == (0,)
+    finally:
+        other.close()
+    db.conn.rollback()
+    assert pending_events(db) == []
+
+
+def test_batches_are_signed_with_the_webhook_secret(db, user_id, project_id, receiver, webhook):
+    webhook_id, secret = webhook
+    db.add_task(project_id, "Homepage copy", "", None, "Not Started")
+    db.add_task(project_id, "Logo", "", None, "Not Started")
+
+    result = webhooks.Dispatcher(db).run()
+
+    assert (result["delivered"], result["batches"], result["failed"]) == (2, 1, [])
+    [(headers, body)] = receiver.requests
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    assert hmac.compare_digest(headers[webhooks.SIGNATURE_HEADER], expected)
+    assert headers[webhooks.SIGNATURE_HEADER] != webhooks.sign("wrong secret", body)
+    payload = json.loads(body)
+    assert payload["webhook_id"] == webhook_id
+    assert [(event["entity"], event["action"], event["data"]["name"]) for event in payload["events"]] == [
+        ("tasks", "created", "Homepage copy"), ("tasks", "created", "Logo")
+    ]
+    # Acknowledged events move the cursor and are pruned
+    assert webhook_state(db, webhook_id)[:2] == (payload["events"][-1]["id"], 0)
+    assert pending_events(db) == []
+
+
+def test_failed_batches_back_off_then_resume_in_order(db, user_id, receiver, webhook):
+    webhook_id, secret = webhook
+    db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "")
+    receiver.statuses = [500, 503]
+
+    before = datetime.datetime.now().replace(microsecond=0)
+    assert webhooks.Dispatcher(db).run()["failed"] == [webhook_id]
+    last_event_id, failures, next_attempt_at, last_error, disabled_at = webhook_state(db, webhook_id)
+    assert (last_event_id, failures, disabled_at) == (0, 1, None)
+    assert "500" in last_error
+    # RETRY_BASE_SECONDS with up to 20% jitter, to the second
+    delay = (datetime.datetime.strptime(next_attempt_at, webhooks.TIME_FORMAT) - before).total_seconds()
+    assert webhooks.RETRY_BASE_SECONDS * 0.8 - 1 <= delay <= webhooks.RETRY_BASE_SECONDS * 1.2 + 1
+
+    # Not retried before the backoff is over
+    assert webhooks.Dispatcher(db).run()["batches"] == 0
+    assert len(receiver.requests) == 1
+
+    make_due(db, webhook_id)
+    db.add_client(user_id, "Globex", "ap@globex.test", "", "Globex", "", "")
+    assert webhooks.Dispatcher(db).run()["failed"] == [webhook_id]
+    assert webhook_state(db, webhook_id)[1] == 2
+
+    make_due(db, webhook_id)
+    assert webhooks.Dispatcher(db).run()["delivered"] == 2
+    # Every attempt carried the same events, and the one that got through kept their order
+    assert [[event["data"]["name"] for event in json.loads(body)["events"]] for headers, body in receiver.requests] == [
+        ["Acme"], ["Acme", "Globex"], ["Acme", "Globex"]
+    ]
+    assert webhook_state(db, webhook_id)[1:] == (0, None, None, None)
+    assert pending_events(db) == []
+
+
+def test_backoff_doubles_up_to_the_cap():
+    for failures in range(12):
+        delay = webhooks.retry_delay(failures)
+        expected = min(webhooks.RETRY_BASE_SECONDS * 2 ** failures, webhooks.RETRY_MAX_SECONDS)
+        assert expected * 0.8 <= delay <= expected * 1.2
+
+
+def test_a_failing_webhook_is_disabled_and_keeps_its_events(db, user_id, receiver, webhook, monkeypatch):
+    webhook_id, secret = webhook
+    monkeypatch.setattr(webhooks, "MAX_FAILURES", 3)
+    db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "")
+    receiver.statuses = [500] * 3
+
+    results = []
+    for attempt in range(3):
+        results.append(webhooks.Dispatcher(db).run())
+        make_due(db, webhook_id)
+    assert [result["disabled"] for result in results] == [[], [], [webhook_id]]
+    last_event_id, failures, next_attempt_at, last_error, disabled_at = webhook_state(db, webhook_id)
+    assert (failures, next_attempt_at) == (3, None) and disabled_at
+
+    # Disabled: nothing is posted, and the missed events (and later ones) are held, not pruned
+    db.add_client(user_id, "Globex", "ap@globex.test", "", "Globex", "", "")
+    assert webhooks.Dispatcher(db).run()["batches"] == 0
+    assert len(receiver.requests) == 3
+    assert pending_events(db) == [("clients", "created"), ("clients", "created")]
+    assert db.get_webhooks(user_id)[0][7:] == (disabled_at, 2)
+
+    db.resume_webhook(user_id, webhook_id)
+    assert webhooks.Dispatcher(db).run()["delivered"] == 2
+    assert [event["data"]["name"] for event in json.loads(receiver.requests[-1][1])["events"]] == ["Acme", "Globex"]
+    assert webhook_state(db, webhook_id)[1:] == (0, None, None, None)
+    assert pending_events(db) == []
+
+
+def test_a_failing_webhook_does_not_hold_up_others(db, user_id, receiver, webhook):
+    healthy = Receiver()
+    thread = threading.Thread(target=healthy.serve_forever, daemon=True)
+    thread.start()
+    try:
+        db.add_webhook(user_id, healthy.url)
+        receiver.statuses = [500]
+        db.add_client(user_id, "Acme", "billing@acme.test", "", "Acme Ltd", "", "")
+
+        result = webhooks.Dispatcher(db).run()
+
+        assert result["failed"] == [webhook[0]]
+        assert [event["data"]["name"] for event in healthy.events()] == ["Acme"]
+        # Kept for the failing subscriber
+        assert pending_events(db) == [("clients", "created")]
+    finally:
+        healthy.shutdown()
+        healthy.server_close()
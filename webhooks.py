@@ -0,0 +1,175 @@
+# Webhook delivery of the event outbox. Database writes an events row in the same transaction as
+# every created, changed, deleted or restored client, project, task, invoice and payment; this
+# dispatcher posts them in batches to each of the owner's webhook URLs and moves that subscriber's
+# cursor (webhooks.last_event_id) only once the batch was acknowledged with a 2xx. Delivery is
+# at-least-once and in order per subscriber: receivers should skip event ids they've seen.
+# A failed batch is retried with exponential backoff, without holding up other subscribers.
+# After MAX_FAILURES failures in a row the subscriber is disabled: nothing more is posted, and
+# the events it missed are kept until it is resumed (Settings > Webhooks) or removed.
+# Kept free of Streamlit so it also runs as a CLI (the app runs a pass every DISPATCH_INTERVAL):
+#
+#   python webhooks.py dispatch [--loop]            deliver pending events (repeatedly with --loop)
+#   python webhooks.py list                         subscribers, their cursor and pending events
+#
+# Each request is a POST of {"webhook_id": ..., "events": [{"id", "entity", "entity_id",
+# "action", "data", "created_at"}, ...]} signed with the subscriber's secret:
+#
+#   X-FreelanceFlow-Signature: sha256=<hex HMAC-SHA256 of the body>
+#
+# Events are removed once every subscriber of their user has them. Records purged from the
+# trash emit nothing: their "deleted" event went out when they were trashed.
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import hmac
+import json
+import random
+import sys
+import time
+import urllib.request
+
+import sharding
+import storage
+from database import Database
+
+BATCH_SIZE = 100
+TIMEOUT_SECONDS = 10
+# Subscribers posted to at the same time
+DELIVERY_THREADS = 8
+# Backoff after a failed batch: RETRY_BASE_SECONDS doubled per consecutive failure, up to the max
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 3600
+# Consecutive failed batches after which a subscriber is disabled, about half a day of retries
+MAX_FAILURES = 20
+# Seconds one pass may spend; whatever is left is picked up by the next pass
+PASS_BUDGET_SECONDS = 25
+DISPATCH_INTERVAL = 30
+# PostgreSQL hands out event ids before commit, so a later id can become visible before an
+# earlier one; events younger than this are left for the next pass so the cursor can't skip them
+POSTGRES_SETTLE_SECONDS = 10
+SIGNATURE_HEADER = "X-FreelanceFlow-Signature"
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def sign(secret, body):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def post(url, body, headers, timeout=TIMEOUT_SECONDS):
+    # Any 2xx acknowledges the batch; urllib raises for everything else
+    request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status
+
+
+def retry_delay(failures):
+    # Jittered so subscribers that failed together don't all come back at once
+    return min(RETRY_BASE_SECONDS * 2 ** failures, RETRY_MAX_SECONDS) * random.uniform(0.8, 1.2)
+
+
+class Dispatcher:
+    def __init__(self, db, send=post):
+        self.db = db
+        self.send = send
+
+    def batch(self, webhook_id, user_id, secret, after_id):
+        # (last event id, event count, body, headers) of the subscriber's next batch, or None when caught up
+        created_before = None
+        if storage.is_postgres(self.db.db_name):
+            created_before = (datetime.datetime.now() - datetime.timedelta(seconds=POSTGRES_SETTLE_SECONDS)).strftime(TIME_FORMAT)
+        events = self.db.get_events(user_id, after_id, BATCH_SIZE, created_before)
+        if not events:
+            return None
+        body = json.dumps({"webhook_id": webhook_id, "events": [
+            {"id": event_id, "entity": entity, "entity_id": entity_id, "action": action, "data": json.loads(data), "created_at": created_at}
+            for event_id, entity, entity_id, action, data, created_at in events
+        ]}, separators=(",", ":")).encode()
+        headers = {"Content-Type": "application/json", "User-Agent": "FreelanceFlow-Webhooks/1", SIGNATURE_HEADER: sign(secret, body)}
+        return events[-1][0], len(events), body, headers
+
+    def run(self, progress=None):
+        # Rounds of one batch per subscriber, posted in parallel; the database is only touched
+        # from this thread. A subscriber leaves the pass once it's caught up or has failed.
+        deadline = time.monotonic() + PASS_BUDGET_SECONDS
+        result = {"delivered": 0, "batches": 0, "failed": [], "disabled": []}
+        active = {webhook_id: [user_id, url, secret, last_event_id, failures]
+                  for webhook_id, user_id, url, secret, last_event_id, failures in self.db.get_due_webhooks(datetime.datetime.now().strftime(TIME_FORMAT))}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=DELIVERY_THREADS) as pool:
+            while active and time.monotonic() < deadline:
+                batches = {}
+                for webhook_id, (user_id, url, secret, last_event_id, failures) in list(active.items()):
+                    batch = self.batch(webhook_id, user_id, secret, last_event_id)
+                    if batch:
+                        batches[webhook_id] = batch
+                    else:
+                        del active[webhook_id]
+                futures = {webhook_id: pool.submit(self.send, active[webhook_id][1], body, headers)
+                           for webhook_id, (last_id, count, body, headers) in batches.items()}
+                for webhook_id, future in futures.items():
+                    last_id, count = batches[webhook_id][:2]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failures = active.pop(webhook_id)[4]
+                        if failures + 1 >= MAX_FAILURES:
+                            self.db.fail_webhook(webhook_id, str(e), None, datetime.datetime.now().strftime(TIME_FORMAT))
+                            result["disabled"].append(webhook_id)
+                        else:
+                            next_attempt_at = datetime.datetime.now() + datetime.timedelta(seconds=retry_delay(failures))
+                            self.db.fail_webhook(webhook_id, str(e), next_attempt_at.strftime(TIME_FORMAT))
+                        result["failed"].append(webhook_id)
+                        continue
+                    self.db.advance_webhook(webhook_id, last_id, datetime.datetime.now().strftime(TIME_FORMAT))
+                    result["delivered"] += count
+                    result["batches"] += 1
+                    active[webhook_id][3] = last_id
+                if progress:
+                    progress(min(0.9, 1 - (deadline - time.monotonic()) / PASS_BUDGET_SECONDS))
+        result["pruned"] = self.db.prune_events()
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="webhooks.py", description="FreelanceFlow webhook delivery")
+    parser.add_argument("--db", default=storage.database_url(), help="database (default: $DATABASE_URL or freelance_flow.db)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    dispatch = commands.add_parser("dispatch", help="deliver pending events")
+    dispatch.add_argument("--loop", action="store_true", help="keep delivering until interrupted")
+    dispatch.add_argument("--interval", type=float, default=5, help="seconds between passes with --loop (default: 5)")
+    commands.add_parser("list", help="subscribers, their cursor and pending events")
+    args = parser.parse_args(argv)
+
+    while True:
+        # With tenant sharding the subscribers and their events live in the shard files
+        for db_name in [args.db] + (sharding.shard_files() if sharding.enabled(args.db) else []):
+            db = Database(db_name)
+            try:
+                if args.command == "dispatch":
+                    result = Dispatcher(db).run()
+                    if result["batches"] or result["failed"] or not args.loop:
+                        print(f"{db_name}: {json.dumps(result)}")
+                elif args.command == "list":
+                    db.cursor.execute("""
+                        SELECT w.url, w.last_event_id, w.failures, w.next_attempt_at, w.last_error, w.disabled_at,
+                               (SELECT COUNT(*) FROM events e WHERE e.user_id = w.user_id AND e.id > w.last_event_id)
+                        FROM webhooks w ORDER BY w.created_at
+                    """)
+                    for url, last_event_id, failures, next_attempt_at, last_error, disabled_at, pending in db.cursor.fetchall():
+                        if disabled_at:
+                            status = f"disabled since {disabled_at} after {failures} failure(s): {last_error}"
+                        elif failures:
+                            status = f"retrying at {next_attempt_at} after {failures} failure(s): {last_error}"
+                        else:
+                            status = "ok"
+                        print(f"{db_name}: {url}  cursor {last_event_id}  {pending} pending  {status}")
+            finally:
+                db.close()
+        if args.command != "dispatch" or not args.loop:
+            break
+        time.sleep(args.interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())